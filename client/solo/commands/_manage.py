@@ -557,9 +557,12 @@ class SoloManage(SoloCommand):
         return run_queue, removal_queue
 
     def _download_packages(self, entropy_client, package_matches,
-                           downdata, multifetch=1):
+                           downdata, multifetch=1, stream_unpack=False):
         """
         Download packages from mirrors, essentially.
+        If stream_unpack is True, the packages are going to be installed
+        and they can be unpacked while being downloaded, if enabled in
+        the configuration. This is unsupported by multifetch.
         """
         # read multifetch parameter from config if needed.
         client_settings = entropy_client.ClientSettings()
@@ -640,7 +643,7 @@ class SoloManage(SoloCommand):
 
                 pkg = action_factory.get(
                     action_factory.FETCH_ACTION,
-                    match)
+                    match, opts={'stream_unpack': stream_unpack})
 
                 xterm_header = "equo (%s) :: %d of %d ::" % (
                     _("download"), count, total)
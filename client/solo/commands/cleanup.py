@@ -30,6 +30,9 @@ class SoloCleanup(SoloCommand):
 
     INTRODUCTION = """\
 Remove downloaded packages and clean temporary directories.
+The least recently used package files in the package store are removed
+until the store fits in its configured size (packages-store-size).
+The unused space of the Entropy Library Cache is reclaimed.
 """
     SEE_ALSO = "equo-cache(1)"
 
@@ -88,6 +91,20 @@ Remove downloaded packages and clean temporary directories.
                     etpConst['entropypackagesworkdir'],
                     rel))
         cleanup(entropy_client, dirs)
+
+        # reclaim the unused space of the packed cache store
+        entropy_client.compact_cache()
+
+        # the package files removed above are still in the package
+        # store, keep the most recently used ones, within its size limit.
+        removed = entropy_client.clean_package_store()
+        if removed:
+            entropy_client.output(
+                "%s: %s %s" % (
+                    _("Cleaned"),
+                    len(removed),
+                    _("package files from the package store"),)
+                )
         return 0
 
 SoloCommandDescriptor.register(
@@ -19,6 +19,7 @@ from entropy.locks import UpdatesNotificationResourceLock
 from entropy.misc import ParallelTask
 from entropy.output import brown, purple, darkred, red, \
     blue, darkblue, darkgreen, bold
+from entropy.client.interfaces.package import PackageInstallScheduler
 from entropy.client.interfaces.package.actions.action import PackageAction
 
 import entropy.tools
@@ -622,7 +623,8 @@ Install or update packages or package files.
         ugc_thread = None
         down_data = {}
         exit_st = self._download_packages(
-            entropy_client, run_queue, down_data, multifetch)
+            entropy_client, run_queue, down_data, multifetch,
+            stream_unpack=not fetch)
         if exit_st == 0:
             ugc_thread = ParallelTask(
                 self._signal_ugc, entropy_client, down_data)
@@ -668,52 +670,61 @@ Install or update packages or package files.
                 'install_queue' : run_queue,
             }
 
-            for count, pkg_match in enumerate(run_queue, 1):
+            actions = []
+            for pkg_match in run_queue:
 
+                opts = metaopts.copy()
                 source_id = installed_pkg_sources.get(pkg_match, None)
 
                 if not onlydeps and pkg_match in packages_by_user:
-                    metaopts['install_source'] = \
+                    opts['install_source'] = \
                         etpConst['install_sources']['user']
                 elif source_id is not None:
                     # Retain the information.
                     # Install action can upgrade packages, their source
                     # should not be changed to automatic_dependency.
-                    metaopts['install_source'] = source_id
+                    opts['install_source'] = source_id
                 else:
-                    metaopts['install_source'] = \
+                    opts['install_source'] = \
                         etpConst['install_sources']['automatic_dependency']
 
-                package_id, repository_id = pkg_match
-                atom = entropy_client.open_repository(
-                    repository_id).retrieveAtom(package_id)
+                actions.append(action_factory.get(
+                    action_factory.INSTALL_ACTION,
+                    pkg_match, opts=opts))
 
-                pkg = None
-                try:
-                    pkg = action_factory.get(
-                        action_factory.INSTALL_ACTION,
-                        pkg_match, opts=metaopts)
+            # upcoming packages are unpacked while the current
+            # one is being merged
+            scheduler = PackageInstallScheduler(entropy_client, actions)
+            scheduler.start()
 
-                    xterm_header = "equo (%s) :: %d of %d ::" % (
-                        _("install"), count, total)
+            count = 0
+            try:
+                for count, pkg in enumerate(actions, 1):
+                    try:
+                        xterm_header = "equo (%s) :: %d of %d ::" % (
+                            _("install"), count, total)
 
-                    pkg.set_xterm_header(xterm_header)
+                        pkg.set_xterm_header(xterm_header)
 
-                    entropy_client.output(
-                        purple(atom),
-                        count=(count, total),
-                        header=darkgreen(" +++ ") + ">>> ")
+                        entropy_client.output(
+                            purple(pkg.atom()),
+                            count=(count, total),
+                            header=darkgreen(" +++ ") + ">>> ")
 
-                    exit_st = pkg.start()
-                    if exit_st != 0:
-                        if ugc_thread is not None:
-                            ugc_thread.join()
-                        return 1, True
+                        exit_st = scheduler.run(pkg)
+                        if exit_st != 0:
+                            if ugc_thread is not None:
+                                ugc_thread.join()
+                            return 1, True
 
-                finally:
-                    if pkg is not None:
+                    finally:
                         pkg.finalize()
 
+            finally:
+                scheduler.shutdown()
+                for pkg in actions[count:]:
+                    pkg.finalize()
+
         finally:
             if notif_acquired:
                 notification_lock.release()
@@ -141,6 +141,9 @@ Manage Entropy Repositories.
         mirrorsort_parser.add_argument(
             "--simulate", action="store_true",
             default=False, help=_("simulate execution"))
+        mirrorsort_parser.add_argument(
+            "--force", action="store_true",
+            default=False, help=_("ignore recent benchmark results"))
         mirrorsort_parser.set_defaults(func=self._mirrorsort)
         _commands.append("mirrorsort")
 
@@ -226,6 +229,7 @@ Manage Entropy Repositories.
             settings = self._entropy_bashcomp().Settings()
             avail_repos = list(settings['repositories']['available'])
             outcome += avail_repos
+            outcome += ["--simulate", "--force"]
 
         elif command == "merge":
             settings = self._entropy_bashcomp().Settings()
@@ -587,12 +591,15 @@ Manage Entropy Repositories.
         excluded_repos = settings['repositories']['excluded']
         available_repos = settings['repositories']['available']
         simulate = self._nsargs.simulate
+        max_age = None
+        if self._nsargs.force:
+            max_age = 0
 
         for repo in self._nsargs.repo:
 
             try:
                 repo_data = entropy_client.reorder_mirrors(
-                    repo, dry_run = simulate)
+                    repo, dry_run = simulate, max_age = max_age)
             except KeyError:
                 entropy_client.output(
                     "[%s] %s" % (
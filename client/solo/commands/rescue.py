@@ -233,6 +233,27 @@ Tools to rescue the running system.
                 )
                 _errors = True
 
+        try:
+            if not repo.verifyChecksum():
+                entropy_client.output(
+                    "%s, %s" % (
+                        darkred(_("Repository checksum mismatch")),
+                        brown(_("run: equo rescue vacuum")),
+                    ),
+                    level="warning"
+                )
+                _errors = True
+        except DatabaseError as err:
+            entropy.tools.print_traceback()
+            entropy_client.output(
+                "%s: %s" % (
+                    darkred(_("Error checking repository checksum")),
+                    err,
+                ),
+                level="warning"
+            )
+            _errors = True
+
         if _errors:
             entropy_client.output(
                 "%s: %s" % (
@@ -276,6 +297,7 @@ Tools to rescue the running system.
             back=True
             )
         inst_repo.dropAllIndexes()
+        inst_repo.verifyChecksum(repair=True)
         inst_repo.vacuum()
         inst_repo.commit()
 
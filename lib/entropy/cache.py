@@ -18,12 +18,13 @@
 import os
 import errno
 import hashlib
+import sqlite3
 import sys
 import tempfile
 
 from entropy.const import etpConst, const_debug_write, \
     const_debug_enabled, const_pid_exists, const_setup_perms, \
-    const_mkdtemp
+    const_mkdtemp, const_setup_file
 from entropy.core import Singleton
 from entropy.misc import TimeScheduled, ParallelTask, Lifo
 import time
@@ -33,6 +34,344 @@ import copy
 import entropy.dump
 import entropy.tools
 
+class EntropyCacheStore(object):
+
+    """
+    Base class of the EntropyCacher on-disk storage backends.
+    Every store instance is bound to a cache directory.
+    """
+
+    def __init__(self, cache_dir):
+        self._cache_dir = cache_dir
+
+    def store_many(self, items, ignore_exceptions = True):
+        """
+        Store the given (key, object) pairs.
+
+        @param items: list of (key, object) tuples
+        @type items: list
+        @keyword ignore_exceptions: if False, raise IOError on failure
+        @type ignore_exceptions: bool
+        @raise IOError: if data cannot be stored and ignore_exceptions
+            is False
+        """
+        raise NotImplementedError()
+
+    def load(self, key, aging_days = None):
+        """
+        Load the object stored at key.
+
+        @param key: cache data identifier
+        @type key: string
+        @keyword aging_days: if int, consider the object invalid if older
+            than aging_days
+        @type aging_days: int
+        @return: the stored object or None
+        @rtype: any Python object
+        """
+        raise NotImplementedError()
+
+    def remove(self, key):
+        """
+        Remove the object stored at key, if any.
+
+        @param key: cache data identifier
+        @type key: string
+        """
+        raise NotImplementedError()
+
+    def remove_tree(self, cache_item):
+        """
+        Remove all the objects sharing the same namespace (dirname)
+        of cache_item.
+
+        @param cache_item: cache data identifier
+        @type cache_item: string
+        """
+        raise NotImplementedError()
+
+    def compact(self, aging_days = None):
+        """
+        Reclaim the unused space and, if aging_days is given, drop the
+        objects older than aging_days.
+
+        @keyword aging_days: drop objects older than aging_days
+        @type aging_days: int
+        """
+        raise NotImplementedError()
+
+    def close(self):
+        """
+        Release any resource held by the store.
+        """
+
+
+class DumpCacheStore(EntropyCacheStore):
+
+    """
+    EntropyCacher store writing one entropy.dump file per key.
+    """
+
+    def store_many(self, items, ignore_exceptions = True):
+        """
+        Reimplemented from EntropyCacheStore.
+        """
+        for key, data in items:
+            try:
+                entropy.dump.dumpobj(key, data, dump_dir = self._cache_dir,
+                    ignore_exceptions = ignore_exceptions)
+            except (EOFError, IOError, OSError) as err:
+                raise IOError("cannot store %s to %s. err: %s" % (
+                    key, self._cache_dir, repr(err)))
+
+    def load(self, key, aging_days = None):
+        """
+        Reimplemented from EntropyCacheStore.
+        """
+        return entropy.dump.loadobj(key, dump_dir = self._cache_dir,
+            aging_days = aging_days)
+
+    def remove(self, key):
+        """
+        Reimplemented from EntropyCacheStore.
+        """
+        try:
+            entropy.dump.removeobj(key, dump_dir = self._cache_dir)
+        except (OSError, IOError):
+            pass
+
+    def remove_tree(self, cache_item):
+        """
+        Reimplemented from EntropyCacheStore.
+        """
+        dump_path = os.path.join(self._cache_dir, cache_item)
+
+        dump_dir = os.path.dirname(dump_path)
+        for currentdir, subdirs, files in os.walk(dump_dir):
+            path = os.path.join(dump_dir, currentdir)
+            for item in files:
+                if item.endswith(entropy.dump.D_EXT):
+                    item = os.path.join(path, item)
+                    try:
+                        os.remove(item)
+                    except (OSError, IOError,):
+                        pass
+            try:
+                if not os.listdir(path):
+                    os.rmdir(path)
+            except (OSError, IOError,):
+                pass
+
+    def compact(self, aging_days = None):
+        """
+        Reimplemented from EntropyCacheStore.
+        """
+        if aging_days is None:
+            return
+        max_age = aging_days * 86400
+        cur_t = time.time()
+        for currentdir, subdirs, files in os.walk(self._cache_dir):
+            for item in files:
+                if not item.endswith(entropy.dump.D_EXT):
+                    continue
+                item = os.path.join(currentdir, item)
+                try:
+                    if abs(cur_t - os.path.getmtime(item)) > max_age:
+                        os.remove(item)
+                except (OSError, IOError,):
+                    pass
+
+
+class PackedCacheStore(EntropyCacheStore):
+
+    """
+    EntropyCacher store keeping all the objects of a cache directory
+    inside a single SQLite key-value file, avoiding the creation of one
+    file (and directory) per key. Writes are done in batches, inside
+    a single transaction.
+    """
+
+    FILE_NAME = "__packed_cache__.db"
+
+    # reclaim free pages when they exceed this fraction of the file
+    _FREE_PAGES_RATIO = 0.25
+
+    def __init__(self, cache_dir):
+        EntropyCacheStore.__init__(self, cache_dir)
+        self._path = os.path.join(cache_dir, PackedCacheStore.FILE_NAME)
+        self._lock = threading.RLock()
+        self._conn = None
+        self._inode = None
+
+    def _connection(self):
+        """
+        Return the SQLite connection, (re)opening the store file if
+        needed. Must be called with self._lock held.
+        """
+        try:
+            inode = os.stat(self._path).st_ino
+        except OSError:
+            inode = None
+
+        if self._conn is not None and inode == self._inode:
+            return self._conn
+        # the store file has been removed or replaced
+        self.close()
+
+        if not os.path.isdir(self._cache_dir):
+            os.makedirs(self._cache_dir, 0o775)
+            const_setup_file(self._cache_dir, entropy.dump.E_GID, 0o775)
+
+        conn = sqlite3.connect(self._path, timeout = 30.0,
+            check_same_thread = False)
+        try:
+            if inode is None:
+                # must be set before any table is created
+                conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache (
+                key VARCHAR PRIMARY KEY,
+                mtime FLOAT,
+                data BLOB
+            )""")
+            conn.commit()
+            if inode is None:
+                const_setup_file(self._path, entropy.dump.E_GID, 0o664)
+            self._inode = os.stat(self._path).st_ino
+        except (OSError, sqlite3.Error):
+            conn.close()
+            raise
+
+        self._conn = conn
+        return conn
+
+    def _maybe_vacuum(self, conn):
+        """
+        Reclaim free pages if they are too many.
+        """
+        free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        pages = conn.execute("PRAGMA page_count").fetchone()[0]
+        if free_pages and free_pages > pages * self._FREE_PAGES_RATIO:
+            conn.execute("PRAGMA incremental_vacuum")
+
+    def store_many(self, items, ignore_exceptions = True):
+        """
+        Reimplemented from EntropyCacheStore.
+        """
+        cur_t = time.time()
+        rows = []
+        for key, data in items:
+            try:
+                blob = entropy.dump.serialize_string(data)
+            except (RuntimeError, TypeError, AttributeError,
+                    entropy.dump.pickle.PicklingError) as err:
+                if not ignore_exceptions:
+                    raise IOError("cannot serialize %s. err: %s" % (
+                        key, repr(err)))
+                continue
+            rows.append((key, cur_t, sqlite3.Binary(blob)))
+        if not rows:
+            return
+
+        with self._lock:
+            try:
+                conn = self._connection()
+                with conn:
+                    conn.executemany("""
+                    INSERT OR REPLACE INTO cache VALUES (?, ?, ?)
+                    """, rows)
+                self._maybe_vacuum(conn)
+            except (OSError, IOError, sqlite3.Error) as err:
+                if not ignore_exceptions:
+                    raise IOError("cannot store to %s. err: %s" % (
+                        self._path, repr(err)))
+
+    def load(self, key, aging_days = None):
+        """
+        Reimplemented from EntropyCacheStore.
+        """
+        if not os.path.isfile(self._path):
+            return None
+        with self._lock:
+            try:
+                row = self._connection().execute("""
+                SELECT mtime, data FROM cache WHERE key = ?
+                """, (key,)).fetchone()
+            except (OSError, IOError, sqlite3.Error):
+                return None
+        if row is None:
+            return None
+
+        mtime, blob = row
+        if aging_days is not None:
+            if abs(time.time() - mtime) > (aging_days * 86400):
+                return None
+        try:
+            return entropy.dump.unserialize_string(bytes(blob))
+        except (ValueError, EOFError, IOError, OSError,
+                entropy.dump.pickle.UnpicklingError, TypeError,
+                AttributeError, ImportError, SystemError,):
+            return None
+
+    def _delete(self, sql, args):
+        if not os.path.isfile(self._path):
+            return
+        with self._lock:
+            try:
+                conn = self._connection()
+                with conn:
+                    conn.execute(sql, args)
+            except (OSError, IOError, sqlite3.Error):
+                pass
+
+    def remove(self, key):
+        """
+        Reimplemented from EntropyCacheStore.
+        """
+        self._delete("DELETE FROM cache WHERE key = ?", (key,))
+
+    def remove_tree(self, cache_item):
+        """
+        Reimplemented from EntropyCacheStore.
+        """
+        namespace = os.path.dirname(cache_item)
+        if not namespace:
+            self._delete("DELETE FROM cache", ())
+            return
+        namespace += "/"
+        self._delete(
+            "DELETE FROM cache WHERE substr(key, 1, ?) = ?",
+            (len(namespace), namespace))
+
+    def compact(self, aging_days = None):
+        """
+        Reimplemented from EntropyCacheStore.
+        """
+        if aging_days is not None:
+            self._delete("DELETE FROM cache WHERE mtime < ?",
+                (time.time() - aging_days * 86400,))
+        if not os.path.isfile(self._path):
+            return
+        with self._lock:
+            try:
+                self._connection().execute("VACUUM")
+            except (OSError, IOError, sqlite3.Error):
+                pass
+
+    def close(self):
+        """
+        Reimplemented from EntropyCacheStore.
+        """
+        with self._lock:
+            if self._conn is not None:
+                try:
+                    self._conn.close()
+                except sqlite3.Error:
+                    pass
+                self._conn = None
+                self._inode = None
+
+
 class EntropyCacher(Singleton):
 
     # Max number of cache objects written at once
@@ -46,6 +385,14 @@ class EntropyCacher(Singleton):
     # yet able to write data to disk.
     STASHING_CACHE = True
 
+    # On-disk storage backend, either "dump" (one file per cache
+    # item) or "packed" (one SQLite key-value file per cache directory).
+    STORES = {
+        "dump": DumpCacheStore,
+        "packed": PackedCacheStore,
+    }
+    BACKEND = os.getenv("ETP_CACHE_BACKEND", "dump")
+
     """
     Entropy asynchronous and synchronous cache writer
     and reader. This class is a Singleton and contains
@@ -106,6 +453,8 @@ class EntropyCacher(Singleton):
         self.__stashing_cache = {}
         self.__inside_with_stmt = 0
         self.__dump_data_lock = threading.Lock()
+        self.__stores = {}
+        self.__stores_lock = threading.Lock()
         self.__worker_sem = threading.Semaphore(0)
         # this lock ensures that all the writes are hold while it's acquired
         self.__enter_context_lock = threading.RLock()
@@ -124,6 +473,35 @@ class EntropyCacher(Singleton):
         self.__inside_with_stmt -= 1
         self.__enter_context_lock.release()
 
+    def _store(self, cache_dir):
+        """
+        Return the EntropyCacheStore instance bound to cache_dir.
+
+        @param cache_dir: cache directory
+        @type cache_dir: string
+        @return: the store object
+        @rtype: EntropyCacheStore
+        """
+        with self.__stores_lock:
+            store = self.__stores.get(cache_dir)
+            if store is None:
+                store_class = EntropyCacher.STORES.get(
+                    EntropyCacher.BACKEND, DumpCacheStore)
+                store = store_class(cache_dir)
+                self.__stores[cache_dir] = store
+            return store
+
+    def close_stores(self):
+        """
+        Release the resources held by the on-disk storage backends.
+        Must be called before removing cache directories.
+        """
+        with self.__stores_lock:
+            stores = list(self.__stores.values())
+            self.__stores.clear()
+        for store in stores:
+            store.close()
+
     def __copy_obj(self, obj):
         """
         Return a copy of an object done by the standard
@@ -171,10 +549,21 @@ class EntropyCacher(Singleton):
                 pass
 
         def _commit_data(_massive_data):
+            # group the writes per cache directory, the buffer is LIFO,
+            # so the first occurrence of a key is the most recent one.
+            batches = {}
+            seen = set()
             for (key, cache_dir), data in _massive_data:
-                d_o = entropy.dump.dumpobj
-                if d_o is not None:
-                    d_o(key, data, dump_dir = cache_dir)
+                if (key, cache_dir) in seen:
+                    continue
+                seen.add((key, cache_dir))
+                batches.setdefault(cache_dir, []).append((key, data))
+            try:
+                for cache_dir, items in batches.items():
+                    self._store(cache_dir).store_many(items)
+            except AttributeError:
+                # interpreter shutdown
+                pass
 
         while self.__alive or run_until_empty:
 
@@ -321,13 +710,9 @@ class EntropyCacher(Singleton):
         """
         if cache_dir is None:
             cache_dir = self.current_directory()
-        try:
-            with self.__dump_data_lock:
-                entropy.dump.dumpobj(key, data, dump_dir = cache_dir,
-                    ignore_exceptions = False)
-        except (EOFError, IOError, OSError) as err:
-            raise IOError("cannot store %s to %s. err: %s" % (
-                key, cache_dir, repr(err)))
+        with self.__dump_data_lock:
+            self._store(cache_dir).store_many(
+                [(key, data)], ignore_exceptions = False)
 
     def push(self, key, data, async = True, cache_dir = None):
         """
@@ -373,7 +758,7 @@ class EntropyCacher(Singleton):
             #        "EntropyCacher.push, sync push %s, into %s" % (
             #            key, cache_dir,))
             with self.__dump_data_lock:
-                entropy.dump.dumpobj(key, data, dump_dir = cache_dir)
+                self._store(cache_dir).store_many([(key, data)])
 
     def pop(self, key, cache_dir = None, aging_days = None):
         """
@@ -397,10 +782,41 @@ class EntropyCacher(Singleton):
             if ram_obj is not None:
                 return ram_obj
 
-        l_o = entropy.dump.loadobj
-        if not l_o:
+        try:
+            store = self._store(cache_dir)
+        except AttributeError:
+            # interpreter shutdown
             return
-        return l_o(key, dump_dir = cache_dir, aging_days = aging_days)
+        return store.load(key, aging_days = aging_days)
+
+    def remove(self, key, cache_dir = None):
+        """
+        Remove the cached object stored at key from on-disk cache.
+
+        @param key: cache data identifier
+        @type key: string
+        @keyword cache_dir: alternative cache directory
+        @type cache_dir: string
+        """
+        if cache_dir is None:
+            cache_dir = self.current_directory()
+        self.__stashing_cache.pop((key, cache_dir), None)
+        self._store(cache_dir).remove(key)
+
+    def compact(self, cache_dir = None, aging_days = None):
+        """
+        Compact the on-disk cache, reclaiming unused space.
+
+        @keyword cache_dir: alternative cache directory
+        @type cache_dir: string
+        @keyword aging_days: if int, also drop cached objects older
+            than aging_days
+        @type aging_days: int
+        """
+        if cache_dir is None:
+            cache_dir = self.current_directory()
+        with self.__dump_data_lock:
+            self._store(cache_dir).compact(aging_days = aging_days)
 
     @classmethod
     def clear_cache_item(cls, cache_item, cache_dir = None):
@@ -414,23 +830,7 @@ class EntropyCacher(Singleton):
         """
         if cache_dir is None:
             cache_dir = cls.current_directory()
-        dump_path = os.path.join(cache_dir, cache_item)
-
-        dump_dir = os.path.dirname(dump_path)
-        for currentdir, subdirs, files in os.walk(dump_dir):
-            path = os.path.join(dump_dir, currentdir)
-            for item in files:
-                if item.endswith(entropy.dump.D_EXT):
-                    item = os.path.join(path, item)
-                    try:
-                        os.remove(item)
-                    except (OSError, IOError,):
-                        pass
-            try:
-                if not os.listdir(path):
-                    os.rmdir(path)
-            except (OSError, IOError,):
-                pass
+        cls()._store(cache_dir).remove_tree(cache_item)
 
 
 class MtimePingus(object):
@@ -38,10 +38,12 @@ from entropy.client.services.interfaces import \
     ClientWebServiceFactory, RepositoryWebServiceFactory
 
 from entropy.const import etpConst, const_debug_write, \
-    const_convert_to_unicode, const_setup_perms
+    const_convert_to_unicode, const_setup_perms, const_debug_enabled
 from entropy.core.settings.base import SystemSettings
 from entropy.misc import LogFile
 from entropy.cache import EntropyCacher
+from entropy.db.cache import EntropyRepositoryCacher, \
+    EntropyRepositoryMatchCacher
 from entropy.i18n import _
 
 import entropy.dump
@@ -299,6 +301,17 @@ class Client(Singleton, TextInterface, CalculatorsMixin,
         This method should be called when the whole process is going to be
         killed. It calls destroy() and stops any running thread
         """
+        match_cacher = EntropyRepositoryMatchCacher()
+        if const_debug_enabled():
+            const_debug_write(__name__,
+                "atomMatch cache stats: %s" % (match_cacher.stats(),))
+            repo_cacher = EntropyRepositoryCacher()
+            const_debug_write(__name__,
+                "repository cache stats: %s" % (repo_cacher.stats(),))
+            const_debug_write(__name__,
+                "per repository cache stats: %s" % (
+                    repo_cacher.repository_stats(),))
+        match_cacher.sync()
         self._cacher.sync()  # enforce, destroy() may kill the current content
         self.destroy(_from_shutdown = True)
         self._cacher.stop()
@@ -414,6 +427,7 @@ class Client(Singleton, TextInterface, CalculatorsMixin,
             # no data is written while holding self._cacher by the balls
             # drop all the buffers then remove on-disk data
             self._cacher.discard()
+            EntropyRepositoryMatchCacher().clear()
             # clear repositories live cache
             inst_repo = self.installed_repository()
             if inst_repo is not None:
@@ -423,6 +437,7 @@ class Client(Singleton, TextInterface, CalculatorsMixin,
                     repo.clearCache()
 
             cache_dir = self._cacher.current_directory()
+            self._cacher.close_stores()
             try:
                 shutil.rmtree(cache_dir, True)
             except (shutil.Error, IOError, OSError):
@@ -436,6 +451,16 @@ class Client(Singleton, TextInterface, CalculatorsMixin,
             except (IOError, OSError):
                 return
 
+    def compact_cache(self):
+        """
+        Reclaim the unused space of the Entropy default cache directory.
+        This function is fault tolerant and will never return any exception.
+        """
+        try:
+            self._cacher.compact()
+        except (IOError, OSError):
+            return
+
     def QA(self):
         """
         Load Entropy QA interface object
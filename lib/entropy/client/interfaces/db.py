@@ -162,6 +162,11 @@ class AvailablePackagesRepositoryUpdater(object):
         UrlFetcher.TIMEOUT_FETCH_ERROR,
         UrlFetcher.GENERIC_FETCH_ERROR)
 
+    # Serializes the local phase of concurrent updates (GPG keyring,
+    # unpack, injection, validation and indexing), downloads run
+    # outside of it.
+    _PROCESSING_LOCK = threading.RLock()
+
     def __init__(self, entropy_client, repository_id, force, gpg):
         self.__force = force
         self.__big_sock_timeout = 20
@@ -1797,6 +1802,19 @@ class AvailablePackagesRepositoryUpdater(object):
             )
             return None
 
+        # the local database is updated while holding the processing
+        # lock, the other repositories keep downloading meanwhile
+        with self._PROCESSING_LOCK:
+            return self.__apply_webserv_database_sync(
+                mydbconn, added_ids, removed_ids, repo_metadata, segment)
+
+    def __apply_webserv_database_sync(self, mydbconn, added_ids,
+                                      removed_ids, repo_metadata, segment):
+        """
+        Apply the package metadata fetched by __handle_webserv_database_sync()
+        to the local repository database.
+        Must be called with _PROCESSING_LOCK held.
+        """
         # update treeupdates
         try:
             mydbconn.setRepositoryUpdatesDigest(self._repository_id,
@@ -2073,11 +2091,8 @@ class AvailablePackagesRepositoryUpdater(object):
         repo_data = avail_data[self._repository_id]
 
         # some variables
-        dumpfile = os.path.join(repo_data['dbpath'],
-            etpConst['etpdatabasedumplight'])
         dbfile = os.path.join(repo_data['dbpath'],
             etpConst['etpdatabasefile'])
-        dbfile_old = dbfile+".sync"
         cmethod = etpConst['etpdatabasecompressclasses'].get(
             cformat)
 
@@ -2146,6 +2161,27 @@ class AvailablePackagesRepositoryUpdater(object):
                 self.__remove_repository_files()
                 return EntropyRepositoryBase.REPOSITORY_CHECKSUM_ERROR
 
+        with self._PROCESSING_LOCK:
+            return self.__process_downloaded_repository(
+                revision, uri, cmethod, downloaded_files,
+                do_db_update_transfer)
+
+    def __process_downloaded_repository(self, revision, uri, cmethod,
+                                        downloaded_files,
+                                        do_db_update_transfer):
+        """
+        Verify, unpack and index the repository files fetched by update().
+        Must be called with _PROCESSING_LOCK held.
+        """
+        avail_data = self._settings['repositories']['available']
+        repo_data = avail_data[self._repository_id]
+        dumpfile = os.path.join(repo_data['dbpath'],
+            etpConst['etpdatabasedumplight'])
+        dbfile = os.path.join(repo_data['dbpath'],
+            etpConst['etpdatabasefile'])
+        dbfile_old = dbfile+".sync"
+        rc = 0
+
         # GPG pubkey install hook
         if self._gpg_feature:
             gpg_available = self._install_gpg_key_if_available()
@@ -2261,6 +2297,96 @@ class AvailablePackagesRepositoryUpdater(object):
         return EntropyRepositoryBase.REPOSITORY_UPDATED_OK
 
 
+class MaskTable(object):
+    """
+    Compact package masking table of a repository, as computed by
+    MaskableRepository.compute_mask_table(). It is backed by a bytearray
+    indexed by package identifier, each byte storing the masking reason
+    (see etpConst['pkg_masking_reference']) plus one and, in its highest
+    bit, whether the package is visible. Zero means "not in table".
+    """
+
+    _VISIBLE_BIT = 0x80
+
+    def __init__(self, codes = None, size = 0):
+        """
+        MaskTable constructor.
+
+        @keyword codes: the table content, as returned by dump()
+        @type codes: bytes
+        @keyword size: the initial table size (the highest package
+            identifier plus one), ignored if codes is given
+        @type size: int
+        """
+        if codes is None:
+            self._codes = bytearray(size)
+        else:
+            self._codes = bytearray(codes)
+
+    def __len__(self):
+        """
+        Return the number of packages in table.
+        """
+        return len(self._codes) - self._codes.count(bytearray(1))
+
+    def set(self, package_id, visible, reason):
+        """
+        Store the masking status of a package.
+
+        @param package_id: package identifier
+        @type package_id: int
+        @param visible: True, if the package is not masked
+        @type visible: bool
+        @param reason: the masking reason identifier
+        @type reason: int
+        """
+        missing = package_id + 1 - len(self._codes)
+        if missing > 0:
+            self._codes.extend(bytearray(missing))
+        code = reason + 1
+        if visible:
+            code |= self._VISIBLE_BIT
+        self._codes[package_id] = code
+
+    def update(self, package_ids, visible, reason):
+        """
+        Store the same masking status for all the given packages.
+        See set().
+        """
+        for package_id in package_ids:
+            self.set(package_id, visible, reason)
+
+    def get(self, package_id):
+        """
+        Return the masking status of a package, in the same form of
+        EntropyRepositoryBase.maskFilter(), or None if the package is not
+        in table.
+
+        @param package_id: package identifier
+        @type package_id: int
+        @return: (package_id or -1, reason) tuple or None
+        @rtype: tuple or None
+        """
+        if package_id < 0 or package_id >= len(self._codes):
+            return None
+        code = self._codes[package_id]
+        if not code:
+            return None
+        reason = (code & ~self._VISIBLE_BIT) - 1
+        if code & self._VISIBLE_BIT:
+            return package_id, reason
+        return -1, reason
+
+    def dump(self):
+        """
+        Return the table content in a compact, serializable form.
+
+        @return: the table content
+        @rtype: bytes
+        """
+        return bytes(self._codes)
+
+
 class MaskableRepository(EntropyRepositoryBase):
     """
     Objects inheriting from this class support package masking.
@@ -2273,6 +2399,10 @@ class MaskableRepository(EntropyRepositoryBase):
     _real_client_settings = None
     _real_client_settings_lock = threading.Lock()
 
+    # atomMatch() results depend on the user masking configuration,
+    # the in-memory reverse dependencies index is used instead
+    _REVERSE_DEPENDENCIES_TABLE_ENABLED = False
+
     def __init__(self, *args, **kwargs):
         super(MaskableRepository, self).__init__(*args, **kwargs)
 
@@ -2298,25 +2428,104 @@ class MaskableRepository(EntropyRepositoryBase):
         from entropy.client.interfaces import Client
         return Client()._settings_client_plugin
 
-    def _mask_filter_fetch_cache(self, package_id):
-        if self._caching:
-            return loadobj(
-                "MaskableRepositoryFilter/%s_%s/%s" % (
-                    self.name,
-                    self.atomMatchCacheKey(),
-                    package_id,
-                    )
-                )
+    def _mask_tables(self):
+        """
+        Return the in-memory MaskTable objects storage, cleared together
+        with the package masking validation cache.
+        """
+        try:
+            clset = self._client_settings
+            return clset['masking_validation']['tables']
+        except KeyError: # system settings client plugin not found
+            return {}
+
+    def compute_mask_table(self):
+        """
+        Evaluate the (non-live) package masking rules, that are user mask,
+        user unmask, repository mask, license mask and keyword mask,
+        against all the packages in repository at once and return the
+        resulting MaskTable, which is used to serve maskFilter() calls.
+        The table of the current repository revision and masking
+        configuration (see atomMatchCacheKey()) is stored on disk, one per
+        repository.
+
+        @return: the package masking table of this repository
+        @rtype: MaskTable
+        """
+        cache_key = self.atomMatchCacheKey()
+        revision = self.checksum()
+        tables = self._mask_tables()
+
+        cached = tables.get(self.name)
+        if cached is not None:
+            table_key, table = cached
+            if table_key == (cache_key, revision):
+                return table
 
-    def _mask_filter_store_cache(self, package_id, value):
+        # a single file per repository, older tables are overwritten
+        disk_key = "MaskableRepositoryFilter/%s/table" % (self.name,)
+        table = None
         if self._caching:
-            dumpobj(
-                "MaskableRepositoryFilter/%s_%s/%s" % (
-                    self.name,
-                    self.atomMatchCacheKey(),
-                    package_id,
-                    ),
-                value)
+            stored = loadobj(disk_key)
+            if isinstance(stored, tuple) and len(stored) == 3:
+                stored_cache_key, stored_revision, codes = stored
+                if (stored_cache_key, stored_revision) == (
+                        cache_key, revision):
+                    table = MaskTable(codes)
+
+        if table is None:
+            table = self._build_mask_table()
+            if self._caching:
+                dumpobj(disk_key, (cache_key, revision, table.dump()))
+
+        tables[self.name] = ((cache_key, revision), table)
+        return table
+
+    def _build_mask_table(self):
+        """
+        Build a new MaskTable object, see compute_mask_table().
+        """
+        ref = self._settings['pkg_masking_reference']
+        package_data = self._maskFilterPackageData()
+        if package_data:
+            table = MaskTable(size = max(package_data) + 1)
+        else:
+            table = MaskTable()
+
+        remaining = set(package_data)
+
+        masked = remaining & self._maskFilter_user_package_mask_ids()
+        table.update(masked, False, ref['user_package_mask'])
+        remaining -= masked
+
+        unmasked = remaining & self._maskFilter_user_package_unmask_ids()
+        table.update(unmasked, True, ref['user_package_unmask'])
+        remaining -= unmasked
+
+        repomask_ids = self._maskFilter_packages_db_mask_ids()
+        if repomask_ids:
+            masked = remaining & repomask_ids
+            table.update(masked, False, ref['repository_packages_db_mask'])
+            remaining -= masked
+
+        # license_mask is a list
+        lic_mask = set(self._settings['license_mask'])
+        if lic_mask:
+            masked = set(
+                x for x in remaining if lic_mask.intersection(
+                    (package_data[x][0] or "").split()))
+            table.update(masked, False, ref['user_license_mask'])
+            remaining -= masked
+
+        for package_id in remaining:
+            _license, keywords = package_data[package_id]
+            myr = self._maskFilter_keyword_reason(package_id, keywords)
+            if myr is None:
+                table.set(package_id, False, ref['completely_masked'])
+            else:
+                table.set(package_id, True, myr)
+
+        return table
 
     def _maskFilter_live(self, package_id):
 
@@ -2332,8 +2541,10 @@ class MaskableRepository(EntropyRepositoryBase):
 
             return package_id, ref['user_live_unmask']
 
-    def _maskFilter_user_package_mask(self, package_id, live):
-
+    def _maskFilter_user_package_mask_ids(self):
+        """
+        Return the set of package identifiers masked by user.
+        """
         with self._settings['mask']:
             # thread-safe in here
             cache_obj = self._settings['mask'].get()
@@ -2360,7 +2571,11 @@ class MaskableRepository(EntropyRepositoryBase):
 
             cache_obj[self.name] = user_package_mask_ids
 
-        if package_id in user_package_mask_ids:
+        return user_package_mask_ids
+
+    def _maskFilter_user_package_mask(self, package_id, live):
+
+        if package_id in self._maskFilter_user_package_mask_ids():
             # sorry, masked
             ref = self._settings['pkg_masking_reference']
             myr = ref['user_package_mask']
@@ -2374,8 +2589,10 @@ class MaskableRepository(EntropyRepositoryBase):
 
             return -1, myr
 
-    def _maskFilter_user_package_unmask(self, package_id, live):
-
+    def _maskFilter_user_package_unmask_ids(self):
+        """
+        Return the set of package identifiers unmasked by user.
+        """
         with self._settings['unmask']:
             # thread-safe in here
             cache_obj = self._settings['unmask'].get()
@@ -2401,7 +2618,11 @@ class MaskableRepository(EntropyRepositoryBase):
 
             cache_obj[self.name] = user_package_unmask_ids
 
-        if package_id in user_package_unmask_ids:
+        return user_package_unmask_ids
+
+    def _maskFilter_user_package_unmask(self, package_id, live):
+
+        if package_id in self._maskFilter_user_package_unmask_ids():
 
             ref = self._settings['pkg_masking_reference']
             myr = ref['user_package_unmask']
@@ -2415,8 +2636,11 @@ class MaskableRepository(EntropyRepositoryBase):
 
             return package_id, myr
 
-    def _maskFilter_packages_db_mask(self, package_id, live):
-
+    def _maskFilter_packages_db_mask_ids(self):
+        """
+        Return the set of package identifiers masked by the repository
+        packages.db.mask file, or None if the repository doesn't ship one.
+        """
         # check if repository packages.db.mask needs it masked
         repos_mask = {}
         clset = self._client_settings
@@ -2424,36 +2648,43 @@ class MaskableRepository(EntropyRepositoryBase):
             repos_mask = clset['repositories']['mask']
 
         repomask = repos_mask.get(self.name)
-        if isinstance(repomask, (list, set, frozenset)):
+        if not isinstance(repomask, (list, set, frozenset)):
+            return None
 
-            # first, seek into generic masking, all branches
-            # (below) avoid issues with repository names
-            mask_repo_id = "%s_ids@@:of:%s" % (self.name, self.name,)
-            repomask_ids = repos_mask.get(mask_repo_id)
+        # first, seek into generic masking, all branches
+        # (below) avoid issues with repository names
+        mask_repo_id = "%s_ids@@:of:%s" % (self.name, self.name,)
+        repomask_ids = repos_mask.get(mask_repo_id)
 
-            if not isinstance(repomask_ids, set):
-                repomask_ids = set()
-                for atom in repomask:
-                    matches, r = self.atomMatch(atom, multiMatch = True,
-                        maskFilter = False)
-                    if r != 0:
-                        continue
-                    repomask_ids |= set(matches)
-                repos_mask[mask_repo_id] = repomask_ids
+        if not isinstance(repomask_ids, set):
+            repomask_ids = set()
+            for atom in repomask:
+                matches, r = self.atomMatch(atom, multiMatch = True,
+                    maskFilter = False)
+                if r != 0:
+                    continue
+                repomask_ids |= set(matches)
+            repos_mask[mask_repo_id] = repomask_ids
 
-            if package_id in repomask_ids:
+        return repomask_ids
 
-                ref = self._settings['pkg_masking_reference']
-                myr = ref['repository_packages_db_mask']
+    def _maskFilter_packages_db_mask(self, package_id, live):
 
-                try:
-                    validator_cache = clset['masking_validation']['cache']
-                    validator_cache[(package_id, self.name, live)] = \
-                        -1, myr
-                except KeyError: # system settings client plugin not found
-                    pass
+        repomask_ids = self._maskFilter_packages_db_mask_ids()
+        if repomask_ids and package_id in repomask_ids:
 
-                return -1, myr
+            ref = self._settings['pkg_masking_reference']
+            myr = ref['repository_packages_db_mask']
+
+            try:
+                clset = self._client_settings
+                validator_cache = clset['masking_validation']['cache']
+                validator_cache[(package_id, self.name, live)] = \
+                    -1, myr
+            except KeyError: # system settings client plugin not found
+                pass
+
+            return -1, myr
 
     def _maskFilter_package_license_mask(self, package_id, live):
 
@@ -2479,12 +2710,16 @@ class MaskableRepository(EntropyRepositoryBase):
 
             return -1, myr
 
-    def _maskFilter_keyword_mask(self, package_id, live):
-
+    def _maskFilter_keyword_reason(self, package_id, mykeywords):
+        """
+        Return the package masking reason (see
+        etpConst['pkg_masking_reference']) for which the given package,
+        having the given keywords, is visible, or None if the package is
+        keyword masked.
+        """
         # WORKAROUND for buggy entries
         # ** is fine then
         # TODO: remove this before 31-12-2011
-        mykeywords = self.retrieveKeywords(package_id)
         if mykeywords == set([""]):
             mykeywords = set(['**'])
 
@@ -2494,17 +2729,7 @@ class MaskableRepository(EntropyRepositoryBase):
         # (universal keywords have been merged from package.keywords)
         same_keywords = etpConst['keywords'] & mykeywords
         if same_keywords:
-            myr = mask_ref['system_keyword']
-            try:
-                clset = self._client_settings
-                validator_cache = clset['masking_validation']['cache']
-                validator_cache[(package_id, self.name, live)] = \
-                    package_id, myr
-
-            except KeyError: # system settings client plugin not found
-                pass
-
-            return package_id, myr
+            return mask_ref['system_keyword']
 
         # if we get here, it means we didn't find mykeywords
         # in etpConst['keywords']
@@ -2523,16 +2748,7 @@ class MaskableRepository(EntropyRepositoryBase):
 
             if "*" in keyword_data:
                 # all packages in this repo with keyword "keyword" are ok
-                myr = mask_ref['user_repo_package_keywords_all']
-                try:
-                    clset = self._client_settings
-                    validator_cache = clset['masking_validation']['cache']
-                    validator_cache[(package_id, self.name, live)] = \
-                        package_id, myr
-                except KeyError: # system settings client plugin not found
-                    pass
-
-                return package_id, myr
+                return mask_ref['user_repo_package_keywords_all']
 
             kwd_key = "%s_ids" % (keyword,)
             keyword_data_ids = keyword_repo[self.name].get(kwd_key)
@@ -2549,22 +2765,13 @@ class MaskableRepository(EntropyRepositoryBase):
                 keyword_repo[self.name][kwd_key] = keyword_data_ids
 
             if package_id in keyword_data_ids:
-
-                myr = mask_ref['user_repo_package_keywords']
-                try:
-                    clset = self._client_settings
-                    validator_cache = clset['masking_validation']['cache']
-                    validator_cache[(package_id, self.name, live)] = \
-                        package_id, myr
-                except KeyError: # system settings client plugin not found
-                    pass
-                return package_id, myr
+                return mask_ref['user_repo_package_keywords']
 
         keyword_pkg = self._settings['keywords']['packages']
 
         # if we get here, it means we didn't find a match in repositories
         # so we scan packages, last chance
-        for keyword in keyword_pkg.keys():
+        for keyword in tuple(keyword_pkg.keys()):
             # use .keys() because keyword_pkg gets modified during iteration
 
             # first of all check if keyword is in mykeywords
@@ -2591,18 +2798,8 @@ class MaskableRepository(EntropyRepositoryBase):
                 keyword_pkg[self.name+kwd_key] = keyword_data_ids
 
             if package_id in keyword_data_ids:
-
                 # valid!
-                myr = mask_ref['user_package_keywords']
-                try:
-                    clset = self._client_settings
-                    validator_cache = clset['masking_validation']['cache']
-                    validator_cache[(package_id, self.name, live)] = \
-                        package_id, myr
-                except KeyError: # system settings client plugin not found
-                    pass
-
-                return package_id, myr
+                return mask_ref['user_package_keywords']
 
 
         ## if we get here, it means that pkg it keyword masked
@@ -2626,11 +2823,7 @@ class MaskableRepository(EntropyRepositoryBase):
         same_keywords = repo_keywords.get('universal') & mykeywords
         if same_keywords:
             # universal keyword matches!
-            myr = mask_ref['repository_packages_db_keywords']
-            validator_cache = clset['masking_validation']['cache']
-            validator_cache[(package_id, self.name, live)] = \
-                package_id, myr
-            return package_id, myr
+            return mask_ref['repository_packages_db_keywords']
 
         ## if we get here, it means that even universal masking failed
         ## and we need to look at per-package settings
@@ -2663,11 +2856,24 @@ class MaskableRepository(EntropyRepositoryBase):
             same_keywords = pkg_keywords & etpConst['keywords']
         if same_keywords:
             # found! this pkg is not masked, yay!
-            myr = mask_ref['repository_packages_db_keywords']
+            return mask_ref['repository_packages_db_keywords']
+
+    def _maskFilter_keyword_mask(self, package_id, live):
+
+        myr = self._maskFilter_keyword_reason(
+            package_id, self.retrieveKeywords(package_id))
+        if myr is None:
+            return
+
+        try:
+            clset = self._client_settings
             validator_cache = clset['masking_validation']['cache']
             validator_cache[(package_id, self.name, live)] = \
                 package_id, myr
-            return package_id, myr
+        except KeyError: # system settings client plugin not found
+            pass
+
+        return package_id, myr
 
     def maskFilter(self, package_id, live = True):
         """
@@ -2680,49 +2886,44 @@ class MaskableRepository(EntropyRepositoryBase):
         if cached is not None:
             return cached
 
-        # use on-disk cache?
-        cached = self._mask_filter_fetch_cache(package_id)
-        if cached is not None:
-            return cached
-
-        # avoid memleaks
-        if len(validator_cache) > 100000:
-            validator_cache.clear()
-
         if live:
             data = self._maskFilter_live(package_id)
             if data:
                 return data
 
+        # served by the whole repository mask table
+        data = self.compute_mask_table().get(package_id)
+        if data is not None:
+            return data
+
+        # avoid memleaks
+        if len(validator_cache) > 100000:
+            validator_cache.clear()
+
+        # package not in table, evaluate the masking rules one by one
         data = self._maskFilter_user_package_mask(package_id, live)
         if data:
-            self._mask_filter_store_cache(package_id, data)
             return data
 
         data = self._maskFilter_user_package_unmask(package_id, live)
         if data:
-            self._mask_filter_store_cache(package_id, data)
             return data
 
         data = self._maskFilter_packages_db_mask(package_id, live)
         if data:
-            self._mask_filter_store_cache(package_id, data)
             return data
 
         data = self._maskFilter_package_license_mask(package_id, live)
         if data:
-            self._mask_filter_store_cache(package_id, data)
             return data
 
         data = self._maskFilter_keyword_mask(package_id, live)
         if data:
-            self._mask_filter_store_cache(package_id, data)
             return data
 
         # holy crap, can't validate
         myr = self._settings['pkg_masking_reference']['completely_masked']
         validator_cache[(package_id, self.name, live)] = -1, myr
-        self._mask_filter_store_cache(package_id, data)
         return -1, myr
 
     def atomMatchCacheKey(self):
@@ -168,6 +168,120 @@ class CalculatorsMixin:
             if reponame in conflictingRevisions:
                 return (results[reponame], reponame)
 
+    def __atom_match_cache_key(self, atom, match_slot, mask_filter,
+            multi_match, multi_repo, match_repo, extended_results):
+        """
+        Return the on-disk cache key of an atom_match() query.
+        """
+        sha = hashlib.sha1()
+
+        cache_fmt = "a{%s}mr{%s}ms{%s}rh{%s}mf{%s}"
+        cache_fmt += "ar{%s}m{%s}cm{%s}s{%s;%s;%s}"
+        cache_s = cache_fmt % (
+            atom,
+            ";".join(match_repo),
+            match_slot,
+            self.repositories_checksum(),
+            mask_filter,
+            ";".join(sorted(self._settings['repositories']['available'])),
+            self._settings.packages_configuration_hash(),
+            self._settings_client_plugin.packages_configuration_hash(),
+            multi_match,
+            multi_repo,
+            extended_results)
+        sha.update(const_convert_to_rawstring(cache_s))
+
+        return "atom_match/atom_match_%s" % (sha.hexdigest(),)
+
+    def __atom_match_repo_result(self, query_data, query_rc, repo,
+            repo_results, extended_results):
+        """
+        Record a successful repository atomMatch() result into repo_results.
+        """
+        if query_rc != 0:
+            return
+        # package found, add to our dictionary
+        if extended_results:
+            repo_results[repo] = (query_data[0], query_data[2],
+                query_data[3], query_data[4])
+        else:
+            repo_results[repo] = query_data
+
+    def __atom_match_result(self, atom, repo_results, valid_repos,
+            match_slot, mask_filter, multi_match, multi_repo,
+            extended_results):
+        """
+        Compute the atom_match() return value out of the per-repository
+        matches.
+        """
+        dbpkginfo = (-1, 1)
+        if extended_results:
+            dbpkginfo = ((-1, None, None, None), 1)
+
+        if multi_repo and repo_results:
+
+            data = set()
+            for repoid in repo_results:
+                data.add((repo_results[repoid], repoid))
+            dbpkginfo = (data, 0)
+
+        elif len(repo_results) == 1:
+            # one result found
+            repo = list(repo_results.keys())[0]
+            dbpkginfo = (repo_results[repo], repo)
+
+        elif len(repo_results) > 1:
+
+            # we have to decide which version should be taken
+            mypkginfo = self.__handle_multi_repo_matches(repo_results,
+                extended_results, valid_repos)
+            if mypkginfo is not None:
+                dbpkginfo = mypkginfo
+
+        # multimatch support
+        if multi_match:
+
+            if dbpkginfo[1] == 1:
+                dbpkginfo = set(), 1
+            else: # can be "0" or a string, but 1 means failure
+                if multi_repo:
+                    data = set()
+                    for q_id, q_repo in dbpkginfo[0]:
+                        dbconn = self.open_repository(q_repo)
+                        query_data, query_rc = dbconn.atomMatch(
+                            atom,
+                            matchSlot = match_slot,
+                            maskFilter = mask_filter,
+                            multiMatch = True,
+                            extendedResults = extended_results
+                        )
+                        if extended_results:
+                            for item in query_data:
+                                _item_d = (item[0], item[2], item[3], item[4])
+                                data.add((_item_d, q_repo))
+                        else:
+                            for x in query_data:
+                                data.add((x, q_repo))
+                    dbpkginfo = (data, 0)
+                else:
+                    dbconn = self.open_repository(dbpkginfo[1])
+                    query_data, query_rc = dbconn.atomMatch(
+                        atom,
+                        matchSlot = match_slot,
+                        maskFilter = mask_filter,
+                        multiMatch = True,
+                        extendedResults = extended_results
+                    )
+                    if extended_results:
+                        dbpkginfo = (
+                            set([((x[0], x[2], x[3], x[4]), dbpkginfo[1]) \
+                                     for x in query_data]), 0)
+                    else:
+                        dbpkginfo = (
+                            set([(x, dbpkginfo[1]) for x in query_data]), 0)
+
+        return dbpkginfo
+
     def atom_match(self, atom, match_slot = None, mask_filter = True,
             multi_match = False, multi_repo = False, match_repo = None,
             extended_results = False, use_cache = True):
@@ -184,25 +298,9 @@ class CalculatorsMixin:
 
         cache_key = None
         if self.xcache and use_cache:
-            sha = hashlib.sha1()
-
-            cache_fmt = "a{%s}mr{%s}ms{%s}rh{%s}mf{%s}"
-            cache_fmt += "ar{%s}m{%s}cm{%s}s{%s;%s;%s}"
-            cache_s = cache_fmt % (
-                atom,
-                ";".join(match_repo),
-                match_slot,
-                self.repositories_checksum(),
-                mask_filter,
-                ";".join(sorted(self._settings['repositories']['available'])),
-                self._settings.packages_configuration_hash(),
-                self._settings_client_plugin.packages_configuration_hash(),
-                multi_match,
-                multi_repo,
+            cache_key = self.__atom_match_cache_key(atom, match_slot,
+                mask_filter, multi_match, multi_repo, match_repo,
                 extended_results)
-            sha.update(const_convert_to_rawstring(cache_s))
-
-            cache_key = "atom_match/atom_match_%s" % (sha.hexdigest(),)
 
             cached = self._cacher.pop(cache_key)
             if cached is not None:
@@ -250,14 +348,8 @@ class CalculatorsMixin:
                             extendedResults = extended_results,
                             useCache = xuse_cache
                         )
-                        if query_rc == 0:
-                            # package found, add to our dictionary
-                            if extended_results:
-                                repo_results[repo] = (query_data[0],
-                                    query_data[2], query_data[3],
-                                    query_data[4])
-                            else:
-                                repo_results[repo] = query_data
+                        self.__atom_match_repo_result(query_data, query_rc,
+                            repo, repo_results, extended_results)
                     except TypeError:
                         if not xuse_cache:
                             raise
@@ -270,76 +362,111 @@ class CalculatorsMixin:
                         break
                     break
 
-        dbpkginfo = (-1, 1)
-        if extended_results:
-            dbpkginfo = ((-1, None, None, None), 1)
+        dbpkginfo = self.__atom_match_result(atom, repo_results, valid_repos,
+            match_slot, mask_filter, multi_match, multi_repo,
+            extended_results)
 
-        if multi_repo and repo_results:
+        if cache_key is not None:
+            self._cacher.push(cache_key, dbpkginfo)
 
-            data = set()
-            for repoid in repo_results:
-                data.add((repo_results[repoid], repoid))
-            dbpkginfo = (data, 0)
+        return dbpkginfo
 
-        elif len(repo_results) == 1:
-            # one result found
-            repo = list(repo_results.keys())[0]
-            dbpkginfo = (repo_results[repo], repo)
+    def atom_match_many(self, atoms, match_slot = None, mask_filter = True,
+            multi_match = False, multi_repo = False, match_repo = None,
+            extended_results = False, use_cache = True):
+        """
+        Batch version of atom_match(). All the given atoms are matched using
+        the same arguments, each repository is queried once through
+        EntropyRepositoryBase.atomMatchMany().
+        "Or" dependencies and atoms carrying a "@repo" suffix are handed
+        over to atom_match().
+
+        @param atoms: list of atoms or dependencies to match
+        @type atoms: iterable
+        @return: dict mapping each atom to its atom_match() result
+        @rtype: dict
+        """
+        valid_repos = self._enabled_repos
+        if match_repo and (type(match_repo) in (list, tuple, set)):
+            valid_repos = list(match_repo)
 
-        elif len(repo_results) > 1:
+        results = {}
+        cache_keys = {}
+        pending = []
+        for atom in atoms:
+            if atom in results:
+                continue
 
-            # we have to decide which version should be taken
-            mypkginfo = self.__handle_multi_repo_matches(repo_results,
-                extended_results, valid_repos)
-            if mypkginfo is not None:
-                dbpkginfo = mypkginfo
+            _atom, repos = entropy.dep.dep_get_match_in_repos(atom)
+            if repos is not None or \
+                    atom.endswith(etpConst['entropyordepquestion']):
+                results[atom] = self.atom_match(atom, match_slot = match_slot,
+                    mask_filter = mask_filter, multi_match = multi_match,
+                    multi_repo = multi_repo, match_repo = match_repo,
+                    extended_results = extended_results,
+                    use_cache = use_cache)
+                continue
 
-        # multimatch support
-        if multi_match:
+            if self.xcache and use_cache:
+                cache_key = self.__atom_match_cache_key(atom, match_slot,
+                    mask_filter, multi_match, multi_repo,
+                    match_repo or tuple(), extended_results)
+                cached = self._cacher.pop(cache_key)
+                if cached is not None:
+                    results[atom] = cached
+                    continue
+                cache_keys[atom] = cache_key
 
-            if dbpkginfo[1] == 1:
-                dbpkginfo = set(), 1
-            else: # can be "0" or a string, but 1 means failure
-                if multi_repo:
-                    data = set()
-                    for q_id, q_repo in dbpkginfo[0]:
-                        dbconn = self.open_repository(q_repo)
-                        query_data, query_rc = dbconn.atomMatch(
-                            atom,
-                            matchSlot = match_slot,
-                            maskFilter = mask_filter,
-                            multiMatch = True,
-                            extendedResults = extended_results
-                        )
-                        if extended_results:
-                            for item in query_data:
-                                _item_d = (item[0], item[2], item[3], item[4])
-                                data.add((_item_d, q_repo))
-                        else:
-                            for x in query_data:
-                                data.add((x, q_repo))
-                    dbpkginfo = (data, 0)
-                else:
-                    dbconn = self.open_repository(dbpkginfo[1])
-                    query_data, query_rc = dbconn.atomMatch(
-                        atom,
+            results[atom] = None
+            pending.append(atom)
+
+        if not pending:
+            return results
+
+        repo_results = dict((x, {}) for x in pending)
+        for repo in valid_repos:
+
+            try:
+                dbconn = self.open_repository(repo)
+            except (RepositoryError, SystemDatabaseError):
+                # ouch, repository not available or corrupted !
+                continue
+            xuse_cache = use_cache
+
+            while True:
+                try:
+                    matches = dbconn.atomMatchMany(
+                        pending,
                         matchSlot = match_slot,
                         maskFilter = mask_filter,
-                        multiMatch = True,
-                        extendedResults = extended_results
+                        extendedResults = extended_results,
+                        useCache = xuse_cache
                     )
-                    if extended_results:
-                        dbpkginfo = (
-                            set([((x[0], x[2], x[3], x[4]), dbpkginfo[1]) \
-                                     for x in query_data]), 0)
-                    else:
-                        dbpkginfo = (
-                            set([(x, dbpkginfo[1]) for x in query_data]), 0)
+                    for atom, (query_data, query_rc) in matches.items():
+                        self.__atom_match_repo_result(query_data, query_rc,
+                            repo, repo_results[atom], extended_results)
+                except TypeError:
+                    if not xuse_cache:
+                        raise
+                    xuse_cache = False
+                    continue
+                except (OperationalError, DatabaseError):
+                    # OperationalError => error in data format
+                    # DatabaseError => database disk image is malformed
+                    # repository fooked, skip!
+                    break
+                break
 
-        if cache_key is not None:
-            self._cacher.push(cache_key, dbpkginfo)
+        for atom in pending:
+            dbpkginfo = self.__atom_match_result(atom, repo_results[atom],
+                valid_repos, match_slot, mask_filter, multi_match,
+                multi_repo, extended_results)
+            cache_key = cache_keys.get(atom)
+            if cache_key is not None:
+                self._cacher.push(cache_key, dbpkginfo)
+            results[atom] = dbpkginfo
 
-        return dbpkginfo
+        return results
 
     def atom_search(self, keyword, description = False, repositories = None,
                     use_cache = True):
@@ -704,6 +831,17 @@ class CalculatorsMixin:
                 return True
             return False
 
+        # match all the dependencies in bulk first, the loop below will
+        # then pick the results up
+        bulk_deps = [x for x in dependencies if x not in depcache \
+                         and not x.startswith("!")]
+        inst_matches = inst_repo.atomMatchMany(bulk_deps, multiMatch = True)
+        repo_matches = {}
+        if deep_deps or not relaxed_deps:
+            repo_matches = self.atom_match_many(
+                [x for x in bulk_deps if inst_matches[x][1] == 0],
+                match_repo = match_repo)
+
         unsatisfied = set()
         for dependency in dependencies:
 
@@ -739,8 +877,10 @@ class CalculatorsMixin:
                 push_to_cache(dependency, False)
                 continue
 
-            c_ids, c_rc = inst_repo.atomMatch(dependency,
-                multiMatch = True)
+            c_ids, c_rc = inst_matches.get(dependency, (None, None))
+            if c_rc is None:
+                c_ids, c_rc = inst_repo.atomMatch(dependency,
+                    multiMatch = True)
             if c_rc != 0:
 
                 # check if dependency can be matched in available repos and
@@ -826,7 +966,10 @@ class CalculatorsMixin:
                 if provide_stop:
                     continue
 
-            r_id, r_repo = self.atom_match(dependency, match_repo = match_repo)
+            r_id, r_repo = repo_matches.get(dependency, (None, None))
+            if r_id is None:
+                r_id, r_repo = self.atom_match(dependency,
+                    match_repo = match_repo)
             if r_id == -1:
                 if const_debug_enabled():
                     const_debug_write(__name__,
@@ -2167,7 +2310,17 @@ class CalculatorsMixin:
 
     def _get_required_packages(self, package_matches, empty_deps = False,
         deep_deps = False, relaxed_deps = False, build_deps = False,
-        only_deps = False, quiet = False, recursive = True):
+        only_deps = False, quiet = False, recursive = True, levels = False):
+        """
+        Return the dependency tree of the given package matches, a dict
+        mapping install order levels (starting from 1) to tuples of package
+        matches. Level 0 contains the installed package ids to be removed
+        because of conflicts.
+        If levels is True, each level maps to a tuple of groups (tuples) of
+        package matches instead: the groups at the same level do not depend
+        on each other and can be processed in parallel, while the package
+        matches of a group (cyclic dependencies) are still in install order.
+        """
 
         ldpaths = frozenset(entropy.tools.collect_linker_paths())
         inst_repo = self.installed_repository()
@@ -2176,7 +2329,7 @@ class CalculatorsMixin:
         if self.xcache:
             sha = hashlib.sha1()
 
-            cache_s = "%s|%s|%s|%s|%s|%s|%s|%s|%s|%s|%s|%s|%s|%s|v8" % (
+            cache_s = "%s|%s|%s|%s|%s|%s|%s|%s|%s|%s|%s|%s|%s|%s|%s|v8" % (
                 ";".join(["%s" % (x,) for x in sorted(package_matches)]),
                 empty_deps,
                 deep_deps,
@@ -2184,6 +2337,7 @@ class CalculatorsMixin:
                 build_deps,
                 only_deps,
                 recursive,
+                levels,
                 inst_repo.checksum(),
                 self.repositories_checksum(),
                 self._settings.packages_configuration_hash(),
@@ -2280,7 +2434,10 @@ class CalculatorsMixin:
         adj_map = dict((x.item(), set(k.item() for k in y)) \
             for x, y in graph.get_adjacency_map().items())
         # solve depgraph and append conflicts
-        deptree = graph.solve()
+        if levels:
+            deptree = graph.solve_levels()
+        else:
+            deptree = graph.solve()
         if 0 in deptree:
             graph.destroy()
             raise KeyError("Graph contains a dep_level == 0")
@@ -2289,11 +2446,10 @@ class CalculatorsMixin:
         # raise DependenciesCollision, containing information about collisions
         # and what requires the packages involved
         _dup_deps_collisions = {}
-        for _level, _deps in deptree.items():
-            for pkg_id, pkg_repo in _deps:
-                keyslot = self.open_repository(pkg_repo).retrieveKeySlot(pkg_id)
-                ks_set = _dup_deps_collisions.setdefault(keyslot, set())
-                ks_set.add((pkg_id, pkg_repo))
+        for pkg_id, pkg_repo in graph.raw():
+            keyslot = self.open_repository(pkg_repo).retrieveKeySlot(pkg_id)
+            ks_set = _dup_deps_collisions.setdefault(keyslot, set())
+            ks_set.add((pkg_id, pkg_repo))
         _colliding_deps = [x for x in _dup_deps_collisions.values() if \
             len(x) > 1]
 
@@ -2309,6 +2465,19 @@ class CalculatorsMixin:
             graph.destroy()
             raise DependenciesCollision((_colliding_deps, _pkg_revdeps))
 
+        if levels:
+            # post-dependencies are scheduled by their own level, as
+            # soon as their dependencies are satisfied
+            reverse_tree = dict((len(deptree) - x + 1, y) \
+                for x, y in deptree.items())
+            graph.destroy()
+            reverse_tree[0] = deptree_conflicts
+
+            if self.xcache:
+                self._cacher.push(cache_key, reverse_tree)
+
+            return reverse_tree
+
         # now use the ASAP herustic to anticipate post-dependencies
         # as much as possible
         if self.DISABLE_ASAP_SCHEDULING is None:
@@ -3113,102 +3282,206 @@ class CalculatorsMixin:
 
         return sec_updates
 
-    @sharedinstlock
-    def calculate_updates(self, empty = False, use_cache = True,
-        critical_updates = True, quiet = False):
-        """
-        Calculate package updates. By default, this method also handles critical
-        updates priority. Updates (as well as other objects here) are returned
-        in alphabetical order. To generate a valid installation queue, have a
-        look at Client.get_install_queue().
+    # calculate_updates() engine: "joined" computes the candidates of all
+    # the installed packages with a few joined queries, "legacy" matches
+    # the installed packages one by one.
+    UPDATES_ENGINE = os.getenv("ETP_UPDATES_ENGINE", "joined")
 
-        @keyword empty: consider the installed packages repository
-            empty. Mark every package as update.
-        @type empty: bool
-        @keyword use_cache: use Entropy cache
-        @type use_cache: bool
-        @keyword critical_updates: if False, disable critical updates check
-            priority.
-        @type critical_updates: bool
-        @keyword quiet: do not print any status info if True
-        @type quiet: bool
-        @return: dict composed by (list of package matches ("update" key),
-            list of installed package identifiers ("remove" key), list of
-            package names already up-to-date ("fine" key), list of package names
-            already up-to-date when user enabled "ignore-spm-downgrades",
-            "spm_fine" key), if critical updates were found ("critical_found"
-            key). If critical_found is True, relaxed dependencies calculation
-            must be enforced.
-        @rtype: tuple
+    def __updates_repository_match(self, repo, candidates, tag):
         """
-        cl_settings = self.ClientSettings()
-        misc_settings = cl_settings['misc']
+        Select the best package out of the key and slot candidates of an
+        installed package in the given repository, the same way
+        EntropyRepositoryBase.atomMatch() does. Return the atom_match()
+        extended result (package_id, version, tag, revision) or None.
+
+        @param repo: the repository
+        @type repo: EntropyRepositoryBase
+        @param candidates: list of (package_id, version, tag, revision)
+        @type candidates: list
+        @param tag: the package tag to match, or None
+        @type tag: string
+        """
+        metadata = {}
+        for candidate in candidates:
+            if tag is not None and candidate[2] != tag:
+                continue
+            if repo.maskFilter(candidate[0])[0] == -1:
+                continue
+            metadata[candidate[0]] = candidate[1:]
+        if not metadata:
+            return None
 
-        # critical updates hook, if enabled
-        # this will force callers to receive only critical updates
-        if misc_settings.get('forcedupdates') and critical_updates:
-            _atoms, update = self.calculate_critical_updates(
-                use_cache = use_cache)
-            if update:
-                return {
-                    'update': update,
-                    'remove': [],
-                    'fine': [],
-                    'spm_fine': [],
-                    'critical_found': True,
-                    }
+        dbpkginfo = set([(x, metadata[x][0]) for x in set(metadata)])
+        if len(dbpkginfo) == 1:
+            package_id = dbpkginfo.pop()[0]
+            return (package_id,) + tuple(metadata[package_id])
+
+        pkgdata = {}
+        versions = set()
+        for package_id, version in list(dbpkginfo):
+            info_tuple = (version, metadata[package_id][1],
+                          metadata[package_id][2])
+            versions.add(info_tuple)
+            pkgdata[info_tuple] = package_id
+
+        # prefer non-tagged packages, if tag is not given
+        if not tag:
+            tags = set(bool(x[1]) for x in versions)
+            if len(tags) > 1:
+                versions = set(x for x in versions if not x[1])
+
+        newer = entropy.dep.get_entropy_newer_version(list(versions))[0]
+        return (pkgdata[newer],) + tuple(newer)
+
+    def __calculate_updates_joined(self, package_ids, match_repos, empty,
+                                   ignore_spm_downgrades, quiet, update,
+                                   remove, fine, spm_fine):
+        """
+        Set based calculate_updates() implementation. The key and slot
+        candidates of all the installed packages are fetched with one
+        joined query per repository (see searchKeySlotMatches()), then
+        the atom_match() selection, masking and version comparison are
+        applied in memory. The outcome is added to the update, remove,
+        fine and spm_fine objects.
+        Return the installed package identifiers left to
+        __calculate_updates_legacy(): old-style virtual packages, or all
+        of them if the repositories cannot be joined.
+        """
+        if not match_repos:
+            return package_ids
 
         inst_repo = self.installed_repository()
-        ignore_spm_downgrades = misc_settings['ignore_spm_downgrades']
-        enabled_repos = self.filter_repositories(self.repositories())
-        repo_order = [x for x in self._settings['repositories']['order'] if
-                      x in enabled_repos]
+        valid_repos = list(match_repos)
+        repos = {}
+        # installed package_id -> repository_id -> candidates list
+        candidates = {}
+        digests = {}
+        match_digests = {}
+        for count, repository_id in enumerate(valid_repos, 1):
+            try:
+                repo = self.open_repository(repository_id)
+            except (RepositoryError, SystemDatabaseError):
+                # atom_match() skips them as well
+                continue
 
-        cache_s = "%s|%s|%s|%s|%s|%s|%s|%s|%s|%s|v7" % (
-            empty,
-            enabled_repos,
-            inst_repo.checksum(),
-            self.repositories_checksum(),
-            self._settings.packages_configuration_hash(),
-            self._settings_client_plugin.packages_configuration_hash(),
-            ";".join(sorted(self._settings['repositories']['available'])),
-            repo_order,
-            ignore_spm_downgrades,
-            # needed when users do bogus things like editing config files
-            # manually (branch setting)
-            self._settings['repositories']['branch'],
-        )
+            if not quiet:
+                self.output(
+                    _("Calculating updates"),
+                    importance = 0,
+                    level = "info",
+                    back = True,
+                    header = ":: ",
+                    count = (count, len(valid_repos)),
+                    percent = True,
+                    footer = " ::"
+                )
 
-        sha = hashlib.sha1()
-        sha.update(const_convert_to_rawstring(cache_s))
-        cache_key = "updates/%s_v1" % (sha.hexdigest(),)
+            try:
+                rows = inst_repo.searchKeySlotMatches(repo)
+            except (OperationalError, DatabaseError):
+                rows = None
+            if rows is None:
+                const_debug_write(
+                    __name__,
+                    "calculate_updates: cannot join %s" % (repository_id,))
+                return package_ids
+
+            repos[repository_id] = repo
+            for (package_id, digest, m_package_id, version, tag, revision,
+                 m_digest) in rows:
+                digests[package_id] = digest
+                match_digests[(m_package_id, repository_id)] = m_digest
+                candidates.setdefault(package_id, {}).setdefault(
+                    repository_id, []).append(
+                        (m_package_id, version, tag, revision))
+
+        def _match(key, slot, pkg_candidates, tag):
+            repo_results = {}
+            for repository_id in valid_repos:
+                repo_candidates = pkg_candidates.get(repository_id)
+                if not repo_candidates:
+                    continue
+                result = self.__updates_repository_match(
+                    repos[repository_id], repo_candidates, tag)
+                if result is not None:
+                    repo_results[repository_id] = result
+            return self.__atom_match_result(
+                key, repo_results, valid_repos, slot, True, False, False,
+                True)
+
+        virtual_category = EntropyRepositoryBase.VIRTUAL_META_PACKAGE_CATEGORY
+        leftovers = []
+        for package_id in package_ids:
+            strict_data = inst_repo.getStrictData(package_id)
+            if strict_data is None:
+                # broken entry, or removed during iteration
+                continue
+            cl_pkgkey, cl_slot, cl_version, cl_tag, cl_revision, \
+                cl_atom = strict_data
+
+            # old-style virtuals are matched through their providers,
+            # keys looking like atoms are not keys for atom_match().
+            if cl_pkgkey.split("/", 1)[0] == virtual_category or \
+                    not entropy.dep.isjustname(cl_pkgkey):
+                leftovers.append(package_id)
+                continue
 
-        if use_cache and self.xcache:
-            cached = self._cacher.pop(cache_key)
-            if cached is not None:
-                return cached
+            pkg_candidates = candidates.get(package_id, {})
+            if not pkg_candidates:
+                # not available, not even masked
+                remove.append(package_id)
+                continue
 
-        # do not match package repositories, never consider them in updates!
-        # that would be a nonsense, since package repos are temporary.
-        enabled_repos = self.filter_repositories(self.repositories())
-        match_repos = tuple([x for x in \
-            self._settings['repositories']['order'] if x in enabled_repos])
+            match = None
+            if cl_tag:
+                match = _match(cl_pkgkey, cl_slot, pkg_candidates, cl_tag)
+                if const_isnumber(match[1]):
+                    match = None
+            if match is None:
+                match = _match(cl_pkgkey, cl_slot, pkg_candidates, None)
 
-        # get all the installed packages
-        try:
-            package_ids = collections.deque(
-                self.installed_repository().listAllPackageIds())
-        except OperationalError:
-            # client db is broken!
-            raise SystemDatabaseError("installed packages repository is broken")
+            (m_package_id, version, tag, revision), repoid = match
+            if m_package_id == -1:
+                # just masked, leave it alone
+                continue
+
+            if empty:
+                update.add((m_package_id, repoid))
+            elif cl_revision != revision:
+                if cl_revision == etpConst['spmetprev'] \
+                        and ignore_spm_downgrades:
+                    # no difference, we're ignoring revision 9999
+                    fine.append(cl_atom)
+                    spm_fine.append((m_package_id, repoid))
+                else:
+                    update.add((m_package_id, repoid))
+            elif cl_version != version or cl_tag != tag:
+                update.add((m_package_id, repoid))
+            else:
+                # check if the package has been repackaged, see
+                # __calculate_updates_legacy()
+                c_digest = digests.get(package_id)
+                r_digest = match_digests.get((m_package_id, repoid))
+                if c_digest != "0" and (r_digest != c_digest) and \
+                        (r_digest is not None) and (c_digest is not None):
+                    update.add((m_package_id, repoid))
+                else:
+                    fine.append(cl_atom)
 
+        return leftovers
+
+    def __calculate_updates_legacy(self, package_ids, match_repos, empty,
+                                   ignore_spm_downgrades, quiet, update,
+                                   remove, fine, spm_fine):
+        """
+        calculate_updates() implementation matching the installed packages
+        one by one through atom_match(). The outcome is added to the
+        update, remove, fine and spm_fine objects.
+        """
+        package_ids = collections.deque(package_ids)
         count = 0
         total = len(package_ids)
         last_count = 0
-        remove = collections.deque()
-        fine = collections.deque()
-        spm_fine = collections.deque()
-        update = set()
 
         while True:
             try:
@@ -3368,6 +3641,108 @@ class CalculatorsMixin:
             if maskedresults[0] == -1:
                 remove.append(package_id)
 
+    @sharedinstlock
+    def calculate_updates(self, empty = False, use_cache = True,
+        critical_updates = True, quiet = False):
+        """
+        Calculate package updates. By default, this method also handles critical
+        updates priority. Updates (as well as other objects here) are returned
+        in alphabetical order. To generate a valid installation queue, have a
+        look at Client.get_install_queue().
+
+        @keyword empty: consider the installed packages repository
+            empty. Mark every package as update.
+        @type empty: bool
+        @keyword use_cache: use Entropy cache
+        @type use_cache: bool
+        @keyword critical_updates: if False, disable critical updates check
+            priority.
+        @type critical_updates: bool
+        @keyword quiet: do not print any status info if True
+        @type quiet: bool
+        @return: dict composed by (list of package matches ("update" key),
+            list of installed package identifiers ("remove" key), list of
+            package names already up-to-date ("fine" key), list of package names
+            already up-to-date when user enabled "ignore-spm-downgrades",
+            "spm_fine" key), if critical updates were found ("critical_found"
+            key). If critical_found is True, relaxed dependencies calculation
+            must be enforced.
+        @rtype: tuple
+        """
+        cl_settings = self.ClientSettings()
+        misc_settings = cl_settings['misc']
+
+        # critical updates hook, if enabled
+        # this will force callers to receive only critical updates
+        if misc_settings.get('forcedupdates') and critical_updates:
+            _atoms, update = self.calculate_critical_updates(
+                use_cache = use_cache)
+            if update:
+                return {
+                    'update': update,
+                    'remove': [],
+                    'fine': [],
+                    'spm_fine': [],
+                    'critical_found': True,
+                    }
+
+        inst_repo = self.installed_repository()
+        ignore_spm_downgrades = misc_settings['ignore_spm_downgrades']
+        enabled_repos = self.filter_repositories(self.repositories())
+        repo_order = [x for x in self._settings['repositories']['order'] if
+                      x in enabled_repos]
+
+        cache_s = "%s|%s|%s|%s|%s|%s|%s|%s|%s|%s|v7" % (
+            empty,
+            enabled_repos,
+            inst_repo.checksum(),
+            self.repositories_checksum(),
+            self._settings.packages_configuration_hash(),
+            self._settings_client_plugin.packages_configuration_hash(),
+            ";".join(sorted(self._settings['repositories']['available'])),
+            repo_order,
+            ignore_spm_downgrades,
+            # needed when users do bogus things like editing config files
+            # manually (branch setting)
+            self._settings['repositories']['branch'],
+        )
+
+        sha = hashlib.sha1()
+        sha.update(const_convert_to_rawstring(cache_s))
+        cache_key = "updates/%s_v1" % (sha.hexdigest(),)
+
+        if use_cache and self.xcache:
+            cached = self._cacher.pop(cache_key)
+            if cached is not None:
+                return cached
+
+        # do not match package repositories, never consider them in updates!
+        # that would be a nonsense, since package repos are temporary.
+        enabled_repos = self.filter_repositories(self.repositories())
+        match_repos = tuple([x for x in \
+            self._settings['repositories']['order'] if x in enabled_repos])
+
+        # get all the installed packages
+        try:
+            package_ids = self.installed_repository().listAllPackageIds()
+        except OperationalError:
+            # client db is broken!
+            raise SystemDatabaseError("installed packages repository is broken")
+
+        remove = collections.deque()
+        fine = collections.deque()
+        spm_fine = collections.deque()
+        update = set()
+
+        if self.UPDATES_ENGINE == "joined":
+            package_ids = self.__calculate_updates_joined(
+                package_ids, match_repos, empty, ignore_spm_downgrades,
+                quiet, update, remove, fine, spm_fine)
+        if package_ids:
+            self.__calculate_updates_legacy(
+                package_ids, match_repos, empty, ignore_spm_downgrades,
+                quiet, update, remove, fine, spm_fine)
+
         # validate remove, do not return installed packages that are
         # still referenced by others as "removable"
         # check inverse dependencies at the cost of growing complexity
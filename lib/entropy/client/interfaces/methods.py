@@ -37,7 +37,7 @@ from entropy.exceptions import RepositoryError, SystemDatabaseError, \
 from entropy.db.skel import EntropyRepositoryBase
 from entropy.db.exceptions import Error as EntropyRepositoryError
 from entropy.cache import EntropyCacher
-from entropy.misc import FlockFile
+from entropy.misc import FlockFile, ParallelTask
 from entropy.fetchers import UrlFetcher
 from entropy.client.interfaces.db import ClientEntropyRepositoryPlugin, \
     InstalledPackagesRepository, AvailablePackagesRepository, GenericRepository
@@ -46,6 +46,7 @@ from entropy.client.misc import sharedinstlock
 from entropy.output import purple, bold, red, blue, darkgreen, darkred, brown, \
     teal
 from entropy.client.interfaces.package.actions.action import PackageAction
+from entropy.client.interfaces.package.store import PackageStore
 from entropy.core.settings.base import RepositoryConfigParser, SystemSettings
 
 from entropy.db.exceptions import IntegrityError, OperationalError, \
@@ -75,6 +76,7 @@ class RepositoryMixin:
             client_metadata = {}
         if "masking_validation" in client_metadata:
             client_metadata['masking_validation']['cache'].clear()
+            client_metadata['masking_validation']['tables'].clear()
 
         def ensure_closed_repo(repoid):
             key = self.__get_repository_cache_key(repoid)
@@ -1496,8 +1498,31 @@ class RepositoryMixin:
                 except OSError:
                     pass
 
+        # the removed package files may still be in the package store
+        self.clean_package_store()
+
         return successfully_removed
 
+    def clean_package_store(self, dry_run = False, max_size = None):
+        """
+        Garbage collect the content-addressed package store (see
+        PackageStore), removing the least recently used package files
+        exceeding the size set by "packages-store-size" in
+        /etc/entropy/client.conf. If the package store is disabled, all
+        the stored package files are removed.
+
+        @keyword dry_run: do not remove files, just return them
+        @type dry_run: bool
+        @keyword max_size: override the client.conf setting, in bytes
+        @type max_size: int
+        @return: list of removed stored package file paths.
+        @rtype: list
+        """
+        if max_size is None:
+            max_size = self.ClientSettings()['misc']['packages_store_size']
+            max_size *= 1024 * 1024
+        return PackageStore().collect(max_size, dry_run = dry_run)
+
     def _run_repositories_post_branch_switch_hooks(self, old_branch, new_branch):
         """
         This method is called whenever branch is successfully switched by user.
@@ -1761,6 +1786,19 @@ class RepositoryMixin:
 
 class MiscMixin:
 
+    # number of mirrors benchmarked in parallel
+    MIRROR_BENCHMARK_WORKERS = 8
+
+    # mirror benchmark results younger than this (in seconds) are
+    # reused by reorder_mirrors()
+    MIRROR_BENCHMARK_MAX_AGE = 86400
+
+    # transfer size (in bytes) used to combine mirror latency and
+    # throughput into a single score
+    MIRROR_BENCHMARK_REFERENCE_SIZE = 1024000
+
+    _MIRROR_BENCHMARK_CACHE_KEY = "mirrors/benchmark_v1"
+
     def switch_chroot(self, chroot):
         """
         Switch Entropy Client to work on given chroot.
@@ -1858,87 +1896,206 @@ class MiscMixin:
 
         return licenses
 
-    def benchmark_mirrors(self, mirrors):
+    def _probe_mirror(self, mirror_url, timeout):
         """
-        Execute a throughput-oriented benchmark against the
-        list of given Entropy Packages mirrors. Return a new sorted list.
+        Download the given mirror URL and measure the time to first byte
+        and the throughput.
+
+        @param mirror_url: URL to download
+        @type mirror_url: string
+        @param timeout: download timeout in seconds
+        @type timeout: int
+        @return: (time to first byte in seconds, throughput in bytes/sec)
+            tuple or None if the download failed
+        @rtype: tuple or None
+        """
+        timings = []
+
+        class ProbeFetcher(self._url_fetcher):
+
+            def handle_statistics(self, th_id, downloaded_size, *args):
+                timings.append((time.time(), downloaded_size))
+
+            def update(self):
+                return
+
+        tmp_fd, tmp_path = const_mkstemp(
+            prefix="entropy.client.methods.benchmark_mirrors")
+        try:
+            fetcher = ProbeFetcher(mirror_url, tmp_path,
+                resume = False, show_speed = True, timeout = timeout)
+            start_t = time.time()
+            rc = fetcher.download()
+        finally:
+            os.close(tmp_fd)
+            os.remove(tmp_path)
+
+        fetch_errors = (
+            UrlFetcher.TIMEOUT_FETCH_ERROR,
+            UrlFetcher.GENERIC_FETCH_ERROR)
+        if rc in fetch_errors or not timings:
+            return None
+
+        first_t, first_size = timings[0]
+        last_t, last_size = timings[-1]
+        ttfb = first_t - start_t
+        if last_t > first_t and last_size > first_size:
+            throughput = (last_size - first_size) / (last_t - first_t)
+        else:
+            # everything arrived at once
+            throughput = last_size / max(last_t - start_t, 0.001)
+        return ttfb, float(throughput)
+
+    def _mirror_benchmark_score(self, ttfb, throughput):
+        """
+        Combine time to first byte and throughput into a score,
+        the higher the better.
+        """
+        if throughput <= 0:
+            return 0.0
+        estimated = ttfb + \
+            self.MIRROR_BENCHMARK_REFERENCE_SIZE / throughput
+        return 1.0 / max(estimated, 0.000001)
+
+    def mirror_benchmark_results(self):
+        """
+        Return the persisted mirror benchmark results.
+
+        @return: dict keyed by mirror URL, values are dicts containing
+            "ttfb" (seconds, or None), "throughput" (bytes/sec), "score"
+            and "time" (measurement timestamp) keys
+        @rtype: dict
+        """
+        results = self._cacher.pop(self._MIRROR_BENCHMARK_CACHE_KEY)
+        if not isinstance(results, dict):
+            results = {}
+        return results
+
+    def benchmark_mirrors(self, mirrors, max_age = 0):
+        """
+        Execute a latency and throughput oriented benchmark against the
+        list of given Entropy Packages mirrors. Return a new list sorted
+        by ascending score (the best mirror is the last one), as expected
+        by the repositories configuration. Mirrors are probed in parallel
+        and results are persisted.
+
+        @param mirrors: list of mirror URLs
+        @type mirrors: list
+        @keyword max_age: reuse persisted results younger than max_age
+            seconds instead of probing the mirror again (0 means never)
+        @type max_age: int
+        @return: the sorted list of mirrors
+        @rtype: list
         """
         # we believe that if a mirror does not respond in 6
         # seconds, then we should give up.
         reasonable_timeout = 6
+        mirror_test_file = "MIRROR_TEST"
+        results = self.mirror_benchmark_results()
         mirror_stats = {}
         mirror_cache = set()
-        retries = 1
-        mirror_test_file = "MIRROR_TEST"
+        pending = []
+        cur_t = time.time()
 
         for mirror in mirrors:
+            url_data = entropy.tools.spliturl(mirror)
+            hostname = url_data.hostname
+            if hostname is None:
+                # mirror string is fucked up
+                continue
+            if hostname in mirror_cache:
+                continue
+            mirror_cache.add(hostname)
 
-            tmp_fd, tmp_path = const_mkstemp(
-                prefix="entropy.client.methods.reorder_mirrors")
-            try:
+            result = results.get(mirror)
+            if max_age and result is not None \
+                    and (cur_t - result['time']) <= max_age:
+                mirror_stats[mirror] = result['score']
+                continue
+            pending.append((mirror, hostname))
+
+        output_lock = threading.Lock()
+        queue = list(reversed(pending))
+
+        def _worker():
+            while True:
+                with output_lock:
+                    if not queue:
+                        return
+                    mirror, hostname = queue.pop()
+
+                outcome = self._probe_mirror(
+                    mirror + "/" + mirror_test_file, reasonable_timeout)
+                if outcome is None:
+                    ttfb, throughput = None, 0.0
+                    score = 0.0
+                else:
+                    ttfb, throughput = outcome
+                    score = self._mirror_benchmark_score(ttfb, throughput)
+
+                with output_lock:
+                    mirror_stats[mirror] = score
+                    results[mirror] = {
+                        'ttfb': ttfb,
+                        'throughput': throughput,
+                        'score': score,
+                        'time': time.time(),
+                    }
+                    if ttfb is None:
+                        latency = _("N/A")
+                    else:
+                        latency = "%d ms" % (int(ttfb * 1000),)
+                    mytxt = "%s: %s, %s/sec, %s" % (
+                        blue(_("Mirror speed")),
+                        purple(hostname),
+                        teal(str(entropy.tools.bytes_into_human(
+                            throughput))),
+                        teal(latency),
+                    )
+                    self.output(
+                        mytxt,
+                        importance = 1,
+                        level = "info",
+                        header = brown(" @@ ")
+                    )
 
-                url_data = entropy.tools.spliturl(mirror)
-                hostname = url_data.hostname
-                if hostname is None:
-                    # mirror string is fucked up
-                    continue
-                if hostname in mirror_cache:
-                    continue
-                mirror_cache.add(hostname)
-                mirror_url = mirror + "/" + mirror_test_file
+        if pending:
+            mytxt = "%s: %s" % (
+                blue(_("Checking speed of")),
+                purple(", ".join(x[1] for x in pending)),
+            )
+            self.output(
+                mytxt,
+                importance = 1,
+                level = "info",
+                header = purple(" @@ "),
+                back = True
+            )
 
-                mytxt = "%s: %s" % (
-                    blue(_("Checking speed of")),
-                    purple(hostname),
-                )
-                self.output(
-                    mytxt,
-                    importance = 1,
-                    level = "info",
-                    header = purple(" @@ "),
-                    back = True
-                )
+            workers = []
+            for idx in range(min(self.MIRROR_BENCHMARK_WORKERS,
+                                 len(pending))):
+                task = ParallelTask(_worker)
+                task.name = "MirrorBenchmark-%d" % (idx,)
+                task.daemon = True
+                task.start()
+                workers.append(task)
+            for task in workers:
+                task.join()
 
-                download_speeds = []
-                fetch_errors = (
-                    UrlFetcher.TIMEOUT_FETCH_ERROR,
-                    UrlFetcher.GENERIC_FETCH_ERROR)
-                for idx in range(retries):
-                    fetcher = self._url_fetcher(mirror_url, tmp_path,
-                        resume = False, show_speed = False,
-                        timeout = reasonable_timeout)
-                    rc = fetcher.download()
-                    if rc not in fetch_errors:
-                        download_speeds.append(fetcher.get_transfer_rate())
-
-                result_speed = 0.0
-                if download_speeds:
-                    download_speeds.sort(reverse=True)
-                    # take the best
-                    result_speed = download_speeds[0]
-                mirror_stats[mirror] = result_speed
-
-                mytxt = "%s: %s, %s/sec" % (
-                    blue(_("Mirror speed")),
-                    purple(hostname),
-                    teal(str(entropy.tools.bytes_into_human(result_speed))),
-                )
-                self.output(
-                    mytxt,
-                    importance = 1,
-                    level = "info",
-                    header = brown(" @@ ")
-                )
-            finally:
-                os.close(tmp_fd)
-                os.remove(tmp_path)
+            try:
+                self._cacher.save(self._MIRROR_BENCHMARK_CACHE_KEY, results)
+            except IOError:
+                # unprivileged user, results are not persisted
+                pass
 
         # calculate new order
         new_mirrors = sorted(mirror_stats.keys(),
             key = lambda x: mirror_stats[x])
         return new_mirrors
 
-    def reorder_mirrors(self, repository_id, dry_run = False):
+    def reorder_mirrors(self, repository_id, dry_run = False,
+                        max_age = None):
         """
         Reorder mirror list for given repository using a throughput-based
         benchmark. This method is atomic and does not require locking,
@@ -1952,6 +2109,9 @@ class MiscMixin:
         @type repository_id: string
         @keyword dry_run: do not actually change repository mirrors order
         @type dry_run: bool
+        @keyword max_age: reuse mirror benchmark results younger than
+            max_age seconds, if None MIRROR_BENCHMARK_MAX_AGE is used
+        @type max_age: int
         @raise KeyError: if repository_id is not available
         @return: new repository metadata
         @rtype: dict
@@ -1973,7 +2133,10 @@ class MiscMixin:
         plain_packages = repository_metadata.get('plain_packages')
         if plain_packages is None:
             raise KeyError("repository_id not found (2)")
-        new_pkg_mirrors = self.benchmark_mirrors(plain_packages)
+        if max_age is None:
+            max_age = self.MIRROR_BENCHMARK_MAX_AGE
+        new_pkg_mirrors = self.benchmark_mirrors(
+            plain_packages, max_age = max_age)
 
         if not dry_run:
             exp_pkg_mirrors = []
@@ -2480,6 +2643,7 @@ class MatchMixin:
             self._settings.clear()
 
         self.ClientSettings()['masking_validation']['cache'].clear()
+        self.ClientSettings()['masking_validation']['tables'].clear()
         return done
 
     def _unmask_package_by_atom(self, package_match, dry_run = False):
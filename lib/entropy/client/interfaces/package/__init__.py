@@ -17,6 +17,7 @@ import shutil
 import time
 import codecs
 import collections
+import threading
 
 from entropy.const import etpConst, const_setup_perms, const_mkstemp, \
     const_isunicode, const_convert_to_unicode, const_debug_write, \
@@ -29,6 +30,7 @@ from entropy.client.mirrors import StatusInterface
 from entropy.core.settings.base import SystemSettings
 from entropy.security import Repository as RepositorySecurity
 from entropy.fetchers import UrlFetcher
+from entropy.misc import ParallelTask
 
 import entropy.dep
 import entropy.tools
@@ -128,6 +130,240 @@ class PackageActionFactory(object):
         return action_class(self._entropy, package_match, opts = opts)
 
 
+class PackageInstallScheduler(object):
+    """
+    Package installation scheduler.
+
+    Execute a queue of install PackageAction objects, unpacking the
+    upcoming packages on a pool of worker threads while the current one
+    is being merged. All the other phases (merge, triggers, installed
+    packages repository update) are still executed in queue order and in
+    the calling thread, inside run().
+    The amount of data unpacked ahead is bounded by UNPACK_AHEAD_SIZE and
+    by the free space available in the unpack directory.
+
+    Example code:
+
+    >>> factory = PackageActionFactory(entropy_client)
+    >>> actions = [factory.get(factory.INSTALL_ACTION, x) for x in queue]
+    >>> scheduler = PackageInstallScheduler(entropy_client, actions)
+    >>> scheduler.start()
+    >>> try:
+    ...     for action in actions:
+    ...         exit_status = scheduler.run(action)
+    ... finally:
+    ...     scheduler.shutdown()
+    ...     for action in actions:
+    ...         action.finalize()
+
+    The scheduler methods must be called from the same thread.
+    """
+
+    # number of unpack worker threads, unpacking is mostly CPU bound
+    # Python code, more threads would just fight for the GIL
+    WORKERS = 1
+
+    # maximum number of packages unpacked ahead
+    UNPACK_AHEAD = 6
+
+    # maximum amount of (uncompressed) bytes unpacked ahead
+    UNPACK_AHEAD_SIZE = 2 * 1024 * 1024 * 1024
+
+    # maximum fraction of the unpack directory free space that
+    # can be used by the packages unpacked ahead
+    UNPACK_AHEAD_FREE_SPACE_RATIO = 0.5
+
+    def __init__(self, entropy_client, actions, workers = None):
+        """
+        Object constructor.
+
+        @param entropy_client: a valid Client instance.
+        @type entropy_client: entropy.client.interfaces.Client
+        @param actions: ordered list of install PackageAction objects
+        @type actions: list
+        @keyword workers: number of unpack worker threads, if None,
+            the ETP_INSTALL_UNPACK_WORKERS environment variable or
+            WORKERS are used. Unpacking ahead is disabled if 0.
+        @type workers: int
+        """
+        self._entropy = entropy_client
+        self._actions = list(actions)
+        if workers is None:
+            workers = os.getenv("ETP_INSTALL_UNPACK_WORKERS", self.WORKERS)
+            try:
+                workers = int(workers)
+            except ValueError:
+                workers = self.WORKERS
+        self._workers = max(0, workers)
+
+        self._cond = threading.Condition(threading.Lock())
+        self._pending = collections.deque()
+        self._running = set()
+        self._reserved = {}
+        self._reserved_size = 0
+        self._size_limit = 0
+        self._next = 0
+        self._threads = []
+        self._stop = False
+
+    def _unpack_ahead_size_limit(self):
+        """
+        Return the maximum amount of bytes that can be unpacked ahead.
+        """
+        unpack_dir = etpConst['entropyunpackdir']
+        while not os.path.isdir(unpack_dir):
+            parent_dir = os.path.dirname(unpack_dir)
+            if parent_dir == unpack_dir:
+                break
+            unpack_dir = parent_dir
+
+        try:
+            st = os.statvfs(unpack_dir)
+        except OSError as err:
+            const_debug_write(
+                __name__,
+                "PackageInstallScheduler: cannot statvfs %s: %s" % (
+                    unpack_dir, repr(err)))
+            return 0
+
+        free_space = st.f_bavail * st.f_frsize
+        return min(self.UNPACK_AHEAD_SIZE,
+                   int(free_space * self.UNPACK_AHEAD_FREE_SPACE_RATIO))
+
+    def _unpacked_size(self, action):
+        """
+        Return the on-disk size of the package referenced by action.
+        """
+        repo = self._entropy.open_repository(action.repository_id())
+        return repo.retrieveOnDiskSize(action.package_id()) or 0
+
+    def _schedule(self):
+        """
+        Schedule more packages for unpacking, as long as the unpack ahead
+        constraints are satisfied.
+        """
+        while self._next < len(self._actions):
+            if len(self._reserved) >= self.UNPACK_AHEAD:
+                break
+
+            action = self._actions[self._next]
+            size = self._unpacked_size(action)
+            if self._reserved and \
+                    self._reserved_size + size > self._size_limit:
+                break
+            self._next += 1
+
+            try:
+                # make sure that the action metadata is generated here,
+                # in the calling thread
+                action.setup()
+            except EntropyException as err:
+                # will be raised again by start()
+                const_debug_write(
+                    __name__,
+                    "PackageInstallScheduler: cannot setup %s: %s" % (
+                        action, repr(err)))
+                continue
+
+            with self._cond:
+                self._reserved[action] = size
+                self._reserved_size += size
+                self._pending.append(action)
+                self._cond.notify()
+
+    def _worker(self):
+        """
+        Unpack worker thread body.
+        """
+        while True:
+            with self._cond:
+                while not (self._pending or self._stop):
+                    self._cond.wait()
+                if self._stop:
+                    return
+                action = self._pending.popleft()
+                self._running.add(action)
+
+            try:
+                action.preunpack()
+            except Exception:
+                entropy.tools.print_traceback()
+            finally:
+                with self._cond:
+                    self._running.discard(action)
+                    self._cond.notify_all()
+
+    def start(self):
+        """
+        Start unpacking the queued packages.
+        """
+        if not self._workers:
+            return
+
+        self._size_limit = self._unpack_ahead_size_limit()
+        for idx in range(self._workers):
+            th = ParallelTask(self._worker)
+            th.daemon = True
+            th.name = "PackageUnpack-%d" % (idx,)
+            self._threads.append(th)
+            th.start()
+        self._schedule()
+
+    def run(self, action):
+        """
+        Execute the given install action, its unpack phase is skipped if
+        the package files have been already unpacked. Actions must be run
+        in queue order.
+
+        @param action: the install PackageAction object
+        @type action: PackageAction
+        @return: the action exit status
+        @rtype: int
+        """
+        with self._cond:
+            try:
+                # not started yet, let start() do the work
+                self._pending.remove(action)
+            except ValueError:
+                pass
+            while action in self._running:
+                self._cond.wait()
+
+        try:
+            return action.start()
+        finally:
+            with self._cond:
+                self._reserved_size -= self._reserved.pop(action, 0)
+            if self._threads and not self._stop:
+                self._schedule()
+
+    def shutdown(self):
+        """
+        Stop the unpack worker threads and wait for them to terminate.
+        The unpacked files of the packages that have not been run are
+        removed.
+        """
+        with self._cond:
+            self._stop = True
+            self._pending.clear()
+            self._cond.notify_all()
+        for th in self._threads:
+            th.join()
+        del self._threads[:]
+
+        with self._cond:
+            leftovers = list(self._reserved.keys())
+            self._reserved.clear()
+            self._reserved_size = 0
+
+        for action in leftovers:
+            metadata = action.metadata()
+            if metadata is None:
+                continue
+            unpack_dir = const_convert_to_rawstring(metadata['unpackdir'])
+            shutil.rmtree(unpack_dir, True)
+
+
 class PackageActionFactoryWrapper(PackageActionFactory):
     """
     Compatibility class that provides the old Entropy Package() interface.
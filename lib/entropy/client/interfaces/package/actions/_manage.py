@@ -21,6 +21,7 @@ import entropy.tools
 
 from .. import _content as Content
 
+from ._merge import ConfigProtectMatcher
 from .action import PackageAction
 
 
@@ -241,37 +242,54 @@ class _PackageInstallRemoveAction(PackageAction):
 
         return config
 
+    def _get_config_protect_matcher(self, entropy_repository, package_id,
+                                    _metadata = None):
+        """
+        Return the ConfigProtectMatcher object for the given package, to be
+        passed to _handle_config_protect(). Build it once per action.
+        """
+        protect = self._get_config_protect(
+            entropy_repository, package_id, _metadata = _metadata)
+        mask = self._get_config_protect(
+            entropy_repository, package_id, mask = True,
+            _metadata = _metadata)
+        return ConfigProtectMatcher(
+            protect, mask, self._get_config_protect_skip())
+
     def _get_config_protect_metadata(self, installed_repository,
                                      installed_package_id,
                                      _metadata=None):
         """
-        Get the config_protect+mask metadata object.
+        Get the config protection metadata object.
         Make sure to call this before the package goes away from the
         repository.
         """
-        protect = self._get_config_protect(
+        matcher = self._get_config_protect_matcher(
             installed_repository, installed_package_id,
             _metadata = _metadata)
-        mask = self._get_config_protect(
-            installed_repository, installed_package_id, mask = True,
-            _metadata = _metadata)
 
         metadata = {
-            'config_protect+mask': (protect, mask)
+            'config_protect_matcher': matcher,
         }
         return metadata
 
-    def _handle_config_protect(self, protect, mask, protectskip,
-                               fromfile, tofile,
+    def _handle_config_protect(self, protect_matcher, fromfile, tofile,
                                do_allocation_check = True,
                                do_quiet = False):
         """
         Handle configuration file protection. This method contains the logic
         for determining if a file should be protected from overwrite.
+        protect_matcher is the ConfigProtectMatcher object returned by
+        _get_config_protect_matcher().
         """
-        protected = False
         do_continue = False
-        in_mask = False
+
+        # not in CONFIG_PROTECT or masked by CONFIG_PROTECT_MASK
+        if not protect_matcher.protected(tofile):
+            return False, False, tofile, do_continue
+
+        protected = True
+        in_mask = True
 
         tofile_os = tofile
         fromfile_os = fromfile
@@ -279,46 +297,6 @@ class _PackageInstallRemoveAction(PackageAction):
             tofile_os = const_convert_to_rawstring(tofile)
             fromfile_os = const_convert_to_rawstring(fromfile)
 
-        if tofile in protect:
-            protected = True
-            in_mask = True
-
-        elif os.path.dirname(tofile) in protect:
-            protected = True
-            in_mask = True
-
-        else:
-            tofile_testdir = os.path.dirname(tofile)
-            old_tofile_testdir = None
-            while tofile_testdir != old_tofile_testdir:
-                if tofile_testdir in protect:
-                    protected = True
-                    in_mask = True
-                    break
-                old_tofile_testdir = tofile_testdir
-                tofile_testdir = os.path.dirname(tofile_testdir)
-
-        if protected: # check if perhaps, file is masked, so unprotected
-
-            if tofile in mask:
-                protected = False
-                in_mask = False
-
-            elif os.path.dirname(tofile) in mask:
-                protected = False
-                in_mask = False
-
-            else:
-                tofile_testdir = os.path.dirname(tofile)
-                old_tofile_testdir = None
-                while tofile_testdir != old_tofile_testdir:
-                    if tofile_testdir in mask:
-                        protected = False
-                        in_mask = False
-                        break
-                    old_tofile_testdir = tofile_testdir
-                    tofile_testdir = os.path.dirname(tofile_testdir)
-
         if not os.path.lexists(tofile_os):
             protected = False # file doesn't exist
 
@@ -365,7 +343,7 @@ class _PackageInstallRemoveAction(PackageAction):
         ##__________________##
 
         # check if protection is disabled for this element
-        if tofile in protectskip:
+        if protect_matcher.skipped(tofile):
             self._entropy.logger.log(
                 "[Package]",
                 etpConst['logging']['normal_loglevel_id'],
@@ -437,8 +415,7 @@ class _PackageInstallRemoveAction(PackageAction):
                                          not_removed_due_to_collisions,
                                          colliding_path_messages,
                                          automerge_metadata, col_protect,
-                                         protect, mask, protectskip,
-                                         sys_root):
+                                         protect_matcher, sys_root):
         """
         Body of the _remove_content_from_system() method.
         """
@@ -489,7 +466,7 @@ class _PackageInstallRemoveAction(PackageAction):
                 protected_item_test = sys_root_item
                 (in_mask, protected, _x,
                  do_continue) = self._handle_config_protect(
-                     protect, mask, protectskip, None, protected_item_test,
+                     protect_matcher, None, protected_item_test,
                      do_allocation_check = False, do_quiet = True
                  )
 
@@ -633,13 +610,16 @@ class _PackageInstallRemoveAction(PackageAction):
 
     def _remove_content_from_system(self, installed_repository,
                                     remove_atom, remove_config, sys_root,
-                                    protect_mask, removecontent_file,
+                                    protect_matcher, removecontent_file,
                                     automerge_metadata,
                                     affected_directories, affected_infofiles,
                                     preserved_mgr):
         """
         Remove installed package content (files/directories) from live system.
 
+        @param protect_matcher: the ConfigProtectMatcher object of the
+            package, or None
+        @type protect_matcher: ConfigProtectMatcher
         @keyword automerge_metadata: Entropy "automerge metadata"
         @type automerge_metadata: dict
         """
@@ -653,11 +633,9 @@ class _PackageInstallRemoveAction(PackageAction):
         not_removed_due_to_collisions = set()
         colliding_path_messages = set()
 
-        if protect_mask is not None:
-            protect, mask = protect_mask
-        else:
-            protect, mask = set(), set()
-        protectskip = self._get_config_protect_skip()
+        if protect_matcher is None:
+            protect_matcher = ConfigProtectMatcher(
+                (), (), self._get_config_protect_skip())
 
         remove_content = None
         try:
@@ -675,7 +653,7 @@ class _PackageInstallRemoveAction(PackageAction):
                 directories, directories_cache,
                 preserved_mgr,
                 not_removed_due_to_collisions, colliding_path_messages,
-                automerge_metadata, col_protect, protect, mask, protectskip,
+                automerge_metadata, col_protect, protect_matcher,
                 sys_root)
 
         finally:
@@ -0,0 +1,467 @@
+# -*- coding: utf-8 -*-
+"""
+
+    @author: Fabio Erculiani <lxnay@sabayon.org>
+    @contact: lxnay@sabayon.org
+    @copyright: Fabio Erculiani
+    @license: GPL-2
+
+    B{Entropy Package Manager Client Package merge and config protection
+    helpers}.
+
+"""
+import collections
+import errno
+import os
+import stat
+import time
+
+try:
+    from os import scandir as _scandir
+except ImportError:
+    try:
+        from scandir import scandir as _scandir
+    except ImportError:
+        _scandir = None
+
+# Python 3.3+ can rename relative to directory file descriptors.
+_RENAME_DIR_FD = getattr(os, "supports_dir_fd", None) is not None \
+    and os.rename in os.supports_dir_fd
+
+
+_BYTES_SEP = os.sep.encode("ascii")
+
+# lstat()-like object only carrying the file type bits in st_mode.
+_FileType = collections.namedtuple("_FileType", ("st_mode",))
+
+
+def _path_sep(path):
+    """
+    Return os.sep in the same string type of path.
+    """
+    if isinstance(path, bytes):
+        return _BYTES_SEP
+    return os.sep
+
+
+class PathPrefixTrie(object):
+    """
+    Set of paths matching a given path if the path itself or any of its
+    parent directories belongs to the set. Lookups cost O(path depth),
+    regardless of the number of paths in the set.
+    Empty path components are ignored, so "/etc/" and "/etc" are the same
+    path.
+    """
+
+    _END = None
+
+    def __init__(self, paths = None):
+        """
+        PathPrefixTrie constructor.
+
+        @keyword paths: initial paths
+        @type paths: iterable
+        """
+        self._root = {}
+        if paths is not None:
+            for path in paths:
+                self.add(path)
+
+    @staticmethod
+    def _components(path):
+        return [x for x in path.split(_path_sep(path)) if x]
+
+    def add(self, path):
+        """
+        Add a path to the set.
+
+        @param path: the path
+        @type path: string
+        """
+        node = self._root
+        for component in self._components(path):
+            node = node.setdefault(component, {})
+        node[self._END] = True
+
+    def match(self, path):
+        """
+        Return whether the given path or any of its parent directories
+        belongs to the set.
+
+        @param path: the path
+        @type path: string
+        @rtype: bool
+        """
+        end = self._END
+        node = self._root
+        if end in node:
+            return True
+        for component in path.split(_path_sep(path)):
+            if not component:
+                continue
+            node = node.get(component)
+            if node is None:
+                return False
+            if end in node:
+                return True
+        return False
+
+    def __bool__(self):
+        return bool(self._root)
+
+    __nonzero__ = __bool__
+
+
+class ConfigProtectMatcher(object):
+    """
+    Compiled configuration file protection rules of a package: the
+    CONFIG_PROTECT, CONFIG_PROTECT_MASK and protection skip paths.
+    A path is protected if it, or any of its parent directories, is listed
+    in CONFIG_PROTECT, unless it, or any of its parent directories, is
+    listed in CONFIG_PROTECT_MASK. Lookups cost O(path depth).
+    """
+
+    def __init__(self, protect, mask, skip):
+        """
+        ConfigProtectMatcher constructor.
+
+        @param protect: CONFIG_PROTECT paths
+        @type protect: iterable
+        @param mask: CONFIG_PROTECT_MASK paths
+        @type mask: iterable
+        @param skip: paths whose protection is skipped (exact match)
+        @type skip: iterable
+        """
+        self._protect = PathPrefixTrie(protect)
+        self._mask = PathPrefixTrie(mask)
+        self._skip = frozenset(skip)
+
+    def protected(self, path):
+        """
+        Return whether path is subject to configuration file protection.
+
+        @param path: the path
+        @type path: string
+        @rtype: bool
+        """
+        if not self._protect.match(path):
+            return False
+        return not self._mask.match(path)
+
+    def masked(self, path):
+        """
+        Return whether path is covered by CONFIG_PROTECT_MASK.
+
+        @param path: the path
+        @type path: string
+        @rtype: bool
+        """
+        return self._mask.match(path)
+
+    def skipped(self, path):
+        """
+        Return whether the protection of path has been disabled.
+
+        @param path: the path
+        @type path: string
+        @rtype: bool
+        """
+        return path in self._skip
+
+
+class MergeTimer(object):
+    """
+    Per-phase timing and item counters of a package merge.
+    """
+
+    def __init__(self):
+        self._timings = {}
+        self._counters = {}
+        self._order = []
+        self._started = time.time()
+
+    def start(self):
+        """
+        Return a start time to be passed to stop().
+        """
+        return time.time()
+
+    def stop(self, phase, started):
+        """
+        Account the time elapsed since started to the given phase.
+        """
+        elapsed = time.time() - started
+        timing = self._timings.get(phase)
+        if timing is None:
+            self._order.append(phase)
+            timing = 0.0
+        self._timings[phase] = timing + elapsed
+
+    def count(self, counter, value = 1):
+        """
+        Increment the given counter.
+        """
+        self._counters[counter] = self._counters.get(counter, 0) + value
+
+    def summary(self):
+        """
+        Return a human readable summary of the collected data.
+
+        @rtype: string
+        """
+        counters = ", ".join(
+            "%s %d" % (x, self._counters[x]) for x in sorted(self._counters))
+        timings = ", ".join(
+            "%s %.3fs" % (x, self._timings[x]) for x in self._order)
+        return "%s in %.3fs (%s)" % (
+            counters, time.time() - self._started, timings)
+
+
+class LiveFilesystem(object):
+    """
+    Cached view of the live filesystem used while merging a package image.
+    Each directory is listed once, lstat() is only called for entries that
+    actually exist (and whose file type is not already known from the
+    directory listing) and realpath() is computed once per directory. All the
+    changes made by the merge code must be recorded through add() and
+    discard() in order to keep the cache coherent.
+    """
+
+    _MAX_DIR_FDS = 4
+
+    def __init__(self, timer = None):
+        """
+        LiveFilesystem constructor.
+
+        @keyword timer: MergeTimer object, directory listings are accounted
+            to its "scan" phase
+        @type timer: MergeTimer
+        """
+        self._timer = timer
+        self._entries = {}
+        self._realpaths = {}
+        self._devices = {}
+        self._dir_fds = collections.OrderedDict()
+
+    def _scan(self, directory):
+        """
+        Return the cached directory listing, name -> lstat() result, the
+        scandir() entry or None if not yet known.
+        """
+        entries = self._entries.get(directory)
+        if entries is not None:
+            return entries
+
+        started = None
+        if self._timer is not None:
+            started = self._timer.start()
+        entries = {}
+        try:
+            if _scandir is not None:
+                for entry in _scandir(directory):
+                    entries[entry.name] = entry
+            else:
+                for name in os.listdir(directory):
+                    entries[name] = None
+        except (OSError, IOError) as err:
+            if err.errno not in (errno.ENOENT, errno.ENOTDIR):
+                raise
+        if started is not None:
+            self._timer.stop("scan", started)
+            self._timer.count("scanned directories")
+
+        self._entries[directory] = entries
+        return entries
+
+    def lstat(self, path):
+        """
+        Return the lstat() result of path or None if it does not exist.
+        """
+        directory, name = os.path.split(path)
+        entries = self._scan(directory)
+        if name not in entries:
+            return None
+        st = entries[name]
+        if st is None or not hasattr(st, "st_mode"):
+            try:
+                if st is None:
+                    st = os.lstat(path)
+                else:
+                    st = st.stat(follow_symlinks = False)
+            except (OSError, IOError) as err:
+                if err.errno not in (errno.ENOENT, errno.ENOTDIR):
+                    raise
+                del entries[name]
+                return None
+            entries[name] = st
+        return st
+
+    def file_type(self, path):
+        """
+        Return an lstat()-like object of path, only carrying the file type
+        in st_mode, or None if it does not exist. The file type reported by
+        the directory listing is used, if available, to avoid lstat().
+
+        @return: object with the st_mode attribute or None
+        @rtype: os.stat_result or None
+        """
+        directory, name = os.path.split(path)
+        entries = self._scan(directory)
+        if name not in entries:
+            return None
+        entry = entries[name]
+        if entry is not None and not hasattr(entry, "st_mode"):
+            # scandir() entry, these never raise on missing files
+            if entry.is_symlink():
+                return _FileType(stat.S_IFLNK)
+            if entry.is_dir(follow_symlinks = False):
+                return _FileType(stat.S_IFDIR)
+            if entry.is_file(follow_symlinks = False):
+                return _FileType(stat.S_IFREG)
+        return self.lstat(path)
+
+    def add(self, path, st = None):
+        """
+        Record that path has been created or replaced.
+
+        @keyword st: the new lstat() result of path, if known
+        @type st: os.stat_result
+        """
+        directory, name = os.path.split(path)
+        entries = self._entries.get(directory)
+        if entries is not None:
+            entries[name] = st
+        self._invalidate(path)
+
+    def discard(self, path):
+        """
+        Record that path has been removed.
+        """
+        directory, name = os.path.split(path)
+        entries = self._entries.get(directory)
+        if entries is not None:
+            entries.pop(name, None)
+        self._invalidate(path)
+
+    def _invalidate(self, path):
+        """
+        Drop the cached data about path as a directory.
+        """
+        self._devices.pop(path, None)
+        fd = self._dir_fds.pop(path, None)
+        if fd is not None:
+            os.close(fd)
+        if path not in self._entries and path not in self._realpaths:
+            return
+
+        # path was a directory, drop everything cached below it and,
+        # since symlinks may point into it, all the realpath() results.
+        prefix = path + _path_sep(path)
+        for cache in (self._entries, self._devices):
+            for key in [x for x in cache if x.startswith(prefix)]:
+                del cache[key]
+        self._entries.pop(path, None)
+        self._realpaths.clear()
+
+    def reset(self):
+        """
+        Drop all the cached data.
+        """
+        self.close()
+        self._entries.clear()
+        self._realpaths.clear()
+        self._devices.clear()
+
+    def realpath(self, directory):
+        """
+        Return os.path.realpath() of the given directory.
+        """
+        r_path = self._realpaths.get(directory)
+        if r_path is None:
+            r_path = os.path.realpath(directory)
+            self._realpaths[directory] = r_path
+        return r_path
+
+    def device(self, directory):
+        """
+        Return the device id of the given directory, following symlinks,
+        or None if it cannot be determined.
+        """
+        if directory in self._devices:
+            return self._devices[directory]
+        try:
+            dev = os.stat(directory).st_dev
+        except (OSError, IOError):
+            dev = None
+        self._devices[directory] = dev
+        return dev
+
+    def _dir_fd(self, directory, keep = None):
+        """
+        Return a (cached) file descriptor of the given directory. When the
+        cache is full, the least recently used descriptor is closed.
+
+        @keyword keep: directory whose cached descriptor must not be closed
+            because it is still in use by the caller
+        @type keep: string
+        """
+        fd = self._dir_fds.pop(directory, None)
+        if fd is None:
+            for old_dir in list(self._dir_fds.keys()):
+                if len(self._dir_fds) < self._MAX_DIR_FDS:
+                    break
+                if old_dir != keep:
+                    os.close(self._dir_fds.pop(old_dir))
+            fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        self._dir_fds[directory] = fd
+        return fd
+
+    def rename(self, src, dest):
+        """
+        Rename src to dest, using directory file descriptors where
+        supported. Both paths are expected to be on the same filesystem.
+
+        @raise OSError: if the rename fails
+        """
+        if _RENAME_DIR_FD:
+            src_dir, src_name = os.path.split(src)
+            dest_dir, dest_name = os.path.split(dest)
+            src_fd = self._dir_fd(src_dir)
+            dest_fd = self._dir_fd(dest_dir, keep = src_dir)
+            os.rename(src_name, dest_name,
+                      src_dir_fd = src_fd, dst_dir_fd = dest_fd)
+        else:
+            os.rename(src, dest)
+
+    def close(self):
+        """
+        Release the directory file descriptors.
+        """
+        fds = list(self._dir_fds.values())
+        self._dir_fds.clear()
+        for fd in fds:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+def is_link(st):
+    """
+    Return whether the given lstat() result (or None) is a symlink.
+    """
+    return st is not None and stat.S_ISLNK(st.st_mode)
+
+
+def is_dir(st):
+    """
+    Return whether the given lstat() result (or None) is a directory.
+    """
+    return st is not None and stat.S_ISDIR(st.st_mode)
+
+
+def is_file(st):
+    """
+    Return whether the given lstat() result (or None) is a regular file.
+    """
+    return st is not None and stat.S_ISREG(st.st_mode)
@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+"""
+
+    @author: Fabio Erculiani <lxnay@sabayon.org>
+    @contact: lxnay@sabayon.org
+    @copyright: Fabio Erculiani
+    @license: GPL-2
+
+    B{Entropy Package Manager Client Package streaming unpack Interface}.
+
+"""
+import codecs
+import errno
+import hashlib
+import os
+import shutil
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+from entropy.const import etpConst, const_debug_write, \
+    const_convert_to_rawstring, const_setup_directory
+from entropy.misc import ParallelTask
+
+import entropy.tools
+
+
+class _QueueReader(object):
+    """
+    Non-seekable file object returning the data chunks pushed into a Queue
+    object. A None chunk marks the end of the stream.
+    """
+
+    def __init__(self, queue):
+        self._queue = queue
+        self._buf = const_convert_to_rawstring("")
+        self._eof = False
+
+    def read(self, size = -1):
+        """
+        Read at most size bytes, blocking until they are available or the
+        end of the stream is reached.
+        """
+        chunks = [self._buf]
+        length = len(self._buf)
+        while not self._eof and (size < 0 or length < size):
+            chunk = self._queue.get()
+            if chunk is None:
+                self._eof = True
+            else:
+                chunks.append(chunk)
+                length += len(chunk)
+        data = const_convert_to_rawstring("").join(chunks)
+        if size < 0:
+            self._buf = const_convert_to_rawstring("")
+            return data
+        self._buf = data[size:]
+        return data[:size]
+
+    def drain(self):
+        """
+        Consume the stream up to its end, so that the writer never blocks.
+        """
+        while not self._eof:
+            if self._queue.get() is None:
+                self._eof = True
+        self._buf = const_convert_to_rawstring("")
+
+
+class PackageStreamUnpacker(object):
+    """
+    Unpack an Entropy package file while it is being downloaded.
+
+    The downloaded data is passed to feed() (see the stream_func argument
+    of UrlFetcher) and, in the same pass, it is hashed, handed to a tar
+    extractor thread unpacking the package payload into a staging image
+    directory and scanned for the Entropy metadata (edb) trailer, which
+    is saved into the staging edb file.
+    Once the downloaded package file has been verified, commit() makes the
+    staging directory available to the install action, see adopt().
+    """
+
+    # maximum number of data chunks queued for the extractor thread
+    _QUEUE_SIZE = 64
+
+    _STAMP_FILE = "digest"
+
+    def __init__(self, package_path, hashes = ("md5",)):
+        """
+        PackageStreamUnpacker constructor.
+
+        @param package_path: path of the package file being downloaded
+        @type package_path: string
+        @keyword hashes: hashlib algorithms computed over the stream
+        @type hashes: iterable
+        """
+        self._package_path = package_path
+        self._hashes = tuple(hashes)
+        self._directory = self.staging_directory(package_path)
+        self._image_dir = os.path.join(self._directory, "image")
+        self._edb_path = os.path.join(self._directory, "edb", "pkg.db")
+        self._tag = const_convert_to_rawstring(etpConst['databasestarttag'])
+
+        self._digests = {}
+        self._queue = None
+        self._thread = None
+        self._extract_st = None
+        self._tar_closed = True
+        self._edb_file = None
+        self._edb_found = False
+        self._carry = const_convert_to_rawstring("")
+        self._failed = False
+        self._complete = False
+
+    @staticmethod
+    def staging_directory(package_path):
+        """
+        Return the staging directory used for the given package file.
+
+        @param package_path: path of the package file
+        @type package_path: string
+        @return: the staging directory path
+        @rtype: string
+        """
+        name = "%s-%s" % (
+            os.path.basename(package_path),
+            hashlib.sha1(
+                const_convert_to_rawstring(package_path)).hexdigest()[:8],)
+        return os.path.join(etpConst['entropyunpackdir'], "stream", name)
+
+    def start(self):
+        """
+        Start a new unpack, discarding any previous staging data.
+        """
+        self.discard()
+        const_setup_directory(os.path.dirname(self._directory))
+        os.makedirs(self._image_dir)
+        os.makedirs(os.path.dirname(self._edb_path))
+
+        self._digests = dict((x, hashlib.new(x)) for x in self._hashes)
+        self._queue = Queue(self._QUEUE_SIZE)
+        self._extract_st = None
+        self._tar_closed = False
+        self._edb_file = None
+        self._edb_found = False
+        self._carry = const_convert_to_rawstring("")
+        self._failed = False
+        self._complete = False
+
+        self._thread = ParallelTask(self._extract)
+        self._thread.name = "PackageStreamUnpack"
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _extract(self):
+        """
+        Extractor thread body.
+        """
+        reader = _QueueReader(self._queue)
+        try:
+            self._extract_st = entropy.tools.uncompress_tarball_stream(
+                reader, self._image_dir, catch_empty = True)
+        except Exception as err:
+            const_debug_write(
+                __name__,
+                "PackageStreamUnpacker: cannot unpack %s: %s" % (
+                    self._package_path, repr(err),))
+            self._extract_st = 1
+        finally:
+            reader.drain()
+
+    def _close_tar(self):
+        """
+        Signal the end of the package payload to the extractor thread.
+        """
+        if not self._tar_closed:
+            self._tar_closed = True
+            self._queue.put(None)
+
+    def feed(self, data):
+        """
+        Process a chunk of the package file data. Chunks must be fed in
+        order and the first one must start at the beginning of the file.
+
+        @param data: package file data
+        @type data: bytes
+        """
+        if self._thread is None:
+            return
+        for digest in self._digests.values():
+            digest.update(data)
+        if self._failed:
+            return
+
+        try:
+            self._feed(data)
+        except (OSError, IOError) as err:
+            const_debug_write(
+                __name__,
+                "PackageStreamUnpacker: cannot process %s: %s" % (
+                    self._package_path, repr(err),))
+            self._failed = True
+            self._close_tar()
+
+    def _feed(self, data):
+        """
+        feed() worker, data is split between the payload and the edb.
+        """
+        tag_len = len(self._tag)
+        carry_len = len(self._carry)
+        buf = self._carry + data
+        self._carry = buf[-(tag_len - 1):]
+
+        first = buf.find(self._tag)
+        if first == -1:
+            if self._edb_file is not None:
+                self._edb_file.write(data)
+            else:
+                self._queue.put(data)
+            return
+
+        last = buf.rfind(self._tag)
+        if self._edb_file is None:
+            # the payload ends right before the first tag, part of the
+            # tag may have already been queued, which is harmless
+            # trailing data for the tar reader.
+            payload = data[:max(0, first - carry_len)]
+            if payload:
+                self._queue.put(payload)
+            self._close_tar()
+            self._edb_file = open(self._edb_path, "wb")
+            self._edb_found = True
+        else:
+            # like entropy.tools.dump_entropy_metadata(), the last tag
+            # wins. But then, the payload has been cut short.
+            self._edb_file.seek(0)
+            self._edb_file.truncate()
+            self._failed = True
+        if first != last:
+            self._failed = True
+        self._edb_file.write(buf[last + tag_len:])
+
+    def finish(self):
+        """
+        Wait for the unpack to complete, once all the data has been fed.
+
+        @return: True, if the payload has been unpacked and the Entropy
+            metadata saved
+        @rtype: bool
+        """
+        if self._thread is None:
+            return False
+        self._close_tar()
+        if self._edb_file is not None:
+            try:
+                self._edb_file.close()
+            except (OSError, IOError):
+                self._failed = True
+            self._edb_file = None
+        self._thread.join()
+        self._thread = None
+
+        self._complete = self._edb_found and not self._failed \
+            and self._extract_st == 0
+        return self._complete
+
+    def complete(self):
+        """
+        Return whether the last unpack completed successfully.
+
+        @rtype: bool
+        """
+        return self._complete
+
+    def hexdigest(self, hash_type):
+        """
+        Return the hex digest of the fed data.
+
+        @param hash_type: hashlib algorithm, one of those passed to
+            the constructor
+        @type hash_type: string
+        @return: the hex digest or None
+        @rtype: string
+        """
+        digest = self._digests.get(hash_type)
+        if digest is None:
+            return None
+        return digest.hexdigest()
+
+    def digests(self):
+        """
+        Return all the hex digests of the fed data.
+
+        @return: hash type -> hex digest map
+        @rtype: dict
+        """
+        return dict((k, v.hexdigest()) for k, v in self._digests.items())
+
+    def commit(self, checksum):
+        """
+        Make the completed unpack available to adopt().
+
+        @param checksum: the verified package file md5
+        @type checksum: string
+        @return: True, if successful
+        @rtype: bool
+        """
+        if not self._complete:
+            self.discard()
+            return False
+        stamp_path = os.path.join(self._directory, self._STAMP_FILE)
+        try:
+            with codecs.open(stamp_path, "w",
+                             encoding = "ascii") as stamp_f:
+                stamp_f.write(checksum)
+        except (OSError, IOError):
+            self.discard()
+            return False
+        return True
+
+    def discard(self):
+        """
+        Stop any running unpack and remove the staging data.
+        """
+        if self._thread is not None:
+            self._close_tar()
+            if self._edb_file is not None:
+                try:
+                    self._edb_file.close()
+                except (OSError, IOError):
+                    pass
+                self._edb_file = None
+            self._thread.join()
+            self._thread = None
+        self._complete = False
+        shutil.rmtree(self._directory, True)
+
+    @classmethod
+    def adopt(cls, package_path, checksum, image_dir, edb_path):
+        """
+        Move the committed streaming unpack of the given package file to
+        image_dir and edb_path. The staging data is removed in any case.
+
+        @param package_path: path of the package file
+        @type package_path: string
+        @param checksum: the expected package file md5
+        @type checksum: string
+        @param image_dir: the package image directory, it must not exist
+            or be empty
+        @type image_dir: string
+        @param edb_path: the package Entropy metadata file path
+        @type edb_path: string
+        @return: True, if the unpack has been adopted
+        @rtype: bool
+        """
+        directory = cls.staging_directory(package_path)
+        if not os.path.isdir(directory):
+            return False
+
+        try:
+            stamp_path = os.path.join(directory, cls._STAMP_FILE)
+            try:
+                with codecs.open(stamp_path, "r",
+                                 encoding = "ascii") as stamp_f:
+                    stamp = stamp_f.read().strip()
+            except (OSError, IOError) as err:
+                if err.errno != errno.ENOENT:
+                    raise
+                return False
+            if not checksum or stamp != checksum:
+                return False
+
+            image_moved = False
+            try:
+                if os.path.isdir(image_dir):
+                    os.rmdir(image_dir)
+                edb_dir = os.path.dirname(edb_path)
+                if not os.path.isdir(edb_dir):
+                    os.makedirs(edb_dir)
+                os.rename(os.path.join(directory, "image"), image_dir)
+                image_moved = True
+                os.rename(os.path.join(directory, "edb", "pkg.db"), edb_path)
+            except (OSError, IOError) as err:
+                const_debug_write(
+                    __name__,
+                    "PackageStreamUnpacker: cannot adopt %s: %s" % (
+                        package_path, repr(err),))
+                if image_moved:
+                    shutil.rmtree(image_dir, True)
+                return False
+            return True
+
+        finally:
+            shutil.rmtree(directory, True)
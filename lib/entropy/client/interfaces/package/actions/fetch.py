@@ -28,6 +28,8 @@ import entropy.dep
 import entropy.tools
 
 from .action import PackageAction
+from ._stream import PackageStreamUnpacker
+from ..store import PackageStore
 
 
 class _PackageFetchAction(PackageAction):
@@ -37,6 +39,10 @@ class _PackageFetchAction(PackageAction):
 
     NAME = "fetch"
 
+    # packages smaller than this (in bytes) are never unpacked while
+    # being downloaded, see PackageStreamUnpacker.
+    STREAM_UNPACK_MIN_SIZE = 8 * 1024 * 1024
+
     def __init__(self, entropy_client, package_match, opts = None):
         """
         Object constructor.
@@ -129,6 +135,20 @@ class _PackageFetchAction(PackageAction):
         metadata['pkgpath'] = self._get_download_path(
             metadata['download'], metadata)
 
+        # unpack large packages while downloading them, if the
+        # package is going to be installed (stream_unpack option).
+        stream_unpack = self._opts.get('stream_unpack', False)
+        if stream_unpack:
+            stream_unpack = self._entropy.ClientSettings(
+                )['misc']['stream_unpack']
+        if stream_unpack and 'fetch_path' not in metadata:
+            size = repo.retrieveSize(self._package_id)
+            stream_unpack = size is not None and \
+                size >= self.STREAM_UNPACK_MIN_SIZE
+        else:
+            stream_unpack = False
+        metadata['stream_unpack'] = stream_unpack
+
         metadata['phases'] = []
 
         if not self._entropy._is_package_repository(self._repository_id):
@@ -525,9 +545,11 @@ class _PackageFetchAction(PackageAction):
 
     def _download_file(self, url, download_path, digest = None,
                        resume = True, package_id = None,
-                       repository_id = None):
+                       repository_id = None, mirror_urls = None):
         """
         Internal method. Try to download the package file.
+        If segmented downloads are enabled, mirror_urls (other URLs
+        of the same file) are used to download segments in parallel.
         """
 
         def do_stfu_rm(xpath):
@@ -555,6 +577,10 @@ class _PackageFetchAction(PackageAction):
                         download_path_dir, err))
                 return -1, 0, False
 
+        # a package file shared with the package store must not be
+        # resumed, the stored copy would be corrupted.
+        self._unshare_download_path(download_path)
+
         fetch_abort_function = self._meta.get('fetch_abort_function')
         existed_before = False
         if os.path.isfile(download_path) and os.path.exists(download_path):
@@ -567,12 +593,31 @@ class _PackageFetchAction(PackageAction):
         basic_pwd = repo_data.get('password')
         https_validate_cert = not repo_data.get('https_validate_cert') == "false"
 
+        # feed the streaming unpacker, if any, only when the file is
+        # downloaded from scratch.
+        fetch_kwargs = {}
+        unpacker = self._meta.get('stream_unpacker')
+        if unpacker is not None:
+            if existed_before:
+                unpacker.discard()
+                unpacker = None
+            else:
+                unpacker.start()
+                fetch_kwargs['stream_func'] = unpacker.feed
+        if unpacker is None:
+            segments = self._entropy.ClientSettings(
+                )['misc']['download_segments']
+            if segments > 1:
+                fetch_kwargs['segments'] = segments
+                fetch_kwargs['mirror_urls'] = mirror_urls
+
         fetch_intf = self._entropy._url_fetcher(
             url, download_path, resume = resume,
             abort_check_func = fetch_abort_function,
             http_basic_user = basic_user,
             http_basic_pwd = basic_pwd,
-            https_validate_cert = https_validate_cert)
+            https_validate_cert = https_validate_cert,
+            **fetch_kwargs)
 
         if (package_id is not None) and (repository_id is not None):
             self._setup_differential_download(
@@ -609,6 +654,10 @@ class _PackageFetchAction(PackageAction):
                 do_stfu_rm(download_path)
             return -1, data_transfer, resumed
 
+        finally:
+            if unpacker is not None:
+                unpacker.finish()
+
         if fetch_checksum == UrlFetcher.GENERIC_FETCH_ERROR:
             # !! not found
             # maybe we already have it?
@@ -739,7 +788,9 @@ class _PackageFetchAction(PackageAction):
                         package_id = package_id,
                         repository_id = repository_id,
                         digest = checksum,
-                        resume = do_resume
+                        resume = do_resume,
+                        mirror_urls = [x + "/" + download for x in uris
+                                       if x != uri and x in remaining]
                     )
 
                 if exit_st == 0:
@@ -878,6 +929,7 @@ class _PackageFetchAction(PackageAction):
                 checksum
             )
 
+        store = self._get_package_store()
         locks = []
         try:
             download_path = self._get_download_path(
@@ -896,22 +948,53 @@ class _PackageFetchAction(PackageAction):
                         self._meta['signatures'])
 
                 if verify_st != 0:
-                    download_st = _fetch(
-                        download_path,
-                        self._meta['download'],
-                        self._meta['checksum'])
+                    verify_st = self._fetch_from_store(
+                        store, download_path,
+                        self._meta['checksum'],
+                        self._meta['signatures'])
+
+                if verify_st != 0:
+                    unpacker = self._get_stream_unpacker(download_path)
+                    self._meta['stream_unpacker'] = unpacker
+                    try:
+                        download_st = _fetch(
+                            download_path,
+                            self._meta['download'],
+                            self._meta['checksum'])
+                    finally:
+                        self._meta['stream_unpacker'] = None
+
+                    # the digests computed while streaming avoid
+                    # reading the package file again.
+                    digests = None
+                    if unpacker is not None and unpacker.complete():
+                        digests = unpacker.digests()
+                        if digests['md5'] != self._meta['checksum']:
+                            digests = None
 
                     if download_st == 0:
                         verify_st = self._match_checksum(
                             download_path,
                             self._repository_id,
                             self._meta['checksum'],
-                            self._meta['signatures'])
+                            self._meta['signatures'],
+                            digests = digests)
+
+                    if unpacker is not None:
+                        if verify_st == 0 and digests is not None:
+                            unpacker.commit(self._meta['checksum'])
+                        else:
+                            unpacker.discard()
 
                 if verify_st != 0:
                     _download_error(verify_st)
                     return verify_st
 
+                self._add_to_store(
+                    store, download_path,
+                    self._meta['checksum'],
+                    self._meta['signatures'])
+
             for extra_download in self._meta['extra_download']:
 
                 download_path = self._get_download_path(
@@ -936,6 +1019,12 @@ class _PackageFetchAction(PackageAction):
                             extra_download['md5'],
                             signatures)
 
+                    if verify_st != 0:
+                        verify_st = self._fetch_from_store(
+                            store, download_path,
+                            extra_download['md5'],
+                            signatures)
+
                     if verify_st != 0:
                         download_st = _fetch(
                             download_path,
@@ -953,16 +1042,92 @@ class _PackageFetchAction(PackageAction):
                         _download_error(verify_st)
                         return verify_st
 
+                    self._add_to_store(
+                        store, download_path,
+                        extra_download['md5'],
+                        signatures)
+
             return 0
 
         finally:
             for l in locks:
                 l.close()
 
+    def _get_package_store(self):
+        """
+        Return the PackageStore object holding the package files, or None
+        if the package store is disabled or the package files are not
+        downloaded to their standard location.
+        """
+        if 'fetch_path' in self._meta:
+            return None
+        if not self._entropy.ClientSettings()['misc']['packages_store_size']:
+            return None
+        return PackageStore()
+
+    def _fetch_from_store(self, store, download_path, checksum, signatures):
+        """
+        Link the package file at download_path to its stored copy, if any,
+        and verify it. Return the _match_checksum() exit status.
+        The download path lock must be held.
+        """
+        if store is None:
+            return 1
+        if not store.link(store.key(checksum, signatures), download_path):
+            return 1
+
+        verify_st = self._match_checksum(
+            download_path, self._repository_id, checksum, signatures)
+        if verify_st != 0:
+            # never write into a stored package file, for instance
+            # while resuming the download.
+            self._unshare_download_path(download_path)
+        return verify_st
+
+    def _add_to_store(self, store, download_path, checksum, signatures):
+        """
+        Add the verified package file at download_path to the package store.
+        The download path lock must be held.
+        """
+        if store is not None:
+            store.insert(store.key(checksum, signatures), download_path)
+
+    def _unshare_download_path(self, download_path):
+        """
+        Remove the package file at download_path if it is hardlinked
+        elsewhere, like to the package store, since it is going to be
+        downloaded again and written to.
+        """
+        try:
+            if os.lstat(download_path).st_nlink > 1:
+                os.remove(download_path)
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+
+    def _get_stream_unpacker(self, download_path):
+        """
+        Return a PackageStreamUnpacker object for the main package file,
+        or None if streaming unpack is not enabled for it.
+        """
+        if not self._meta['stream_unpack']:
+            return None
+        enabled_hashes = self._entropy.ClientSettings(
+            )['misc']['packagehashes']
+        hashes = ["md5"]
+        for hash_type in ("sha1", "sha256", "sha512"):
+            if hash_type in enabled_hashes:
+                hashes.append(hash_type)
+        return PackageStreamUnpacker(download_path, hashes = hashes)
+
     def _match_checksum(self, download_path, repository_id,
-                        checksum, signatures):
+                        checksum, signatures, digests = None):
         """
         Verify package checksum and return an exit status code.
+        If digests (hash type -> hex digest map of the package file
+        data) is given, the listed hashes are not computed again.
+        Otherwise, the package file is read only once, computing all
+        the hashes to verify together.
         """
         download_path_mtime = download_path + etpConst['packagemtimefileext']
 
@@ -1082,7 +1247,10 @@ class _PackageFetchAction(PackageAction):
 
                     down_name = os.path.basename(download_path)
 
-                    valid = cmp_func(download_path, hash_val)
+                    if digests and hash_type in digests:
+                        valid = digests[hash_type] == hash_val
+                    else:
+                        valid = cmp_func(download_path, hash_val)
                     if valid is None:
                         self._entropy.output(
                             "[%s] %s '%s' %s" % (
@@ -1134,7 +1302,23 @@ class _PackageFetchAction(PackageAction):
         download_name = os.path.basename(download_path)
         valid_checksum = False
         try:
-            valid_checksum = entropy.tools.compare_md5(download_path, checksum)
+            if not digests or "md5" not in digests:
+                # read the package file once, also computing the
+                # signatures that are going to be checked.
+                hashes = ["md5"]
+                if isinstance(signatures, dict) and \
+                        do_mtime_validation() != 0:
+                    for hash_type in ("sha1", "sha256", "sha512"):
+                        if hash_type not in enabled_hashes:
+                            continue
+                        if signatures.get(hash_type) is None:
+                            continue
+                        hashes.append(hash_type)
+                computed = entropy.tools.multi_hash(download_path, hashes)
+                if digests:
+                    computed.update(digests)
+                digests = computed
+            valid_checksum = digests["md5"] == checksum
         except (OSError, IOError) as err:
             valid_checksum = False
             const_debug_write(
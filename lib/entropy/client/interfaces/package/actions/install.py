@@ -26,6 +26,8 @@ import entropy.dep
 import entropy.tools
 
 from ._manage import _PackageInstallRemoveAction
+from ._merge import LiveFilesystem, MergeTimer, is_dir, is_file, is_link
+from ._stream import PackageStreamUnpacker
 from ._triggers import Trigger
 
 from .. import _content as Content
@@ -146,6 +148,12 @@ class _PackageInstallAction(_PackageInstallRemoveAction):
 
         metadata['download'] = repo.retrieveDownloadURL(self._package_id)
 
+        # used to pick up the package unpacked while being downloaded,
+        # see PackageStreamUnpacker.
+        metadata['checksum'] = None
+        if not is_package_repo:
+            metadata['checksum'] = repo.retrieveDigest(self._package_id)
+
         description = repo.retrieveDescription(self._package_id)
         if description:
             if len(description) > 74:
@@ -396,20 +404,23 @@ class _PackageInstallAction(_PackageInstallRemoveAction):
 
         return 0
 
-    def _unpack_package(self, package_path, image_dir, pkg_dbpath):
+    def _unpack_package(self, package_path, image_dir, pkg_dbpath,
+                        quiet = False):
         """
-        Effectively unpack the package tarballs.
+        Effectively unpack the package tarballs. If quiet is True, nothing
+        is printed to the user, errors are only logged.
         """
-        txt = "%s: %s" % (
-            blue(_("Unpacking")),
-            red(os.path.basename(package_path)),
-        )
-        self._entropy.output(
-            txt,
-            importance = 1,
-            level = "info",
-            header = red("   ## ")
-        )
+        if not quiet:
+            txt = "%s: %s" % (
+                blue(_("Unpacking")),
+                red(os.path.basename(package_path)),
+            )
+            self._entropy.output(
+                txt,
+                importance = 1,
+                level = "info",
+                header = red("   ## ")
+            )
 
         self._entropy.logger.log(
             "[Package]",
@@ -440,12 +451,13 @@ class _PackageInstallAction(_PackageInstallRemoveAction):
                     "Unable to mkdir: %s, error: %s" % (
                         image_dir, repr(err),)
                 )
-                self._entropy.output(
-                    "%s: %s" % (brown(_("Unpack error")), err.errno,),
-                    importance = 1,
-                    level = "error",
-                    header = red("   ## ")
-                )
+                if not quiet:
+                    self._entropy.output(
+                        "%s: %s" % (brown(_("Unpack error")), err.errno,),
+                        importance = 1,
+                        level = "error",
+                        header = red("   ## ")
+                    )
                 return 1
 
         # pkg_dbpath is only non-None for the base package file
@@ -472,12 +484,13 @@ class _PackageInstallAction(_PackageInstallRemoveAction):
                     "[Package]", etpConst['logging']['normal_loglevel_id'],
                     "Unable to dump edb for: " + pkg_dbpath
                 )
-                self._entropy.output(
-                    brown(_("Unable to find Entropy metadata in package")),
-                    importance = 1,
-                    level = "error",
-                    header = red("   ## ")
-                )
+                if not quiet:
+                    self._entropy.output(
+                        brown(_("Unable to find Entropy metadata in package")),
+                        importance = 1,
+                        level = "error",
+                        header = red("   ## ")
+                    )
                 return 1
 
         try:
@@ -492,7 +505,8 @@ class _PackageInstallAction(_PackageInstallRemoveAction):
                 "EOFError on " + package_path + " " + \
                 repr(err)
             )
-            entropy.tools.print_traceback()
+            if not quiet:
+                entropy.tools.print_traceback()
             # try again until unpack_tries goes to 0
             exit_st = 1
         except Exception as err:
@@ -502,7 +516,8 @@ class _PackageInstallAction(_PackageInstallRemoveAction):
                 "Ouch! error while unpacking " + \
                 package_path + " " + repr(err)
             )
-            entropy.tools.print_traceback()
+            if not quiet:
+                entropy.tools.print_traceback()
             # try again until unpack_tries goes to 0
             exit_st = 1
 
@@ -511,12 +526,13 @@ class _PackageInstallAction(_PackageInstallRemoveAction):
                 "[Package]", etpConst['logging']['normal_loglevel_id'],
                 "Unable to unpack: %s" % (package_path,)
             )
-            self._entropy.output(
-                brown(_("Unable to unpack package")),
-                importance = 1,
-                level = "error",
-                header = red("   ## ")
-            )
+            if not quiet:
+                self._entropy.output(
+                    brown(_("Unable to unpack package")),
+                    importance = 1,
+                    level = "error",
+                    header = red("   ## ")
+                )
 
         return exit_st
 
@@ -610,32 +626,27 @@ class _PackageInstallAction(_PackageInstallRemoveAction):
         return spm_class.entropy_install_unpack_hook(self._entropy,
             self._meta)
 
-    def _unpack_phase(self):
+    def preunpack(self):
         """
-        Execute the unpack phase.
+        Unpack the package files into the image directory ahead of start(),
+        which is then going to skip the unpack work. This is meant to be
+        called from another thread while other packages are being installed
+        and thus it doesn't touch the live system nor print anything.
+        Return an exit status.
         """
-        xterm_title = "%s %s: %s" % (
-            self._xterm_header,
-            _("Unpacking"),
-            self._meta['download'],
-        )
-        self._entropy.set_title(xterm_title)
+        self.setup()
+        if self._meta['merge_from']:
+            return 0
 
-        def _unpack_error(exit_st):
-            msg = _("An error occurred while trying to unpack the package")
-            errormsg = "%s. %s. %s: %s" % (
-                red(msg),
-                red(_("Check if your system is healthy")),
-                blue(_("Error")),
-                exit_st,
-            )
-            self._entropy.output(
-                errormsg,
-                importance = 1,
-                level = "error",
-                header = red("   ## ")
-            )
+        exit_st = self._unpack_package_files(quiet = True)
+        self._meta['preunpack_status'] = exit_st
+        return exit_st
 
+    def _unpack_package_files(self, quiet = False):
+        """
+        Unpack the package file and its extra download files into the
+        image directory. Return an exit status.
+        """
         locks = []
         try:
             download_path = self._meta['pkgpath']
@@ -647,22 +658,32 @@ class _PackageInstallAction(_PackageInstallRemoveAction):
                 if not self._stat_path(download_path):
                     const_debug_write(
                         __name__,
-                        "_unpack_phase: %s vanished" % (
+                        "_unpack_package_files: %s vanished" % (
                             download_path,))
-                    _unpack_error(2)
                     return 2
 
-                exit_st = self._unpack_package(
-                    download_path,
-                    self._meta['imagedir'],
-                    self._meta['pkgdbpath'])
+                if self._meta['checksum'] and PackageStreamUnpacker.adopt(
+                        download_path, self._meta['checksum'],
+                        self._meta['imagedir'], self._meta['pkgdbpath']):
+                    self._entropy.logger.log(
+                        "[Package]",
+                        etpConst['logging']['normal_loglevel_id'],
+                        "Package unpacked while downloading: %s" % (
+                            download_path,)
+                    )
+                    exit_st = 0
+                else:
+                    exit_st = self._unpack_package(
+                        download_path,
+                        self._meta['imagedir'],
+                        self._meta['pkgdbpath'],
+                        quiet = quiet)
 
                 if exit_st != 0:
                     const_debug_write(
                         __name__,
-                        "_unpack_phase: %s unpack error: %s" % (
+                        "_unpack_package_files: %s unpack error: %s" % (
                             download_path, exit_st))
-                    _unpack_error(exit_st)
                     return exit_st
 
             for extra_download in self._meta['extra_download']:
@@ -675,28 +696,71 @@ class _PackageInstallAction(_PackageInstallRemoveAction):
                     if not self._stat_path(download_path):
                         const_debug_write(
                             __name__,
-                            "_unpack_phase: %s vanished" % (
+                            "_unpack_package_files: %s vanished" % (
                                 download_path,))
-                        _unpack_error(2)
                         return 2
 
                     exit_st = self._unpack_package(
                         download_path,
                         self._meta['imagedir'],
-                        None)
+                        None,
+                        quiet = quiet)
 
                     if exit_st != 0:
                         const_debug_write(
                             __name__,
-                            "_unpack_phase: %s unpack error: %s" % (
+                            "_unpack_package_files: %s unpack error: %s" % (
                                 download_path, exit_st,))
-                        _unpack_error(exit_st)
                         return exit_st
 
         finally:
             for l in locks:
                 l.close()
 
+        return 0
+
+    def _unpack_phase(self):
+        """
+        Execute the unpack phase.
+        """
+        xterm_title = "%s %s: %s" % (
+            self._xterm_header,
+            _("Unpacking"),
+            self._meta['download'],
+        )
+        self._entropy.set_title(xterm_title)
+
+        exit_st = self._meta.get('preunpack_status')
+        if exit_st is None:
+            exit_st = self._unpack_package_files()
+
+        elif exit_st != 0:
+            # preunpack() failed, start from scratch, this time
+            # errors are reported to the user
+            const_debug_write(
+                __name__,
+                "_unpack_phase: preunpack error: %s, trying again" % (
+                    exit_st,))
+            shutil.rmtree(self._meta['imagedir'], True)
+            shutil.rmtree(os.path.dirname(self._meta['pkgdbpath']), True)
+            exit_st = self._unpack_package_files()
+
+        if exit_st != 0:
+            msg = _("An error occurred while trying to unpack the package")
+            errormsg = "%s. %s. %s: %s" % (
+                red(msg),
+                red(_("Check if your system is healthy")),
+                blue(_("Error")),
+                exit_st,
+            )
+            self._entropy.output(
+                errormsg,
+                importance = 1,
+                level = "error",
+                header = red("   ## ")
+            )
+            return exit_st
+
         spm_class = self._entropy.Spm_class()
         # call Spm unpack hook
         return spm_class.entropy_install_unpack_hook(self._entropy,
@@ -905,7 +969,7 @@ class _PackageInstallAction(_PackageInstallRemoveAction):
                 remove_atom,
                 self._meta['removeconfig'],
                 sys_root,
-                config_protect_metadata['config_protect+mask'],
+                config_protect_metadata['config_protect_matcher'],
                 removecontent_file,
                 self._meta['already_protected_config_files'],
                 self._meta['affected_directories'],
@@ -1524,10 +1588,8 @@ class _PackageInstallAction(_PackageInstallRemoveAction):
         """
         metadata = self.metadata()
         repo = self._entropy.open_repository(self._repository_id)
-        protect = self._get_config_protect(repo, self._package_id)
-        mask = self._get_config_protect(repo, self._package_id,
-                                        mask = True)
-        protectskip = self._get_config_protect_skip()
+        protect_matcher = self._get_config_protect_matcher(
+            repo, self._package_id)
 
         # support for unit testing settings
         sys_root = self._get_system_root(metadata)
@@ -1546,6 +1608,21 @@ class _PackageInstallAction(_PackageInstallRemoveAction):
                 from_enctype = etpConst['conf_encoding'])
         movefile = entropy.tools.movefile
 
+        # the live filesystem state is read once per directory
+        timer = MergeTimer()
+        live = LiveFilesystem(timer = timer)
+        image_dir_meta = {}
+
+        def get_image_dir_meta(currentdir):
+            dir_meta = image_dir_meta.get(currentdir)
+            if dir_meta is None:
+                rel_dir_utf = const_convert_to_unicode(
+                    currentdir[len(image_dir):] or os.sep)
+                dir_meta = (rel_dir_utf, rel_dir_utf in info_dirs)
+                image_dir_meta.clear()
+                image_dir_meta[currentdir] = dir_meta
+            return dir_meta
+
         def workout_subdir(currentdir, subdir):
 
             imagepath_dir = os.path.join(currentdir, subdir)
@@ -1568,13 +1645,19 @@ class _PackageInstallAction(_PackageInstallRemoveAction):
                         items_not_installed.add(unicode_rootdir)
                         return 0
 
+            live_st = live.file_type(rootdir)
+            live_link = is_link(live_st)
+
             # handle broken symlinks
-            if os.path.islink(rootdir) and not os.path.exists(rootdir):
+            if live_link and not os.path.exists(rootdir):
                 # broken symlink
                 os.remove(rootdir)
+                live.discard(rootdir)
+                live_st, live_link = None, False
 
             # if our directory is a file on the live system
-            elif os.path.isfile(rootdir): # really weird...!
+            elif is_file(live_st) or (
+                    live_link and os.path.isfile(rootdir)): # really weird...!
 
                 self._entropy.logger.log(
                     "[Package]",
@@ -1598,6 +1681,9 @@ class _PackageInstallAction(_PackageInstallRemoveAction):
                     tmp_fd, tmp_path = const_mkstemp(
                         dir = rootdir_dir, prefix=rootdir_name)
                     os.rename(rootdir, tmp_path)
+                    live.discard(rootdir)
+                    live.add(tmp_path)
+                    live_st, live_link = None, False
                 finally:
                     if tmp_fd is not None:
                         try:
@@ -1621,7 +1707,7 @@ class _PackageInstallAction(_PackageInstallRemoveAction):
 
                 # if our live system features a directory instead of
                 # a symlink, we should consider removing the directory
-                if not os.path.islink(rootdir) and os.path.isdir(rootdir):
+                if is_dir(live_st):
                     self._entropy.logger.log(
                         "[Package]",
                         etpConst['logging']['normal_loglevel_id'],
@@ -1643,15 +1729,16 @@ class _PackageInstallAction(_PackageInstallRemoveAction):
 
                 tolink = os.readlink(imagepath_dir)
                 live_tolink = None
-                if os.path.islink(rootdir):
+                if live_link:
                     live_tolink = os.readlink(rootdir)
 
                 if tolink != live_tolink:
                     _symfail = False
-                    if os.path.lexists(rootdir):
+                    if live_st is not None:
                         # at this point, it must be a file
                         try:
                             os.remove(rootdir)
+                            live.discard(rootdir)
                         except OSError as err:
                             _symfail = True
                             # must be atomic, too bad if it fails
@@ -1677,12 +1764,16 @@ class _PackageInstallAction(_PackageInstallRemoveAction):
                             )
                     if not _symfail:
                         os.symlink(tolink, rootdir)
+                        live.add(rootdir)
+                        live_link = True
 
-            elif not os.path.isdir(rootdir):
+            elif not is_dir(live_st) and not (
+                    live_link and os.path.isdir(rootdir)):
                 # directory not found, we need to create it
                 try:
                     # really force a simple mkdir first of all
                     os.mkdir(rootdir)
+                    live.add(rootdir)
                 except (OSError, IOError) as err:
                     # the only two allowed errors are these
                     if err.errno not in (errno.EEXIST, errno.ENOENT):
@@ -1697,13 +1788,16 @@ class _PackageInstallAction(_PackageInstallRemoveAction):
                         except (OSError, IOError) as err2:
                             if err2.errno != errno.EEXIST:
                                 raise
+                    # parent directories may have been created as well
+                    live.reset()
 
-            if not os.path.islink(rootdir):
+            if not live_link:
 
                 # symlink doesn't need permissions, also
                 # until os.walk ends they might be broken
-                user = os.stat(imagepath_dir)[stat.ST_UID]
-                group = os.stat(imagepath_dir)[stat.ST_GID]
+                imagepath_st = os.stat(imagepath_dir)
+                user = imagepath_st[stat.ST_UID]
+                group = imagepath_st[stat.ST_GID]
                 try:
                     os.chown(rootdir, user, group)
                     shutil.copystat(imagepath_dir, rootdir)
@@ -1737,7 +1831,7 @@ class _PackageInstallAction(_PackageInstallRemoveAction):
                         return 4
 
             item_dir, item_base = os.path.split(rootdir)
-            item_dir = os.path.realpath(item_dir)
+            item_dir = live.realpath(item_dir)
             item_inst = os.path.join(item_dir, item_base)
             item_inst = const_convert_to_unicode(item_inst)
             items_installed.add(item_inst)
@@ -1749,16 +1843,15 @@ class _PackageInstallAction(_PackageInstallRemoveAction):
 
             fromfile = os.path.join(currentdir, item)
             rel_fromfile = fromfile[len(image_dir):]
-            rel_fromfile_dir = os.path.dirname(rel_fromfile)
             tofile = sys_root + rel_fromfile
 
-            rel_fromfile_dir_utf = const_convert_to_unicode(
-                rel_fromfile_dir)
+            rel_fromfile_dir_utf, is_info_dir = get_image_dir_meta(
+                currentdir)
             metadata['affected_directories'].add(
                 rel_fromfile_dir_utf)
 
             # account for info files, if any
-            if rel_fromfile_dir_utf in info_dirs:
+            if is_info_dir:
                 rel_fromfile_utf = const_convert_to_unicode(
                     rel_fromfile)
                 for _ext in self._INFO_EXTS:
@@ -1799,9 +1892,11 @@ class _PackageInstallAction(_PackageInstallRemoveAction):
             prot_old_tofile = const_convert_to_unicode(prot_old_tofile)
 
             pre_tofile = tofile[:]
+            started = timer.start()
             (in_mask, protected,
              tofile, do_return) = self._handle_config_protect(
-                 protect, mask, protectskip, fromfile, tofile)
+                 protect_matcher, fromfile, tofile)
+            timer.stop("config protect", started)
 
             # collect new config automerge data
             if in_mask and os.path.exists(fromfile):
@@ -1859,57 +1954,22 @@ class _PackageInstallAction(_PackageInstallRemoveAction):
             if do_return:
                 return 0
 
-            try:
-                from_r_path = os.path.realpath(fromfile)
-            except RuntimeError:
-                # circular symlink, fuck!
-                # really weird...!
-                self._entropy.logger.log(
-                    "[Package]",
-                    etpConst['logging']['normal_loglevel_id'],
-                    "WARNING!!! %s is a circular symlink !!!" % (fromfile,)
-                )
-                txt = "%s: %s" % (
-                    _("QA: circular symlink issue"),
-                    const_convert_to_unicode(fromfile),
-                )
-                self._entropy.output(
-                    darkred(txt),
-                    importance = 1,
-                    level = "warning",
-                    header = red(" !!! ")
-                )
-                from_r_path = fromfile
-
-            try:
-                to_r_path = os.path.realpath(tofile)
-            except RuntimeError:
-                # circular symlink, fuck!
-                # really weird...!
-                self._entropy.logger.log(
-                    "[Package]",
-                    etpConst['logging']['normal_loglevel_id'],
-                    "WARNING!!! %s is a circular symlink !!!" % (tofile,)
-                )
-                mytxt = "%s: %s" % (
-                    _("QA: circular symlink issue"),
-                    const_convert_to_unicode(tofile),
-                )
-                self._entropy.output(
-                    darkred(mytxt),
-                    importance = 1,
-                    level = "warning",
-                    header = red(" !!! ")
-                )
-                to_r_path = tofile
+            to_st = live.file_type(tofile)
+            # realpath() is only relevant if tofile is a symlink
+            from_r_path = None
+            to_r_path = None
+            if is_link(to_st):
+                from_r_path, to_r_path = resolve_paths(fromfile, tofile)
 
-            if from_r_path == to_r_path and os.path.islink(tofile):
+            if from_r_path == to_r_path and is_link(to_st):
                 # there is a serious issue here, better removing tofile,
                 # happened to someone.
 
                 try:
                     # try to cope...
                     os.remove(tofile)
+                    live.discard(tofile)
+                    to_st = None
                 except (OSError, IOError,) as err:
                     self._entropy.logger.log(
                         "[Package]",
@@ -1921,7 +1981,7 @@ class _PackageInstallAction(_PackageInstallRemoveAction):
                     )
 
             # if our file is a dir on the live system
-            if os.path.isdir(tofile) and not os.path.islink(tofile):
+            if is_dir(to_st):
 
                 # really weird...!
                 self._entropy.logger.log(
@@ -1944,8 +2004,9 @@ class _PackageInstallAction(_PackageInstallRemoveAction):
                 return 1
 
             # moving file using the raw format
+            started = timer.start()
             try:
-                done = movefile(fromfile, tofile, src_basedir = image_dir)
+                done = move_file(fromfile, tofile)
             except (IOError,) as err:
                 # try to move forward, sometimes packages might be
                 # fucked up and contain broken things
@@ -1963,6 +2024,8 @@ class _PackageInstallAction(_PackageInstallRemoveAction):
                     )
                 )
                 done = True
+            finally:
+                timer.stop("move", started)
 
             if not done:
                 self._entropy.logger.log(
@@ -1985,7 +2048,7 @@ class _PackageInstallAction(_PackageInstallRemoveAction):
                 )
                 return 4
 
-            item_dir = os.path.realpath(os.path.dirname(tofile))
+            item_dir = live.realpath(os.path.dirname(tofile))
             item_inst = os.path.join(item_dir, os.path.basename(tofile))
             item_inst = const_convert_to_unicode(item_inst)
             items_installed.add(item_inst)
@@ -1998,18 +2061,108 @@ class _PackageInstallAction(_PackageInstallRemoveAction):
 
             return 0
 
+        def resolve_paths(fromfile, tofile):
+
+            try:
+                from_r_path = os.path.realpath(fromfile)
+            except RuntimeError:
+                # circular symlink, fuck!
+                # really weird...!
+                self._entropy.logger.log(
+                    "[Package]",
+                    etpConst['logging']['normal_loglevel_id'],
+                    "WARNING!!! %s is a circular symlink !!!" % (fromfile,)
+                )
+                txt = "%s: %s" % (
+                    _("QA: circular symlink issue"),
+                    const_convert_to_unicode(fromfile),
+                )
+                self._entropy.output(
+                    darkred(txt),
+                    importance = 1,
+                    level = "warning",
+                    header = red(" !!! ")
+                )
+                from_r_path = fromfile
+
+            try:
+                to_r_path = os.path.realpath(tofile)
+            except RuntimeError:
+                # circular symlink, fuck!
+                # really weird...!
+                self._entropy.logger.log(
+                    "[Package]",
+                    etpConst['logging']['normal_loglevel_id'],
+                    "WARNING!!! %s is a circular symlink !!!" % (tofile,)
+                )
+                mytxt = "%s: %s" % (
+                    _("QA: circular symlink issue"),
+                    const_convert_to_unicode(tofile),
+                )
+                self._entropy.output(
+                    darkred(mytxt),
+                    importance = 1,
+                    level = "warning",
+                    header = red(" !!! ")
+                )
+                to_r_path = tofile
+
+            return from_r_path, to_r_path
+
+        def move_file(fromfile, tofile):
+            # rename() regular files on the same filesystem right away,
+            # movefile() handles everything else.
+            try:
+                from_st = os.lstat(fromfile)
+            except OSError:
+                from_st = None
+
+            if is_file(from_st) and from_st.st_dev == live.device(
+                    os.path.dirname(tofile)):
+                try:
+                    live.rename(fromfile, tofile)
+                except OSError as err:
+                    const_debug_write(
+                        __name__,
+                        "move_file: cannot rename %s: %s" % (
+                            tofile, repr(err)))
+                else:
+                    live.add(tofile, st = from_st)
+                    timer.count("renamed files")
+                    return True
+
+            try:
+                return movefile(fromfile, tofile, src_basedir = image_dir)
+            finally:
+                live.add(tofile)
+
         # merge data into system
-        for currentdir, subdirs, files in os.walk(image_dir):
+        try:
+            for currentdir, subdirs, files in os.walk(image_dir):
 
-            # create subdirs
-            for subdir in subdirs:
-                exit_st = workout_subdir(currentdir, subdir)
-                if exit_st != 0:
-                    return exit_st
+                # create subdirs
+                started = timer.start()
+                for subdir in subdirs:
+                    exit_st = workout_subdir(currentdir, subdir)
+                    if exit_st != 0:
+                        return exit_st
+                timer.stop("directories", started)
+                timer.count("directories", len(subdirs))
 
-            for item in files:
-                move_st = workout_file(currentdir, item)
-                if move_st != 0:
-                    return move_st
+                started = timer.start()
+                for item in files:
+                    move_st = workout_file(currentdir, item)
+                    if move_st != 0:
+                        return move_st
+                timer.stop("files", started)
+                timer.count("files", len(files))
+
+        finally:
+            live.close()
+            self._entropy.logger.log(
+                "[Package]",
+                etpConst['logging']['normal_loglevel_id'],
+                "Merged %s: %s" % (metadata['atom'], timer.summary())
+            )
 
         return 0
@@ -406,24 +406,35 @@ class _PackageMultiFetchAction(_PackageFetchAction):
 
         # Note: the following two hooks are running in separate threads.
 
+        store = self._get_package_store()
+
         def pre_download_hook(path, download_id):
             path_data = url_data[download_id - 1]
             (_hook_package_id, hook_repository_id, _hook_url,
              hook_download_path, hook_cksum, hook_signs) = path_data
 
+            verify_st = 1
             if self._stat_path(hook_download_path):
                 verify_st = self._match_checksum(
                     hook_download_path,
                     hook_repository_id,
                     hook_cksum,
                     hook_signs)
-                if verify_st == 0:
-                    # UrlFetcher returns the md5 checksum on success
-                    with validated_download_ids_lock:
-                        validated_download_ids.add(download_id)
-                    return hook_cksum
+            if verify_st != 0:
+                verify_st = self._fetch_from_store(
+                    store, hook_download_path, hook_cksum, hook_signs)
+
+            if verify_st == 0:
+                self._add_to_store(
+                    store, hook_download_path, hook_cksum, hook_signs)
+                # UrlFetcher returns the md5 checksum on success
+                with validated_download_ids_lock:
+                    validated_download_ids.add(download_id)
+                return hook_cksum
 
-            # request the download
+            # request the download, a package file shared with the
+            # package store must not be resumed.
+            self._unshare_download_path(hook_download_path)
             return None
 
         def post_download_hook(_path, _status, download_id):
@@ -432,7 +443,7 @@ class _PackageMultiFetchAction(_PackageFetchAction):
              hook_download_path, hook_cksum, hook_signs) = path_data
 
             with validated_download_ids_lock:
-                if hook_download_path in validated_download_ids:
+                if download_id in validated_download_ids:
                     # nothing to check, path already verified
                     return
 
@@ -445,6 +456,8 @@ class _PackageMultiFetchAction(_PackageFetchAction):
                 hook_cksum,
                 hook_signs)
             if verify_st == 0:
+                self._add_to_store(
+                    store, hook_download_path, hook_cksum, hook_signs)
                 with validated_download_ids_lock:
                     validated_download_ids.add(download_id)
 
@@ -204,7 +204,7 @@ class _PackageRemoveAction(_PackageInstallRemoveAction):
             atom,
             self._meta['removeconfig'],
             sys_root,
-            config_protect_metadata['config_protect+mask'],
+            config_protect_metadata['config_protect_matcher'],
             removecontent_file,
             automerge_metadata,
             self._meta['affected_directories'],
@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+"""
+
+    @author: Fabio Erculiani <lxnay@sabayon.org>
+    @contact: lxnay@sabayon.org
+    @copyright: Fabio Erculiani
+    @license: GPL-2
+
+    B{Entropy Package Manager Client content-addressed package store}.
+
+"""
+import errno
+import os
+import re
+import shutil
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from entropy.const import etpConst, const_debug_write, const_setup_directory
+from entropy.tools import multi_hash
+
+
+class PackageStore(object):
+    """
+    Content-addressed store of the downloaded package files.
+
+    Verified package files are stored by digest, the per-repository
+    download paths are hardlinks to the stored files. Where hardlinks are
+    refused (too many links, protected hardlinks), reflinks are used if
+    the filesystem supports them. The same package file mirrored in
+    several repositories, or kept across branch switches, is thus
+    downloaded and stored only once.
+    If the store is on another filesystem, or neither hardlinks nor
+    reflinks can be made, plain copies are used instead: they still save
+    the download, but not the disk space.
+    Stored files not linked anymore by any download path are kept as cache,
+    up to a given size, see collect().
+
+    Sample code:
+
+    >>> store = PackageStore()
+    >>> key = store.key(checksum, signatures)
+    >>> if not store.link(key, download_path):
+    ...     download(download_path) and verify(download_path)
+    ...     store.insert(key, download_path)
+    """
+
+    # digest types used as store keys, in order of preference, they must
+    # be available through EntropyRepository.retrieveSignatures() or
+    # EntropyRepository.retrieveDigest() (md5).
+    DIGEST_TYPES = ("sha256", "md5")
+
+    _DIGEST_RE = re.compile(r"^[a-fA-F0-9]{32,128}$")
+
+    # linux/fs.h FICLONE ioctl
+    _FICLONE = 0x40049409
+
+    def __init__(self, directory = None):
+        """
+        PackageStore constructor.
+
+        @keyword directory: the store directory, if None, the default
+            etpConst['entropypackagesstoredir'] is used
+        @type directory: string
+        """
+        if directory is None:
+            directory = etpConst['entropypackagesstoredir']
+        self._directory = directory
+
+    def directory(self):
+        """
+        Return the store directory.
+
+        @rtype: string
+        """
+        return self._directory
+
+    @classmethod
+    def key(cls, checksum, signatures):
+        """
+        Return the store key of a package file given its recorded md5
+        checksum and signatures.
+
+        @param checksum: the package file md5
+        @type checksum: string
+        @param signatures: the package file signatures, hash type -> hex
+            digest map, as returned by retrieveSignatures(). Can be None.
+        @type signatures: dict
+        @return: a (hash type, hex digest) tuple or None, if there is no
+            usable digest
+        @rtype: tuple
+        """
+        digests = {"md5": checksum}
+        if signatures:
+            digests.update(signatures)
+        for hash_type in cls.DIGEST_TYPES:
+            digest = digests.get(hash_type)
+            # digests are used as file names, do not trust them
+            if digest and cls._DIGEST_RE.match(digest):
+                return hash_type, digest.lower()
+        return None
+
+    def blob_path(self, key):
+        """
+        Return the path of the stored file of the given key.
+
+        @param key: the store key, see key()
+        @type key: tuple
+        @return: the stored file path
+        @rtype: string
+        """
+        hash_type, digest = key
+        return os.path.join(self._directory, hash_type, digest[:2], digest)
+
+    def _clone(self, src, dest):
+        """
+        Make dest a hardlink to src or, if refused, a reflink. If src and
+        dest are on different filesystems, or neither can be made, dest
+        is a plain copy of src. Return True if successful.
+        """
+        try:
+            os.link(src, dest)
+            return True
+        except OSError as err:
+            if err.errno not in (errno.EXDEV, errno.EMLINK, errno.EPERM):
+                raise
+            cross_device = err.errno == errno.EXDEV
+
+        # reflinks cannot cross filesystems either (EXDEV)
+        if fcntl is not None and not cross_device:
+            try:
+                with open(src, "rb") as src_f:
+                    with open(dest, "wb") as dest_f:
+                        fcntl.ioctl(dest_f.fileno(), self._FICLONE,
+                                    src_f.fileno())
+                shutil.copystat(src, dest)
+                return True
+            except (OSError, IOError):
+                pass
+
+        try:
+            shutil.copy2(src, dest)
+            return True
+        except (OSError, IOError):
+            try:
+                os.remove(dest)
+            except OSError:
+                pass
+            return False
+
+    def _replace(self, src, dest):
+        """
+        Atomically replace dest with a clone of src.
+        Return True if successful.
+        """
+        tmp_path = "%s.store-%d" % (dest, os.getpid())
+        try:
+            os.remove(tmp_path)
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+        if not self._clone(src, tmp_path):
+            return False
+        try:
+            os.rename(tmp_path, dest)
+        except OSError:
+            os.remove(tmp_path)
+            raise
+        return True
+
+    @staticmethod
+    def _verify(key, path):
+        """
+        Return True if the digest of the file at path matches the given
+        store key.
+        """
+        hash_type, digest = key
+        return multi_hash(path, (hash_type,))[hash_type] == digest
+
+    @staticmethod
+    def _touch(path):
+        """
+        Mark the stored file as recently used, the access time is used
+        by collect() and it is not affected by the package file mtime
+        validation.
+        """
+        try:
+            st = os.stat(path)
+            os.utime(path, (time.time(), st.st_mtime))
+        except OSError:
+            pass
+
+    def link(self, key, path):
+        """
+        Make path a link to the stored file of the given key, if any.
+
+        @param key: the store key, see key()
+        @type key: tuple
+        @param path: the package file path, any existing file is replaced
+        @type path: string
+        @return: True, if path is now linked to the stored file
+        @rtype: bool
+        """
+        if key is None:
+            return False
+        blob_path = self.blob_path(key)
+        try:
+            if not os.path.isfile(blob_path):
+                return False
+            path_dir = os.path.dirname(path)
+            if not os.path.isdir(path_dir):
+                os.makedirs(path_dir, 0o755)
+            if not self._replace(blob_path, path):
+                return False
+        except (OSError, IOError) as err:
+            const_debug_write(
+                __name__,
+                "PackageStore.link: cannot link %s to %s: %s" % (
+                    blob_path, path, repr(err),))
+            return False
+
+        self._touch(blob_path)
+        return True
+
+    def insert(self, key, path):
+        """
+        Add the verified package file at path to the store. If the store
+        already contains the file, path is replaced by a link to it, once
+        the stored file digest has been checked.
+
+        @param key: the store key, see key()
+        @type key: tuple
+        @param path: the verified package file path
+        @type path: string
+        @return: True, if path is linked to the stored file
+        @rtype: bool
+        """
+        if key is None:
+            return False
+        blob_path = self.blob_path(key)
+        try:
+            path_st = os.stat(path)
+            try:
+                blob_st = os.stat(blob_path)
+            except OSError as err:
+                if err.errno != errno.ENOENT:
+                    raise
+                blob_st = None
+
+            if blob_st is None:
+                const_setup_directory(self._directory)
+                blob_dir = os.path.dirname(blob_path)
+                if not os.path.isdir(blob_dir):
+                    os.makedirs(blob_dir, 0o775)
+                linked = self._replace(path, blob_path)
+            elif (blob_st.st_dev, blob_st.st_ino) == (
+                    path_st.st_dev, path_st.st_ino):
+                linked = True
+            elif blob_st.st_size == path_st.st_size and \
+                    self._verify(key, blob_path):
+                linked = self._replace(blob_path, path)
+            else:
+                # corrupted stored file, replace it
+                linked = self._replace(path, blob_path)
+
+        except (OSError, IOError) as err:
+            const_debug_write(
+                __name__,
+                "PackageStore.insert: cannot store %s: %s" % (
+                    path, repr(err),))
+            return False
+
+        if linked:
+            self._touch(blob_path)
+        return linked
+
+    def _blobs(self):
+        """
+        Return a list of (path, os.stat_result) tuples of the stored files.
+        """
+        blobs = []
+        for hash_type in self.DIGEST_TYPES:
+            hash_dir = os.path.join(self._directory, hash_type)
+            try:
+                subdirs = os.listdir(hash_dir)
+            except OSError as err:
+                if err.errno not in (errno.ENOENT, errno.ENOTDIR):
+                    raise
+                continue
+            for subdir in subdirs:
+                blob_dir = os.path.join(hash_dir, subdir)
+                try:
+                    names = os.listdir(blob_dir)
+                except OSError as err:
+                    if err.errno not in (errno.ENOENT, errno.ENOTDIR):
+                        raise
+                    continue
+                for name in names:
+                    blob_path = os.path.join(blob_dir, name)
+                    try:
+                        st = os.lstat(blob_path)
+                    except OSError as err:
+                        if err.errno != errno.ENOENT:
+                            raise
+                        continue
+                    blobs.append((blob_path, st))
+        return blobs
+
+    def size(self):
+        """
+        Return the number of stored files and their total size in bytes.
+
+        @return: a (count, size) tuple
+        @rtype: tuple
+        """
+        blobs = self._blobs()
+        return len(blobs), sum(st.st_size for _path, st in blobs)
+
+    def collect(self, max_size, dry_run = False):
+        """
+        Garbage collect the store, removing the least recently used stored
+        files until their total size is not greater than max_size bytes.
+        Files not linked by any download path anymore are removed first,
+        those still linked do not free any space but also stop being
+        shared.
+
+        @param max_size: the maximum store size in bytes
+        @type max_size: int
+        @keyword dry_run: do not remove files, just return them
+        @type dry_run: bool
+        @return: list of (to be) removed stored file paths
+        @rtype: list
+        """
+        blobs = self._blobs()
+        # stale temporary files, left behind by interrupted clones
+        removable = [(path, st) for path, st in blobs if ".store-" in path]
+        blobs = [(path, st) for path, st in blobs if ".store-" not in path]
+        total_size = sum(st.st_size for _path, st in blobs)
+        blobs.sort(key = lambda x: (x[1].st_nlink > 1, x[1].st_atime))
+
+        for path, st in blobs:
+            if total_size <= max_size:
+                break
+            removable.append((path, st))
+            total_size -= st.st_size
+
+        removed = []
+        for path, _st in removable:
+            if not dry_run:
+                try:
+                    os.remove(path)
+                except OSError as err:
+                    if err.errno != errno.ENOENT:
+                        raise
+                    continue
+            removed.append(path)
+        return removed
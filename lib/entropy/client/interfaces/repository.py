@@ -23,6 +23,7 @@ from entropy.exceptions import RepositoryError, PermissionDenied
 from entropy.output import blue, darkred, red, darkgreen, bold, purple, teal, \
     brown
 from entropy.locks import ResourceLock
+from entropy.misc import ParallelTask
 
 from entropy.db.exceptions import Error
 from entropy.db.skel import EntropyRepositoryBase
@@ -55,14 +56,74 @@ class RepositoriesUpdateResourcesLock(ResourceLock):
             etpConst['entropyrundir'], "." + __name__ + ".lock")
 
 
+class _RepositoryOutputBuffer(object):
+    """
+    Entropy Client proxy handed to concurrent repository updates. Messages
+    are recorded and written by flush(), so that the updates of different
+    repositories do not interleave. Transient (back = True) progress lines
+    are written right away instead, prefixed by the repository identifier.
+    Download progress is dropped.
+    """
+
+    # serializes the progress lines of all the repositories
+    _progress_lock = threading.Lock()
+
+    def __init__(self, entropy_client, repository_id):
+        self._entropy = entropy_client
+        self._repository_id = repository_id
+        self._lines = []
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self._entropy, name)
+
+    def output(self, text, header = "", footer = "", back = False,
+        importance = 0, level = "info", count = None, percent = False):
+        """
+        Record the output, see entropy.output.TextInterface.output().
+        """
+        kwargs = {
+            'header': header,
+            'footer': footer,
+            'importance': importance,
+            'level': level,
+            'count': count,
+            'percent': percent,
+        }
+        if back:
+            text = "[%s] %s" % (purple(self._repository_id), text)
+            with _RepositoryOutputBuffer._progress_lock:
+                self._entropy.output(text, back = True, **kwargs)
+            return
+        with self._lock:
+            self._lines.append((text, kwargs))
+
+    def _url_fetcher(self, *args, **kwargs):
+        kwargs['show_speed'] = False
+        return self._entropy._url_fetcher(*args, **kwargs)
+
+    def flush(self):
+        """
+        Write the recorded output.
+        """
+        with self._lock:
+            lines, self._lines = self._lines, []
+        for text, kwargs in lines:
+            self._entropy.output(text, **kwargs)
+
+
 class Repository(object):
 
     """
     Entropy Client Repositories management interface.
     """
 
+    # Maximum number of repositories updated concurrently, can be
+    # overridden through the ETP_REPOSITORY_SYNC_WORKERS env var.
+    SYNC_WORKERS = 4
+
     def __init__(self, entropy_client, repo_identifiers = None,
-        force = False, fetch_security = True, gpg = True):
+        force = False, fetch_security = True, gpg = True, workers = None):
         """
         Entropy Client Repositories management interface constructor.
 
@@ -72,7 +133,10 @@ class Repository(object):
         @keyword repo_identifiers: list of repository identifiers you want to
             take into consideration
         @type repo_identifiers: list
-        @
+        @keyword workers: maximum number of repositories downloaded
+            concurrently, 1 restores the sequential behaviour. If None,
+            Repository.SYNC_WORKERS is used.
+        @type workers: int
         """
 
         if repo_identifiers is None:
@@ -95,6 +159,16 @@ class Repository(object):
         if env_gpg is not None:
             self._gpg_feature = False
 
+        if workers is None:
+            workers = self.SYNC_WORKERS
+            env_workers = os.getenv('ETP_REPOSITORY_SYNC_WORKERS')
+            if env_workers is not None:
+                try:
+                    workers = int(env_workers)
+                except ValueError:
+                    pass
+        self._workers = max(1, workers)
+
         if not repo_ids:
             avail_repos = self._settings['repositories']['available'].keys()
             repo_ids.extend(list(avail_repos))
@@ -134,18 +208,97 @@ class Repository(object):
 
         return br_rc
 
+    def _update_repository(self, repository_id, entropy_client = None):
+        """
+        Update the given repository and return its update status.
+        Exceptions are confined to the failing repository.
+        entropy_client is the Entropy Client used for the update, and its
+        output, it defaults to self._entropy.
+        """
+        if entropy_client is None:
+            entropy_client = self._entropy
+        sts = EntropyRepositoryBase
+        try:
+            return self._entropy.get_repository(repository_id).update(
+                entropy_client, repository_id, self.force, self._gpg_feature)
+        except PermissionDenied:
+            return sts.REPOSITORY_PERMISSION_DENIED_ERROR
+        except Exception as err:
+            entropy.tools.print_traceback()
+            mytxt = "%s %s: %s" % (
+                red(_("Cannot update repository")),
+                purple(repository_id),
+                err,
+            )
+            entropy_client.output(
+                mytxt,
+                importance = 1,
+                level = "warning",
+                header = darkred(" @@ ")
+            )
+            return sts.REPOSITORY_GENERIC_ERROR
+
+    def _start_update_workers(self, repository_ids):
+        """
+        Start the threads updating the given repositories, at most
+        self._workers at a time. Downloads run concurrently, the local
+        processing of each repository is serialized by the updater itself.
+        Return a (events, statuses, outputs) tuple, all keyed by repository
+        identifier: each threading.Event is set as soon as the repository
+        update status is available in statuses, the update messages are
+        buffered into outputs (see _RepositoryOutputBuffer).
+        """
+        pending = list(repository_ids)
+        pending.reverse()
+        pending_lock = threading.Lock()
+        statuses = {}
+        events = dict((x, threading.Event()) for x in pending)
+        outputs = dict(
+            (x, _RepositoryOutputBuffer(self._entropy, x)) for x in pending)
+
+        def _worker():
+            while True:
+                with pending_lock:
+                    if not pending:
+                        return
+                    repository_id = pending.pop()
+                try:
+                    statuses[repository_id] = self._update_repository(
+                        repository_id,
+                        entropy_client = outputs[repository_id])
+                finally:
+                    events[repository_id].set()
+
+        for idx in range(min(self._workers, len(pending))):
+            task = ParallelTask(_worker)
+            task.name = "RepositorySync-%d" % (idx,)
+            task.daemon = True
+            task.start()
+
+        return events, statuses, outputs
+
     def _run_sync(self):
 
         self.updated = False
         sts = EntropyRepositoryBase
 
+        events = None
+        if self._workers > 1 and len(self.repo_ids) > 1:
+            events, statuses, outputs = self._start_update_workers(
+                self.repo_ids)
+
+        # statuses and output are collected in order, while the other
+        # repositories are still being downloaded
         for repo in self.repo_ids:
 
-            try:
-                status = self._entropy.get_repository(repo).update(
-                    self._entropy, repo, self.force, self._gpg_feature)
-            except PermissionDenied:
-                status = sts.REPOSITORY_PERMISSION_DENIED_ERROR
+            if events is None:
+                status = self._update_repository(repo)
+            else:
+                # use a timeout, or signals are blocked on Python 2
+                while not events[repo].is_set():
+                    events[repo].wait(1.0)
+                outputs[repo].flush()
+                status = statuses.get(repo, sts.REPOSITORY_GENERIC_ERROR)
 
             if status == sts.REPOSITORY_ALREADY_UPTODATE:
                 self.already_updated = True
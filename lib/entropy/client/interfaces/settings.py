@@ -239,6 +239,7 @@ class ClientSystemSettingsPlugin(SystemSettingsPlugin):
     def masking_validation_parser(self, system_settings_instance):
         data = {
             'cache': {}, # package masking validation cache
+            'tables': {}, # repository package masking tables
         }
         return data
 
@@ -392,6 +393,9 @@ class ClientSystemSettingsPlugin(SystemSettingsPlugin):
             'configprotectskip': set(),
             'autoprune_days': None, # disabled by default
             'edelta_support': False, # disabled by default
+            'stream_unpack': False, # disabled by default
+            'packages_store_size': 0, # MiB, disabled by default
+            'download_segments': 1, # disabled by default
         }
 
         cli_conf = ClientSystemSettingsPlugin.client_conf_path()
@@ -419,6 +423,21 @@ class ClientSystemSettingsPlugin(SystemSettingsPlugin):
             if bool_setting is not None:
                 data['edelta_support'] = bool_setting
 
+        def _packagesstreamunpack(setting):
+            bool_setting = entropy.tools.setting_to_bool(setting)
+            if bool_setting is not None:
+                data['stream_unpack'] = bool_setting
+
+        def _packagesstoresize(setting):
+            int_setting = entropy.tools.setting_to_int(setting, 0, None)
+            if int_setting is not None:
+                data['packages_store_size'] = int_setting
+
+        def _packagesdownloadsegments(setting):
+            int_setting = entropy.tools.setting_to_int(setting, 1, 16)
+            if int_setting is not None:
+                data['download_segments'] = int_setting
+
         def _packagehashes(setting):
             setting = setting.lower().split()
             hashes = set()
@@ -481,6 +500,9 @@ class ClientSystemSettingsPlugin(SystemSettingsPlugin):
             'forced-updates': _forcedupdates,
             'packages-autoprune-days': _autoprune,
             'packages-delta': _packagesdelta,
+            'packages-stream-unpack': _packagesstreamunpack,
+            'packages-store-size': _packagesstoresize,
+            'packages-download-segments': _packagesdownloadsegments,
             # backward compatibility
             'packagehashes': _packagehashes,
             'package-hashes': _packagehashes,
@@ -310,6 +310,9 @@ def const_default_settings(rootdir):
         # packages-nonfree/, packages-restricted/ etc
         'entropypackagesworkdir': os.path.join(default_etp_dir,
             default_etp_client_repodir, "packages"),
+        # content-addressed store of the downloaded package files
+        'entropypackagesstoredir': os.path.join(default_etp_dir,
+            default_etp_client_repodir, "packages", "store"),
         # Entropy unpack directory
         'entropyunpackdir': default_etp_vardir,
         # Entropy packages image directory
@@ -9,70 +9,542 @@
     I{EntropyRepository} caching interface.
 
 """
+import collections
+import os
+import sys
+import threading
+import time
 import weakref
 
+from entropy.cache import EntropyCacher
 from entropy.core import Singleton
+from entropy.misc import LRUCache
 
 import entropy.tools
 
 
+def _env_int(name, default):
+    """
+    Read a non-negative integer from the environment, falling back
+    to default if unset or invalid.
+    """
+    value = os.getenv(name)
+    if value is None:
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        return default
+    if value < 0:
+        return default
+    return value
+
+
+class _LiveCacheEntry(object):
+    """
+    EntropyRepositoryCacher cache item.
+    """
+
+    __slots__ = ("value", "size", "expiration", "prefix")
+
+    def __init__(self, value, size, expiration, prefix):
+        self.value = value
+        self.size = size
+        self.expiration = expiration
+        self.prefix = prefix
+
+
+class _LiveCachePartition(object):
+    """
+    EntropyRepositoryCacher per-repository LRU partition.
+    """
+
+    __slots__ = ("keys", "size", "hits", "misses", "evictions")
+
+    def __init__(self):
+        self.keys = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'items': len(self.keys),
+            'bytes': self.size,
+        }
+
+
 class EntropyRepositoryCacher(Singleton):
     """
     Tiny singleton-based helper class used by EntropyRepository in order
     to keep cached items in RAM.
+
+    Cached items are grouped by repository key prefix (see set()) and
+    every repository gets its own memory budget (MAX_BYTES, in bytes,
+    0 means unbounded), enforced by evicting the least recently used
+    items. Items older than TTL seconds (0 means forever) are considered
+    stale. Both can be overridden through the ETP_REPOSITORY_CACHE_MB and
+    ETP_REPOSITORY_CACHE_TTL environment variables or by calling
+    configure().
     """
+
+    MAX_BYTES = _env_int("ETP_REPOSITORY_CACHE_MB", 64) * 1024 * 1024
+
+    TTL = _env_int("ETP_REPOSITORY_CACHE_TTL", 0)
+
     def init_singleton(self):
         self.__live_cache = {}
+        self.__partitions = {}
+        self.__lock = threading.RLock()
+        self.__max_bytes = self.MAX_BYTES
+        self.__ttl = self.TTL
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+
+    @staticmethod
+    def _sizeof(value):
+        """
+        Return the approximate memory footprint of value, in bytes.
+        Containers are measured along with their direct items.
+        """
+        size = sys.getsizeof(value)
+        if isinstance(value, dict):
+            for key, item in value.items():
+                size += sys.getsizeof(key) + sys.getsizeof(item)
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            for item in value:
+                size += sys.getsizeof(item)
+        return size
+
+    def configure(self, max_bytes = None, ttl = None):
+        """
+        Change the per-repository memory budget and the items time to live.
+
+        @keyword max_bytes: per-repository memory budget in bytes,
+            0 means unbounded
+        @type max_bytes: int
+        @keyword ttl: items time to live in seconds, 0 means forever
+        @type ttl: int
+        """
+        with self.__lock:
+            if max_bytes is not None:
+                self.__max_bytes = max_bytes
+            if ttl is not None:
+                self.__ttl = ttl
+            if self.__max_bytes:
+                for prefix in list(self.__partitions.keys()):
+                    self.__shrink(prefix, 0)
+
+    def __drop(self, key):
+        """
+        Remove key from the cache, return the removed entry or None.
+        Must be called with self.__lock held.
+        """
+        entry = self.__live_cache.pop(key, None)
+        if entry is None:
+            return None
+        partition = self.__partitions.get(entry.prefix)
+        if partition is not None:
+            partition.keys.pop(key, None)
+            partition.size -= entry.size
+        return entry
+
+    def __evict(self, key):
+        """
+        Evict key from the cache, updating the eviction counters.
+        Must be called with self.__lock held.
+        """
+        partition = self.__partitions.get(self.__live_cache[key].prefix)
+        if partition is not None:
+            partition.evictions += 1
+        self.__evictions += 1
+        self.__drop(key)
+
+    def __shrink(self, prefix, size):
+        """
+        Evict the least recently used items of the prefix partition until
+        there is room for size more bytes.
+        Must be called with self.__lock held.
+        """
+        partition = self.__partitions.get(prefix)
+        if partition is None:
+            return
+        while partition.keys and partition.size + size > self.__max_bytes:
+            self.__evict(next(iter(partition.keys)))
 
     def clear(self):
         """
         Clear all the cached items
         """
-        self.__live_cache.clear()
+        with self.__lock:
+            self.__live_cache.clear()
+            self.__partitions.clear()
 
     def clear_key(self, key):
         """
         Clear just the cached item at key (hash table).
         """
-        try:
-            del self.__live_cache[key]
-        except KeyError:
-            pass
+        with self.__lock:
+            self.__drop(key)
 
     def keys(self):
         """
         Return a list of available cache keys
         """
-        return list(self.__live_cache.keys())
+        with self.__lock:
+            return list(self.__live_cache.keys())
 
     def discard(self, key):
         """
         Discard all the cache items with hash table key starting with "key".
         """
-        for dkey in tuple(self.__live_cache.keys()):
-            if dkey.startswith(key):
-                try:
-                    self.__live_cache.pop(dkey)
-                except KeyError:
-                    pass
+        with self.__lock:
+            dkeys = []
+            for prefix, partition in self.__partitions.items():
+                if prefix.startswith(key):
+                    dkeys.extend(partition.keys.keys())
+                elif key.startswith(prefix):
+                    dkeys.extend(
+                        x for x in partition.keys if x.startswith(key))
+            for dkey in dkeys:
+                self.__drop(dkey)
 
-    def get(self, key):
+    def get(self, key, prefix = None):
         """
         Get the cached item, if exists.
+
+        @param key: the cache key
+        @type key: string
+        @keyword prefix: the repository key prefix, used to account
+            cache misses
+        @type prefix: string
+        @return: the cached object or None
+        @rtype: object
         """
-        obj = self.__live_cache.get(key)
-        if isinstance(obj, weakref.ref):
-            return obj()
-        return obj
+        with self.__lock:
+            entry = self.__live_cache.get(key)
+            obj = None
+            if entry is not None:
+                if entry.expiration is not None \
+                        and entry.expiration < time.time():
+                    self.__evict(key)
+                    entry = None
+                else:
+                    obj = entry.value
+                    if isinstance(obj, weakref.ref):
+                        obj = obj()
+                        if obj is None:
+                            # referent is gone
+                            self.__drop(key)
+                            entry = None
 
-    def set(self, key, value):
+            if entry is None:
+                self.__misses += 1
+                partition = self.__partitions.get(prefix)
+                if partition is not None:
+                    partition.misses += 1
+                return None
+
+            partition = self.__partitions[entry.prefix]
+            partition.hits += 1
+            self.__hits += 1
+            # mark as most recently used
+            del partition.keys[key]
+            partition.keys[key] = None
+            return obj
+
+    def set(self, key, value, prefix = ""):
         """
         Set item in cache.
+
+        @param key: the cache key, starting with prefix
+        @type key: string
+        @param value: the object to cache, sets are weakly referenced
+        @type value: object
+        @keyword prefix: the repository key prefix, the memory budget and
+            statistics are accounted per-prefix
+        @type prefix: string
         """
         if isinstance(value, (set, frozenset)):
-            self.__live_cache[key] = weakref.ref(value)
-        else:
-            self.__live_cache[key] = value
+            value = weakref.ref(value)
+        size = sys.getsizeof(value) if isinstance(value, weakref.ref) \
+            else self._sizeof(value)
+
+        with self.__lock:
+            self.__drop(key)
+            if self.__max_bytes:
+                if size > self.__max_bytes:
+                    # would not fit anyway
+                    return
+                self.__shrink(prefix, size)
+
+            expiration = None
+            if self.__ttl:
+                expiration = time.time() + self.__ttl
+            self.__live_cache[key] = _LiveCacheEntry(
+                value, size, expiration, prefix)
+
+            partition = self.__partitions.get(prefix)
+            if partition is None:
+                partition = _LiveCachePartition()
+                self.__partitions[prefix] = partition
+            partition.keys[key] = None
+            partition.size += size
+
+    def stats(self, prefix = None):
+        """
+        Return cache usage counters, either global or restricted to the
+        given repository key prefix.
+
+        @keyword prefix: the repository key prefix
+        @type prefix: string
+        @return: dict containing "hits", "misses", "evictions", "items",
+            "bytes" and "max_bytes" keys (plus "repositories" and "ttl"
+            for the global counters)
+        @rtype: dict
+        """
+        with self.__lock:
+            if prefix is not None:
+                partition = self.__partitions.get(prefix)
+                if partition is None:
+                    partition = _LiveCachePartition()
+                stats = partition.stats()
+                stats['max_bytes'] = self.__max_bytes
+                return stats
+
+            return {
+                'hits': self.__hits,
+                'misses': self.__misses,
+                'evictions': self.__evictions,
+                'items': len(self.__live_cache),
+                'bytes': sum(x.size for x in self.__partitions.values()),
+                'max_bytes': self.__max_bytes,
+                'ttl': self.__ttl,
+                'repositories': len(
+                    [x for x in self.__partitions.values() if x.keys]),
+            }
+
+    def repository_stats(self):
+        """
+        Return the cache usage counters of every cached repository.
+
+        @return: dict keyed by repository key prefix, see stats()
+        @rtype: dict
+        """
+        with self.__lock:
+            prefixes = list(self.__partitions.keys())
+        return dict((x, self.stats(prefix = x)) for x in prefixes)
+
+    def reset_stats(self):
+        """
+        Reset the global usage counters.
+        """
+        with self.__lock:
+            self.__hits = 0
+            self.__misses = 0
+            self.__evictions = 0
+
+
+class EntropyRepositoryMatchCacher(Singleton):
+    """
+    Process-wide, size bounded, in-memory cache of atomMatch() results,
+    shared by all the EntropyRepository instances.
+
+    Results are bound to a namespace (repository name, atomMatch cache key
+    and repository checksum), so any change to the repository content
+    implicitly invalidates them. Every namespace can be backed by an
+    on-disk snapshot (a single file per repository revision) that is
+    loaded lazily at the first cache miss and written back through
+    EntropyCacher. Set ETP_DISABLE_MATCH_SNAPSHOT to disable snapshots.
+    """
+
+    # maximum number of in-memory atomMatch() results
+    MAX_ITEMS = 32768
+
+    # number of new results that trigger a snapshot write
+    SNAPSHOT_SYNC_ITEMS = 512
+
+    SNAPSHOT_ENABLED = os.getenv("ETP_DISABLE_MATCH_SNAPSHOT") is None
+
+    _CACHE_KEY = "match/db"
+
+    def init_singleton(self):
+        self._cache = LRUCache(self.MAX_ITEMS)
+        self._snapshots = {}
+        self._dirty = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._stores = 0
+        self._snapshot_loads = 0
+
+    def _snapshot_key(self, namespace):
+        name, match_key, ck_sum = namespace
+        return "%s/%s/snapshot_%s_%s" % (
+            self._CACHE_KEY, name, match_key, ck_sum)
+
+    def _snapshot(self, namespace):
+        """
+        Return the on-disk snapshot dict of namespace, loading it if needed.
+        Must be called without self._lock held, the snapshot is read from
+        disk outside of it.
+        """
+        with self._lock:
+            snapshot = self._snapshots.get(namespace)
+        if snapshot is not None:
+            return snapshot
+
+        loaded = EntropyCacher().pop(self._snapshot_key(namespace))
+        if not isinstance(loaded, dict):
+            loaded = None
+
+        stale = []
+        with self._lock:
+            snapshot = self._snapshots.get(namespace)
+            if snapshot is not None:
+                # loaded by another thread in the meantime
+                return snapshot
+            # a new repository revision makes the older snapshot useless
+            for old_namespace in list(self._snapshots.keys()):
+                if old_namespace[:2] != namespace[:2]:
+                    continue
+                self._snapshots.pop(old_namespace)
+                self._dirty.pop(old_namespace, None)
+                stale.append(old_namespace)
+
+            if loaded is None:
+                snapshot = {}
+            else:
+                snapshot = loaded
+                self._snapshot_loads += 1
+            self._snapshots[namespace] = snapshot
+
+        for old_namespace in stale:
+            EntropyCacher().remove(self._snapshot_key(old_namespace))
+        return snapshot
+
+    @staticmethod
+    def _copy(result):
+        # multiMatch results are mutable sets, never hand out
+        # the cached objects.
+        data, rc = result
+        if isinstance(data, set):
+            data = set(data)
+        return data, rc
+
+    def get(self, namespace, args):
+        """
+        Return the cached atomMatch() result or None.
+
+        @param namespace: (repository name, atomMatch cache key,
+            repository checksum) tuple
+        @type namespace: tuple
+        @param args: atomMatch() arguments
+        @type args: tuple
+        @return: atomMatch() result or None
+        @rtype: tuple or None
+        """
+        key = (namespace, args)
+        result = self._cache.get(key)
+        if result is None and self.SNAPSHOT_ENABLED:
+            snapshot = self._snapshot(namespace)
+            with self._lock:
+                result = snapshot.get(args)
+            if result is not None:
+                self._cache.set(key, result)
+
+        with self._lock:
+            if result is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+        return self._copy(result)
+
+    def set(self, namespace, args, result):
+        """
+        Cache an atomMatch() result.
+
+        @param namespace: (repository name, atomMatch cache key,
+            repository checksum) tuple
+        @type namespace: tuple
+        @param args: atomMatch() arguments
+        @type args: tuple
+        @param result: atomMatch() result
+        @type result: tuple
+        """
+        result = self._copy(result)
+        self._cache.set((namespace, args), result)
+
+        snapshot = None
+        if self.SNAPSHOT_ENABLED:
+            snapshot = self._snapshot(namespace)
+
+        sync = False
+        with self._lock:
+            self._stores += 1
+            if snapshot is not None:
+                if len(snapshot) < self.MAX_ITEMS:
+                    snapshot[args] = result
+                dirty = self._dirty.get(namespace, 0) + 1
+                self._dirty[namespace] = dirty
+                sync = dirty >= self.SNAPSHOT_SYNC_ITEMS
+        if sync:
+            self.sync()
+
+    def sync(self):
+        """
+        Queue the modified snapshots for writing to disk.
+        """
+        snapshots = []
+        with self._lock:
+            for namespace in self._dirty.keys():
+                snapshot = self._snapshots.get(namespace)
+                if snapshot is not None:
+                    # set() keeps modifying the live dict, while
+                    # EntropyCacher pickles it in another thread.
+                    snapshots.append((namespace, dict(snapshot)))
+            self._dirty.clear()
+
+        cacher = EntropyCacher()
+        for namespace, snapshot in snapshots:
+            cacher.push(self._snapshot_key(namespace), snapshot)
+
+    def clear(self):
+        """
+        Drop all the in-memory results and reset the counters.
+        On-disk snapshots are left untouched.
+        """
+        with self._lock:
+            self._cache.clear()
+            self._snapshots.clear()
+            self._dirty.clear()
+            self._hits = 0
+            self._misses = 0
+            self._stores = 0
+            self._snapshot_loads = 0
+
+    def stats(self):
+        """
+        Return cache usage counters.
+
+        @return: dict containing "hits", "misses", "stores", "items",
+            "max_items" and "snapshot_loads" keys
+        @rtype: dict
+        """
+        with self._lock:
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'stores': self._stores,
+                'items': len(self._cache),
+                'max_items': self.MAX_ITEMS,
+                'snapshot_loads': self._snapshot_loads,
+            }
 
 
 class EntropyRepositoryCachePolicies(object):
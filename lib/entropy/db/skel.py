@@ -12,7 +12,6 @@ import base64
 import os
 import shutil
 import warnings
-import hashlib
 import codecs
 import collections
 import contextlib
@@ -21,7 +20,7 @@ import threading
 from entropy.i18n import _
 from entropy.exceptions import InvalidAtom
 from entropy.const import etpConst, const_cmp, const_debug_write, \
-    const_convert_to_rawstring, const_mkstemp, const_is_python3
+    const_convert_to_rawstring, const_mkstemp
 from entropy.output import TextInterface, brown, bold, red, blue, purple, \
     darkred, darkgreen
 from entropy.cache import EntropyCacher
@@ -31,7 +30,8 @@ from entropy.exceptions import RepositoryPluginError
 from entropy.spm.plugins.factory import get_default_instance as get_spm, \
     get_default_class as get_spm_class
 from entropy.db.exceptions import OperationalError
-from entropy.db.cache import EntropyRepositoryCachePolicies
+from entropy.db.cache import EntropyRepositoryCachePolicies, \
+    EntropyRepositoryMatchCacher
 
 import entropy.dep
 import entropy.tools
@@ -358,6 +358,108 @@ class EntropyRepositoryPluginStore(EntropyPluginStore):
         meta[key] = value
 
 
+class _AtomMatchMetadata(object):
+
+    """
+    Package metadata accessor used by EntropyRepositoryBase.atomMatch().
+    By default, every lookup is forwarded to the repository. When
+    package names are preloaded (see atomMatchMany()), the candidate
+    packages metadata is read off a few bulk queries and served from
+    memory instead.
+    """
+
+    def __init__(self, repository):
+        self._repo = repository
+        self._names = {}
+        self._data = {}
+        self._useflags = {}
+        self.parsed = {}
+
+    def preload(self, names, useflags = False):
+        """
+        Load the metadata of all the packages named after any of the
+        given names.
+
+        @param names: list of package names (without category)
+        @type names: iterable
+        @keyword useflags: also load USE flags
+        @type useflags: bool
+        """
+        names = set(names) - set(self._names)
+        if not names:
+            return
+
+        data = self._repo._atomMatchPackageData(names)
+        if useflags:
+            self._useflags.update(self._repo._atomMatchUseflags(data))
+
+        pkg_names = dict((x, []) for x in names)
+        for package_id, row in data.items():
+            self._data[package_id] = row
+            package_ids = pkg_names.get(row[1])
+            if package_ids is not None:
+                package_ids.append(package_id)
+        self._names.update(pkg_names)
+
+    def search_name(self, name):
+        package_ids = self._names.get(name)
+        if package_ids is None:
+            return self._repo.searchName(name, sensitive = True,
+                just_id = True)
+        return tuple(package_ids)
+
+    def search_name_category(self, name, category):
+        package_ids = self._names.get(name)
+        if package_ids is None:
+            return self._repo.searchNameCategory(name, category,
+                just_id = True)
+        return frozenset((x for x in package_ids \
+            if self._data[x][0] == category))
+
+    def category(self, package_id):
+        row = self._data.get(package_id)
+        if row is None:
+            return self._repo.retrieveCategory(package_id)
+        return row[0]
+
+    def key_split(self, package_id):
+        row = self._data.get(package_id)
+        if row is None:
+            return self._repo.retrieveKeySplit(package_id)
+        return row[0], row[1]
+
+    def version(self, package_id):
+        row = self._data.get(package_id)
+        if row is None:
+            return self._repo.retrieveVersion(package_id)
+        return row[2]
+
+    def tag(self, package_id):
+        row = self._data.get(package_id)
+        if row is None:
+            return self._repo.retrieveTag(package_id)
+        return row[3]
+
+    def revision(self, package_id):
+        row = self._data.get(package_id)
+        if row is None:
+            return self._repo.retrieveRevision(package_id)
+        return row[4]
+
+    def slot(self, package_id):
+        row = self._data.get(package_id)
+        if row is None:
+            return self._repo.retrieveSlot(package_id)
+        return row[5]
+
+    def useflags(self, package_id):
+        useflags = self._useflags.get(package_id)
+        if useflags is None:
+            useflags = self._repo.retrieveUseflags(package_id)
+            self._useflags[package_id] = useflags
+        return useflags
+
+
 class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
     """
     EntropyRepository interface base class.
@@ -425,7 +527,7 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
         self.reponame = name
         self._settings = SystemSettings()
         self._cacher = EntropyCacher()
-        self.__db_match_cache_key = "match/db"
+        self._match_cacher = EntropyRepositoryMatchCacher()
 
         EntropyRepositoryPluginStore.__init__(self)
 
@@ -4080,6 +4182,21 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
         """
         raise NotImplementedError()
 
+    def searchKeySlotMatches(self, repository):
+        """
+        Search, for every package in this repository, the packages with
+        the same key and slot in the given repository.
+        This is meant to be reimplemented by subclasses able to compute
+        the result in bulk, the default implementation returns None.
+
+        @param repository: the repository to search into
+        @type repository: EntropyRepositoryBase
+        @return: list of (package_id, digest, matched package_id, version,
+            tag, revision, matched digest) tuples or None, if not supported
+        @rtype: list
+        """
+        return None
+
     def searchNeeded(self, needed, elfclass = -1, like = False):
         """
         Search packages that need given NEEDED ELF entry (library name).
@@ -4717,6 +4834,19 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
         """
         raise NotImplementedError()
 
+    def verifyChecksum(self, repair = False):
+        """
+        Verify the checksum that is maintained incrementally on write
+        (see checksum()) against a full computation.
+
+        @keyword repair: store the fully computed checksum in case of
+            mismatch
+        @type repair: bool
+        @return: True, if the stored checksum is valid
+        @rtype: bool
+        """
+        raise NotImplementedError()
+
     def mtime(self):
         """
         Return last modification time of given repository.
@@ -5025,26 +5155,156 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
             identifiers) and command status is returned.
         @rtype: tuple or set
         """
-        if not atom:
-            return -1, 1
+        return self.__atomMatch(atom, matchSlot, multiMatch, maskFilter,
+            extendedResults, useCache, _AtomMatchMetadata(self))
 
-        if useCache:
-            cached = self.__atomMatchFetchCache(atom, matchSlot,
-                multiMatch, maskFilter, extendedResults)
-            if cached is not None:
-                return cached
+    def atomMatchMany(self, atoms, matchSlot = None, multiMatch = False,
+        maskFilter = True, extendedResults = False, useCache = True):
+        """
+        Batch version of atomMatch(). All the given atoms (or dependencies)
+        are matched using the same arguments. Candidate packages are grouped
+        by name and fetched in bulk, then filtered in memory, which is much
+        faster than calling atomMatch() once per atom.
 
-        # "or" dependency support
-        # app-foo/foo-1.2.3;app-foo/bar-1.4.3?
+        @param atoms: list of atoms or dependencies to match in repository
+        @type atoms: iterable
+        @keyword matchSlot: match packages with given slot
+        @type matchSlot: string
+        @keyword multiMatch: match all the available packages, not just the
+            best one
+        @type multiMatch: bool
+        @keyword maskFilter: enable package masking filter
+        @type maskFilter: bool
+        @keyword extendedResults: return extended results
+        @type extendedResults: bool
+        @keyword useCache: use on-disk cache
+        @type useCache: bool
+        @return: dict mapping each atom to its atomMatch() result
+        @rtype: dict
+        """
+        results = {}
+        ck_sum = None
+        if useCache and self._caching:
+            ck_sum = self.checksum(strict = False)
+
+        pending = []
+        for atom in atoms:
+            if atom in results:
+                continue
+            if atom and useCache:
+                cached = self.__atomMatchFetchCache(atom, matchSlot,
+                    multiMatch, maskFilter, extendedResults, ck_sum = ck_sum)
+                if cached is not None:
+                    results[atom] = cached
+                    continue
+            results[atom] = None
+            pending.append(atom)
+
+        metadata = _AtomMatchMetadata(self)
+        if pending:
+            names = set()
+            use_names = set()
+            for atom in pending:
+                atom_names, with_use = self.__atomMatchNames(atom, metadata)
+                names.update(atom_names)
+                if with_use:
+                    use_names.update(atom_names)
+            try:
+                metadata.preload(use_names, useflags = True)
+                metadata.preload(names)
+            except OperationalError:
+                # tables are not available, atomMatch() will fallback
+                # to live queries
+                pass
+
+        for atom in pending:
+            results[atom] = self.__atomMatch(atom, matchSlot, multiMatch,
+                maskFilter, extendedResults, useCache, metadata,
+                ck_sum = ck_sum)
+
+        return results
+
+    def _atomMatchPackageData(self, names):
+        """
+        Return the atomMatch() metadata of all the packages named after
+        any of the given names, as a dict mapping package identifiers to
+        (category, name, version, tag, revision, slot) tuples.
+        Subclasses should reimplement this using bulk queries.
+
+        @param names: list of package names (without category)
+        @type names: iterable
+        @return: package metadata
+        @rtype: dict
+        """
+        data = {}
+        for name in names:
+            for package_id in self.searchName(name, sensitive = True,
+                                              just_id = True):
+                category, pkg_name = self.retrieveKeySplit(package_id)
+                version, tag, revision = self.getVersioningData(package_id)
+                data[package_id] = (category, pkg_name, version, tag,
+                    revision, self.retrieveSlot(package_id))
+        return data
+
+    def _atomMatchUseflags(self, package_ids):
+        """
+        Return the USE flags of the given packages, as a dict mapping
+        package identifiers to frozensets of USE flags.
+        Subclasses should reimplement this using bulk queries.
+
+        @param package_ids: list of package identifiers
+        @type package_ids: iterable
+        @return: package USE flags
+        @rtype: dict
+        """
+        return dict((x, self.retrieveUseflags(x)) for x in package_ids)
+
+    def _maskFilterPackageData(self):
+        """
+        Return the maskFilter() metadata of all the packages in repository,
+        as a dict mapping package identifiers to (license, keywords) tuples.
+        Subclasses should reimplement this using bulk queries.
+
+        @return: package metadata
+        @rtype: dict
+        """
+        return dict(
+            (x, (self.retrieveLicense(x), self.retrieveKeywords(x)))
+            for x in self.listAllPackageIds())
+
+    def __atomMatchNames(self, atom, metadata):
+        """
+        Return the package names that atomMatch() would look for and
+        whether USE dependencies are used.
+        """
+        if not atom:
+            return (), False
         if atom.endswith(etpConst['entropyordepquestion']):
-            # or dependency!
             atoms = atom[:-1].split(etpConst['entropyordepsep'])
-            for s_atom in atoms:
-                data, rc = self.atomMatch(s_atom, matchSlot = matchSlot,
-                    multiMatch = multiMatch, maskFilter = maskFilter,
-                    extendedResults = extendedResults, useCache = useCache)
-                if rc == 0:
-                    return data, rc
+        else:
+            atoms = [atom]
+
+        names = []
+        with_use = False
+        for s_atom in atoms:
+            try:
+                parsed = self.__atomMatchParse(s_atom, metadata)
+            except InvalidAtom:
+                continue
+            if parsed[1]:
+                with_use = True
+            if parsed[7]:
+                names.append(parsed[7])
+        return names, with_use
+
+    def __atomMatchParse(self, atom, metadata):
+        """
+        Split an atom into the components used by atomMatch(). Results
+        are memoized into the given _AtomMatchMetadata object.
+        """
+        parsed = metadata.parsed.get(atom)
+        if parsed is not None:
+            return parsed
 
         matchTag = entropy.dep.dep_gettag(atom)
         try:
@@ -5061,12 +5321,8 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
         scan_atom = entropy.dep.remove_usedeps(atom)
         # tag match
         scan_atom = entropy.dep.remove_tag(scan_atom)
-
         # slot match
         scan_atom = entropy.dep.remove_slot(scan_atom)
-        if (matchSlot is None) and (atomSlot is not None):
-            matchSlot = atomSlot
-
         # revision match
         scan_atom = entropy.dep.remove_entropy_revision(scan_atom)
 
@@ -5077,45 +5333,84 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
         pkgcat = ''
         pkgversion = ''
         stripped_atom = ''
-        found_ids = []
-        default_package_ids = None
-
-        if scan_atom:
 
-            while True:
-                # check for direction
-                scan_cpv = entropy.dep.dep_getcpv(scan_atom)
-                stripped_atom = scan_cpv
+        while scan_atom:
+            # check for direction
+            scan_cpv = entropy.dep.dep_getcpv(scan_atom)
+            stripped_atom = scan_cpv
+            if scan_atom.endswith("*"):
+                stripped_atom += "*"
+            direction = scan_atom[0:-len(stripped_atom)]
+
+            justname = entropy.dep.isjustname(scan_cpv)
+            pkgkey = stripped_atom
+            if justname == 0:
+                # get version
+                data = entropy.dep.catpkgsplit(scan_cpv)
+                if data is None:
+                    break # badly formatted
+                wildcard = ""
                 if scan_atom.endswith("*"):
-                    stripped_atom += "*"
-                direction = scan_atom[0:-len(stripped_atom)]
-
-                justname = entropy.dep.isjustname(scan_cpv)
-                pkgkey = stripped_atom
-                if justname == 0:
-                    # get version
-                    data = entropy.dep.catpkgsplit(scan_cpv)
-                    if data is None:
-                        break # badly formatted
-                    wildcard = ""
-                    if scan_atom.endswith("*"):
-                        wildcard = "*"
-                    pkgversion = data[2]+wildcard+"-"+data[3]
-                    pkgkey = entropy.dep.dep_getkey(stripped_atom)
-
-                splitkey = pkgkey.split("/")
-                if (len(splitkey) == 2):
-                    pkgcat, pkgname = splitkey
-                else:
-                    pkgcat, pkgname = "null", splitkey[0]
+                    wildcard = "*"
+                pkgversion = data[2]+wildcard+"-"+data[3]
+                pkgkey = entropy.dep.dep_getkey(stripped_atom)
 
-                break
+            splitkey = pkgkey.split("/")
+            if (len(splitkey) == 2):
+                pkgcat, pkgname = splitkey
+            else:
+                pkgcat, pkgname = "null", splitkey[0]
+
+            break
 
+        parsed = (matchTag, matchUse, atomSlot, matchRevision, direction,
+            justname, pkgkey, pkgname, pkgcat, pkgversion, stripped_atom,
+            scan_atom)
+        metadata.parsed[atom] = parsed
+        return parsed
+
+    def __atomMatch(self, atom, matchSlot, multiMatch, maskFilter,
+                    extendedResults, useCache, metadata, ck_sum = None):
+        """
+        atomMatch() implementation, package metadata is read through
+        the given _AtomMatchMetadata object.
+        """
+        if not atom:
+            return -1, 1
+
+        if useCache:
+            cached = self.__atomMatchFetchCache(atom, matchSlot,
+                multiMatch, maskFilter, extendedResults, ck_sum = ck_sum)
+            if cached is not None:
+                return cached
+
+        # "or" dependency support
+        # app-foo/foo-1.2.3;app-foo/bar-1.4.3?
+        if atom.endswith(etpConst['entropyordepquestion']):
+            # or dependency!
+            atoms = atom[:-1].split(etpConst['entropyordepsep'])
+            for s_atom in atoms:
+                data, rc = self.__atomMatch(s_atom, matchSlot, multiMatch,
+                    maskFilter, extendedResults, useCache, metadata,
+                    ck_sum = ck_sum)
+                if rc == 0:
+                    return data, rc
+
+        (matchTag, matchUse, atomSlot, matchRevision, direction, justname,
+         pkgkey, pkgname, pkgcat, pkgversion, stripped_atom,
+         scan_atom) = self.__atomMatchParse(atom, metadata)
+        if (matchSlot is None) and (atomSlot is not None):
+            matchSlot = atomSlot
+
+        found_ids = []
+        default_package_ids = None
+
+        if scan_atom:
 
             # IDs found in the database that match our search
             try:
                 found_ids, default_package_ids = self.__generate_found_ids_match(
-                    pkgkey, pkgname, pkgcat, multiMatch)
+                    pkgkey, pkgname, pkgcat, multiMatch, metadata)
             except OperationalError:
                 # we are fault tolerant, cannot crash because
                 # tables are not available and validateDatabase()
@@ -5128,7 +5423,7 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
         # filter slot and tag
         if found_ids:
             found_ids = self.__filterSlotTagUse(found_ids, matchSlot,
-                matchTag, matchUse, direction)
+                matchTag, matchUse, direction, metadata)
             if maskFilter:
                 def _filter(pkg_id):
                     pkg_id, pkg_reason = self.maskFilter(pkg_id)
@@ -5140,7 +5435,8 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
         dbpkginfo = set()
         if found_ids:
             dbpkginfo = self.__handle_found_ids_match(found_ids, direction,
-                matchTag, matchRevision, justname, stripped_atom, pkgversion)
+                matchTag, matchRevision, justname, stripped_atom, pkgversion,
+                metadata)
 
         if not dbpkginfo:
             if extendedResults:
@@ -5151,7 +5447,7 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
                 self.__atomMatchStoreCache(
                     atom, matchSlot,
                     multiMatch, maskFilter,
-                    extendedResults, result = (x, 1)
+                    extendedResults, ck_sum = ck_sum, result = (x, 1)
                 )
                 return x, 1
             else:
@@ -5162,18 +5458,18 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
                 self.__atomMatchStoreCache(
                     atom, matchSlot,
                     multiMatch, maskFilter,
-                    extendedResults, result = (x, 1)
+                    extendedResults, ck_sum = ck_sum, result = (x, 1)
                 )
                 return x, 1
 
         if multiMatch:
             if extendedResults:
-                x = set([(x[0], 0, x[1], self.retrieveTag(x[0]), \
-                    self.retrieveRevision(x[0])) for x in dbpkginfo])
+                x = set([(x[0], 0, x[1], metadata.tag(x[0]), \
+                    metadata.revision(x[0])) for x in dbpkginfo])
                 self.__atomMatchStoreCache(
                     atom, matchSlot,
                     multiMatch, maskFilter,
-                    extendedResults, result = (x, 0)
+                    extendedResults, ck_sum = ck_sum, result = (x, 0)
                 )
                 return x, 0
             else:
@@ -5181,27 +5477,27 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
                 self.__atomMatchStoreCache(
                     atom, matchSlot,
                     multiMatch, maskFilter,
-                    extendedResults, result = (x, 0)
+                    extendedResults, ck_sum = ck_sum, result = (x, 0)
                 )
                 return x, 0
 
         if len(dbpkginfo) == 1:
             x = dbpkginfo.pop()
             if extendedResults:
-                x = (x[0], 0, x[1], self.retrieveTag(x[0]),
-                    self.retrieveRevision(x[0]),)
+                x = (x[0], 0, x[1], metadata.tag(x[0]),
+                    metadata.revision(x[0]),)
 
                 self.__atomMatchStoreCache(
                     atom, matchSlot,
                     multiMatch, maskFilter,
-                    extendedResults, result = (x, 0)
+                    extendedResults, ck_sum = ck_sum, result = (x, 0)
                 )
                 return x, 0
             else:
                 self.__atomMatchStoreCache(
                     atom, matchSlot,
                     multiMatch, maskFilter,
-                    extendedResults, result = (x[0], 0)
+                    extendedResults, ck_sum = ck_sum, result = (x[0], 0)
                 )
                 return x[0], 0
 
@@ -5223,8 +5519,8 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
         versions = set()
 
         for x in dbpkginfo:
-            info_tuple = (x[1], self.retrieveTag(x[0]), \
-                self.retrieveRevision(x[0]))
+            info_tuple = (x[1], metadata.tag(x[0]), \
+                metadata.revision(x[0]))
             versions.add(info_tuple)
             pkgdata[info_tuple] = x[0]
 
@@ -5265,24 +5561,24 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
             self.__atomMatchStoreCache(
                 atom, matchSlot,
                 multiMatch, maskFilter,
-                extendedResults, result = (x, rc)
+                extendedResults, ck_sum = ck_sum, result = (x, rc)
             )
             return x, rc
         else:
             self.__atomMatchStoreCache(
                 atom, matchSlot,
                 multiMatch, maskFilter,
-                extendedResults, result = (x, rc)
+                extendedResults, ck_sum = ck_sum, result = (x, rc)
             )
             return x, rc
 
-    def __generate_found_ids_match(self, pkgkey, pkgname, pkgcat, multiMatch):
+    def __generate_found_ids_match(self, pkgkey, pkgname, pkgcat, multiMatch,
+                                   metadata):
 
         if pkgcat == "null":
-            results = self.searchName(pkgname, sensitive = True,
-                just_id = True)
+            results = metadata.search_name(pkgname)
         else:
-            results = self.searchNameCategory(pkgname, pkgcat, just_id = True)
+            results = metadata.search_name_category(pkgname, pkgcat)
 
         old_style_virtuals = None
         # if it's a PROVIDE, search with searchProvide
@@ -5315,7 +5611,7 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
             found_id = None
             cats = set()
             for package_id in results:
-                cat = self.retrieveCategory(package_id)
+                cat = metadata.category(package_id)
                 cats.add(cat)
                 if (cat == pkgcat) or \
                     ((pkgcat == self.VIRTUAL_META_PACKAGE_CATEGORY) and \
@@ -5340,8 +5636,7 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
             # we need to search using the category
             if (not multiMatch) and (pkgcat == "null"):
                 # we searched by name, we need to search using category
-                results = self.searchNameCategory(
-                    pkgname, pkgcat, just_id = True)
+                results = metadata.search_name_category(pkgname, pkgcat)
 
             # if we get here, we have found the needed IDs
             return set(results), old_style_virtuals
@@ -5356,11 +5651,11 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
             (old_style_virtuals is not None):
             # in case of virtual packages only
             # (that they're not stored as provide)
-            pkgcat, pkgname = self.retrieveKeySplit(package_id)
+            pkgcat, pkgname = metadata.key_split(package_id)
 
         # check if category matches
         if pkgcat != "null":
-            found_cat = self.retrieveCategory(package_id)
+            found_cat = metadata.category(package_id)
             if pkgcat == found_cat:
                 return set([package_id]), old_style_virtuals
             del results
@@ -5372,7 +5667,7 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
 
 
     def __handle_found_ids_match(self, found_ids, direction, matchTag,
-            matchRevision, justname, stripped_atom, pkgversion):
+            matchRevision, justname, stripped_atom, pkgversion, metadata):
 
         dbpkginfo = set()
         # now we have to handle direction
@@ -5403,7 +5698,7 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
 
                 for package_id in found_ids:
 
-                    dbver = self.retrieveVersion(package_id)
+                    dbver = metadata.version(package_id)
                     if (direction == "~"):
                         myrev = entropy.dep.dep_get_spm_revision(
                             dbver)
@@ -5417,7 +5712,7 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
                             if dbver.startswith(pkgversion[:-1]):
                                 dbpkginfo.add((package_id, dbver))
                         elif (matchRevision is not None) and (pkgversion == dbver):
-                            dbrev = self.retrieveRevision(package_id)
+                            dbrev = metadata.revision(package_id)
                             if dbrev == matchRevision:
                                 dbpkginfo.add((package_id, dbver))
                         elif (pkgversion == dbver) and (matchRevision is None):
@@ -5437,14 +5732,14 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
                         revcmp = 0
                         tagcmp = 0
                         if matchRevision is not None:
-                            dbrev = self.retrieveRevision(package_id)
+                            dbrev = metadata.revision(package_id)
                             revcmp = const_cmp(matchRevision, dbrev)
 
                         if matchTag is not None:
-                            dbtag = self.retrieveTag(package_id)
+                            dbtag = metadata.tag(package_id)
                             tagcmp = const_cmp(matchTag, dbtag)
 
-                        dbver = self.retrieveVersion(package_id)
+                        dbver = metadata.version(package_id)
                         pkgcmp = entropy.dep.compare_versions(
                             pkgversion, dbver)
 
@@ -5505,70 +5800,47 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
 
         else: # just the key
 
-            dbpkginfo = set([(x, self.retrieveVersion(x),) for x in found_ids])
+            dbpkginfo = set([(x, metadata.version(x),) for x in found_ids])
 
         return dbpkginfo
 
-    def __atomMatchFetchCache(self, *args):
-        if self._caching:
+    def __atomMatchCacheNamespace(self, ck_sum):
+        if ck_sum is None:
             ck_sum = self.checksum(strict = False)
-            hash_str = self.__atomMatch_gen_hash_str(args)
-            cached = entropy.dump.loadobj(
-                "%s/%s/%s_%s_%s" % (
-                    self.__db_match_cache_key,
-                    self.name,
-                    self.atomMatchCacheKey(),
-                    ck_sum,
-                    hash_str,
-                    )
-                )
-            return cached
+        return (self.name, self.atomMatchCacheKey(), ck_sum)
 
-    def __atomMatch_gen_hash_str(self, args):
-        data_str = repr(args)
-        sha1 = hashlib.sha1()
-        if const_is_python3():
-            sha1.update(data_str.encode("utf-8"))
-        else:
-            sha1.update(data_str)
-        return sha1.hexdigest()
+    def __atomMatchFetchCache(self, *args, **kwargs):
+        if self._caching:
+            return self._match_cacher.get(
+                self.__atomMatchCacheNamespace(kwargs.get('ck_sum')), args)
 
     def __atomMatchStoreCache(self, *args, **kwargs):
         if self._caching:
-            ck_sum = self.checksum(strict = False)
-            hash_str = self.__atomMatch_gen_hash_str(args)
-            self._cacher.push(
-                "%s/%s/%s_%s_%s" % (
-                    self.__db_match_cache_key,
-                    self.name,
-                    self.atomMatchCacheKey(),
-                    ck_sum,
-                    hash_str,
-                    ),
-                kwargs.get('result'),
-                async = False)
+            self._match_cacher.set(
+                self.__atomMatchCacheNamespace(kwargs.get('ck_sum')), args,
+                kwargs.get('result'))
 
-    def __filterSlot(self, package_id, slot):
+    def __filterSlot(self, package_id, slot, metadata):
         if slot is None:
             return package_id
-        dbslot = self.retrieveSlot(package_id)
+        dbslot = metadata.slot(package_id)
         if dbslot == slot:
             return package_id
 
-    def __filterTag(self, package_id, tag, operators):
+    def __filterTag(self, package_id, tag, operators, metadata):
         if tag is None:
             return package_id
 
-        dbtag = self.retrieveTag(package_id)
+        dbtag = metadata.tag(package_id)
         compare = const_cmp(tag, dbtag)
         # cannot do operator compare because it breaks the tag concept
         if compare == 0:
             return package_id
 
-    def __filterUse(self, package_id, uses):
+    def __filterUse(self, package_id, uses, metadata):
         if not uses:
             return package_id
-        pkguse = set(self.retrieveUseflags(package_id))
+        pkguse = set(metadata.useflags(package_id))
         enabled = set([x for x in uses if not x.startswith("-")])
         disabled = set(uses) - enabled
 
@@ -5635,19 +5907,21 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
             return None
         return package_id
 
-    def __filterSlotTagUse(self, found_ids, slot, tag, use, operators):
+    def __filterSlotTagUse(self, found_ids, slot, tag, use, operators,
+                           metadata):
 
         def myfilter(package_id):
 
-            package_id = self.__filterSlot(package_id, slot)
+            package_id = self.__filterSlot(package_id, slot, metadata)
             if not package_id:
                 return False
 
-            package_id = self.__filterUse(package_id, use)
+            package_id = self.__filterUse(package_id, use, metadata)
             if not package_id:
                 return False
 
-            package_id = self.__filterTag(package_id, tag, operators)
+            package_id = self.__filterTag(package_id, tag, operators,
+                metadata)
             if not package_id:
                 return False
 
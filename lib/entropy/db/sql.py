@@ -11,6 +11,7 @@
 
 """
 import os
+import contextlib
 import hashlib
 import itertools
 import time
@@ -19,7 +20,7 @@ import threading
 from entropy.const import etpConst, const_debug_write, \
     const_debug_enabled, const_isunicode, const_convert_to_unicode, \
     const_get_buffer, const_convert_to_rawstring, const_is_python3, \
-    const_get_stringtype
+    const_get_stringtype, const_isnumber
 from entropy.exceptions import SystemDatabaseError, SPMError
 from entropy.spm.plugins.factory import get_default_instance as get_spm
 from entropy.output import bold, red
@@ -615,6 +616,15 @@ class EntropySQLRepository(EntropyRepositoryBase):
     # Generic repository name to use when none is given.
     GENERIC_NAME = "__generic__"
 
+    # settings table key of the incremental checksum, see checksum()
+    _INCREMENTAL_CHECKSUM_SETTING = "incremental_checksum"
+    _INCREMENTAL_CHECKSUM_MODULO = 2 ** 160
+
+    # materialized reverse dependencies index, maintained by writable
+    # repositories, see retrieveReverseDependencies()
+    _REVERSE_DEPENDENCIES_TABLE = "reversedependencies"
+    _REVERSE_DEPENDENCIES_SETTING = "reversedependencies_key"
+
     def __init__(self, db, read_only, skip_checks, indexing,
                  xcache, temporary, name, direct=False, cache_policy=None):
         # connection and cursor automatic cleanup support
@@ -859,13 +869,15 @@ class EntropySQLRepository(EntropyRepositoryBase):
         """
         Save a new key -> value pair to the in-memory cache.
         """
-        self._live_cacher.set(self._getLiveCacheKey() + key, value)
+        prefix = self._getLiveCacheKey()
+        self._live_cacher.set(prefix + key, value, prefix = prefix)
 
     def _getLiveCache(self, key):
         """
         Lookup a key value from the in-memory cache.
         """
-        return self._live_cacher.get(self._getLiveCacheKey() + key)
+        prefix = self._getLiveCacheKey()
+        return self._live_cacher.get(prefix + key, prefix = prefix)
 
     def _getLiveCacheKey(self):
         """
@@ -1288,6 +1300,7 @@ class EntropySQLRepository(EntropyRepositoryBase):
                     pkg_data['datecreation'],
                 )
             )
+        self._updateIncrementalChecksum(package_id, 0)
         # baseinfo and extrainfo are tainted
         self.clearCache()
         ### other information iserted below are not as
@@ -1396,9 +1409,13 @@ class EntropySQLRepository(EntropyRepositoryBase):
         Needs to call superclass method.
         """
         try:
+            rev_deps = self._isReverseDependenciesTableValid()
             package_id = self._addPackage(pkg_data, revision = revision,
                 package_id = package_id,
                 formatted_content = formatted_content)
+            if rev_deps:
+                self._updateReverseDependencies(
+                    self._reverseDependenciesCandidates(package_id))
             super(EntropySQLRepository, self).addPackage(
                 pkg_data, revision = revision,
                 package_id = package_id,
@@ -1419,8 +1436,21 @@ class EntropySQLRepository(EntropyRepositoryBase):
                 package_id, from_add_package = from_add_package)
             self.clearCache()
 
-            return self._removePackage(package_id,
-                from_add_package = from_add_package)
+            rev_deps = self._isReverseDependenciesTableValid()
+            if rev_deps:
+                dep_ids = self._reverseDependenciesCandidates(package_id)
+
+            # the reverse dependencies table is updated below
+            with self._trackIncrementalChecksum(
+                    package_id, resolution = False):
+                self._removePackage(package_id,
+                    from_add_package = from_add_package)
+
+            if rev_deps:
+                self._cursor().execute("""
+                DELETE FROM %s WHERE idpackage = ?
+                """ % (self._REVERSE_DEPENDENCIES_TABLE,), (package_id,))
+                self._updateReverseDependencies(dep_ids)
         except:
             self._connection().rollback()
             raise
@@ -1560,17 +1590,21 @@ class EntropySQLRepository(EntropyRepositoryBase):
         """
         Reimplemented from EntropyRepositoryBase.
         """
-        self._cursor().execute("""
-        UPDATE extrainfo SET datecreation = ? WHERE idpackage = ?
-        """, (str(date), package_id,))
+        with self._trackIncrementalChecksum(
+                package_id, resolution = False):
+            self._cursor().execute("""
+            UPDATE extrainfo SET datecreation = ? WHERE idpackage = ?
+            """, (str(date), package_id,))
 
     def setDigest(self, package_id, digest):
         """
         Reimplemented from EntropyRepositoryBase.
         """
-        self._cursor().execute("""
-        UPDATE extrainfo SET digest = ? WHERE idpackage = ?
-        """, (digest, package_id,))
+        with self._trackIncrementalChecksum(
+                package_id, resolution = False):
+            self._cursor().execute("""
+            UPDATE extrainfo SET digest = ? WHERE idpackage = ?
+            """, (digest, package_id,))
 
     def setSignatures(self, package_id, sha1, sha256, sha512, gpg = None):
         """
@@ -1590,17 +1624,20 @@ class EntropySQLRepository(EntropyRepositoryBase):
         @param url: URL prefix to set
         @type url: string
         """
-        self._cursor().execute("""
-        UPDATE extrainfo SET download = ? WHERE idpackage = ?
-        """, (url, package_id,))
+        with self._trackIncrementalChecksum(
+                package_id, resolution = False):
+            self._cursor().execute("""
+            UPDATE extrainfo SET download = ? WHERE idpackage = ?
+            """, (url, package_id,))
 
     def setCategory(self, package_id, category):
         """
         Reimplemented from EntropyRepositoryBase.
         """
-        self._cursor().execute("""
-        UPDATE baseinfo SET category = ? WHERE idpackage = ?
-        """, (category, package_id,))
+        with self._trackIncrementalChecksum(package_id):
+            self._cursor().execute("""
+            UPDATE baseinfo SET category = ? WHERE idpackage = ?
+            """, (category, package_id,))
 
     def setCategoryDescription(self, category, description_data):
         """
@@ -1619,9 +1656,10 @@ class EntropySQLRepository(EntropyRepositoryBase):
         """
         Reimplemented from EntropyRepositoryBase.
         """
-        self._cursor().execute("""
-        UPDATE baseinfo SET name = ? WHERE idpackage = ?
-        """, (name, package_id,))
+        with self._trackIncrementalChecksum(package_id):
+            self._cursor().execute("""
+            UPDATE baseinfo SET name = ? WHERE idpackage = ?
+            """, (name, package_id,))
 
     def setDependency(self, iddependency, dependency):
         """
@@ -1631,30 +1669,35 @@ class EntropySQLRepository(EntropyRepositoryBase):
         UPDATE dependenciesreference SET dependency = ?
         WHERE iddependency = ?
         """, (dependency, iddependency,))
+        if self._isReverseDependenciesTableValid():
+            self._updateReverseDependencies([iddependency])
 
     def setAtom(self, package_id, atom):
         """
         Reimplemented from EntropyRepositoryBase.
         """
-        self._cursor().execute("""
-        UPDATE baseinfo SET atom = ? WHERE idpackage = ?
-        """, (atom, package_id,))
+        with self._trackIncrementalChecksum(package_id):
+            self._cursor().execute("""
+            UPDATE baseinfo SET atom = ? WHERE idpackage = ?
+            """, (atom, package_id,))
 
     def setSlot(self, package_id, slot):
         """
         Reimplemented from EntropyRepositoryBase.
         """
-        self._cursor().execute("""
-        UPDATE baseinfo SET slot = ? WHERE idpackage = ?
-        """, (slot, package_id,))
+        with self._trackIncrementalChecksum(package_id):
+            self._cursor().execute("""
+            UPDATE baseinfo SET slot = ? WHERE idpackage = ?
+            """, (slot, package_id,))
 
     def setRevision(self, package_id, revision):
         """
         Reimplemented from EntropyRepositoryBase.
         """
-        self._cursor().execute("""
-        UPDATE baseinfo SET revision = ? WHERE idpackage = ?
-        """, (revision, package_id,))
+        with self._trackIncrementalChecksum(package_id):
+            self._cursor().execute("""
+            UPDATE baseinfo SET revision = ? WHERE idpackage = ?
+            """, (revision, package_id,))
 
     def removeDependencies(self, package_id):
         """
@@ -1688,9 +1731,12 @@ class EntropySQLRepository(EntropyRepositoryBase):
 
             return deps
 
+        deps = insert_list()
         self._cursor().executemany("""
         INSERT INTO dependencies VALUES (?, ?, ?)
-        """, insert_list())
+        """, deps)
+        if self._isReverseDependenciesTableValid():
+            self._updateReverseDependencies(set(x[1] for x in deps))
 
     def removeConflicts(self, package_id):
         """
@@ -3703,19 +3749,12 @@ class EntropySQLRepository(EntropyRepositoryBase):
         """
         Reimplemented from EntropyRepositoryBase.
         """
-        cached = self._getLiveCache("reverseDependenciesMetadata")
-        if cached is None:
-            cached = self._generateReverseDependenciesMetadata()
-
-        dep_ids = set((k for k, v in cached.items() if package_id in v))
-        if not dep_ids:
-            # avoid python3.x memleak
-            del cached
+        dep_ids_str = self._reverseDependencyIdsQuery(package_id)
+        if dep_ids_str is None:
             if key_slot:
                 return tuple()
             return frozenset()
 
-        dep_ids_str = ', '.join((str(x) for x in dep_ids))
         excluded_deptypes_query = ""
         if exclude_deptypes is not None:
             for dep_type in exclude_deptypes:
@@ -3818,34 +3857,36 @@ class EntropySQLRepository(EntropyRepositoryBase):
                 WHERE dependencies.iddependency IN ( %s )""" % (dep_ids_str,))
                 result = self._cur2frozenset(cur)
 
-        # avoid python3.x memleak
-        del cached
         return result
 
     def retrieveUnusedPackageIds(self):
         """
         Reimplemented from EntropyRepositoryBase.
         """
-        cached = self._getLiveCache("reverseDependenciesMetadata")
-        if cached is None:
-            cached = self._generateReverseDependenciesMetadata()
-
-        pkg_ids = set()
-        for v in cached.values():
-            pkg_ids |= v
-        if not pkg_ids:
+        if self._isReverseDependenciesTableValid():
+            table = self._REVERSE_DEPENDENCIES_TABLE
+            cur = self._cursor().execute("""
+            SELECT 1 FROM %s LIMIT 1
+            """ % (table,))
+            if cur.fetchone() is None:
+                return tuple()
+            pkg_ids_str = "SELECT idpackage FROM %s" % (table,)
+        else:
+            cached = self._getLiveCache("reverseDependenciesIndex")
+            if cached is None:
+                cached = self._generateReverseDependenciesIndex()
+            pkg_ids = [k for k, v in cached.items() if v]
             # avoid python3.x memleak
             del cached
-            return tuple()
-        pkg_ids_str = ', '.join((str(x) for x in pkg_ids))
+            if not pkg_ids:
+                return tuple()
+            pkg_ids_str = ', '.join((str(x) for x in pkg_ids))
 
         cur = self._cursor().execute("""
         SELECT idpackage FROM baseinfo
         WHERE idpackage NOT IN ( %s )
         ORDER BY atom
         """ % (pkg_ids_str,))
-        # avoid python3.x memleak
-        del cached
         return self._cur2tuple(cur)
 
     def arePackageIdsAvailable(self, package_ids):
@@ -4567,6 +4608,64 @@ class EntropySQLRepository(EntropyRepositoryBase):
         """, (name, category))
         return tuple(cur)
 
+    def _atomMatchPackageData(self, names):
+        """
+        Reimplemented from EntropyRepositoryBase.
+        """
+        data = {}
+        names = list(names)
+        # stay well below SQLITE_MAX_VARIABLE_NUMBER
+        chunk_size = 500
+        for idx in range(0, len(names), chunk_size):
+            chunk = names[idx:idx + chunk_size]
+            cur = self._cursor().execute("""
+            SELECT idpackage, category, name, version, versiontag,
+            revision, slot FROM baseinfo
+            WHERE name IN (%s)
+            """ % (",".join("?" * len(chunk)),), chunk)
+            for row in cur:
+                data[row[0]] = tuple(row[1:])
+        return data
+
+    def _atomMatchUseflags(self, package_ids):
+        """
+        Reimplemented from EntropyRepositoryBase.
+        """
+        useflags = dict((x, set()) for x in package_ids)
+        package_ids = list(useflags.keys())
+        chunk_size = 500
+        for idx in range(0, len(package_ids), chunk_size):
+            chunk = package_ids[idx:idx + chunk_size]
+            cur = self._cursor().execute("""
+            SELECT useflags.idpackage, useflagsreference.flagname
+            FROM useflags, useflagsreference
+            WHERE useflags.idpackage IN (%s)
+            AND useflags.idflag = useflagsreference.idflag
+            """ % (",".join("?" * len(chunk)),), chunk)
+            for package_id, flag in cur:
+                useflags[package_id].add(flag)
+        return dict((x, frozenset(y)) for x, y in useflags.items())
+
+    def _maskFilterPackageData(self):
+        """
+        Reimplemented from EntropyRepositoryBase.
+        """
+        keywords = {}
+        cur = self._cursor().execute("""
+        SELECT keywords.idpackage, keywordsreference.keywordname
+        FROM keywords, keywordsreference
+        WHERE keywords.idkeyword = keywordsreference.idkeyword
+        """)
+        for package_id, keyword in cur:
+            keywords.setdefault(package_id, set()).add(keyword)
+
+        cur = self._cursor().execute("""
+        SELECT idpackage, license FROM baseinfo
+        """)
+        return dict(
+            (package_id, (licenses, frozenset(keywords.get(package_id, ()))))
+            for package_id, licenses in cur)
+
     def isPackageScopeAvailable(self, atom, slot, revision):
         """
         Reimplemented from EntropyRepositoryBase.
@@ -4810,9 +4909,10 @@ class EntropySQLRepository(EntropyRepositoryBase):
         """
         Reimplemented from EntropyRepositoryBase.
         """
-        self._cursor().execute("""
-        UPDATE baseinfo SET branch = ?
-        WHERE idpackage = ?""", (tobranch, package_id,))
+        with self._trackIncrementalChecksum(package_id):
+            self._cursor().execute("""
+            UPDATE baseinfo SET branch = ?
+            WHERE idpackage = ?""", (tobranch, package_id,))
         self.clearCache()
 
     def getSetting(self, setting_name):
@@ -4929,11 +5029,163 @@ class EntropySQLRepository(EntropyRepositoryBase):
         """
         raise NotImplementedError()
 
+    @staticmethod
+    def _checksumRecord(record):
+        """
+        Serialize a table row in a platform and interpreter
+        independent way.
+        """
+        data = []
+        for value in record:
+            if value is None:
+                data.append(b"N")
+            elif isinstance(value, float):
+                data.append(b"F" + const_convert_to_rawstring(repr(value)))
+            elif const_isnumber(value):
+                data.append(b"I" + const_convert_to_rawstring(value))
+            else:
+                data.append(b"S" + const_convert_to_rawstring(value))
+        return b"\0".join(data)
+
+    def _packageChecksumDigest(self, package_id):
+        """
+        Return the incremental checksum contribution of a package, as
+        an integer. Packages not in the repository contribute 0.
+        """
+        cur = self._cursor().execute("""
+        SELECT * FROM baseinfo WHERE idpackage = ? LIMIT 1
+        """, (package_id,))
+        base_record = cur.fetchone()
+        if base_record is None:
+            return 0
+        cur = self._cursor().execute("""
+        SELECT * FROM extrainfo WHERE idpackage = ? LIMIT 1
+        """, (package_id,))
+        extra_record = cur.fetchone() or ()
+
+        sha = hashlib.sha1()
+        sha.update(self._checksumRecord(base_record))
+        sha.update(b"\1")
+        sha.update(self._checksumRecord(extra_record))
+        return int(sha.hexdigest(), 16)
+
+    def _computeIncrementalChecksum(self):
+        """
+        Compute the incremental checksum from scratch, by summing up the
+        digests of all the packages (modulo 2^160), so that the result
+        doesn't depend on the packages order.
+        """
+        cur = self._cursor().execute("""
+        SELECT * FROM extrainfo
+        """)
+        extra_records = dict((x[0], x) for x in cur)
+
+        value = 0
+        cur = self._cursor().execute("""
+        SELECT * FROM baseinfo
+        """)
+        for base_record in cur:
+            sha = hashlib.sha1()
+            sha.update(self._checksumRecord(base_record))
+            sha.update(b"\1")
+            sha.update(self._checksumRecord(
+                extra_records.get(base_record[0], ())))
+            value += int(sha.hexdigest(), 16)
+        return value % self._INCREMENTAL_CHECKSUM_MODULO
+
+    def _readIncrementalChecksum(self):
+        """
+        Read the stored incremental checksum, bypassing the settings
+        cache. Return None if it is not available.
+        """
+        try:
+            cur = self._cursor().execute("""
+            SELECT setting_value FROM settings WHERE setting_name = ?
+            LIMIT 1
+            """, (self._INCREMENTAL_CHECKSUM_SETTING,))
+        except Error:
+            return None
+        setting = cur.fetchone()
+        if setting is None:
+            return None
+        try:
+            return int(setting[0], 16)
+        except (TypeError, ValueError):
+            return None
+
+    def _updateIncrementalChecksum(self, package_id, old_digest):
+        """
+        Update the stored incremental checksum after package_id metadata
+        has changed. old_digest is the package digest before the change
+        (0 for new packages). If no checksum has been stored yet, a full
+        computation is done.
+        """
+        if not self._isBaseinfoExtrainfo2010():
+            return
+
+        stored = self._readIncrementalChecksum()
+        if stored is None:
+            value = self._computeIncrementalChecksum()
+        else:
+            value = (stored - old_digest + self._packageChecksumDigest(
+                    package_id)) % self._INCREMENTAL_CHECKSUM_MODULO
+        try:
+            self._setSetting(self._INCREMENTAL_CHECKSUM_SETTING,
+                "%040x" % (value,))
+        except Error:
+            # settings table not available
+            pass
+        self._live_cacher.discard(self._getLiveCacheKey() + "checksum_")
+
+    @contextlib.contextmanager
+    def _trackIncrementalChecksum(self, package_id, resolution = True):
+        """
+        Context manager that updates the incremental checksum with the
+        changes made to package_id metadata inside its block.
+        The reverse dependencies table is keyed on the checksum, so it is
+        kept valid as well: if resolution is True, the changes may affect
+        dependency resolution and the candidate dependencies of package_id
+        are resolved again, otherwise the table is just re-keyed.
+        """
+        rev_deps = self._isReverseDependenciesTableValid()
+        old_digest = self._packageChecksumDigest(package_id)
+        yield
+        self._updateIncrementalChecksum(package_id, old_digest)
+        if not rev_deps:
+            return
+        if resolution:
+            self._updateReverseDependencies(
+                self._reverseDependenciesCandidates(package_id))
+        else:
+            self._setSetting(self._REVERSE_DEPENDENCIES_SETTING,
+                             self._reverseDependenciesKey())
+
+    def verifyChecksum(self, repair = False):
+        """
+        Reimplemented from EntropyRepositoryBase.
+        """
+        if not self._isBaseinfoExtrainfo2010():
+            return True
+        stored = self._readIncrementalChecksum()
+        if stored is None:
+            return True
+
+        value = self._computeIncrementalChecksum()
+        if stored == value:
+            return True
+        if repair:
+            self._setSetting(self._INCREMENTAL_CHECKSUM_SETTING,
+                "%040x" % (value,))
+            self.clearCache()
+        return False
+
     def checksum(self, do_order = False, strict = True,
                  include_signatures = False,
                  include_dependencies = False):
         """
         Reimplemented from EntropyRepositoryBase.
+        The unordered checksum of package metadata is maintained
+        incrementally on write and stored into the settings table.
         """
         cache_key = "checksum_%s_%s_True_%s_%s" % (
             do_order, strict, include_signatures, include_dependencies)
@@ -4943,6 +5195,19 @@ class EntropySQLRepository(EntropyRepositoryBase):
         # avoid memleak with python3.x
         del cached
 
+        if not (do_order or include_signatures or include_dependencies):
+            if not self._doesTableExist("baseinfo"):
+                m = hashlib.sha1()
+                m.update(const_convert_to_rawstring("~empty~"))
+                return m.hexdigest()
+
+            value = self._readIncrementalChecksum()
+            if value is None:
+                value = self._computeIncrementalChecksum()
+            result = "%040x" % (value,)
+            self._setLiveCache(cache_key, result)
+            return result
+
         package_id_order = ""
         depenenciesref_order = ""
         dependencies_order = ""
@@ -5160,6 +5425,7 @@ class EntropySQLRepository(EntropyRepositoryBase):
         self._createDesktopMimeIndex()
         self._createProvidedMimeIndex()
         self._createPackageDownloadsIndex()
+        self._createReverseDependenciesIndex()
 
     def _createTrashedCountersIndex(self):
         try:
@@ -5398,6 +5664,23 @@ class EntropySQLRepository(EntropyRepositoryBase):
         except OperationalError:
             pass
 
+    def _createReverseDependenciesIndex(self):
+        if not self._isReverseDependenciesTableEnabled():
+            return
+        try:
+            if not self._isReverseDependenciesTableValid():
+                self._generateReverseDependenciesTable()
+        except OperationalError:
+            # repository tables are not available
+            return
+        try:
+            self._cursor().execute("""
+            CREATE INDEX reversedependenciesindex_iddependency
+                ON %s ( iddependency );
+            """ % (self._REVERSE_DEPENDENCIES_TABLE,))
+        except OperationalError:
+            pass
+
     def _createCountersIndex(self):
         try:
             self._cursor().execute("""
@@ -5533,64 +5816,220 @@ class EntropySQLRepository(EntropyRepositoryBase):
         UPDATE treeupdates SET digest = '-1'
         """)
 
-    def _generateReverseDependenciesMetadata(self):
+    def _resolveDependencies(self, dependencies):
         """
-        Reverse dependencies dynamic metadata generation.
+        Match the given (iddependency, dependency) pairs against the
+        repository and return the set of (package_id, iddependency) pairs
+        they resolve to. Or-dependencies resolve to every available
+        alternative.
+        """
+        dep_atoms = {}
+        for iddep, dependency in dependencies:
+            if iddep == -1:
+                continue
+            if dependency.endswith(etpConst['entropyordepquestion']):
+                dep_atoms[iddep] = dependency[:-1].split(
+                    etpConst['entropyordepsep'])
+            else:
+                dep_atoms[iddep] = [dependency]
+
+        # not safe to use cache here, people messing with multiple
+        # instances can make this crash
+        matches = self.atomMatchMany(
+            set(itertools.chain.from_iterable(dep_atoms.values())),
+            useCache = False)
+
+        resolved = set()
+        for iddep, atoms in dep_atoms.items():
+            for atom in atoms:
+                package_id, rc = matches[atom]
+                if package_id != -1:
+                    resolved.add((package_id, iddep))
+        return resolved
+
+    def _reverseDependenciesKey(self):
+        """
+        Return the key identifying the repository content and the
+        matching rules the reverse dependencies table is valid for.
+        """
+        return "%s|%s" % (self.atomMatchCacheKey(), self.checksum())
+
+    def _isReverseDependenciesTableEnabled(self):
+        """
+        Return whether the reverse dependencies table can be used. It is
+        not for read-only repositories and for repositories whose
+        atomMatch() results depend on the user masking configuration
+        (see MaskableRepository, which sets
+        _REVERSE_DEPENDENCIES_TABLE_ENABLED to False).
+        """
+        if self.readonly():
+            return False
+        # not defined in this class, it would shadow the MaskableRepository
+        # one, which comes later in the MRO
+        return getattr(self, "_REVERSE_DEPENDENCIES_TABLE_ENABLED", True)
+
+    def _isReverseDependenciesTableValid(self):
+        """
+        Return whether the reverse dependencies table is available and
+        up-to-date.
+        """
+        if not self._isReverseDependenciesTableEnabled():
+            return False
+        if not self._doesTableExist(self._REVERSE_DEPENDENCIES_TABLE):
+            return False
+        try:
+            key = self.getSetting(self._REVERSE_DEPENDENCIES_SETTING)
+        except KeyError:
+            return False
+        return key == self._reverseDependenciesKey()
+
+    def _generateReverseDependenciesTable(self):
+        """
+        Regenerate the reverse dependencies table from scratch.
+        """
+        table = self._REVERSE_DEPENDENCIES_TABLE
+        if self._doesTableExist(table):
+            self._cursor().execute("DELETE FROM %s" % (table,))
+        else:
+            self._cursor().execute("""
+            CREATE TABLE %s (
+                idpackage INTEGER,
+                iddependency INTEGER,
+                PRIMARY KEY(idpackage, iddependency)
+            );
+            """ % (table,))
+            self._clearLiveCache("_doesTableExist")
+
+        self._cursor().executemany("""
+        INSERT INTO %s VALUES (?, ?)
+        """ % (table,), self._resolveDependencies(
+                self.listAllDependencies()))
+        self._setSetting(self._REVERSE_DEPENDENCIES_SETTING,
+                         self._reverseDependenciesKey())
+
+    def _reverseDependenciesCandidates(self, package_id):
+        """
+        Return the identifiers of the dependencies whose resolution may
+        change when package_id is added or removed: its own dependencies,
+        the ones currently resolving to it and the ones mentioning its key
+        or any of its provides.
+        """
+        table = self._REVERSE_DEPENDENCIES_TABLE
+        cur = self._cursor().execute("""
+        SELECT iddependency FROM dependencies WHERE idpackage = ?
+        UNION
+        SELECT iddependency FROM %s WHERE idpackage = ?
+        """ % (table,), (package_id, package_id,))
+        dep_ids = set(self._cur2frozenset(cur))
+
+        keys = set()
+        key_slot = self.retrieveKeySlot(package_id)
+        if key_slot is not None:
+            keys.add(key_slot[0])
+        for atom, is_default in self.retrieveProvide(package_id):
+            keys.add(entropy.dep.dep_getkey(atom))
+        for key in keys:
+            # LIKE returns a superset, which is fine here
+            cur = self._cursor().execute("""
+            SELECT iddependency FROM dependenciesreference
+            WHERE dependency LIKE ?
+            """, ("%" + key + "%",))
+            dep_ids |= self._cur2frozenset(cur)
+        return dep_ids
+
+    def _updateReverseDependencies(self, dependency_ids):
+        """
+        Resolve again the given dependency identifiers and store the
+        result into the reverse dependencies table, then mark the table
+        as up-to-date.
+        """
+        table = self._REVERSE_DEPENDENCIES_TABLE
+        if dependency_ids:
+            dep_ids_str = ', '.join((str(x) for x in dependency_ids))
+            self._cursor().execute("""
+            DELETE FROM %s WHERE iddependency IN ( %s )
+            """ % (table, dep_ids_str,))
+            cur = self._cursor().execute("""
+            SELECT iddependency, dependency FROM dependenciesreference
+            WHERE iddependency IN ( %s )
+            """ % (dep_ids_str,))
+            self._cursor().executemany("""
+            INSERT INTO %s VALUES (?, ?)
+            """ % (table,), self._resolveDependencies(tuple(cur)))
+        self._setSetting(self._REVERSE_DEPENDENCIES_SETTING,
+                         self._reverseDependenciesKey())
+
+    def _generateReverseDependenciesIndex(self):
+        """
+        Reverse dependencies in-memory index generation, used when the
+        reverse dependencies table is not available.
+        Return a dict mapping package identifiers to the set of
+        identifiers of the dependencies resolving to them.
         """
         checksum = self.checksum()
         try:
             mtime = repr(self.mtime())
         except (OSError, IOError):
             mtime = "0.0"
-        hash_str = "%s|%s|%s|%s|%s" % (
+        hash_str = "%s|%s|%s|%s|%s|%s" % (
             repr(self._db),
             repr(etpConst['systemroot']),
             repr(self.name),
             repr(checksum),
+            repr(self.atomMatchCacheKey()),
             mtime,
         )
         if const_is_python3():
             hash_str = hash_str.encode("utf-8")
         sha = hashlib.sha1()
         sha.update(hash_str)
-        cache_key = "__generateReverseDependenciesMetadata2_" + \
+        cache_key = "__generateReverseDependenciesIndex_" + \
             sha.hexdigest()
         rev_deps_data = self._cacher.pop(cache_key)
         if rev_deps_data is not None:
-            self._setLiveCache("reverseDependenciesMetadata",
+            self._setLiveCache("reverseDependenciesIndex",
                 rev_deps_data)
             return rev_deps_data
 
-        dep_data = {}
-        for iddep, atom in self.listAllDependencies():
+        rev_deps_data = {}
+        for package_id, iddep in self._resolveDependencies(
+                self.listAllDependencies()):
+            obj = rev_deps_data.setdefault(package_id, set())
+            obj.add(iddep)
 
-            if iddep == -1:
-                continue
-
-            if atom.endswith(etpConst['entropyordepquestion']):
-                or_atoms = atom[:-1].split(etpConst['entropyordepsep'])
-                for or_atom in or_atoms:
-                    # not safe to use cache here, people messing with multiple
-                    # instances can make this crash
-                    package_id, rc = self.atomMatch(or_atom, useCache = False)
-                    if package_id != -1:
-                        obj = dep_data.setdefault(iddep, set())
-                        obj.add(package_id)
-            else:
-                # not safe to use cache here, people messing with multiple
-                # instances can make this crash
-                package_id, rc = self.atomMatch(atom, useCache = False)
-                if package_id != -1:
-                    obj = dep_data.setdefault(iddep, set())
-                    obj.add(package_id)
-
-        self._setLiveCache("reverseDependenciesMetadata", dep_data)
+        self._setLiveCache("reverseDependenciesIndex", rev_deps_data)
         try:
-            self._cacher.save(cache_key, dep_data)
+            self._cacher.save(cache_key, rev_deps_data)
         except IOError:
             # race condition, ignore
             pass
-        return dep_data
+        return rev_deps_data
+
+    def _reverseDependencyIdsQuery(self, package_id):
+        """
+        Return the SQL expression listing the identifiers of the
+        dependencies resolving to package_id, suitable for an "IN ( )"
+        clause, or None if there are none.
+        """
+        if self._isReverseDependenciesTableValid():
+            table = self._REVERSE_DEPENDENCIES_TABLE
+            cur = self._cursor().execute("""
+            SELECT 1 FROM %s WHERE idpackage = ? LIMIT 1
+            """ % (table,), (package_id,))
+            if cur.fetchone() is None:
+                return None
+            return "SELECT iddependency FROM %s WHERE idpackage = %d" % (
+                table, package_id,)
+
+        cached = self._getLiveCache("reverseDependenciesIndex")
+        if cached is None:
+            cached = self._generateReverseDependenciesIndex()
+        dep_ids = cached.get(package_id)
+        # avoid python3.x memleak
+        del cached
+        if not dep_ids:
+            return None
+        return ', '.join((str(x) for x in dep_ids))
 
     def moveSpmUidsToBranch(self, to_branch):
         """
@@ -513,7 +513,8 @@ class EntropySQLiteRepository(EntropySQLRepository):
         if self.__cur_mtime != mtime:
             self.__cur_mtime = mtime
             self._discardLiveCache()
-        return self._live_cacher.get(self._getLiveCacheKey() + key)
+        prefix = self._getLiveCacheKey()
+        return self._live_cacher.get(prefix + key, prefix = prefix)
 
     def _get_reslock(self, mode):
         """
@@ -817,9 +818,10 @@ class EntropySQLiteRepository(EntropySQLRepository):
         We must handle _baseinfo_extrainfo_2010 and live cache.
         """
         if self._isBaseinfoExtrainfo2010():
-            self._cursor().execute("""
-            UPDATE baseinfo SET category = (?) WHERE idpackage = (?)
-            """, (category, package_id,))
+            with self._trackIncrementalChecksum(package_id):
+                self._cursor().execute("""
+                UPDATE baseinfo SET category = (?) WHERE idpackage = (?)
+                """, (category, package_id,))
         else:
             # create new category if it doesn't exist
             catid = self._isCategoryAvailable(category)
@@ -1732,6 +1734,54 @@ class EntropySQLiteRepository(EntropySQLRepository):
         del cached
         return obj
 
+    def searchKeySlotMatches(self, repository):
+        """
+        Reimplemented from EntropyRepositoryBase.
+        The repository database file is ATTACHed to the connection of this
+        repository and both the baseinfo tables are joined in a single
+        query. None is returned if repository is not an
+        EntropySQLiteRepository stored on disk, if any of the two uses the
+        pre-2010 schema or if the database cannot be attached (for
+        example, because a transaction is in progress).
+        """
+        if not isinstance(repository, EntropySQLiteRepository):
+            return None
+        if self._is_memory() or repository._is_memory():
+            return None
+        if not (self._isBaseinfoExtrainfo2010() and \
+                    repository._isBaseinfoExtrainfo2010()):
+            return None
+
+        cursor = self._cursor()
+        try:
+            cursor.execute("ATTACH DATABASE ? AS attached",
+                           (repository._db,))
+        except (OperationalError, DatabaseError) as err:
+            const_debug_write(
+                __name__,
+                "searchKeySlotMatches: cannot attach %s: %s" % (
+                    repository._db, repr(err),))
+            return None
+
+        try:
+            cur = cursor.execute("""
+            SELECT inst.idpackage, inst_extra.digest, avail.idpackage,
+                avail.version, avail.versiontag, avail.revision,
+                avail_extra.digest
+            FROM main.baseinfo AS inst
+            JOIN attached.baseinfo AS avail
+                ON avail.name = inst.name
+                AND avail.category = inst.category
+                AND avail.slot = inst.slot
+            LEFT JOIN main.extrainfo AS inst_extra
+                ON inst_extra.idpackage = inst.idpackage
+            LEFT JOIN attached.extrainfo AS avail_extra
+                ON avail_extra.idpackage = avail.idpackage
+            """)
+            return cur.fetchall()
+        finally:
+            cursor.execute("DETACH DATABASE attached")
+
     def searchSets(self, keyword):
         """
         Reimplemented from EntropySQLRepository.
@@ -2060,7 +2110,8 @@ class EntropySQLiteRepository(EntropySQLRepository):
         """
         Reimplemented from EntropyRepositoryBase.
         """
-        exclude_tables = []
+        # derived data, regenerated locally
+        exclude_tables = [self._REVERSE_DEPENDENCIES_TABLE]
         gentle_with_tables = True
         toraw = const_convert_to_rawstring
 
@@ -2096,6 +2147,9 @@ class EntropySQLiteRepository(EntropySQLRepository):
             q = "SELECT 'INSERT INTO \"%(tbl_name)s\" VALUES("
             q += ", ".join(["'||quote(" + x + ")||'" for x in cols])
             q += ")' FROM '%(tbl_name)s'"
+            if name == "settings":
+                q += " WHERE setting_name != '%s'" % (
+                    self._REVERSE_DEPENDENCIES_SETTING,)
             self._connection().unicode()
             cur3 = self._cursor().execute(q % {'tbl_name': name})
             for row in cur3:
@@ -15,6 +15,7 @@
 import re
 from entropy.exceptions import InvalidAtom, EntropyException
 from entropy.const import etpConst, const_cmp
+from entropy.misc import LRUCache
 
 # Imported from Gentoo portage_dep.py
 # Copyright 1999-2010 Gentoo Foundation
@@ -315,6 +316,8 @@ def remove_usedeps(depend):
     @return: 
     @rtype: 
     """
+    if "[" not in depend and "]" not in depend:
+        return depend
     new_depend = ""
     skip = 0
     for char in depend:
@@ -502,122 +505,109 @@ def remove_package_operators(atom):
     """
     return atom.lstrip("><=~")
 
-def compare_versions(ver1, ver2):
-    """
-    docstring_title
-
-    @param ver1: 
-    @type ver1: 
-    @param ver2: 
-    @type ver2: 
-    @return: 
-    @rtype: 
-    """
-    if ver1 == ver2:
-        return 0
-    match1 = None
-    match2 = None
-    if ver1:
-        match1 = ver_regexp.match(ver1)
-    if ver2:
-        match2 = ver_regexp.match(ver2)
-
-    # checking that the versions are valid
-    invalid = False
-    invalid_rc = 0
-    if not match1:
-        invalid = True
-    elif not match1.groups():
-        invalid = True
-    elif not match2:
-        invalid_rc = 1
-        invalid = True
-    elif not match2.groups():
-        invalid_rc = 1
-        invalid = True
-    if invalid:
-        return invalid_rc
-
-    # building lists of the version parts before the suffix
-    # first part is simple
-    list1 = [int(match1.group(2))]
-    list2 = [int(match2.group(2))]
-
-    # this part would greatly benefit from a fixed-length version pattern
-    if len(match1.group(3)) or len(match2.group(3)):
-        vlist1 = match1.group(3)[1:].split(".")
-        vlist2 = match2.group(3)[1:].split(".")
-        for i in range(0, max(len(vlist1), len(vlist2))):
-            # Implcit .0 is given a value of -1, so that 1.0.0 > 1.0, since it
-            # would be ambiguous if two versions that aren't literally equal
-            # are given the same value (in sorting, for example).
-            if len(vlist1) <= i or len(vlist1[i]) == 0:
-                list1.append(-1)
-                list2.append(int(vlist2[i]))
-            elif len(vlist2) <= i or len(vlist2[i]) == 0:
-                list1.append(int(vlist1[i]))
-                list2.append(-1)
-            # Let's make life easy and use integers unless we're forced to use floats
-            elif (vlist1[i][0] != "0" and vlist2[i][0] != "0"):
-                list1.append(int(vlist1[i]))
-                list2.append(int(vlist2[i]))
-            # now we have to use floats so 1.02 compares correctly against 1.1
+# version_key() memo, bounded to keep memory usage under control
+# in long running processes.
+_VERSION_KEY_CACHE = LRUCache(32768)
+# invalid versions sort before any valid one.
+_INVALID_VERSION_KEY = (0,)
+# "_p" and "_p0" suffixes, also used to pad the shorter suffix list.
+_NULL_SUFFIX = (0, 0)
+_SUFFIX_KEY_END = (0,)
+
+def _version_key(ver):
+    if not ver:
+        return _INVALID_VERSION_KEY
+    match = ver_regexp.match(ver)
+    if not match or not match.groups():
+        return _INVALID_VERSION_KEY
+
+    # Version components starting with "0" are compared as floats
+    # ("0." + component) so that 1.02 < 1.1. Such floats are always
+    # lower than 0.1, thus they sort before any other component.
+    # Implicit .0 components sort before explicit ones, so that
+    # 1.0.0 > 1.0, which is what a shorter tuple does.
+    components = []
+    if match.group(3):
+        for component in match.group(3)[1:].split("."):
+            if component[0] == "0":
+                components.append((0, float("0." + component)))
             else:
-                list1.append(float("0."+vlist1[i]))
-                list2.append(float("0."+vlist2[i]))
+                components.append((1, int(component)))
 
-    # and now the final letter
-    if len(match1.group(5)):
-        list1.append(ord(match1.group(5)))
-    if len(match2.group(5)):
-        list2.append(ord(match2.group(5)))
+    letter = match.group(5)
+    if letter:
+        letter = ord(letter)
+    else:
+        letter = -1
+
+    # Suffix lists are implicitly padded with "_p0" entries, which
+    # cannot be expressed with plain tuple comparison. Every suffix
+    # different from "_p0" is then stored with the number of "_p0"
+    # entries preceding it and with the direction it compares to
+    # "_p0", the list end marker compares like the padding.
+    suffixes = []
+    nulls = 0
+    for suffix in match.group(6).split("_")[1:]:
+        name, number = suffix_regexp.match(suffix).groups()
+        if number:
+            number = int(number)
+        else:
+            number = 0
+        entry = (suffix_value[name], number)
+        if entry == _NULL_SUFFIX:
+            nulls += 1
+            continue
+        if entry > _NULL_SUFFIX:
+            direction = 1
+        else:
+            direction = -1
+        suffixes.append((direction, -direction * nulls, entry))
+        nulls = 0
+    suffixes.append(_SUFFIX_KEY_END)
+
+    revision = match.group(10)
+    if revision:
+        revision = int(revision)
+    else:
+        revision = 0
 
-    for i in range(0, max(len(list1), len(list2))):
-        if len(list1) <= i:
-            return -1
-        elif len(list2) <= i:
-            return 1
-        elif list1[i] != list2[i]:
-            return list1[i] - list2[i]
+    return (1, int(match.group(2)), tuple(components), letter,
+            tuple(suffixes), revision)
 
-    # main version is equal, so now compare the _suffix part
-    list1 = match1.group(6).split("_")[1:]
-    list2 = match2.group(6).split("_")[1:]
+def version_key(ver):
+    """
+    Return a sort key for the given package version string, to be used
+    with sorted(), list.sort(), min() and max().
+    Keys sort like compare_versions() does and are memoized in a bounded
+    LRU cache.
 
-    for i in range(0, max(len(list1), len(list2))):
-        if len(list1) <= i:
-            s1 = ("p", "0")
-        else:
-            s1 = suffix_regexp.match(list1[i]).groups()
-        if len(list2) <= i:
-            s2 = ("p", "0")
-        else:
-            s2 = suffix_regexp.match(list2[i]).groups()
-        if s1[0] != s2[0]:
-            return suffix_value[s1[0]] - suffix_value[s2[0]]
-        if s1[1] != s2[1]:
-            # it's possible that the s(1|2)[1] == ''
-            # in such a case, fudge it.
-            try:
-                r1 = int(s1[1])
-            except ValueError:
-                r1 = 0
-            try:
-                r2 = int(s2[1])
-            except ValueError:
-                r2 = 0
-            return r1 - r2
+    @param ver: package version (for example: "1.2.3_rc1-r2")
+    @type ver: string
+    @return: the version sort key
+    @rtype: tuple
+    """
+    key = _VERSION_KEY_CACHE.get(ver)
+    if key is None:
+        key = _version_key(ver)
+        _VERSION_KEY_CACHE.set(ver, key)
+    return key
 
-    # the suffix part is equal to, so finally check the revision
-    if match1.group(10):
-        r1 = int(match1.group(10))
-    else:
-        r1 = 0
-    if match2.group(10):
-        r2 = int(match2.group(10))
-    else:
-        r2 = 0
-    return r1 - r2
+def compare_versions(ver1, ver2):
+    """
+    Compare two package version strings.
+
+    @param ver1: package version
+    @type ver1: string
+    @param ver2: package version
+    @type ver2: string
+    @return: a negative number if ver1 < ver2, zero if ver1 == ver2,
+        a positive number if ver1 > ver2. Invalid versions are lower
+        than valid ones.
+    @rtype: int
+    """
+    if ver1 == ver2:
+        return 0
+    return const_cmp(version_key(ver1), version_key(ver2))
 
 tag_regexp = re.compile("^([A-Za-z0-9+_.-]+)?$")
 def is_valid_package_tag(tag):
@@ -712,6 +702,21 @@ def entropy_compare_versions(ver_data, ver_data2):
 
     return rc
 
+def entropy_version_key(ver_data):
+    """
+    Return a sort key for the given [version, tag, revision] list, to
+    be used with sorted(). Keys sort like entropy_compare_versions()
+    does as long as the compared items are either all tagged or all
+    non-tagged, entropy_compare_versions() is not a total order otherwise.
+
+    @param ver_data: [version, tag, revision] list
+    @type ver_data: list or tuple
+    @return: the sort key
+    @rtype: tuple
+    """
+    ver, tag, rev = ver_data
+    return (tuple(_nat_sort_key(tag)), version_key(ver), rev)
+
 def get_newer_version(versions):
     """
     Return a sorted list of versions
@@ -721,7 +726,7 @@ def get_newer_version(versions):
     @return: sorted version list
     @rtype: list
     """
-    return _generic_sorter(versions, compare_versions)
+    return sorted(versions, key = version_key, reverse = True)
 
 def get_entropy_newer_version(versions):
     """
@@ -732,7 +737,11 @@ def get_entropy_newer_version(versions):
     @return: sorted list
     @rtype: list
     """
-    return _generic_sorter(versions, entropy_compare_versions)
+    tagged = [bool(tag) for ver, tag, rev in versions]
+    if any(tagged) and not all(tagged):
+        # mixing tagged and non-tagged versions, cannot use a sort key.
+        return _generic_sorter(versions, entropy_compare_versions)
+    return sorted(versions, key = entropy_version_key, reverse = True)
 
 sha1_re = re.compile(r"(.*)\.([a-f\d]{40})(.*)")
 def get_entropy_package_sha1(package_name):
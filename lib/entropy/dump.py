@@ -21,11 +21,18 @@
     they must be "pickable". Please read Python Library reference for
     more information.
 
+    Serialized data is framed by a small versioned header that records
+    the codec (compression) and the pickle protocol used, see
+    serialize_string(). Headerless data written by older versions is
+    still readable.
+
 """
 
 import sys
 import os
+import struct
 import time
+import zlib
 
 from entropy.const import etpConst, const_setup_file, const_is_python3, \
     const_mkstemp
@@ -40,6 +47,21 @@ else:
     except ImportError:
         import pickle
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+# pickle protocol used by framed data, this is the highest protocol
+# that both Python 2 and Python 3 are able to read.
+_PICKLE_HIGHEST_PROTOCOL = pickle.HIGHEST_PROTOCOL
+PICKLE_PROTOCOL = min(2, _PICKLE_HIGHEST_PROTOCOL)
+
 pickle.HIGHEST_PROTOCOL = COMPAT_PICKLE_PROTOCOL
 pickle.DEFAULT_PROTOCOL = COMPAT_PICKLE_PROTOCOL
 
@@ -49,6 +71,162 @@ E_GID = etpConst['entropygid']
 if E_GID == None:
     E_GID = 0
 
+# framed data header: magic, format version, codec id, pickle protocol.
+# 0xe7 is not a valid pickle opcode, so legacy data is never
+# mistaken for framed data.
+D_MAGIC = b"\xe7ETP"
+D_FORMAT_VERSION = 1
+_HEADER_FMT = "4sBBB"
+_HEADER_LEN = struct.calcsize(_HEADER_FMT)
+# smaller payloads are not compressed by the default codec
+_COMPRESS_MIN_SIZE = 1024
+
+
+class DumpCodec(object):
+    """
+    Base class of the serialized data compression codecs.
+    """
+
+    # unique codec identifier, stored into the framed data header
+    ID = None
+    # codec name, as accepted by set_default_codec()
+    NAME = None
+
+    @classmethod
+    def available(cls):
+        """
+        Return whether the codec can be used on this system.
+        """
+        return True
+
+    def compress(self, data):
+        """
+        Compress data.
+
+        @param data: raw data
+        @type data: bytes
+        @return: compressed data
+        @rtype: bytes
+        """
+        raise NotImplementedError()
+
+    def decompress(self, data):
+        """
+        Decompress data.
+
+        @param data: compressed data
+        @type data: bytes
+        @return: raw data
+        @rtype: bytes
+        """
+        raise NotImplementedError()
+
+
+class _NoneCodec(DumpCodec):
+
+    ID = 0
+    NAME = "none"
+
+    def compress(self, data):
+        return data
+
+    def decompress(self, data):
+        return data
+
+
+class _ZlibCodec(DumpCodec):
+
+    ID = 1
+    NAME = "zlib"
+
+    def compress(self, data):
+        return zlib.compress(data, 1)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+
+class _Lz4Codec(DumpCodec):
+
+    ID = 2
+    NAME = "lz4"
+
+    @classmethod
+    def available(cls):
+        return lz4_frame is not None
+
+    def compress(self, data):
+        return lz4_frame.compress(data)
+
+    def decompress(self, data):
+        return lz4_frame.decompress(data)
+
+
+class _ZstdCodec(DumpCodec):
+
+    ID = 3
+    NAME = "zstd"
+
+    @classmethod
+    def available(cls):
+        return zstandard is not None
+
+    def compress(self, data):
+        return zstandard.ZstdCompressor(level = 3).compress(data)
+
+    def decompress(self, data):
+        return zstandard.ZstdDecompressor().decompress(data)
+
+
+# ordered by preference
+_CODECS = [_ZstdCodec(), _Lz4Codec(), _ZlibCodec(), _NoneCodec()]
+_CODECS_BY_ID = dict((x.ID, x) for x in _CODECS)
+_CODECS_BY_NAME = dict((x.NAME, x) for x in _CODECS)
+
+
+def available_codecs():
+    """
+    Return the names of the codecs usable on this system, ordered
+    by preference.
+
+    @return: list of codec names
+    @rtype: list
+    """
+    return [x.NAME for x in _CODECS if x.available()]
+
+
+def set_default_codec(name):
+    """
+    Set the codec used by default to serialize objects.
+
+    @param name: codec name, see available_codecs()
+    @type name: string
+    @raise ValueError: if the codec is not available
+    """
+    global _DEFAULT_CODEC
+    codec = _CODECS_BY_NAME.get(name)
+    if codec is None or not codec.available():
+        raise ValueError("codec %s is not available" % (name,))
+    _DEFAULT_CODEC = codec
+
+
+def get_default_codec():
+    """
+    Return the name of the codec used by default to serialize objects.
+
+    @return: codec name
+    @rtype: string
+    """
+    return _DEFAULT_CODEC.NAME
+
+
+_DEFAULT_CODEC = _CODECS_BY_NAME[available_codecs()[0]]
+if os.getenv("ETP_DUMP_CODEC"):
+    try:
+        set_default_codec(os.getenv("ETP_DUMP_CODEC"))
+    except ValueError:
+        pass
+
 
 def dumpobj(name, my_object, complete_path = False, ignore_exceptions = True,
     dump_dir = None, custom_permissions = None):
@@ -114,11 +292,7 @@ def dumpobj(name, my_object, complete_path = False, ignore_exceptions = True,
             # is causing EBADF. There is probably a race
             # condition down in the stack.
             with open(tmp_dmpfile, "wb") as dmp_f:
-                if const_is_python3():
-                    pickle.dump(my_object, dmp_f,
-                        protocol = COMPAT_PICKLE_PROTOCOL, fix_imports = True)
-                else:
-                    pickle.dump(my_object, dmp_f)
+                dmp_f.write(serialize_string(my_object))
 
             const_setup_file(tmp_dmpfile, E_GID, custom_permissions)
             os.rename(tmp_dmpfile, dmpfile)
@@ -144,7 +318,7 @@ def dumpobj(name, my_object, complete_path = False, ignore_exceptions = True,
                     pass
         break
 
-def serialize(myobj, ser_f, do_seek = True):
+def serialize(myobj, ser_f, do_seek = True, codec = None):
     """
     Serialize object to ser_f (file)
 
@@ -155,6 +329,9 @@ def serialize(myobj, ser_f, do_seek = True):
     @keyword do_seek: move file cursor back to the beginning
         of ser_f
     @type do_seek: bool
+    @keyword codec: codec name, see available_codecs(), if None the
+        default codec is used
+    @type codec: string
     @return: file object where data has been written
     @rtype: file object
     @raise RuntimeError: caused by pickle.dump in case of
@@ -165,11 +342,7 @@ def serialize(myobj, ser_f, do_seek = True):
         race conditions on multi-processing or multi-threading
     @raise pickle.PicklingError: when object cannot be recreated
     """
-    if const_is_python3():
-        pickle.dump(myobj, ser_f, protocol = COMPAT_PICKLE_PROTOCOL,
-            fix_imports = True)
-    else:
-        pickle.dump(myobj, ser_f)
+    ser_f.write(serialize_string(myobj, codec = codec))
     ser_f.flush()
     if do_seek:
         ser_f.seek(0)
@@ -184,44 +357,79 @@ def unserialize(serial_f):
     @return: rebuilt object
     @rtype: any Python pickable object
     @raise pickle.UnpicklingError: when object cannot be recreated
+    @raise ValueError: when the framed data is not supported
     """
-    if const_is_python3():
-        return pickle.load(serial_f, fix_imports = True,
-            encoding = etpConst['conf_raw_encoding'])
-    else:
-        return pickle.load(serial_f)
+    return unserialize_string(serial_f.read())
 
 def unserialize_string(mystring):
     """
-    Unserialize pickle string to object
+    Unserialize pickle string to object. Both framed and legacy
+    (headerless) data are supported.
 
     @param mystring: data stream in string form to reconstruct
     @type mystring: string
     @return: reconstructed object
     @rtype: any Python pickable object
     @raise pickle.UnpicklingError: when object cannot be recreated
+    @raise ValueError: when the framed data is not supported
     """
+    if mystring[:len(D_MAGIC)] == D_MAGIC:
+        if len(mystring) < _HEADER_LEN:
+            raise ValueError("truncated header")
+        _magic, version, codec_id, protocol = struct.unpack(
+            _HEADER_FMT, mystring[:_HEADER_LEN])
+        if version > D_FORMAT_VERSION:
+            raise ValueError("unsupported format version %d" % (version,))
+        codec = _CODECS_BY_ID.get(codec_id)
+        if codec is None or not codec.available():
+            raise ValueError("unsupported codec %d" % (codec_id,))
+        if protocol > _PICKLE_HIGHEST_PROTOCOL:
+            raise ValueError("unsupported pickle protocol %d" % (protocol,))
+        try:
+            mystring = codec.decompress(mystring[_HEADER_LEN:])
+        except Exception as err:
+            # codec libraries raise their own exception types
+            raise ValueError("cannot decompress data: %s" % (err,))
+
     if const_is_python3():
         return pickle.loads(mystring, fix_imports = True,
             encoding = etpConst['conf_raw_encoding'])
     else:
         return pickle.loads(mystring)
 
-def serialize_string(myobj):
+def serialize_string(myobj, codec = None):
     """
-    Serialize object to string
+    Serialize object to string. The returned data is framed by a header
+    recording the codec and the pickle protocol used.
 
     @param myobj: object to serialize
     @type myobj: any Python picklable object
+    @keyword codec: codec name, see available_codecs(), if None the
+        default codec is used (small objects are not compressed)
+    @type codec: string
     @return: serialized string
     @rtype: string
     @raise pickle.PicklingError: when object cannot be recreated
+    @raise ValueError: if the codec is not available
     """
+    if codec is None:
+        dump_codec = _DEFAULT_CODEC
+    else:
+        dump_codec = _CODECS_BY_NAME.get(codec)
+        if dump_codec is None or not dump_codec.available():
+            raise ValueError("codec %s is not available" % (codec,))
+
     if const_is_python3():
-        return pickle.dumps(myobj, protocol = COMPAT_PICKLE_PROTOCOL,
-            fix_imports = True, encoding = etpConst['conf_raw_encoding'])
+        data = pickle.dumps(myobj, protocol = PICKLE_PROTOCOL,
+            fix_imports = True)
     else:
-        return pickle.dumps(myobj)
+        data = pickle.dumps(myobj, PICKLE_PROTOCOL)
+    if codec is None and len(data) < _COMPRESS_MIN_SIZE:
+        # not worth it
+        dump_codec = _CODECS_BY_NAME["none"]
+    header = struct.pack(_HEADER_FMT, D_MAGIC, D_FORMAT_VERSION,
+        dump_codec.ID, PICKLE_PROTOCOL)
+    return header + dump_codec.compress(data)
 
 def loadobj(name, complete_path = False, dump_dir = None, aging_days = None):
     """
@@ -269,11 +477,7 @@ def loadobj(name, complete_path = False, dump_dir = None, aging_days = None):
             with open(dmpfile, "rb") as dmp_f:
                 obj = None
                 try:
-                    if const_is_python3():
-                        obj = pickle.load(dmp_f, fix_imports = True,
-                            encoding = etpConst['conf_raw_encoding'])
-                    else:
-                        obj = pickle.load(dmp_f)
+                    obj = unserialize(dmp_f)
                 except (ValueError, EOFError, IOError,
                     OSError, pickle.UnpicklingError, TypeError,
                     AttributeError, ImportError, SystemError,):
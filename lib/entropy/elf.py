@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+"""
+
+    @author: Fabio Erculiani <lxnay@sabayon.org>
+    @contact: lxnay@sabayon.org
+    @copyright: Fabio Erculiani
+    @license: GPL-2
+
+    B{Entropy ELF object reader module}.
+
+    This module contains a pure-Python, mmap-based ELF reader that is
+    able to extract the dynamic linking metadata (ELF class, SONAME,
+    NEEDED, RPATH, RUNPATH and program interpreter) from ELF objects
+    without spawning external tools like scanelf or lddtree.
+
+    Both 32bit and 64bit, little and big endian ELF objects are supported.
+
+"""
+import errno
+import mmap
+import os
+import struct
+
+from entropy.const import const_is_python3, const_convert_to_unicode
+from entropy.exceptions import EntropyException
+
+ELF_MAGIC = b"\x7fELF"
+
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+
+ELFDATA2LSB = 1
+ELFDATA2MSB = 2
+
+_SHT_DYNAMIC = 6
+_PT_LOAD = 1
+_PT_DYNAMIC = 2
+_PT_INTERP = 3
+
+_DT_NULL = 0
+_DT_NEEDED = 1
+_DT_STRTAB = 5
+_DT_SONAME = 14
+_DT_RPATH = 15
+_DT_RUNPATH = 29
+
+# struct layouts, indexed by ELF class. The endianness prefix
+# is added at runtime.
+_EHDR_FMT = {
+    # e_type, e_machine, e_version, e_entry, e_phoff, e_shoff, e_flags,
+    # e_ehsize, e_phentsize, e_phnum, e_shentsize, e_shnum, e_shstrndx
+    ELFCLASS32: "HHIIIIIHHHHHH",
+    ELFCLASS64: "HHIQQQIHHHHHH",
+}
+_PHDR_FMT = {
+    # p_type, p_offset, p_vaddr, p_paddr, p_filesz, p_memsz, p_flags, p_align
+    ELFCLASS32: "IIIIIIII",
+    # p_type, p_flags, p_offset, p_vaddr, p_paddr, p_filesz, p_memsz, p_align
+    ELFCLASS64: "IIQQQQQQ",
+}
+_SHDR_FMT = {
+    # sh_name, sh_type, sh_flags, sh_addr, sh_offset, sh_size, sh_link,
+    # sh_info, sh_addralign, sh_entsize
+    ELFCLASS32: "IIIIIIIIII",
+    ELFCLASS64: "IIQQQQIIQQ",
+}
+_DYN_FMT = {
+    ELFCLASS32: "iI",
+    ELFCLASS64: "qQ",
+}
+_EHDR_OFFSET = 16
+
+
+class ElfError(EntropyException):
+    """
+    Raised when an ELF object is truncated or malformed.
+    """
+
+
+class _ElfReader(object):
+
+    """
+    Low level ELF reader working on top of a memory mapped file.
+    """
+
+    def __init__(self, buf):
+        self._buf = buf
+        self._size = len(buf)
+
+        self.elf_class = struct.unpack_from("B", buf, 4)[0]
+        self.elf_data = struct.unpack_from("B", buf, 5)[0]
+        if self.elf_class not in (ELFCLASS32, ELFCLASS64):
+            raise ElfError("unsupported ELF class %d" % (self.elf_class,))
+        if self.elf_data == ELFDATA2LSB:
+            self._endian = "<"
+        elif self.elf_data == ELFDATA2MSB:
+            self._endian = ">"
+        else:
+            raise ElfError("unsupported ELF data encoding %d" % (
+                self.elf_data,))
+
+        (self.e_type, self.e_machine, _version, _entry, self._phoff,
+         self._shoff, _flags, _ehsize, self._phentsize, self._phnum,
+         self._shentsize, self._shnum, _shstrndx) = self._unpack(
+            _EHDR_FMT[self.elf_class], _EHDR_OFFSET)
+
+    def _unpack(self, fmt, offset):
+        fmt = self._endian + fmt
+        if offset < 0 or offset + struct.calcsize(fmt) > self._size:
+            raise ElfError("truncated ELF object")
+        return struct.unpack_from(fmt, self._buf, offset)
+
+    def _string(self, offset):
+        """
+        Read a NUL terminated string starting at given file offset.
+        """
+        if offset < 0 or offset >= self._size:
+            raise ElfError("string offset out of bounds")
+        end = self._buf.find(b"\0", offset)
+        if end == -1:
+            end = self._size
+        data = self._buf[offset:end]
+        if const_is_python3():
+            data = const_convert_to_unicode(data)
+        return data
+
+    def program_headers(self):
+        """
+        Return the list of program headers as
+        (p_type, p_offset, p_vaddr, p_filesz) tuples.
+        """
+        headers = []
+        if not self._phoff:
+            return headers
+        fmt = _PHDR_FMT[self.elf_class]
+        for idx in range(self._phnum):
+            fields = self._unpack(fmt, self._phoff + idx * self._phentsize)
+            if self.elf_class == ELFCLASS32:
+                p_type, p_offset, p_vaddr, _p, p_filesz = fields[:5]
+            else:
+                p_type, _f, p_offset, p_vaddr, _p, p_filesz = fields[:6]
+            headers.append((p_type, p_offset, p_vaddr, p_filesz))
+        return headers
+
+    def section_headers(self):
+        """
+        Return the list of section headers as
+        (sh_type, sh_offset, sh_size, sh_link) tuples.
+        """
+        headers = []
+        if not self._shoff:
+            return headers
+        fmt = _SHDR_FMT[self.elf_class]
+        for idx in range(self._shnum):
+            fields = self._unpack(fmt, self._shoff + idx * self._shentsize)
+            headers.append((fields[1], fields[4], fields[5], fields[6]))
+        return headers
+
+    def _vaddr_to_offset(self, vaddr, program_headers):
+        for p_type, p_offset, p_vaddr, p_filesz in program_headers:
+            if p_type != _PT_LOAD:
+                continue
+            if p_vaddr <= vaddr < p_vaddr + p_filesz:
+                return vaddr - p_vaddr + p_offset
+        return None
+
+    def _dynamic_entries(self, offset, size):
+        fmt = _DYN_FMT[self.elf_class]
+        entsize = struct.calcsize(fmt)
+        entries = []
+        for idx in range(size // entsize):
+            tag, val = self._unpack(fmt, offset + idx * entsize)
+            if tag == _DT_NULL:
+                break
+            entries.append((tag, val))
+        return entries
+
+    def interpreter(self, program_headers):
+        for p_type, p_offset, _vaddr, _filesz in program_headers:
+            if p_type == _PT_INTERP:
+                return self._string(p_offset)
+        return None
+
+    def dynamic(self, program_headers):
+        """
+        Return the dynamic section entries and the file offset of
+        the dynamic string table, or (None, None) if the object has
+        no dynamic section (static binaries, relocatable objects).
+        """
+        sections = self.section_headers()
+        for sh_type, sh_offset, sh_size, sh_link in sections:
+            if sh_type != _SHT_DYNAMIC:
+                continue
+            entries = self._dynamic_entries(sh_offset, sh_size)
+            if sh_link < len(sections):
+                return entries, sections[sh_link][1]
+            break
+
+        # stripped section headers, fallback to program headers and
+        # resolve DT_STRTAB through the PT_LOAD segments.
+        for p_type, p_offset, _vaddr, p_filesz in program_headers:
+            if p_type != _PT_DYNAMIC:
+                continue
+            entries = self._dynamic_entries(p_offset, p_filesz)
+            for tag, val in entries:
+                if tag == _DT_STRTAB:
+                    return entries, self._vaddr_to_offset(
+                        val, program_headers)
+            return entries, None
+
+        return None, None
+
+    def metadata(self):
+        phdrs = self.program_headers()
+        entries, strtab = self.dynamic(phdrs)
+        if entries is None:
+            return None
+
+        soname = ""
+        needed = []
+        rpath = []
+        runpath = []
+        for tag, val in entries:
+            if tag not in (_DT_NEEDED, _DT_SONAME, _DT_RPATH, _DT_RUNPATH):
+                continue
+            if strtab is None:
+                raise ElfError("cannot locate the dynamic string table")
+            value = self._string(strtab + val)
+            if tag == _DT_NEEDED:
+                needed.append(value)
+            elif tag == _DT_SONAME:
+                soname = value
+            elif tag == _DT_RPATH:
+                rpath.append(value)
+            else:
+                runpath.append(value)
+
+        return {
+            'class': self.elf_class,
+            'data': self.elf_data,
+            'machine': self.e_machine,
+            'type': self.e_type,
+            'interpreter': self.interpreter(phdrs),
+            'soname': soname,
+            'needed': needed,
+            'rpath': ":".join(rpath),
+            'runpath': ":".join(runpath),
+        }
+
+
+def read_metadata(elf_file):
+    """
+    Read the dynamic linking metadata of an ELF object.
+
+    The returned dict contains the following keys:
+     - "class": the ELF class (ELFCLASS32 or ELFCLASS64)
+     - "data": the ELF data encoding (ELFDATA2LSB or ELFDATA2MSB)
+     - "machine": the e_machine value
+     - "type": the e_type value
+     - "interpreter": the PT_INTERP path or None
+     - "soname": the DT_SONAME string (empty if not set)
+     - "needed": the ordered list of DT_NEEDED strings
+     - "rpath": the DT_RPATH string (colon separated, empty if not set)
+     - "runpath": the DT_RUNPATH string (colon separated, empty if not set)
+
+    @param elf_file: path to ELF file
+    @type elf_file: string
+    @return: the metadata dict or None if the file is not an ELF object
+        or it has no dynamic section
+    @rtype: dict or None
+    @raise IOError: if the file cannot be read
+    @raise ElfError: if the ELF object is malformed
+    """
+    with open(elf_file, "rb") as elf_f:
+        try:
+            size = os.fstat(elf_f.fileno()).st_size
+        except OSError as err:
+            raise IOError(err.errno, err.strerror)
+        if size < _EHDR_OFFSET + struct.calcsize("<" + _EHDR_FMT[ELFCLASS32]):
+            return None
+        if elf_f.read(len(ELF_MAGIC)) != ELF_MAGIC:
+            return None
+
+        buf = mmap.mmap(elf_f.fileno(), 0, access = mmap.ACCESS_READ)
+        try:
+            return _ElfReader(buf).metadata()
+        finally:
+            buf.close()
+
+
+def read_metadata_many(elf_files):
+    """
+    Batch version of read_metadata(). Files that cannot be read or
+    are not valid ELF objects are mapped to None.
+
+    @param elf_files: list of paths to ELF files
+    @type elf_files: iterable
+    @return: dict mapping each path to its metadata dict (or None)
+    @rtype: dict
+    """
+    outcome = {}
+    for elf_file in elf_files:
+        if elf_file in outcome:
+            continue
+        try:
+            outcome[elf_file] = read_metadata(elf_file)
+        except (IOError, OSError) as err:
+            if err.errno not in (errno.ENOENT, errno.EACCES, errno.EISDIR,
+                                 errno.ENOTDIR, errno.ELOOP):
+                raise
+            outcome[elf_file] = None
+        except ElfError:
+            outcome[elf_file] = None
+    return outcome
@@ -25,6 +25,7 @@ import subprocess
 import threading
 import contextlib
 import base64
+import json
 import ssl
 
 from entropy.const import const_is_python3, const_file_readable
@@ -40,13 +41,16 @@ from entropy.exceptions import InterruptError
 from entropy.tools import print_traceback, \
     convert_seconds_to_fancy_output, bytes_into_human, spliturl, \
     add_proxy_opener, md5sum
-from entropy.const import etpConst, const_isfileobj, const_debug_write
+from entropy.const import etpConst, const_isfileobj, const_debug_write, \
+    const_isstring
 from entropy.output import TextInterface, darkblue, darkred, purple, blue, \
     brown, darkgreen, red
 
 from entropy.i18n import _, ngettext
 from entropy.misc import ParallelTask
 from entropy.core.settings.base import SystemSettings
+from entropy.httppool import HTTPConnectionPool, \
+    build_opener as build_pooled_opener
 
 
 class UrlFetcher(TextInterface):
@@ -74,6 +78,20 @@ class UrlFetcher(TextInterface):
     TIMEOUT_FETCH_ERROR = "-4"
     GENERIC_FETCH_WARN = "-2"
 
+    # minimum size of a segment of a segmented download, in bytes
+    SEGMENT_MIN_SIZE = 2 * 1024 * 1024
+    # segmented download state file extension
+    SEGMENTS_STATE_EXT = ".segments"
+    # interval between segmented download state file updates, in seconds
+    _SEGMENTS_STATE_SAVE_INTERVAL = 1.0
+    # read buffer size of each segment connection
+    _SEGMENT_BUFFER_SIZE = 65536
+
+    # urllib openers using HTTPConnectionPool, keyed by https certificate
+    # validation, shared by all the instances
+    _pooled_openers = {}
+    _pooled_openers_lock = threading.Lock()
+
     def __init__(self, url, path_to_save, checksum = True,
                  show_speed = True, resume = True,
                  abort_check_func = None, disallow_redirect = False,
@@ -81,7 +99,8 @@ class UrlFetcher(TextInterface):
                  timeout = None, download_context_func = None,
                  pre_download_hook = None, post_download_hook = None,
                  http_basic_user = None, http_basic_pwd = None,
-                 https_validate_cert = True):
+                 https_validate_cert = True, stream_func = None,
+                 segments = None, mirror_urls = None):
         """
         Entropy URL downloader constructor.
 
@@ -128,6 +147,23 @@ class UrlFetcher(TextInterface):
             The function takes a path (the download path) and the download
             status and the download id as arguments.
         @type post_download_hook: callable
+        @keyword stream_func: function called with every chunk of data
+            written to path_to_save, in order, so that downloaded data can be
+            processed while being fetched. It is only called by the
+            file, http, https, ftp and ftps handlers and only when the download
+            starts from the beginning of the file (no resume).
+        @type stream_func: callable
+        @keyword segments: maximum number of HTTP Range requests used to
+            download the file in parallel. The per-segment progress is
+            saved next to path_to_save, so that interrupted downloads can
+            be resumed. Segmented downloads are only used by the http and
+            https handlers, if the server supports Range requests, the file
+            is large enough (see SEGMENT_MIN_SIZE) and stream_func is None.
+            None or 1 disable segmented downloads.
+        @type segments: int
+        @keyword mirror_urls: list of other URLs serving the same file,
+            segments are spread across url and these URLs.
+        @type mirror_urls: list
         """
         self.__supported_uris = {
             'file': self._urllib_download,
@@ -169,12 +205,16 @@ class UrlFetcher(TextInterface):
         self.__thread_stop_func = thread_stop_func
         self.__disallow_redirect = disallow_redirect
         self.__speedlimit = speed_limit # kbytes/sec
+        self.__stream_func = stream_func
+        self.__segments = segments or 1
+        self.__mirror_urls = list(mirror_urls or [])
 
         # HTTP Basic Authentication parameters
         self.__http_basic_user = http_basic_user
         self.__http_basic_pwd = http_basic_pwd
         # SSL Context options
         self.__https_validate_cert = https_validate_cert
+        self.__urllib_proxied = False
 
         self._init_vars()
         self.__init_urllib()
@@ -571,12 +611,386 @@ class UrlFetcher(TextInterface):
         else:
             # unset
             urlmod._opener = None
+        self.__urllib_proxied = bool(mydict)
+
+    @classmethod
+    def _get_pooled_opener(cls, validate_cert):
+        """
+        Return the urllib opener using persistent HTTP(S) connections
+        from HTTPConnectionPool.
+        """
+        with cls._pooled_openers_lock:
+            opener = cls._pooled_openers.get(validate_cert)
+            if opener is None:
+                ctx = None
+                if not validate_cert:
+                    ctx = ssl.create_default_context()
+                    ctx.check_hostname = False
+                    ctx.verify_mode = ssl.CERT_NONE
+                opener = build_pooled_opener(context = ctx)
+                cls._pooled_openers[validate_cert] = opener
+        return opener
+
+    def __urlopen(self, req):
+        """
+        Open the given urllib request (or URL). Persistent connections
+        are used, unless a proxy has been configured.
+        """
+        if not self.__urllib_proxied:
+            opener = self._get_pooled_opener(self.__https_validate_cert)
+            return opener.open(req, None, self.__timeout)
+
+        url = req if const_isstring(req) else req.get_full_url()
+        if UrlFetcher._get_url_protocol(url) == "https" and \
+                not self.__https_validate_cert:
+            ctx = ssl.create_default_context()
+            ctx.check_hostname = False
+            ctx.verify_mode = ssl.CERT_NONE
+            return urlmod.urlopen(req, None, self.__timeout, context=ctx)
+        return urlmod.urlopen(req, None, self.__timeout)
+
+    def __get_user_agent(self, url):
+        """
+        Return the HTTP User-Agent header value.
+        """
+        uname = os.uname()
+        return "Entropy/%s (compatible; %s; %s: %s %s %s)" % (
+            etpConst['entropyversion'],
+            "Entropy",
+            os.path.basename(url),
+            uname[0],
+            uname[4],
+            uname[2],
+        )
+
+    def __urlopen_range(self, url, start, end):
+        """
+        Open an HTTP Range request of the [start, end] (inclusive) byte range
+        of the given (encoded) URL. Return the response object and the
+        total file size, as advertised by the server.
+
+        @raise IOError: if the server does not honour the Range request
+        """
+        headers = {
+            'User-Agent': self.__get_user_agent(url),
+            'Range': "bytes=%d-%d" % (start, end),
+        }
+        if self.__http_basic_user and self.__http_basic_pwd:
+            basic_header = base64.b64encode(('%s:%s' % (
+                self.__http_basic_user, self.__http_basic_pwd)
+            ).encode('utf-8')).decode('utf-8')
+            headers['Authorization'] = 'Basic %s' % (basic_header,)
+        req = urlmod.Request(url, headers = headers)
+        remote = self.__urlopen(req)
+
+        try:
+            if remote.getcode() != 206:
+                raise IOError("Range request not supported")
+            # Content-Range: bytes <start>-<end>/<size>
+            content_range = remote.headers.get("content-range", "")
+            range_spec, _sep, size = content_range.partition("/")
+            if not range_spec.strip().startswith("bytes %d-" % (start,)):
+                raise IOError("unexpected Content-Range: %s" % (
+                    content_range,))
+            if self.__disallow_redirect and url != remote.geturl():
+                raise IOError("redirect disallowed")
+            size = int(size)
+        except (IOError, ValueError) as err:
+            remote.close()
+            raise IOError(str(err))
+        return remote, size
+
+    def __load_segments_state(self, state_path, size):
+        """
+        Load the segments of an interrupted segmented download, if its
+        state is consistent with the file being downloaded.
+        """
+        if not self.__resume:
+            return None
+        try:
+            with open(state_path, "r") as state_f:
+                state = json.load(state_f)
+            if state['size'] != size:
+                return None
+            if os.path.getsize(self.__path_to_save) != size:
+                return None
+            segments = []
+            for start, end, offset in state['segments']:
+                if not (0 <= start <= offset <= end <= size):
+                    return None
+                segments.append([start, end, offset])
+        except (OSError, IOError, ValueError, KeyError, TypeError):
+            return None
+        return segments
+
+    def __save_segments_state(self, state_path, size, segments, lock):
+        """
+        Atomically save the state of the segmented download.
+        """
+        with lock:
+            state = {
+                'size': size,
+                'segments': [list(x) for x in segments],
+            }
+        tmp_path = state_path + ".tmp"
+        try:
+            with open(tmp_path, "w") as state_f:
+                json.dump(state, state_f)
+            os.rename(tmp_path, state_path)
+        except (OSError, IOError) as err:
+            const_debug_write(
+                __name__,
+                "__save_segments_state(%s): %s" % (state_path, err,))
+
+    @staticmethod
+    def __remove_segments_state(state_path):
+        """
+        Remove the segmented download state file.
+        """
+        for path in (state_path, state_path + ".tmp"):
+            try:
+                os.remove(path)
+            except OSError as err:
+                if err.errno != errno.ENOENT:
+                    raise
+
+    def _segmented_download(self):
+        """
+        HTTP Range based downloader, fetching the file through multiple
+        connections, possibly to multiple mirrors, at the same time.
+        Return None if the download cannot be segmented.
+        """
+        urls = [self.__encode_url(self.__url)]
+        for url in self.__mirror_urls:
+            url = self.__encode_url(url)
+            if url not in urls:
+                urls.append(url)
+
+        state_path = self.__path_to_save + self.SEGMENTS_STATE_EXT
+        try:
+            remote, size = self.__urlopen_range(urls[0], 0, 0)
+            remote.close()
+        except KeyboardInterrupt:
+            raise
+        except Exception as err:
+            # not supported by the server, or any other error that the
+            # standard downloader is going to handle.
+            const_debug_write(
+                __name__,
+                "_segmented_download(%s): probe failed: %s" % (
+                    self.__url, repr(err),))
+            return None
+
+        segments = self.__load_segments_state(state_path, size)
+        prefix = 0
+        if segments is None:
+            if self.__resume and const_file_readable(self.__path_to_save):
+                # data of a previous, not segmented, download
+                prefix = os.path.getsize(self.__path_to_save)
+                if prefix == size:
+                    self.__remove_segments_state(state_path)
+                    return self.__prepare_return()
+                if prefix > size:
+                    prefix = 0
+            remaining = size - prefix
+            count = min(self.__segments, remaining // self.SEGMENT_MIN_SIZE)
+            if count < 2:
+                return None
+
+            seg_size = remaining // count
+            segments = []
+            for idx in range(count):
+                start = prefix + idx * seg_size
+                end = start + seg_size
+                if idx == count - 1:
+                    end = size
+                segments.append([start, end, start])
+
+            mode = "wb"
+            if prefix:
+                mode = "r+b"
+            with open(self.__path_to_save, mode) as local_f:
+                local_f.truncate(size)
+                if hasattr(os, "posix_fallocate"):
+                    try:
+                        os.posix_fallocate(local_f.fileno(), 0, size)
+                    except OSError:
+                        pass
+        else:
+            prefix = segments[0][0]
+
+        done = lambda: prefix + sum(x[2] - x[0] for x in segments)
+        self.__resumed = done() > 0
+        self.__startingposition = done()
+        self.__last_downloadedsize = self.__startingposition
+        self.__downloadedsize = self.__startingposition
+        self.__remotesize = float(size) / 1000
+
+        lock = threading.Lock()
+        stop = threading.Event()
+        errors = []
+
+        def _worker(idx):
+            segment = segments[idx]
+            url_idx = idx % len(urls)
+            failures = 0
+            # unbuffered, the saved state must never be ahead of the
+            # data actually written.
+            local_f = open(self.__path_to_save, "r+b", 0)
+            try:
+                while segment[2] < segment[1] and not stop.is_set():
+                    url = urls[url_idx]
+                    try:
+                        remote, _size = self.__urlopen_range(
+                            url, segment[2], segment[1] - 1)
+                    except Exception as err:
+                        remote = None
+                        error = err
+                    if remote is not None:
+                        try:
+                            error = None
+                            local_f.seek(segment[2])
+                            while segment[2] < segment[1]:
+                                if stop.is_set():
+                                    return
+                                data = remote.read(min(
+                                    self._SEGMENT_BUFFER_SIZE,
+                                    segment[1] - segment[2]))
+                                if not data:
+                                    error = IOError("short read")
+                                    break
+                                view = memoryview(data)
+                                while view:
+                                    written = local_f.write(view)
+                                    if written is None:
+                                        # Python 2, all data written
+                                        break
+                                    view = view[written:]
+                                with lock:
+                                    segment[2] += len(data)
+                                failures = 0
+                                while self.__speedlimit and \
+                                        self.__datatransfer > \
+                                        self.__speedlimit * 1000 and \
+                                        not stop.is_set():
+                                    time.sleep(0.1)
+                        except Exception as err:
+                            error = err
+                        finally:
+                            remote.close()
+                    if error is None:
+                        continue
+
+                    const_debug_write(
+                        __name__,
+                        "_segmented_download(%s): segment %d: %s" % (
+                            url, idx, repr(error),))
+                    # try the next mirror, give up when all failed
+                    failures += 1
+                    if failures >= len(urls):
+                        with lock:
+                            errors.append(error)
+                        stop.set()
+                        return
+                    url_idx = (url_idx + 1) % len(urls)
+            finally:
+                local_f.close()
+
+        threads = []
+        for idx in range(len(segments)):
+            thread = threading.Thread(target = _worker, args = (idx,))
+            thread.name = "UrlFetcherSegment-%d" % (idx,)
+            thread.daemon = True
+            threads.append(thread)
+            thread.start()
+
+        last_save = time.time()
+        try:
+            while True:
+                alive = [x for x in threads if x.is_alive()]
+                if not alive:
+                    break
+                # use a timeout, or signals are blocked on Python 2
+                alive[0].join(0.2)
+
+                if self.__abort_check_func != None:
+                    self.__abort_check_func()
+                if self.__thread_stop_func != None:
+                    self.__thread_stop_func()
+
+                with lock:
+                    self.__downloadedsize = done()
+                try:
+                    average = int(
+                        (float(self.__downloadedsize) / 1000 /
+                         self.__remotesize) * 100)
+                except ZeroDivisionError:
+                    average = 0
+                self.__average = min(average, 100)
+                self._update_speed()
+                if self.__show_speed:
+                    self.handle_statistics(self.__th_id,
+                        self.__downloadedsize, self.__remotesize,
+                        self.__average, self.__oldaverage,
+                        self.__updatestep, self.__show_speed,
+                        self.__datatransfer, self.__time_remaining,
+                        self.__time_remaining_secs
+                    )
+                    self.update()
+                    self.__oldaverage = self.__average
+
+                if time.time() - last_save > \
+                        self._SEGMENTS_STATE_SAVE_INTERVAL:
+                    self.__save_segments_state(
+                        state_path, size, segments, lock)
+                    last_save = time.time()
+        finally:
+            stop.set()
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(1.0)
+            self.__downloadedsize = done()
+            self._update_speed()
+
+            if done() < size:
+                if self.__resume:
+                    self.__save_segments_state(
+                        state_path, size, segments, lock)
+                else:
+                    self.__remove_segments_state(state_path)
+
+        if done() < size:
+            if not self.__resume:
+                try:
+                    os.remove(self.__path_to_save)
+                except OSError:
+                    pass
+            self.__status = UrlFetcher.GENERIC_FETCH_ERROR
+            for error in errors:
+                # urlopen() wraps connection timeouts into URLError
+                reason = getattr(error, "reason", error)
+                if isinstance(reason, socket.timeout):
+                    self.__status = UrlFetcher.TIMEOUT_FETCH_ERROR
+            return self.__status
+
+        self.__remove_segments_state(state_path)
+        self.__average = 100
+        return self.__prepare_return()
 
     def _urllib_download(self):
         """
         urrlib2 based downloader. This is the default for HTTP and FTP urls.
         """
         self._setup_urllib_proxy()
+
+        url_protocol = UrlFetcher._get_url_protocol(self.__url)
+        if self.__segments > 1 and self.__stream_func is None and \
+                url_protocol in ("http", "https"):
+            status = self._segmented_download()
+            if status is not None:
+                return status
+            self._init_vars()
+
         self.__setup_urllib_resume_support()
         # we're going to feed the md5 digestor on the way.
         self.__use_md5_checksum = True
@@ -618,18 +1032,7 @@ class UrlFetcher(TextInterface):
 
             # get file size if available
             try:
-                if url_protocol in ("https") and \
-                    not self.__https_validate_cert:
-
-                    ctx = ssl.create_default_context()
-                    ctx.check_hostname = False
-                    ctx.verify_mode = ssl.CERT_NONE
-
-                    self.__remotefile = urlmod.urlopen(req, None, self.__timeout,
-                            context=ctx)
-
-                else:
-                    self.__remotefile = urlmod.urlopen(req, None, self.__timeout)
+                self.__remotefile = self.__urlopen(req)
             except KeyboardInterrupt:
                 self.__urllib_close(False)
                 raise
@@ -725,8 +1128,7 @@ class UrlFetcher(TextInterface):
                     self.__remotefile.close()
                 except:
                     pass
-                self.__remotefile = urlmod.urlopen(
-                    request, None, self.__timeout)
+                self.__remotefile = self.__urlopen(request)
 
             elif self.__startingposition == self.__remotesize:
                 # all fine then!
@@ -818,6 +1220,8 @@ class UrlFetcher(TextInterface):
         # writing file buffer
         self.__localfile.write(mybuffer)
         self.__md5_checksum.update(mybuffer)
+        if self.__stream_func is not None and not self.__resumed:
+            self.__stream_func(mybuffer)
         # update progress info
         self.__downloadedsize = self.__localfile.tell()
         kbytecount = float(self.__downloadedsize)/1000
@@ -1006,6 +1410,14 @@ class UrlFetcher(TextInterface):
 
 class MultipleUrlFetcher(TextInterface):
 
+    # maximum number of concurrent downloads, the other ones wait for
+    # a free slot and then reuse the idle HTTP connections left around
+    # by the completed ones (see HTTPConnectionPool). Set through the
+    # ETP_MULTIFETCH_PARALLEL env var, 0 starts all the downloads at
+    # once (None), as older Entropy versions did.
+    MAX_PARALLEL_DOWNLOADS = max(
+        0, int(os.getenv("ETP_MULTIFETCH_PARALLEL", "4"))) or None
+
     def __init__(self, url_path_list, checksum = True,
                  show_speed = True, resume = True,
                  abort_check_func = None, disallow_redirect = False,
@@ -1092,10 +1504,21 @@ class MultipleUrlFetcher(TextInterface):
         if self.__stop_threads:
             raise InterruptError("interrupted")
 
+    def _parallel_downloads(self):
+        """
+        Return the number of downloads actually run concurrently.
+        """
+        count = len(self._url_path_list)
+        if self.MAX_PARALLEL_DOWNLOADS is not None:
+            count = min(count, self.MAX_PARALLEL_DOWNLOADS)
+        return max(1, count)
+
     def _init_vars(self):
         self._progress_data.clear()
         self._progress_data_lock = threading.Lock()
         self.__thread_pool = {}
+        self.__download_slots = threading.BoundedSemaphore(
+            self._parallel_downloads())
         self.__download_statuses = {}
         self.__show_progress = False
         self.__stop_threads = False
@@ -1139,7 +1562,7 @@ class MultipleUrlFetcher(TextInterface):
         speed_limit = 0
         dsl = self.__system_settings['repositories']['transfer_limit']
         if isinstance(dsl, int) and self._url_path_list:
-            speed_limit = dsl/len(self._url_path_list)
+            speed_limit = dsl/self._parallel_downloads()
 
         class MyFetcher(self.__url_fetcher):
 
@@ -1179,7 +1602,10 @@ class MultipleUrlFetcher(TextInterface):
             downloader.set_id(th_id)
 
             def do_download(ds, dth_id, downloader):
-                ds[dth_id] = downloader.download()
+                with self.__download_slots:
+                    if self.__stop_threads:
+                        return
+                    ds[dth_id] = downloader.download()
 
             t = ParallelTask(do_download, self.__download_statuses, th_id,
                 downloader)
@@ -1217,6 +1643,10 @@ class MultipleUrlFetcher(TextInterface):
                     self.__download_statuses[th_id] = \
                         UrlFetcher.GENERIC_FETCH_ERROR
 
+        const_debug_write(
+            __name__,
+            "MultipleUrlFetcher.download: connections %s" % (
+                HTTPConnectionPool().stats(),))
         return self.__download_statuses
 
     def get_transfer_rate(self):
@@ -231,31 +231,6 @@ class TopologicalSorter(object):
         """
         object.__init__(self)
         self.__adjacency_map = adjacency_map
-        self.__stack = Lifo()
-
-    def __topological_sort_visit_node(self, node, low, result):
-        """
-        Internal method, visits a node ad push to stack.
-        """
-        if node in low:
-            return
-
-        num = len(low)
-        low[node] = num
-        stack_pos = len(self.__stack)
-        self.__stack.push(node)
-
-        for successor in self.__adjacency_map[node]:
-            self.__topological_sort_visit_node(successor, low, result)
-            low[node] = min(low[node], low[successor])
-
-        if num == low[node]:
-            component = tuple()
-            while len(self.__stack) > stack_pos:
-                component += (self.__stack.pop(),)
-            result.append(component)
-            for item in component:
-                low[item] = len(self.__adjacency_map)
 
     def __strongly_connected_nodes(self):
         """
@@ -264,15 +239,77 @@ class TopologicalSorter(object):
 
         adjacency_map should be a dictionary mapping node names to
         lists of successor nodes.
+        The graph is visited iteratively, using an explicit stack, so that
+        deep dependency chains do not hit the Python recursion limit.
         """
+        adjacency_map = self.__adjacency_map
+        done = len(adjacency_map)
         result = []
         low = {}
-
-        for node in self.__adjacency_map:
-            self.__topological_sort_visit_node(node, low, result)
+        stack = []
+
+        for root in adjacency_map:
+            if root in low:
+                continue
+
+            num = len(low)
+            low[root] = num
+            # (node, successors iterator, stack position, visit number)
+            visit = [(root, iter(adjacency_map[root]), len(stack), num)]
+            stack.append(root)
+            while visit:
+                node, successors, stack_pos, num = visit[-1]
+
+                for successor in successors:
+                    if successor not in low:
+                        succ_num = len(low)
+                        low[successor] = succ_num
+                        visit.append((successor,
+                                      iter(adjacency_map[successor]),
+                                      len(stack), succ_num))
+                        stack.append(successor)
+                        break
+                    if low[successor] < low[node]:
+                        low[node] = low[successor]
+                else:
+                    visit.pop()
+                    if num == low[node]:
+                        component = tuple(reversed(stack[stack_pos:]))
+                        del stack[stack_pos:]
+                        result.append(component)
+                        for item in component:
+                            low[item] = done
+                    if visit:
+                        parent = visit[-1][0]
+                        if low[node] < low[parent]:
+                            low[parent] = low[node]
 
         return result
 
+    def __component_graph(self):
+        """
+        Return the list of strongly connected components and the adjacency
+        list of the graph of the components, in which components are
+        identified by their index.
+        """
+        adjacency_map = self.__adjacency_map
+        components = self.__strongly_connected_nodes()
+
+        node_component = {}
+        for index, component in enumerate(components):
+            for node in component:
+                node_component[node] = index
+
+        component_graph = [[] for x in components]
+        for node, successors in adjacency_map.items():
+            node_c = node_component[node]
+            obj = component_graph[node_c]
+            for successor in successors:
+                successor_c = node_component[successor]
+                if node_c != successor_c:
+                    obj.append(successor_c)
+
+        return components, component_graph
 
     def __topological_sort(self, graph):
         """
@@ -280,14 +317,14 @@ class TopologicalSorter(object):
         """
 
         # initialize count map
-        count = dict((node, 0) for node in graph)
+        count = [0] * len(graph)
 
-        for node in graph:
-            for successor in graph[node]:
+        for successors in graph:
+            for successor in successors:
                 count[successor] += 1
 
         ready_stack = Lifo()
-        for node in graph:
+        for node in range(len(graph)):
             if count[node] == 0:
                 ready_stack.push(node)
 
@@ -323,26 +360,49 @@ class TopologicalSorter(object):
         @return: sorted graph representation
         @rtype: dict
         """
-        # clear stack
-        self.__stack.clear()
+        components, component_graph = self.__component_graph()
+        sorted_graph = self.__topological_sort(component_graph)
+        return dict((x, components[y]) for x, y in sorted_graph.items())
 
-        components = self.__strongly_connected_nodes()
+    def sort_levels(self):
+        """
+        Given an adjacency map, identify strongly connected nodes,
+        then group them in levels, so that there are no arches between
+        strongly connected nodes at the same level. Each level only contains
+        successors of the previous levels, nodes at level 1 are not
+        successors of any other node.
+        Unlike sort(), which returns a serial order, the returned levels can
+        be used to process the strongly connected nodes of each level in
+        parallel.
+
+        @return: sorted graph representation, dict mapping levels (starting
+            from 1) to tuples of strongly connected nodes (tuples)
+        @rtype: dict
+        """
+        components, component_graph = self.__component_graph()
 
-        node_component = {}
-        for component in components:
-            for node in component:
-                node_component[node] = component
+        count = [0] * len(component_graph)
+        for successors in component_graph:
+            for successor in successors:
+                count[successor] += 1
 
-        component_graph = {}
-        for node in self.__adjacency_map:
-            node_c = node_component[node]
-            obj = component_graph.setdefault(node_c, [])
-            for successor in self.__adjacency_map[node]:
-                successor_c = node_component[successor]
-                if node_c != successor_c:
-                    obj.append(successor_c)
+        ready = [x for x in range(len(component_graph)) if count[x] == 0]
+        dep_level = 1
+        result = {}
+        while ready:
+            result[dep_level] = tuple(components[x] for x in ready)
+            dep_level += 1
+
+            next_ready = []
+            for node in ready:
+                for successor in component_graph[node]:
+                    count[successor] -= 1
+                    if count[successor] == 0:
+                        next_ready.append(successor)
+            next_ready.sort()
+            ready = next_ready
 
-        return self.__topological_sort(component_graph)
+        return result
 
 
 class Graph(object):
@@ -480,6 +540,28 @@ class Graph(object):
         sorted_data = self.solve_nodes()
         return dict((x, trans_vals(y),) for x, y in sorted_data.items())
 
+    def solve_levels(self):
+        """
+        Like solve(), but items are grouped by dependency level: all the
+        items at the same level are independent from each other, apart from
+        those in the same strongly connected group (cyclic dependencies).
+        Data is returned in map form, where key represents the dependency
+        level and value a tuple of strongly connected groups (tuples) of
+        items at that dependency level. Items at higher levels are
+        dependencies of the items at lower levels.
+
+        @return: sorted graph representation
+        @rtype: dict
+        """
+        def trans_vals(node_list):
+            return tuple([x.item() for x in node_list])
+
+        adj_map = self.get_adjacency_map()
+        sorter = TopologicalSorter(adj_map)
+        sorted_data = sorter.sort_levels()
+        return dict((x, tuple(trans_vals(k) for k in y)) \
+            for x, y in sorted_data.items())
+
     def raw(self):
         """
         Return all items stored in the graph in raw form (list) without sorting
@@ -0,0 +1,462 @@
+# -*- coding: utf-8 -*-
+"""
+
+    @author: Fabio Erculiani <lxnay@sabayon.org>
+    @contact: lxnay@sabayon.org
+    @copyright: Fabio Erculiani
+    @license: GPL-2
+
+    B{Entropy HTTP persistent connections pool}.
+
+    HTTP/1.1 keep-alive connections are kept around, per host, and reused
+    by UrlFetcher (through the urllib opener returned by build_opener())
+    and by the Entropy Web Services client, saving a TCP (and TLS)
+    handshake per request.
+
+"""
+import io
+import os
+import select
+import socket
+import threading
+import time
+
+from entropy.const import const_is_python3, const_debug_write
+from entropy.core import Singleton
+
+if const_is_python3():
+    import http.client as httplib
+    import urllib.request as urlmod
+    import urllib.error as urlmod_error
+else:
+    import httplib
+    import urllib2 as urlmod
+    import urllib2 as urlmod_error
+
+
+class HTTPConnectionPool(Singleton):
+    """
+    Thread-safe pool of idle HTTP(S) persistent connections, keyed by
+    (scheme, host[:port], SSL context).
+    Connections are handed out exclusively by get() and must be given
+    back through put() (response fully read, connection reusable) or
+    discard().
+
+    Sample code:
+
+    >>> pool = HTTPConnectionPool()
+    >>> conn = pool.get("https", "www.sabayon.org", 30.0)
+    >>> try:
+    ...     conn.request("GET", "/")
+    ...     response = conn.getresponse()
+    ...     data = response.read()
+    ... except:
+    ...     pool.discard(conn)
+    ...     raise
+    >>> pool.put(conn)
+    """
+
+    # maximum number of idle connections kept per host, 0 disables pooling
+    MAX_IDLE_PER_HOST = int(os.getenv("ETP_HTTP_POOL_SIZE", "4"))
+    # maximum number of idle connections kept overall
+    MAX_IDLE = 32
+    # idle connections older than this (in seconds) are closed, servers
+    # usually drop them way before than this anyway
+    IDLE_TIMEOUT = 30.0
+
+    def init_singleton(self):
+        self._lock = threading.Lock()
+        # key -> list of (connection, last used time), most recent last
+        self._idle = {}
+        self._idle_count = 0
+        self._stats = {
+            "created": 0,
+            "reused": 0,
+            "discarded": 0,
+            "expired": 0,
+            "dropped": 0,
+        }
+
+    @staticmethod
+    def _is_dropped(connection):
+        """
+        Return whether the idle connection has been closed by the server
+        (or it sent unexpected data), in which case it cannot be reused.
+        """
+        sock = connection.sock
+        if sock is None:
+            return True
+        try:
+            readable, _w, _x = select.select([sock], [], [], 0.0)
+        except (select.error, socket.error, ValueError):
+            return True
+        return bool(readable)
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.close()
+        except (socket.error, httplib.HTTPException):
+            pass
+
+    def _expire(self, now):
+        """
+        Drop the idle connections older than IDLE_TIMEOUT. Must be called
+        with the lock held, return the connections to be closed.
+        """
+        expired = []
+        for key in list(self._idle.keys()):
+            entries = self._idle[key]
+            alive = [x for x in entries if now - x[1] < self.IDLE_TIMEOUT]
+            if len(alive) != len(entries):
+                expired.extend(x[0] for x in entries if x not in alive)
+                if alive:
+                    self._idle[key] = alive
+                else:
+                    del self._idle[key]
+        self._idle_count -= len(expired)
+        self._stats["expired"] += len(expired)
+        return expired
+
+    def get(self, scheme, host, timeout, context = None):
+        """
+        Return an idle connection to the given host, or a new one.
+
+        @param scheme: "http" or "https"
+        @type scheme: string
+        @param host: the host, with optional ":port"
+        @type host: string
+        @param timeout: socket timeout
+        @type timeout: float
+        @keyword context: the ssl.SSLContext of https connections, it is
+            part of the pool key, so callers should reuse the same object
+        @type context: ssl.SSLContext
+        @return: a httplib.HTTPConnection or HTTPSConnection object
+        @raise ValueError: if scheme is not supported
+        """
+        if scheme not in ("http", "https"):
+            raise ValueError("unsupported scheme: %s" % (scheme,))
+        key = (scheme, host, context)
+
+        stale = []
+        connection = None
+        with self._lock:
+            stale.extend(self._expire(time.time()))
+            entries = self._idle.get(key)
+            while entries:
+                candidate, _last = entries.pop()
+                self._idle_count -= 1
+                if self._is_dropped(candidate):
+                    self._stats["dropped"] += 1
+                    stale.append(candidate)
+                    continue
+                connection = candidate
+                break
+            if not entries:
+                self._idle.pop(key, None)
+            if connection is not None:
+                self._stats["reused"] += 1
+            else:
+                self._stats["created"] += 1
+
+        for conn in stale:
+            self._close(conn)
+
+        if connection is None:
+            if scheme == "https":
+                if context is not None:
+                    connection = httplib.HTTPSConnection(
+                        host, timeout = timeout, context = context)
+                else:
+                    connection = httplib.HTTPSConnection(
+                        host, timeout = timeout)
+            else:
+                connection = httplib.HTTPConnection(host, timeout = timeout)
+        else:
+            connection.timeout = timeout
+            if timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
+                timeout = socket.getdefaulttimeout()
+            try:
+                connection.sock.settimeout(timeout)
+            except (AttributeError, socket.error):
+                pass
+
+        connection._entropy_pool_key = key
+        return connection
+
+    def put(self, connection):
+        """
+        Give back a connection handed out by get(), whose last response
+        has been fully read. It is closed if the server asked so, or if
+        the pool is full.
+
+        @param connection: the connection
+        @type connection: httplib.HTTPConnection
+        """
+        stale = []
+        key = getattr(connection, "_entropy_pool_key", None)
+        with self._lock:
+            reusable = key is not None and connection.sock is not None \
+                and self.MAX_IDLE_PER_HOST > 0
+            if reusable:
+                entries = self._idle.setdefault(key, [])
+                entries.append((connection, time.time()))
+                self._idle_count += 1
+                if len(entries) > self.MAX_IDLE_PER_HOST:
+                    stale.append(entries.pop(0)[0])
+                    self._idle_count -= 1
+                if self._idle_count > self.MAX_IDLE:
+                    stale.extend(self._evict_oldest())
+            else:
+                stale.append(connection)
+            self._stats["discarded"] += len(stale)
+
+        for conn in stale:
+            self._close(conn)
+
+    def _evict_oldest(self):
+        """
+        Drop the least recently used idle connection. Must be called with
+        the lock held, return the connections to be closed.
+        """
+        oldest_key, oldest_last = None, None
+        for key, entries in self._idle.items():
+            last = entries[0][1]
+            if oldest_last is None or last < oldest_last:
+                oldest_key, oldest_last = key, last
+        if oldest_key is None:
+            return []
+        entries = self._idle[oldest_key]
+        connection = entries.pop(0)[0]
+        if not entries:
+            del self._idle[oldest_key]
+        self._idle_count -= 1
+        return [connection]
+
+    def discard(self, connection):
+        """
+        Close a connection handed out by get() that cannot be reused,
+        for example because of an error or a partially read response.
+
+        @param connection: the connection
+        @type connection: httplib.HTTPConnection
+        """
+        with self._lock:
+            self._stats["discarded"] += 1
+        self._close(connection)
+
+    def clear(self):
+        """
+        Close all the idle connections.
+        """
+        with self._lock:
+            idle = self._idle
+            self._idle = {}
+            self._idle_count = 0
+        for entries in idle.values():
+            for connection, _last in entries:
+                self._close(connection)
+
+    def stats(self):
+        """
+        Return the connection counters: "created", "reused" (connections
+        handed out by get()), "discarded", "expired" (idle timeout) and
+        "dropped" (closed by the server while idle). Also "idle", the
+        number of idle connections currently in the pool.
+
+        @return: counter name -> value map
+        @rtype: dict
+        """
+        with self._lock:
+            stats = self._stats.copy()
+            stats["idle"] = self._idle_count
+        return stats
+
+
+class PooledResponse(object):
+    """
+    urllib response object of a pooled connection. The connection is
+    given back to the pool as soon as the response has been fully read,
+    or discarded if the response is closed before that.
+    """
+
+    def __init__(self, pool, connection, response, url):
+        self._pool = pool
+        self._connection = connection
+        self._response = response
+        self._url = url
+        self.headers = response.msg
+        self.code = response.status
+        self.msg = response.reason
+
+    def _release(self):
+        connection, self._connection = self._connection, None
+        if connection is None:
+            return
+        if self._response.isclosed():
+            self._pool.put(connection)
+        else:
+            self._pool.discard(connection)
+
+    def _read(self, func, *args):
+        try:
+            data = func(*args)
+        except:
+            self._response.close()
+            self._release()
+            raise
+        if self._response.isclosed():
+            self._release()
+        return data
+
+    def read(self, amt = None):
+        """
+        Read at most amt bytes of the response body, or all of it.
+        """
+        if amt is None:
+            return self._read(self._response.read)
+        return self._read(self._response.read, amt)
+
+    def readline(self, limit = -1):
+        """
+        Read a line of the response body.
+        """
+        return self._read(self._response.readline, limit)
+
+    def close(self):
+        """
+        Close the response.
+        """
+        self._release()
+        self._response.close()
+
+    def info(self):
+        return self.headers
+
+    def getcode(self):
+        return self.code
+
+    def geturl(self):
+        return self._url
+
+
+class _PooledHandlerMixin(object):
+    """
+    urllib HTTP(S) handler using HTTPConnectionPool connections. Proxied
+    requests are handled by the standard (non-pooled) handler.
+    """
+
+    _scheme = None
+    # idempotent methods retried on stale connections
+    _RETRY_METHODS = ("GET", "HEAD")
+
+    def _pooled_open(self, req, context = None):
+        host = req.host if const_is_python3() else req.get_host()
+        if not host:
+            raise urlmod_error.URLError("no host given")
+        if const_is_python3():
+            selector, data = req.selector, req.data
+        else:
+            selector, data = req.get_selector(), req.get_data()
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update(
+            (k, v) for k, v in req.headers.items() if k not in headers)
+        headers["Connection"] = "keep-alive"
+        headers = dict((k.title(), v) for k, v in headers.items())
+
+        pool = HTTPConnectionPool()
+        # a reused connection may have been dropped by the server while
+        # in flight, retry once on a new one. Only requests that can be
+        # safely sent twice are retried, others may have been processed.
+        method = req.get_method()
+        retry = method in self._RETRY_METHODS
+        for attempt in (0, 1):
+            connection = pool.get(self._scheme, host, req.timeout,
+                                  context = context)
+            # new connections are not connected yet
+            reused = connection.sock is not None
+            try:
+                connection.request(method, selector, data, headers)
+                response = connection.getresponse()
+            except (socket.error, httplib.BadStatusLine) as err:
+                pool.discard(connection)
+                if retry and reused and attempt == 0 and \
+                        not isinstance(err, socket.timeout):
+                    const_debug_write(
+                        __name__,
+                        "HTTPConnectionPool: stale connection to %s: %s" % (
+                            host, repr(err),))
+                    continue
+                if isinstance(err, httplib.HTTPException):
+                    raise
+                raise urlmod_error.URLError(err)
+            except:
+                pool.discard(connection)
+                raise
+            break
+
+        return PooledResponse(pool, connection, response,
+                              req.get_full_url())
+
+
+class PooledHTTPHandler(_PooledHandlerMixin, urlmod.HTTPHandler):
+
+    _scheme = "http"
+
+    def http_open(self, req):
+        if req.has_proxy() or HTTPConnectionPool.MAX_IDLE_PER_HOST < 1:
+            return urlmod.HTTPHandler.http_open(self, req)
+        return self._pooled_open(req)
+
+
+class PooledHTTPSHandler(_PooledHandlerMixin, urlmod.HTTPSHandler):
+
+    _scheme = "https"
+
+    def __init__(self, context = None):
+        urlmod.HTTPSHandler.__init__(self, context = context)
+        self._pool_context = context
+
+    def https_open(self, req):
+        if req.has_proxy() or HTTPConnectionPool.MAX_IDLE_PER_HOST < 1:
+            return urlmod.HTTPSHandler.https_open(self, req)
+        return self._pooled_open(req, context = self._pool_context)
+
+
+class PooledHTTPErrorHandler(urlmod.HTTPDefaultErrorHandler):
+    """
+    urllib handler raising HTTPError for the unhandled HTTP error
+    responses. The body of pooled responses is read in advance, so that
+    their connection goes back to the pool even if the HTTPError is
+    never read nor closed by the caller.
+    """
+
+    def http_error_default(self, req, fp, code, msg, hdrs):
+        if isinstance(fp, PooledResponse):
+            try:
+                body = fp.read()
+            except (socket.error, httplib.HTTPException):
+                # the connection has been discarded already
+                body = b""
+            fp = io.BytesIO(body)
+        return urlmod.HTTPDefaultErrorHandler.http_error_default(
+            self, req, fp, code, msg, hdrs)
+
+
+def build_opener(*handlers, **kwargs):
+    """
+    Return a urllib OpenerDirector using HTTPConnectionPool for HTTP
+    and HTTPS requests.
+
+    @param handlers: additional urllib handlers
+    @type handlers: tuple
+    @keyword context: the ssl.SSLContext used for HTTPS requests
+    @type context: ssl.SSLContext
+    @return: the urllib opener
+    @rtype: OpenerDirector
+    """
+    context = kwargs.pop("context", None)
+    return urlmod.build_opener(
+        PooledHTTPHandler(), PooledHTTPSHandler(context = context),
+        PooledHTTPErrorHandler(), *handlers)
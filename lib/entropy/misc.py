@@ -32,7 +32,7 @@ else:
     UrllibBaseHandler = urllib2.BaseHandler
 import logging
 import threading
-from collections import deque
+from collections import deque, OrderedDict
 
 from entropy.const import etpConst, const_isunicode, \
     const_isfileobj, const_convert_log_level, const_setup_file
@@ -172,6 +172,106 @@ class Lifo(object):
             raise ValueError("Lifo is empty")
 
 
+class LRUCache(object):
+
+    """
+    Size bounded, thread-safe, Least Recently Used cache.
+    When the cache is full, the least recently accessed item is
+    evicted to make room for the new one.
+
+    Sample code:
+
+        >>> from entropy.misc import LRUCache
+        >>> cache = LRUCache(2)
+        >>> cache.set("a", 1)
+        >>> cache.set("b", 2)
+        >>> cache.get("a")
+        1
+        >>> cache.set("c", 3)
+        >>> cache.get("b") is None
+        True
+
+    """
+
+    def __init__(self, max_size):
+        """
+        LRUCache constructor.
+
+        @param max_size: maximum number of items kept in the cache
+        @type max_size: int
+        """
+        object.__init__(self)
+        if max_size < 1:
+            raise ValueError("max_size must be a positive integer")
+        self._max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """
+        Return the number of cached items.
+        """
+        return len(self._data)
+
+    def __contains__(self, key):
+        """
+        Return whether key is cached, without touching the LRU ordering.
+        """
+        return key in self._data
+
+    def get(self, key, default = None):
+        """
+        Return the value cached for key, or default if not found.
+
+        @param key: cache key
+        @type key: hashable object
+        @keyword default: value returned in case of cache miss
+        @type default: any Python object
+        @return: the cached value or default
+        @rtype: any Python object
+        """
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return default
+            self._data[key] = value
+            return value
+
+    def set(self, key, value):
+        """
+        Cache value for key, evicting the least recently used item
+        if the cache is full.
+
+        @param key: cache key
+        @type key: hashable object
+        @param value: value to cache
+        @type value: any Python object
+        """
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self._max_size:
+                self._data.popitem(last = False)
+
+    def discard(self, key):
+        """
+        Remove key from the cache, if present.
+
+        @param key: cache key
+        @type key: hashable object
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """
+        Clear the cache.
+        """
+        with self._lock:
+            self._data.clear()
+
+
 class TimeScheduled(threading.Thread):
 
     """
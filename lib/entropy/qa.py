@@ -924,13 +924,20 @@ class QAInterface(TextInterface, EntropyPluginStore):
                     return True
             return False
 
-        mylibs = {}
+        elf_files = []
         for myfile in mycontent:
             myfile = const_convert_to_rawstring(myfile)
             if not self._is_elf_executable_or_library(myfile):
                 continue
-            mylibs[myfile] = entropy.tools.read_elf_dynamic_libraries(
-                myfile)
+            elf_files.append(myfile)
+
+        mylibs = {}
+        elf_metadata = entropy.tools.read_elf_metadata_many(elf_files)
+        for myfile, meta in elf_metadata.items():
+            if meta is None:
+                mylibs[myfile] = set()
+            else:
+                mylibs[myfile] = meta['needed']
 
         broken_libs = {}
         for mylib in mylibs:
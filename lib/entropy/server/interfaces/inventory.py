@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+
+    @author: Fabio Erculiani <lxnay@sabayon.org>
+    @contact: lxnay@sabayon.org
+    @copyright: Fabio Erculiani
+    @license: GPL-2
+
+    B{Entropy Package Manager Server Remote Inventory}.
+
+    Inventory of the package files stored on a packages mirror. Remote
+    directories are listed concurrently, over several URI handler
+    connections, and the resulting manifest is cached locally, per
+    repository, mirror and branch, together with the directory stamps
+    (see EntropyUriHandler.list_directory_stamps()). On the next run,
+    only the directories whose stamp changed are listed again.
+
+"""
+import os
+import hashlib
+import threading
+
+from entropy.const import const_convert_to_rawstring, const_debug_write
+from entropy.misc import ParallelTask
+
+
+class RemoteInventory(object):
+
+    """
+    Remote package files inventory of a repository on a given mirror.
+
+    Sample code:
+
+    >>> inventory = RemoteInventory(entropy_server, repository_id, uri)
+    >>> txc = entropy_server.Transceiver(uri)
+    >>> with txc as handler:
+    ...     files = inventory.list_files(remote_dirs, handler)
+    """
+
+    # number of URI handler connections used to list remote directories
+    WORKERS = int(os.getenv("ETP_INVENTORY_WORKERS", "4"))
+    # set ETP_INVENTORY_NOCACHE to always list the whole remote tree
+    CACHE = os.getenv("ETP_INVENTORY_NOCACHE") is None
+
+    def __init__(self, entropy_server, repository_id, uri):
+        """
+        RemoteInventory constructor.
+
+        @param entropy_server: Entropy Server instance
+        @type entropy_server: entropy.server.interfaces.main.Server
+        @param repository_id: repository identifier
+        @type repository_id: string
+        @param uri: packages mirror URI
+        @type uri: string
+        """
+        self._entropy = entropy_server
+        self._repository_id = repository_id
+        self._uri = uri
+
+    def _cache_key(self, remote_dir):
+        """
+        Return the cache key of the manifest of remote_dir, which contains
+        the branch already.
+        """
+        sha = hashlib.sha1()
+        sha.update(const_convert_to_rawstring(
+            repr((self._repository_id, self._uri, remote_dir))))
+        return "remote_inventory/%s" % (sha.hexdigest(),)
+
+    def _load(self, remote_dir):
+        """
+        Load the cached manifest of remote_dir, return None if not available.
+        """
+        if not RemoteInventory.CACHE:
+            return None
+        manifest = self._entropy._cacher.pop(
+            self._cache_key(remote_dir), cache_dir = self._entropy.CACHE_DIR)
+        if not isinstance(manifest, dict):
+            return None
+        if "stamps" not in manifest or "files" not in manifest:
+            return None
+        return manifest
+
+    def _store(self, remote_dir, stamps, files):
+        """
+        Store the manifest of remote_dir.
+        """
+        if not RemoteInventory.CACHE:
+            return
+        manifest = {
+            "stamps": stamps,
+            "files": files,
+        }
+        self._entropy._cacher.save(
+            self._cache_key(remote_dir), manifest,
+            cache_dir = self._entropy.CACHE_DIR)
+
+    def _list_directories(self, handler, jobs, recursive):
+        """
+        List the given directories concurrently, using handler and up to
+        WORKERS - 1 additional URI handler connections.
+
+        @param handler: connected URI handler
+        @type handler: EntropyUriHandler
+        @param jobs: list of (remote_dir, path relative to remote_dir)
+        @type jobs: list
+        @param recursive: also list the subdirectories found
+        @type recursive: bool
+        @return: dict mapping (remote_dir, relative path) to the
+            list of files in it: [(name, size), ...]
+        @rtype: dict
+        """
+        queue = list(jobs)
+        listing = {}
+        cond = threading.Condition()
+        state = {
+            # jobs queued or being listed
+            'pending': len(queue),
+            'error': None,
+        }
+
+        def _worker(txc_handler, primary):
+            while True:
+                with cond:
+                    while not queue and state['pending'] > 0 \
+                            and state['error'] is None:
+                        cond.wait()
+                    if not queue or state['error'] is not None:
+                        return
+                    job = queue.pop(0)
+
+                remote_dir, path = job
+                files = []
+                subdirs = []
+                try:
+                    info = txc_handler.list_content_metadata(
+                        os.path.join(remote_dir, path))
+                    for name, size, _owner, _group, perms in info:
+                        if perms.startswith("d"):
+                            subdirs.append(
+                                (remote_dir, os.path.join(path, name)))
+                        else:
+                            files.append((name, int(size)))
+                except Exception as err:
+                    with cond:
+                        if primary:
+                            if state['error'] is None:
+                                state['error'] = err
+                        else:
+                            # mirrors may limit the number of connections,
+                            # leave the job to the other workers
+                            queue.insert(0, job)
+                        cond.notify_all()
+                    if not primary:
+                        raise
+                    return
+
+                with cond:
+                    listing[job] = files
+                    if recursive:
+                        queue.extend(subdirs)
+                        state['pending'] += len(subdirs)
+                    state['pending'] -= 1
+                    cond.notify_all()
+
+        def _txc_worker():
+            txc = self._entropy.Transceiver(self._uri)
+            try:
+                with txc as txc_handler:
+                    _worker(txc_handler, False)
+            except Exception as err:
+                const_debug_write(
+                    __name__,
+                    "RemoteInventory: additional connection failed: %s" % (
+                        repr(err),))
+
+        workers = RemoteInventory.WORKERS
+        if not recursive:
+            workers = min(workers, len(queue))
+        tasks = [ParallelTask(_txc_worker) for _idx in range(workers - 1)]
+        for task in tasks:
+            task.daemon = True
+            task.start()
+        # the given handler is used by this thread
+        _worker(handler, True)
+        for task in tasks:
+            task.join()
+
+        if state['error'] is not None:
+            raise state['error']
+        return listing
+
+    def list_files(self, remote_dirs, handler):
+        """
+        Return the files stored in the given remote directory trees, which
+        are created if they do not exist.
+
+        @param remote_dirs: list of remote directories
+        @type remote_dirs: list
+        @param handler: connected URI handler
+        @type handler: EntropyUriHandler
+        @return: dict mapping each remote directory to the list of files
+            in its tree: [(path relative to remote directory, size), ...]
+        @rtype: dict
+        """
+        # remote_dir -> {relative directory path: [(name, size), ...]}
+        manifests = {}
+        all_stamps = {}
+        jobs = []
+        walk_jobs = []
+
+        for remote_dir in remote_dirs:
+            stamps = handler.list_directory_stamps(remote_dir)
+            if stamps is None:
+                # not supported, the whole tree must be walked
+                if not handler.is_dir(remote_dir):
+                    handler.makedirs(remote_dir)
+                manifests[remote_dir] = {}
+                walk_jobs.append((remote_dir, ""))
+                continue
+
+            all_stamps[remote_dir] = stamps
+            files = dict((x, []) for x in stamps)
+            manifests[remote_dir] = files
+            manifest = self._load(remote_dir)
+
+            if manifest is None:
+                # the whole tree is listed at once
+                for path, size in handler.list_content_recursive(remote_dir):
+                    dir_path, name = os.path.split(path)
+                    files.setdefault(dir_path, []).append((name, size))
+                continue
+
+            cached_stamps = manifest["stamps"]
+            cached_files = manifest["files"]
+            for dir_path, stamp in stamps.items():
+                cached = cached_files.get(dir_path)
+                if cached is None or cached_stamps.get(dir_path) != stamp:
+                    jobs.append((remote_dir, dir_path))
+                else:
+                    files[dir_path] = cached
+
+        for jobs_list, recursive in ((jobs, False), (walk_jobs, True)):
+            if not jobs_list:
+                continue
+            listing = self._list_directories(handler, jobs_list, recursive)
+            for (remote_dir, dir_path), files in listing.items():
+                manifests[remote_dir][dir_path] = files
+
+        content = {}
+        for remote_dir, files in manifests.items():
+            stamps = all_stamps.get(remote_dir)
+            if stamps is not None:
+                self._store(remote_dir, stamps, files)
+            content[remote_dir] = [
+                (os.path.join(sub_dir, file_name), file_size)
+                for sub_dir, dir_files in files.items()
+                for file_name, file_size in dir_files]
+        return content
@@ -3833,6 +3833,16 @@ class Server(Client):
 
         my_qa = self.QA()
 
+        # hash all the package files upfront, concurrently, reading each
+        # file once for the checksum and all the recorded signatures.
+        hash_types = ("md5", "sha1", "sha256", "sha512")
+        package_paths = {}
+        for package_id in available:
+            package_paths[package_id] = self._get_package_path(
+                repository_id, dbconn, package_id)
+        package_hashes = entropy.tools.multi_hash_files(
+            list(package_paths.values()), hash_types)
+
         totalcounter = str(len(available))
         currentcounter = 0
         for package_id in available:
@@ -3852,8 +3862,16 @@ class Server(Client):
             )
 
             storedmd5 = dbconn.retrieveDigest(package_id)
-            pkgpath = self._get_package_path(repository_id, dbconn, package_id)
-            result = entropy.tools.compare_md5(pkgpath, storedmd5)
+            sha1, sha256, sha512, _gpg = dbconn.retrieveSignatures(
+                package_id)
+            pkgpath = package_paths[package_id]
+            hashes = package_hashes.get(pkgpath)
+            result = False
+            if hashes is not None:
+                expected = zip(hash_types,
+                               (storedmd5, sha1, sha256, sha512))
+                result = all(hashes[k] == v for k, v in expected
+                             if v is not None)
             qa_fine = my_qa.entropy_package_checks(pkgpath)
             if result and qa_fine:
                 fine.add(package_id)
@@ -6160,10 +6178,12 @@ class Server(Client):
 
             size = entropy.tools.get_file_size(path)
             disksize = entropy.tools.get_uncompressed_size(path)
-            md5 = entropy.tools.md5sum(path)
-            sha1 = entropy.tools.sha1(path)
-            sha256 = entropy.tools.sha256(path)
-            sha512 = entropy.tools.sha512(path)
+            hashes = entropy.tools.multi_hash(
+                path, ("md5", "sha1", "sha256", "sha512"))
+            md5 = hashes['md5']
+            sha1 = hashes['sha1']
+            sha256 = hashes['sha256']
+            sha512 = hashes['sha512']
             gpg = None
             if repo_sec is not None:
                 gpg = self._get_gpg_signature(repo_sec, repository_id, path)
@@ -17,10 +17,6 @@ import threading
 import multiprocessing
 import socket
 import codecs
-try:
-    from Queue import Queue
-except ImportError:
-    from queue import Queue
 
 from entropy.exceptions import EntropyPackageException
 from entropy.output import red, darkgreen, bold, brown, blue, darkred, \
@@ -34,6 +30,7 @@ from entropy.transceivers import EntropyTransceiver
 from entropy.transceivers.uri_handlers.skel import EntropyUriHandler
 from entropy.core.settings.base import SystemSettings
 from entropy.server.interfaces.db import ServerPackagesRepository
+from entropy.server.interfaces.inventory import RemoteInventory
 
 import entropy.tools
 
@@ -1101,30 +1098,10 @@ class Server(object):
         remote_packages_data = {}
         remote_packages = []
         branch = self._settings['repositories']['branch']
-        fifo_q = Queue()
+        only_dir = self._entropy.complete_remote_package_relative_path(
+            "", repository_id)
 
-        def get_content(lookup_dir):
-            only_dir = self._entropy.complete_remote_package_relative_path(
-                "", repository_id)
-            db_url_dir = lookup_dir[len(only_dir):]
-
-            # create path to lock file if it doesn't exist
-            if not txc_handler.is_dir(lookup_dir):
-                txc_handler.makedirs(lookup_dir)
-
-            info = txc_handler.list_content_metadata(lookup_dir)
-
-            dirs = []
-            for path, size, user, group, perms in info:
-
-                if perms.startswith("d"):
-                    fifo_q.put(os.path.join(lookup_dir, path))
-                else:
-                    rel_path = os.path.join(db_url_dir, path)
-                    remote_packages.append(rel_path)
-                    remote_packages_data[rel_path] = int(size)
-
-        # initialize the queue
+        remote_dirs = []
         pkgs_dir_types = self._entropy._get_pkg_dir_names()
         for pkg_dir_type in pkgs_dir_types:
 
@@ -1132,11 +1109,18 @@ class Server(object):
                 pkg_dir_type, repository_id)
             remote_dir = os.path.join(remote_dir, etpConst['currentarch'],
                 branch)
-
-            fifo_q.put(remote_dir)
-
-        while not fifo_q.empty():
-            get_content(fifo_q.get())
+            remote_dirs.append(remote_dir)
+
+        # directories are listed concurrently and only those changed
+        # since the last run are listed again
+        inventory = RemoteInventory(self._entropy, repository_id, uri)
+        content = inventory.list_files(remote_dirs, txc_handler)
+        for remote_dir in remote_dirs:
+            db_url_dir = remote_dir[len(only_dir):]
+            for path, size in content[remote_dir]:
+                rel_path = os.path.join(db_url_dir, path)
+                remote_packages.append(rel_path)
+                remote_packages_data[rel_path] = size
 
         return remote_packages, remote_packages_data
 
@@ -1467,70 +1451,87 @@ class Server(object):
                 os.remove(expiration_file)
 
 
-    def _sync_run_upload_queue(self, repository_id, uri, upload_queue):
+    def _sync_run_upload_queue(self, repository_id, upload_queues):
+        """
+        Upload the package files to the given mirrors, concurrently.
 
+        @param repository_id: repository identifier
+        @type repository_id: string
+        @param upload_queues: dict mapping each mirror URI to its upload
+            queue, as returned by _expand_queues()
+        @type upload_queues: dict
+        @return: set of mirror URIs that could not be updated
+        @rtype: set
+        """
         branch = self._settings['repositories']['branch']
-        crippled_uri = EntropyTransceiver.get_uri_name(uri)
-        queue_map = {}
-
-        for upload_path, rel_path, size in upload_queue:
-            rel_dir = os.path.dirname(rel_path)
-            obj = queue_map.setdefault(rel_dir, [])
-            obj.append(upload_path)
-
-        errors = False
-        m_fine_uris = set()
-        m_broken_uris = set()
-        for rel_path, myqueue in queue_map.items():
+        downloads = {}
+        uri_files = {}
+        critical_files = set()
+
+        # a single handler takes care of all the mirrors and remote
+        # directories, so that files are uploaded concurrently
+        for uri, upload_queue in upload_queues.items():
+            myqueue = uri_files.setdefault(uri, [])
+            for upload_path, rel_path, size in upload_queue:
+                rel_dir = os.path.dirname(rel_path)
+                remote_dir = \
+                    self._entropy.complete_remote_package_relative_path(
+                        rel_dir, repository_id)
+                downloads[remote_dir] = rel_dir
+                myqueue.append((remote_dir, upload_path))
+                critical_files.add(upload_path)
+
+        handlers_data = {
+            'branch': branch,
+            'downloads': downloads,
+        }
+        uris = sorted(uri_files.keys())
+        uploader = self.TransceiverServerHandler(self._entropy, uris,
+            [], critical_files = critical_files,
+            txc_basedir = self._entropy.complete_remote_package_relative_path(
+                "", repository_id),
+            copy_herustic_support = True,
+            handlers_data = handlers_data, repo = repository_id,
+            uri_files = uri_files)
 
-            remote_dir = self._entropy.complete_remote_package_relative_path(
-                rel_path, repository_id)
+        errors, m_fine_uris, m_broken_uris = uploader.go()
 
-            handlers_data = {
-                'branch': branch,
-                'download': rel_path,
-            }
-            uploader = self.TransceiverServerHandler(self._entropy, [uri],
-                myqueue, critical_files = myqueue,
-                txc_basedir = remote_dir, copy_herustic_support = True,
-                handlers_data = handlers_data, repo = repository_id)
+        # mirrors that could not be reached do not show up anywhere
+        failed_uris = set(uris) - m_fine_uris
+        reasons = {}
+        for uri, uri_rc in m_broken_uris:
+            failed_uris.add(uri)
+            reasons.setdefault(uri, uri_rc)
 
-            xerrors, xm_fine_uris, xm_broken_uris = uploader.go()
-            if xerrors:
-                errors = True
-            m_fine_uris.update(xm_fine_uris)
-            m_broken_uris.update(xm_broken_uris)
+        for uri in uris:
+            crippled_uri = EntropyTransceiver.get_uri_name(uri)
+            if uri in failed_uris:
+                self._entropy.output(
+                    "[%s] %s: %s, %s: %s" % (
+                        brown(branch),
+                        blue(_("upload errors")),
+                        red(crippled_uri),
+                        blue(_("reason")),
+                        darkgreen(repr(reasons.get(uri))),
+                    ),
+                    importance = 1,
+                    level = "error",
+                    header = darkred(" !!! ")
+                )
+                continue
 
-        if errors:
-            my_broken_uris = [
-                (EntropyTransceiver.get_uri_name(x_uri), x_uri_rc) for \
-                    x_uri, x_uri_rc in m_broken_uris]
-            reason = my_broken_uris[0][1]
             self._entropy.output(
-                "[%s] %s: %s, %s: %s" % (
+                "[%s] %s: %s" % (
                     brown(branch),
-                    blue(_("upload errors")),
+                    blue(_("upload completed successfully")),
                     red(crippled_uri),
-                    blue(_("reason")),
-                    darkgreen(repr(reason)),
                 ),
                 importance = 1,
-                level = "error",
-                header = darkred(" !!! ")
+                level = "info",
+                header = blue(" @@ ")
             )
-            return errors, m_fine_uris, m_broken_uris
 
-        self._entropy.output(
-            "[%s] %s: %s" % (
-                brown(branch),
-                blue(_("upload completed successfully")),
-                red(crippled_uri),
-            ),
-            importance = 1,
-            level = "info",
-            header = blue(" @@ ")
-        )
-        return errors, m_fine_uris, m_broken_uris
+        return failed_uris
 
 
     def _sync_run_download_queue(self, repository_id, uri, download_queue):
@@ -1672,6 +1673,66 @@ class Server(object):
         return ServerPackagesRepository.update(self._entropy, repository_id,
             enable_upload, enable_download, force = force)
 
+    def _sync_packages_interrupted(self, repository_id):
+        """
+        Tell the user that the packages sync has been interrupted.
+        """
+        self._entropy.output(
+            "[%s|%s|%s] %s" % (
+                repository_id,
+                red(_("sync")),
+                self._settings['repositories']['branch'],
+                darkgreen(_("keyboard interrupt !")),
+            ),
+            importance = 1,
+            level = "info",
+            header = darkgreen(" * ")
+        )
+
+    def _sync_packages_failed(self, repository_id, err, successfull_mirrors):
+        """
+        Report an unexpected packages sync error.
+        """
+        entropy.tools.print_traceback()
+        self._entropy.output(
+            "[%s|%s|%s] %s: %s, %s: %s" % (
+                repository_id,
+                red(_("sync")),
+                self._settings['repositories']['branch'],
+                darkred(_("exception caught")),
+                Exception,
+                _("error"),
+                err,
+            ),
+            importance = 1,
+            level = "error",
+            header = darkred(" !!! ")
+        )
+
+        exc_txt = entropy.tools.print_exception(
+            silent = True)
+        for line in exc_txt:
+            self._entropy.output(
+                repr(line),
+                importance = 1,
+                level = "error",
+                header = darkred(":  ")
+            )
+
+        if len(successfull_mirrors) > 0:
+            self._entropy.output(
+                "[%s|%s|%s] %s" % (
+                    repository_id,
+                    red(_("sync")),
+                    self._settings['repositories']['branch'],
+                    darkred(
+                        _("at least one mirror synced properly!")),
+                ),
+                importance = 1,
+                level = "error",
+                header = darkred(" !!! ")
+            )
+
     def sync_packages(self, repository_id, ask = True, pretend = False,
         packages_check = False):
         """
@@ -1712,11 +1773,12 @@ class Server(object):
         mirrors_tainted = False
         mirror_errors = False
         mirrors_errors = False
+        # mirrors whose queues have been confirmed
+        confirmed = []
 
         for uri in self._entropy.remote_packages_mirrors(repository_id):
 
             crippled_uri = EntropyTransceiver.get_uri_name(uri)
-            mirror_errors = False
 
             self._entropy.output(
                 "[%s|%s|%s] %s: %s" % (
@@ -1812,6 +1874,14 @@ class Server(object):
                 if rc_sync == _("No"):
                     continue
 
+            confirmed.append((uri, upload, download, removal, copy_q))
+
+        # QA checks, removals and copies are run per mirror, then the
+        # package files are uploaded to all the mirrors at once
+        uploads = {}
+        ready = []
+        for uri, upload, download, removal, copy_q in confirmed:
+
             try:
 
                 # QA checks
@@ -1829,41 +1899,8 @@ class Server(object):
                 if copy_q:
                     self._sync_run_copy_queue(repository_id, copy_q)
 
-                if upload:
-                    mirrors_tainted = True
-
-                if upload:
-                    d_errors, m_fine_uris, \
-                        m_broken_uris = self._sync_run_upload_queue(
-                            repository_id, uri, upload)
-
-                    if d_errors:
-                        mirror_errors = True
-
-                if download:
-                    d_errors, m_fine_uris, \
-                        m_broken_uris = self._sync_run_download_queue(
-                            repository_id, uri, download)
-
-                    if d_errors:
-                        mirror_errors = True
-                if not mirror_errors:
-                    successfull_mirrors.add(uri)
-                else:
-                    mirrors_errors = True
-
             except KeyboardInterrupt:
-                self._entropy.output(
-                    "[%s|%s|%s] %s" % (
-                        repository_id,
-                        red(_("sync")),
-                        self._settings['repositories']['branch'],
-                        darkgreen(_("keyboard interrupt !")),
-                    ),
-                    importance = 1,
-                    level = "info",
-                    header = darkgreen(" * ")
-                )
+                self._sync_packages_interrupted(repository_id)
                 continue
 
             except EntropyPackageException as err:
@@ -1890,50 +1927,60 @@ class Server(object):
                     broken_mirrors, check_data
 
             except Exception as err:
-
-                entropy.tools.print_traceback()
                 mirrors_errors = True
                 broken_mirrors.add(uri)
-                self._entropy.output(
-                    "[%s|%s|%s] %s: %s, %s: %s" % (
-                        repository_id,
-                        red(_("sync")),
-                        self._settings['repositories']['branch'],
-                        darkred(_("exception caught")),
-                        Exception,
-                        _("error"),
-                        err,
-                    ),
-                    importance = 1,
-                    level = "error",
-                    header = darkred(" !!! ")
-                )
+                self._sync_packages_failed(repository_id, err,
+                    successfull_mirrors)
+                continue
 
-                exc_txt = entropy.tools.print_exception(
-                    silent = True)
-                for line in exc_txt:
-                    self._entropy.output(
-                        repr(line),
-                        importance = 1,
-                        level = "error",
-                        header = darkred(":  ")
-                    )
+            if upload:
+                uploads[uri] = upload
+            ready.append((uri, download))
 
-                if len(successfull_mirrors) > 0:
-                    self._entropy.output(
-                        "[%s|%s|%s] %s" % (
-                            repository_id,
-                            red(_("sync")),
-                            self._settings['repositories']['branch'],
-                            darkred(
-                                _("at least one mirror synced properly!")),
-                        ),
-                        importance = 1,
-                        level = "error",
-                        header = darkred(" !!! ")
-                    )
+        failed_uploads = set()
+        if uploads:
+            mirrors_tainted = True
+            try:
+                failed_uploads = self._sync_run_upload_queue(
+                    repository_id, uploads)
+            except KeyboardInterrupt:
+                ready = [x for x in ready if x[0] not in uploads]
+                self._sync_packages_interrupted(repository_id)
+            except Exception as err:
+                mirrors_errors = True
+                broken_mirrors.update(uploads)
+                ready = [x for x in ready if x[0] not in uploads]
+                self._sync_packages_failed(repository_id, err,
+                    successfull_mirrors)
+
+        for uri, download in ready:
+
+            mirror_errors = uri in failed_uploads
+            try:
+                if download:
+                    d_errors, m_fine_uris, \
+                        m_broken_uris = self._sync_run_download_queue(
+                            repository_id, uri, download)
+
+                    if d_errors:
+                        mirror_errors = True
+
+            except KeyboardInterrupt:
+                self._sync_packages_interrupted(repository_id)
                 continue
 
+            except Exception as err:
+                mirrors_errors = True
+                broken_mirrors.add(uri)
+                self._sync_packages_failed(repository_id, err,
+                    successfull_mirrors)
+                continue
+
+            if not mirror_errors:
+                successfull_mirrors.add(uri)
+            else:
+                mirrors_errors = True
+
         # if at least one server has been synced successfully, move files
         if (len(successfull_mirrors) > 0) and not pretend:
             self._move_files_over_from_upload(repository_id)
@@ -10,6 +10,7 @@
 
 """
 import os
+import threading
 
 from entropy.const import const_isstring, const_isnumber, etpConst
 from entropy.output import darkred, blue, brown, darkgreen, red, bold
@@ -19,18 +20,28 @@ from entropy.client.interfaces.db import InstalledPackagesRepository
 from entropy.core.settings.base import SystemSettings
 from entropy.transceivers import EntropyTransceiver
 from entropy.tools import print_traceback, is_valid_md5, compare_md5, md5sum
+from entropy.misc import ParallelTask
+
 
 class TransceiverServerHandler:
 
+    # number of files transferred in parallel to each mirror
+    MIRROR_WORKERS = int(os.getenv("ETP_TXC_MIRROR_WORKERS", "2"))
+    # number of mirrors handled in parallel
+    PARALLEL_MIRRORS = int(os.getenv("ETP_TXC_PARALLEL_MIRRORS", "4"))
+
     def __init__(self, entropy_interface, uris, files_to_upload,
         download = False, remove = False, txc_basedir = None,
         local_basedir = None, critical_files = None,
-        handlers_data = None, repo = None, copy_herustic_support = False):
+        handlers_data = None, repo = None, copy_herustic_support = False,
+        uri_files = None):
 
         if critical_files is None:
             critical_files = []
         if handlers_data is None:
             handlers_data = {}
+        if uri_files is None:
+            uri_files = {}
 
         self._entropy = entropy_interface
         if not isinstance(uris, list):
@@ -43,6 +54,8 @@ class TransceiverServerHandler:
             self.myfiles = files_to_upload[:]
         else:
             self.myfiles = sorted([x for x in files_to_upload])
+        # mirrors with their own list of files, see _files()
+        self._uri_files = uri_files
 
         self._settings = SystemSettings()
         self.sys_settings_plugin_id = \
@@ -76,13 +89,21 @@ class TransceiverServerHandler:
 
         self.critical_files = critical_files
         self.handlers_data = handlers_data.copy()
+        self._output_lock = threading.Lock()
+        # mirror -> kept back messages, see _output()
+        self._output_buffers = {}
+        self._concurrent = False
+        # number of transfers in progress, see _transfer_speed_limit()
+        self._active_lock = threading.Lock()
+        self._active = 0
 
     def handler_verify_upload(self, local_filepath, uri, counter, maxcount,
         tries, remote_md5 = None):
 
         crippled_uri = EntropyTransceiver.get_uri_name(uri)
 
-        self._entropy.output(
+        self._output(
+            uri,
             "[%s|#%s|(%s/%s)] %s: %s" % (
                 blue(crippled_uri),
                 darkgreen(str(tries)),
@@ -105,7 +126,8 @@ class TransceiverServerHandler:
             if valid_md5: # seems valid
                 ckres = compare_md5(local_filepath, remote_md5)
             if ckres:
-                self._entropy.output(
+                self._output(
+                    uri,
                     "[%s|#%s|(%s/%s)] %s: %s: %s" % (
                         blue(crippled_uri),
                         darkgreen(str(tries)),
@@ -123,7 +145,8 @@ class TransceiverServerHandler:
             # ouch!
             elif not valid_md5:
                 # mmmh... malformed md5, try with handlers
-                self._entropy.output(
+                self._output(
+                    uri,
                     "[%s|#%s|(%s/%s)] %s: %s: %s" % (
                         blue(crippled_uri),
                         darkgreen(str(tries)),
@@ -138,7 +161,8 @@ class TransceiverServerHandler:
                     header = brown(" @@ ")
                 )
             else: # it's really bad!
-                self._entropy.output(
+                self._output(
+                    uri,
                     "[%s|#%s|(%s/%s)] %s: %s: %s" % (
                         blue(crippled_uri),
                         darkgreen(str(tries)),
@@ -156,11 +180,57 @@ class TransceiverServerHandler:
 
         return valid_remote_md5 # always valid
 
-    def _transceive(self, uri):
+    def _output(self, uri, *args, **kwargs):
+        """
+        Thread-safe output of a message about the given mirror, mirrors
+        and files are handled concurrently. While several mirrors are
+        handled in parallel, their messages are kept back until the mirror
+        is done, see _flush_output(). Transfer progress (back = True) is
+        always printed right away.
+        """
+        with self._output_lock:
+            buf = self._output_buffers.get(uri)
+            if buf is not None and not kwargs.get("back"):
+                buf.append((args, kwargs))
+                return
+            self._entropy.output(*args, **kwargs)
+
+    def _buffer_output(self, uri):
+        """
+        Start keeping back the messages about the given mirror.
+        """
+        with self._output_lock:
+            self._output_buffers[uri] = []
 
-        fine = set()
-        broken = set()
-        fail = False
+    def _flush_output(self, uri):
+        """
+        Print the messages kept back about the given mirror, at once.
+        """
+        with self._output_lock:
+            buf = self._output_buffers.pop(uri, None) or []
+            for args, kwargs in buf:
+                self._entropy.output(*args, **kwargs)
+
+    def _transfer_speed_limit(self, active):
+        """
+        Return the speed limit of a single transfer in kb/sec, 0 means
+        unlimited. URI handlers fix the speed limit when a transfer
+        starts, so the server-side limit is split evenly among the
+        transfers in progress at that time, this one included.
+
+        @param active: the number of transfers in progress
+        @type active: int
+        """
+        if not const_isnumber(self.speed_limit) or self.speed_limit <= 0:
+            return 0
+        return max(1, int(self.speed_limit) // max(1, active))
+
+    def _transceive_file(self, handler, uri, base_dir, mypath, counter,
+        maxcount):
+        """
+        Transfer a single file (or remove it), retrying up to five times.
+        Return a (done, last error) tuple.
+        """
         crippled_uri = EntropyTransceiver.get_uri_name(uri)
         action = 'push'
         if self.download:
@@ -168,148 +238,212 @@ class TransceiverServerHandler:
         elif self.remove:
             action = 'remove'
 
-        try:
-            txc = EntropyTransceiver(uri)
-            if const_isnumber(self.speed_limit):
-                txc.set_speed_limit(self.speed_limit)
-            txc.set_output_interface(self._entropy)
-        except TransceiverConnectionError:
-            print_traceback()
-            return True, fine, broken # issues
-
-        maxcount = len(self.myfiles)
-        counter = 0
-
-        with txc as handler:
-
-            for mypath in self.myfiles:
-
-                base_dir = self.txc_basedir
-
-                if isinstance(mypath, tuple):
-                    if len(mypath) < 2:
-                        continue
-                    base_dir, mypath = mypath
-
-                if not handler.is_dir(base_dir):
-                    handler.makedirs(base_dir)
-
-                mypath_fn = os.path.basename(mypath)
-                remote_path = os.path.join(base_dir, mypath_fn)
-
-                syncer = handler.upload
-                myargs = (mypath, remote_path)
-                if self.download:
-                    syncer = handler.download
-                    local_path = os.path.join(self.local_basedir, mypath_fn)
-                    myargs = (remote_path, local_path)
-                elif self.remove:
-                    syncer = handler.delete
-                    myargs = (remote_path,)
-
-                fallback_syncer, fallback_args = None, None
-                # upload -> remote copy herustic support
-                # if a package file might have been already uploaded
-                # to remote mirror, try to look in other repositories'
-                # package directories if a file, with the same md5 and name
-                # is already available. In this case, use remote copy instead
-                # of upload to save bandwidth.
-                if self._copy_herustic and (syncer == handler.upload):
-                    # copy herustic support enabled
-                    # we are uploading
-                    new_syncer, new_args = self._copy_herustic_support(
-                        handler, mypath, base_dir, remote_path)
-                    if new_syncer is not None:
-                        fallback_syncer, fallback_args = syncer, myargs
-                        syncer, myargs = new_syncer, new_args
-                        action = "copy"
-
-                counter += 1
-                tries = 0
-                done = False
-                lastrc = None
-
-                while tries < 5:
-                    tries += 1
-                    self._entropy.output(
-                        "[%s|#%s|(%s/%s)] %s: %s" % (
-                            blue(crippled_uri),
-                            darkgreen(str(tries)),
-                            blue(str(counter)),
-                            bold(str(maxcount)),
-                            blue(action),
-                            red(os.path.basename(mypath)),
-                        ),
-                        importance = 0,
-                        level = "info",
-                        header = red(" @@ ")
-                    )
-                    rc = syncer(*myargs)
-                    if (not rc) and (fallback_syncer is not None):
-                        # if we have a fallback syncer, try it first
-                        # before giving up.
-                        rc = fallback_syncer(*myargs)
-
-                    if rc and not (self.download or self.remove):
-                        remote_md5 = handler.get_md5(remote_path)
-                        rc = self.handler_verify_upload(mypath, uri,
-                            counter, maxcount, tries, remote_md5 = remote_md5)
-                    if rc:
-                        self._entropy.output(
-                            "[%s|#%s|(%s/%s)] %s %s: %s" % (
-                                        blue(crippled_uri),
-                                        darkgreen(str(tries)),
-                                        blue(str(counter)),
-                                        bold(str(maxcount)),
-                                        blue(action),
-                                        _("successful"),
-                                        red(os.path.basename(mypath)),
-                            ),
-                            importance = 0,
-                            level = "info",
-                            header = darkgreen(" @@ ")
-                        )
-                        done = True
-                        fine.add(uri)
-                        break
-                    else:
-                        self._entropy.output(
-                            "[%s|#%s|(%s/%s)] %s %s: %s" % (
-                                        blue(crippled_uri),
-                                        darkgreen(str(tries)),
-                                        blue(str(counter)),
-                                        bold(str(maxcount)),
-                                        blue(action),
-                                        brown(_("failed, retrying")),
-                                        red(os.path.basename(mypath)),
-                                ),
-                            importance = 0,
-                            level = "warning",
-                            header = brown(" @@ ")
-                        )
-                        lastrc = rc
-                        continue
+        mypath_fn = os.path.basename(mypath)
+        remote_path = os.path.join(base_dir, mypath_fn)
 
-                if not done:
-
-                    self._entropy.output(
-                        "[%s|(%s/%s)] %s %s: %s - %s: %s" % (
+        syncer = handler.upload
+        myargs = (mypath, remote_path)
+        if self.download:
+            syncer = handler.download
+            local_path = os.path.join(self.local_basedir, mypath_fn)
+            myargs = (remote_path, local_path)
+        elif self.remove:
+            syncer = handler.delete
+            myargs = (remote_path,)
+
+        fallback_syncer, fallback_args = None, None
+        # upload -> remote copy herustic support
+        # if a package file might have been already uploaded
+        # to remote mirror, try to look in other repositories'
+        # package directories if a file, with the same md5 and name
+        # is already available. In this case, use remote copy instead
+        # of upload to save bandwidth.
+        if self._copy_herustic and (syncer == handler.upload):
+            # copy herustic support enabled
+            # we are uploading
+            new_syncer, new_args = self._copy_herustic_support(
+                handler, mypath, base_dir, remote_path)
+            if new_syncer is not None:
+                fallback_syncer, fallback_args = syncer, myargs
+                syncer, myargs = new_syncer, new_args
+                action = "copy"
+
+        tries = 0
+        lastrc = None
+
+        while tries < 5:
+            tries += 1
+            self._output(
+                uri,
+                "[%s|#%s|(%s/%s)] %s: %s" % (
+                    blue(crippled_uri),
+                    darkgreen(str(tries)),
+                    blue(str(counter)),
+                    bold(str(maxcount)),
+                    blue(action),
+                    red(os.path.basename(mypath)),
+                ),
+                importance = 0,
+                level = "info",
+                header = red(" @@ "),
+                back = self._concurrent
+            )
+            with self._active_lock:
+                self._active += 1
+                active = self._active
+            try:
+                handler.set_speed_limit(self._transfer_speed_limit(active))
+                rc = syncer(*myargs)
+                if (not rc) and (fallback_syncer is not None):
+                    # if we have a fallback syncer, try it first
+                    # before giving up.
+                    rc = fallback_syncer(*fallback_args)
+            finally:
+                with self._active_lock:
+                    self._active -= 1
+
+            if rc and not (self.download or self.remove):
+                remote_md5 = handler.get_md5(remote_path)
+                rc = self.handler_verify_upload(mypath, uri,
+                    counter, maxcount, tries, remote_md5 = remote_md5)
+            if rc:
+                self._output(
+                    uri,
+                    "[%s|#%s|(%s/%s)] %s %s: %s" % (
+                                blue(crippled_uri),
+                                darkgreen(str(tries)),
+                                blue(str(counter)),
+                                bold(str(maxcount)),
+                                blue(action),
+                                _("successful"),
+                                red(os.path.basename(mypath)),
+                    ),
+                    importance = 0,
+                    level = "info",
+                    header = darkgreen(" @@ ")
+                )
+                return True, None
+            else:
+                self._output(
+                    uri,
+                    "[%s|#%s|(%s/%s)] %s %s: %s" % (
                                 blue(crippled_uri),
+                                darkgreen(str(tries)),
                                 blue(str(counter)),
                                 bold(str(maxcount)),
                                 blue(action),
-                                darkred("failed, giving up"),
+                                brown(_("failed, retrying")),
                                 red(os.path.basename(mypath)),
-                                _("error"),
-                                lastrc,
                         ),
-                        importance = 1,
-                        level = "error",
-                        header = darkred(" !!! ")
-                    )
+                    importance = 0,
+                    level = "warning",
+                    header = brown(" @@ ")
+                )
+                lastrc = rc
+                continue
 
-                    if mypath not in self.critical_files:
-                        self._entropy.output(
+        self._output(
+            uri,
+            "[%s|(%s/%s)] %s %s: %s - %s: %s" % (
+                    blue(crippled_uri),
+                    blue(str(counter)),
+                    bold(str(maxcount)),
+                    blue(action),
+                    darkred("failed, giving up"),
+                    red(os.path.basename(mypath)),
+                    _("error"),
+                    lastrc,
+            ),
+            importance = 1,
+            level = "error",
+            header = darkred(" !!! ")
+        )
+        return False, lastrc
+
+    def _files(self, uri):
+        """
+        Return the files to transfer to or from the given mirror.
+        """
+        return self._uri_files.get(uri, self.myfiles)
+
+    def _transceive(self, uri):
+
+        fine = set()
+        broken = set()
+        crippled_uri = EntropyTransceiver.get_uri_name(uri)
+
+        queue = []
+        for mypath in self._files(uri):
+            base_dir = self.txc_basedir
+            if isinstance(mypath, tuple):
+                if len(mypath) < 2:
+                    continue
+                base_dir, mypath = mypath
+            queue.append((base_dir, mypath))
+
+        workers = max(1, min(self.MIRROR_WORKERS, len(queue)))
+        try:
+            transceivers = []
+            for _idx in range(workers):
+                txc = EntropyTransceiver(uri)
+                txc.set_output_interface(self._entropy)
+                if self._concurrent:
+                    # transfer progress of concurrent transfers would
+                    # be garbled
+                    txc.set_silent(True)
+                transceivers.append(txc)
+        except TransceiverConnectionError:
+            print_traceback()
+            return True, fine, broken # issues
+
+        maxcount = len(queue)
+        lock = threading.Lock()
+        dirs_lock = threading.Lock()
+        checked_dirs = set()
+        # a failing critical file stops the transfers to its directory only
+        failed_dirs = set()
+        state = {
+            'counter': 0,
+            'fail': False,
+            'error': None,
+        }
+
+        def _worker(txc):
+            try:
+                with txc as handler:
+                    while True:
+                        with lock:
+                            while queue and queue[0][0] in failed_dirs:
+                                queue.pop(0)
+                            if state['error'] is not None or not queue:
+                                return
+                            base_dir, mypath = queue.pop(0)
+                            state['counter'] += 1
+                            counter = state['counter']
+
+                        with dirs_lock:
+                            if base_dir not in checked_dirs:
+                                if not handler.is_dir(base_dir):
+                                    handler.makedirs(base_dir)
+                                checked_dirs.add(base_dir)
+
+                        done, lastrc = self._transceive_file(
+                            handler, uri, base_dir, mypath, counter,
+                            maxcount)
+
+                        with lock:
+                            if done:
+                                fine.add(uri)
+                                continue
+                            if mypath in self.critical_files:
+                                state['fail'] = True
+                                broken.add((uri, lastrc))
+                                # next directory
+                                failed_dirs.add(base_dir)
+                                continue
+
+                        self._output(
+                            uri,
                             "[%s|(%s/%s)] %s: %s, %s..." % (
                                 blue(crippled_uri),
                                 blue(str(counter)),
@@ -322,14 +456,28 @@ class TransceiverServerHandler:
                             level = "warning",
                             header = brown(" @@ ")
                         )
-                        continue
-
-                    fail = True
-                    broken.add((uri, lastrc))
-                    # next mirror
-                    break
+            except Exception as err:
+                if workers == 1:
+                    raise
+                # raised again by the caller thread
+                with lock:
+                    state['fail'] = True
+                    if state['error'] is None:
+                        state['error'] = err
+
+        if workers == 1:
+            _worker(transceivers[0])
+        else:
+            tasks = [ParallelTask(_worker, x) for x in transceivers]
+            for task in tasks:
+                task.daemon = True
+                task.start()
+            for task in tasks:
+                task.join()
+            if state['error'] is not None:
+                raise state['error']
 
-        return fail, fine, broken
+        return state['fail'], fine, broken
 
     def _copy_herustic_support(self, handler, local_path,
             txc_basedir, remote_path):
@@ -340,6 +488,10 @@ class TransceiverServerHandler:
         Thus, it should be only enabled for these kind of uploads.
         """
         pkg_download = self.handlers_data.get('download')
+        downloads = self.handlers_data.get('downloads')
+        if downloads is not None:
+            # "download" metadatum of each remote directory
+            pkg_download = downloads.get(txc_basedir, pkg_download)
         if pkg_download is None:
             # unsupported, we need at least package "download" metadatum
             # to be able to reconstruct a valid remote URI
@@ -371,20 +523,25 @@ class TransceiverServerHandler:
         test_repositories.sort()
 
         local_path_filename = os.path.basename(local_path)
-        local_md5 = None
+        test_remote_paths = []
         for repository_id in test_repositories:
             repo_txc_basedir = \
                 self._entropy.complete_remote_package_relative_path(
                     pkg_download, repository_id)
-            test_remote_path = repo_txc_basedir + "/" + local_path_filename
-            if not handler.is_file(test_remote_path):
-                # not found on this packages mirror
-                continue
-            # then check md5 and compare
-            remote_md5 = handler.get_md5(test_remote_path)
+            test_remote_paths.append(
+                repo_txc_basedir + "/" + local_path_filename)
+
+        # check md5 of all the candidates at once, files not found on
+        # the packages mirror have no md5
+        remote_md5s = handler.get_md5_many(test_remote_paths)
+
+        local_md5 = None
+        for test_remote_path in test_remote_paths:
+            remote_md5 = remote_md5s.get(test_remote_path)
             if not const_isstring(remote_md5):
-                # transceiver or remote server doesn't support md5sum()
-                # so cannot verify the integrity
+                # not found on this packages mirror, or transceiver or
+                # remote server doesn't support md5sum(), so cannot verify
+                # the integrity
                 continue
             if local_md5 is None:
                 local_md5 = md5sum(local_path)
@@ -394,44 +551,86 @@ class TransceiverServerHandler:
 
         return None, None
 
-    def go(self):
-
-        broken_uris = set()
-        fine_uris = set()
-        errors = False
+    def _go_mirror(self, uri):
+        """
+        Handle a single mirror, return a (fail, fine, broken) tuple.
+        """
         action = 'push'
         if self.download:
             action = 'pull'
         elif self.remove:
             action = 'remove'
 
-        for uri in self.uris:
+        crippled_uri = EntropyTransceiver.get_uri_name(uri)
+        self._output(
+            uri,
+            "[%s|%s] %s..." % (
+                blue(crippled_uri),
+                brown(action),
+                blue(_("connecting to mirror")),
+            ),
+            importance = 0,
+            level = "info",
+            header = blue(" @@ ")
+        )
+
+        self._output(
+            uri,
+            "[%s|%s] %s %s..." % (
+                blue(crippled_uri),
+                brown(action),
+                blue(_("setting directory to")),
+                darkgreen(self.txc_basedir),
+            ),
+            importance = 0,
+            level = "info",
+            header = blue(" @@ ")
+        )
 
-            crippled_uri = EntropyTransceiver.get_uri_name(uri)
-            self._entropy.output(
-                "[%s|%s] %s..." % (
-                    blue(crippled_uri),
-                    brown(action),
-                    blue(_("connecting to mirror")),
-                ),
-                importance = 0,
-                level = "info",
-                header = blue(" @@ ")
-            )
+        return self._transceive(uri)
 
-            self._entropy.output(
-                "[%s|%s] %s %s..." % (
-                    blue(crippled_uri),
-                    brown(action),
-                    blue(_("setting directory to")),
-                    darkgreen(self.txc_basedir),
-                ),
-                importance = 0,
-                level = "info",
-                header = blue(" @@ ")
-            )
+    def go(self):
 
-            fail, fine, broken = self._transceive(uri)
+        broken_uris = set()
+        fine_uris = set()
+        errors = False
+
+        parallel_mirrors = max(1, min(self.PARALLEL_MIRRORS, len(self.uris)))
+        max_files = max([len(self._files(x)) for x in self.uris] or [0])
+        workers = max(1, min(self.MIRROR_WORKERS, max_files))
+        self._concurrent = parallel_mirrors * workers > 1
+
+        if parallel_mirrors == 1:
+            outcomes = [self._go_mirror(uri) for uri in self.uris]
+        else:
+            semaphore = threading.BoundedSemaphore(parallel_mirrors)
+            results = {}
+
+            def _mirror_worker(uri):
+                with semaphore:
+                    # do not interleave the messages of different mirrors
+                    self._buffer_output(uri)
+                    try:
+                        results[uri] = self._go_mirror(uri)
+                    except Exception as err:
+                        # raised again by the caller thread
+                        results[uri] = err
+                    finally:
+                        self._flush_output(uri)
+
+            tasks = [ParallelTask(_mirror_worker, x) for x in self.uris]
+            for task in tasks:
+                task.daemon = True
+                task.start()
+            for task in tasks:
+                task.join()
+
+            outcomes = [results[uri] for uri in self.uris]
+            for outcome in outcomes:
+                if isinstance(outcome, Exception):
+                    raise outcome
+
+        for fail, fine, broken in outcomes:
             fine_uris |= fine
             broken_uris |= broken
             if fail:
@@ -40,6 +40,7 @@ from entropy.const import const_debug_write, const_setup_file, etpConst, \
     const_convert_to_unicode, const_isstring, const_debug_enabled
 from entropy.core.settings.base import SystemSettings
 from entropy.exceptions import EntropyException
+from entropy.httppool import HTTPConnectionPool
 import entropy.tools
 import entropy.dep
 
@@ -146,6 +147,11 @@ class WebService(object):
     WEB_SERVICE_NOT_FOUND_CODE = 404
     WEB_SERVICE_RESPONSE_ERROR_CODE = 503
 
+    # SSL context shared by all the HTTPS requests, it is part of the
+    # HTTPConnectionPool key
+    _ssl_context = None
+    _ssl_context_lock = threading.Lock()
+
 
     class WebServiceException(EntropyException):
         """
@@ -419,6 +425,19 @@ class WebService(object):
             self.__cacher = EntropyCacher()
         return self.__cacher
 
+    @classmethod
+    def _get_ssl_context(cls):
+        """
+        Return the SSL context used for HTTPS requests, or None.
+        """
+        if not hasattr(ssl, 'create_default_context'):
+            return None
+        with cls._ssl_context_lock:
+            if WebService._ssl_context is None:
+                WebService._ssl_context = ssl.create_default_context(
+                    purpose = ssl.Purpose.CLIENT_AUTH)
+            return WebService._ssl_context
+
     def _generate_user_agent(self, function_name):
         """
         Generate a standard (entropy services centric) HTTP User Agent.
@@ -508,17 +527,15 @@ class WebService(object):
             " tx_callback: %s, timeout: %s" % (self._request_host, request_path,
                 params, self._transfer_callback, timeout,))
         connection = None
+        reusable = False
+        pool = HTTPConnectionPool()
         try:
             if self._request_protocol == "http":
-                connection = httplib.HTTPConnection(self._request_host,
-                    timeout = timeout)
+                connection = pool.get("http", self._request_host, timeout)
             elif self._request_protocol == "https":
-                ssl_context = None
-                if hasattr(ssl, 'create_default_context'):
-                    ssl_context = ssl.create_default_context(
-                        purpose = ssl.Purpose.CLIENT_AUTH)
-                connection = httplib.HTTPSConnection(
-                    self._request_host, timeout = timeout, context = ssl_context)
+                connection = pool.get(
+                    "https", self._request_host, timeout,
+                    context = self._get_ssl_context())
             else:
                 raise WebService.RequestError("invalid request protocol",
                     method = function_name)
@@ -669,6 +686,10 @@ class WebService(object):
             if self._transfer_callback is not None:
                 self._transfer_callback(total_length, total_length, True)
 
+            # the response has been fully read, the connection can serve
+            # the next request
+            reusable = response.isclosed()
+
             if const_is_python3():
                 outcome = const_convert_to_unicode(outcome)
             if not outcome:
@@ -680,7 +701,10 @@ class WebService(object):
                 method = function_name)
         finally:
             if connection is not None:
-                connection.close()
+                if reusable:
+                    pool.put(connection)
+                else:
+                    pool.discard(connection)
 
     def _setup_credentials(self, request_params):
         """
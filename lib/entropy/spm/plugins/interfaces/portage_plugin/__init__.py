@@ -30,8 +30,8 @@ from entropy.const import etpConst, const_get_stringtype, \
     const_setup_perms, const_setup_file, const_is_python3, \
     const_debug_enabled, const_mkdtemp, const_mkstemp, \
     const_file_readable, const_dir_readable
-from entropy.exceptions import FileNotFound, InvalidDependString, \
-    InvalidAtom, EntropyException
+from entropy.exceptions import InvalidDependString, InvalidAtom, \
+    EntropyException
 from entropy.output import darkred, darkgreen, brown, darkblue, teal, \
     purple, red, bold, blue, getcolor, decolorize, is_mute, is_interactive
 from entropy.i18n import _
@@ -1399,11 +1399,13 @@ class PortagePlugin(SpmPlugin):
         system_settings = SystemSettings()
 
         # fill package name and version
-        data['digest'] = entropy.tools.md5sum(package_file)
+        hashes = entropy.tools.multi_hash(
+            package_file, ("md5", "sha1", "sha256", "sha512"))
+        data['digest'] = hashes['md5']
         data['signatures'] = {
-            'sha1': entropy.tools.sha1(package_file),
-            'sha256': entropy.tools.sha256(package_file),
-            'sha512': entropy.tools.sha512(package_file),
+            'sha1': hashes['sha1'],
+            'sha256': hashes['sha256'],
+            'sha512': hashes['sha512'],
             'gpg': None, # GPG signature will be filled later on, if enabled
         }
         data['datecreation'] = str(os.path.getmtime(package_file))
@@ -4683,7 +4685,7 @@ class PortagePlugin(SpmPlugin):
         Generate NEEDED.ELF.2 metadata by scraping the package
         content directly. For: needed_libs metadata.
         """
-        needed_libs = set()
+        elf_objs = {}
         for obj, ftype in content.items():
 
             if ftype != "obj":
@@ -4699,20 +4701,25 @@ class PortagePlugin(SpmPlugin):
             try:
                 if not entropy.tools.is_elf_file(unpack_obj):
                     continue
-                elf_class = entropy.tools.read_elf_class(unpack_obj)
             except IOError as err:
                 self.__output.output("%s: %s => %s" % (
                     _("IOError while reading"), unpack_obj, repr(err),),
                     level = "warning")
                 continue
 
-            meta = entropy.tools.read_elf_metadata(unpack_obj)
+            elf_objs[unpack_obj] = obj
+
+        needed_libs = set()
+        elf_metadata = entropy.tools.read_elf_metadata_many(elf_objs)
+        for unpack_obj, meta in elf_metadata.items():
             if meta is None:
                 continue
 
+            obj = elf_objs[unpack_obj]
             for soname in meta['needed']:
                 needed_libs.add((
-                    obj, meta['soname'], soname, elf_class, meta['runpath']))
+                    obj, meta['soname'], soname, meta['class'],
+                    meta['runpath']))
 
         return frozenset(needed_libs)
 
@@ -4766,7 +4773,7 @@ class PortagePlugin(SpmPlugin):
         # NOTE: this does not take into account changes to environment
         # caused by the installation of the package, if this metadata
         # is read off a non-installed one.
-        provided_libs = set()
+        elf_objs = {}
         for obj, ftype in content.items():
 
             if ftype not in ("obj", "sym"):
@@ -4792,16 +4799,18 @@ class PortagePlugin(SpmPlugin):
                     level = "warning")
                 continue
 
-            try:
-                elf_meta = entropy.tools.read_elf_metadata(unpack_obj)
-            except FileNotFound:
-                continue
+            elf_objs[unpack_obj] = obj
 
+        provided_libs = set()
+        elf_metadata = entropy.tools.read_elf_metadata_many(elf_objs)
+        for unpack_obj, elf_meta in elf_metadata.items():
             if elf_meta is None:
                 continue
 
             if elf_meta['soname']:  # no soname == no shared library
-                provided_libs.add((elf_meta['soname'], obj, elf_meta['class'],))
+                provided_libs.add(
+                    (elf_meta['soname'], elf_objs[unpack_obj],
+                     elf_meta['class'],))
 
         return provided_libs
 
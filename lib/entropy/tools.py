@@ -33,6 +33,7 @@ import bz2
 import mmap
 import codecs
 import struct
+import threading
 
 from entropy.output import print_generic
 from entropy.const import etpConst, const_kill_threads, const_islive, \
@@ -41,8 +42,15 @@ from entropy.const import etpConst, const_kill_threads, const_islive, \
     const_mkstemp, const_file_readable
 from entropy.exceptions import FileNotFound, InvalidAtom, DirectoryNotFound
 
+import entropy.elf
+
 
 _READ_SIZE = 1024000
+# read buffer size used by multi_hash()
+_HASH_READ_SIZE = 4 * 1024 * 1024
+# maximum number of files hashed concurrently by multi_hash_files(),
+# can be overridden through the ETP_HASH_WORKERS env var.
+_HASH_WORKERS = 4
 
 
 def is_root():
@@ -838,6 +846,100 @@ def split_indexable_into_chunks(mystr, chunk_len):
         mylen -= my_chunk_len
     return chunks
 
+def multi_hash(filepath, algorithms):
+    """
+    Calculate multiple hashes of given file at path, reading it only once.
+
+    @param filepath: path to file
+    @type filepath: string
+    @param algorithms: hashlib algorithm names (for example: "md5", "sha1")
+    @type algorithms: iterable
+    @return: algorithm name -> hex digest map
+    @rtype: dict
+    @raise OSError: if the file cannot be read
+    @raise IOError: if the file cannot be read
+    """
+    digests = dict((x, hashlib.new(x)) for x in algorithms)
+    updates = [x.update for x in digests.values()]
+
+    with open(filepath, "rb", 0) as readfile:
+        # do not allocate a large buffer for small files
+        size = os.fstat(readfile.fileno()).st_size
+        buf_size = min(_HASH_READ_SIZE, max(size, _READ_SIZE // 8))
+        buf = bytearray(buf_size)
+        view = memoryview(buf)
+        while True:
+            count = readfile.readinto(buf)
+            if not count:
+                break
+            if count < buf_size:
+                chunk = view[:count]
+            else:
+                chunk = view
+            for update in updates:
+                update(chunk)
+
+    return dict((k, v.hexdigest()) for k, v in digests.items())
+
+def multi_hash_files(filepaths, algorithms, workers = None):
+    """
+    Calculate multiple hashes of the given files, see multi_hash().
+    Files are hashed concurrently by a pool of threads, since hashlib
+    releases the GIL while hashing.
+
+    @param filepaths: list of paths to files
+    @type filepaths: list
+    @param algorithms: hashlib algorithm names (for example: "md5", "sha1")
+    @type algorithms: iterable
+    @keyword workers: maximum number of files hashed concurrently, if None,
+        the ETP_HASH_WORKERS env var or a built-in default is used
+    @type workers: int
+    @return: path -> (algorithm name -> hex digest map) map, the value is
+        None for files that cannot be read
+    @rtype: dict
+    """
+    if workers is None:
+        workers = os.getenv("ETP_HASH_WORKERS", _HASH_WORKERS)
+        try:
+            workers = int(workers)
+        except ValueError:
+            workers = _HASH_WORKERS
+    algorithms = tuple(algorithms)
+
+    pending = list(filepaths)
+    pending.reverse()
+    pending_lock = threading.Lock()
+    results = dict((x, None) for x in pending)
+
+    def _worker():
+        while True:
+            with pending_lock:
+                if not pending:
+                    return
+                filepath = pending.pop()
+            try:
+                results[filepath] = multi_hash(filepath, algorithms)
+            except (OSError, IOError):
+                pass
+
+    workers = min(max(1, workers), len(pending))
+    if workers < 2:
+        _worker()
+        return results
+
+    threads = []
+    for idx in range(workers):
+        thread = threading.Thread(target = _worker)
+        thread.name = "MultiHash-%d" % (idx,)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        # use a timeout, or signals are blocked on Python 2
+        while thread.is_alive():
+            thread.join(1.0)
+    return results
+
 def md5sum(filepath):
     """
     Calculate md5 hash of given file at path.
@@ -847,13 +949,7 @@ def md5sum(filepath):
     @return: md5 hex digest
     @rtype: string
     """
-    m = hashlib.md5()
-    with open(filepath, "rb") as readfile:
-        block = readfile.read(_READ_SIZE)
-        while block:
-            m.update(block)
-            block = readfile.read(_READ_SIZE)
-    return m.hexdigest()
+    return multi_hash(filepath, ("md5",))["md5"]
 
 def sha512(filepath):
     """
@@ -864,13 +960,7 @@ def sha512(filepath):
     @return: SHA512 hex digest
     @rtype: string
     """
-    m = hashlib.sha512()
-    with open(filepath, "rb") as readfile:
-        block = readfile.read(_READ_SIZE)
-        while block:
-            m.update(block)
-            block = readfile.read(_READ_SIZE)
-    return m.hexdigest()
+    return multi_hash(filepath, ("sha512",))["sha512"]
 
 def sha256(filepath):
     """
@@ -881,13 +971,7 @@ def sha256(filepath):
     @return: SHA256 hex digest
     @rtype: string
     """
-    m = hashlib.sha256()
-    with open(filepath, "rb") as readfile:
-        block = readfile.read(_READ_SIZE)
-        while block:
-            m.update(block)
-            block = readfile.read(_READ_SIZE)
-    return m.hexdigest()
+    return multi_hash(filepath, ("sha256",))["sha256"]
 
 def sha1(filepath):
     """
@@ -898,13 +982,7 @@ def sha1(filepath):
     @return: SHA1 hex digest
     @rtype: string
     """
-    m = hashlib.sha1()
-    with open(filepath, "rb") as readfile:
-        block = readfile.read(_READ_SIZE)
-        while block:
-            m.update(block)
-            block = readfile.read(_READ_SIZE)
-    return m.hexdigest()
+    return multi_hash(filepath, ("sha1",))["sha1"]
 
 def md5sum_directory(directory):
     """
@@ -2105,6 +2183,35 @@ def uncompress_tarball(filepath, extract_path = None, catch_empty = False):
     if not os.path.isfile(filepath):
         raise FileNotFound('FileNotFound: archive does not exist')
 
+    return _uncompress_tarball(
+        lambda: tarfile.open(filepath, "r"),
+        extract_path, catch_empty)
+
+def uncompress_tarball_stream(fileobj, extract_path, catch_empty = False):
+    """
+    Unpack tarball data sequentially read from a file object, which is not
+    required to be seekable, like uncompress_tarball() does for files.
+    Only the tarball data is consumed, the caller is in charge of reading
+    any trailing data.
+
+    @param fileobj: file object exposing a read() method
+    @type fileobj: file object
+    @param extract_path: path where to extract tarball
+    @type extract_path: string
+    @keyword catch_empty: do not raise exceptions when trying to unpack empty
+        file
+    @type catch_empty: bool
+    @return: exit status
+    @rtype: int
+    """
+    return _uncompress_tarball(
+        lambda: tarfile.open(fileobj = fileobj, mode = "r|*"),
+        extract_path, catch_empty)
+
+def _uncompress_tarball(open_func, extract_path, catch_empty):
+    """
+    Unpack the tarball returned by open_func, see uncompress_tarball().
+    """
     def _setup_file_metadata(tarinfo, epath):
         try:
             tar.chown(tarinfo, epath)
@@ -2135,7 +2242,7 @@ def uncompress_tarball(filepath, extract_path = None, catch_empty = False):
     try:
 
         try:
-            tar = tarfile.open(filepath, "r")
+            tar = open_func()
         except tarfile.ReadError:
             if catch_empty:
                 return 0
@@ -2702,6 +2809,33 @@ def resolve_dynamic_library(library, requiring_executable):
 
     return found_path
 
+def _read_elf_metadata(elf_file):
+    """
+    Read ELF dynamic linking metadata through entropy.elf, turning
+    read errors into FileNotFound exceptions.
+    """
+    try:
+        return entropy.elf.read_metadata(elf_file)
+    except (OSError, IOError) as err:
+        raise FileNotFound("cannot read %s: %s" % (elf_file, err))
+    except entropy.elf.ElfError as err:
+        raise FileNotFound("malformed ELF object %s: %s" % (elf_file, err))
+
+def _elf_metadata_to_legacy(meta):
+    """
+    Convert entropy.elf metadata into the read_elf_metadata() format.
+    """
+    paths = []
+    for rpath in (meta['rpath'], meta['runpath']):
+        if rpath and rpath not in paths:
+            paths.append(rpath)
+    return {
+        'soname': meta['soname'],
+        'class': meta['class'],
+        'runpath': ":".join(paths),
+        'needed': set(meta['needed']),
+    }
+
 def read_elf_dynamic_libraries(elf_file):
     """
     Extract NEEDED metadatum from ELF file at path.
@@ -2710,39 +2844,12 @@ def read_elf_dynamic_libraries(elf_file):
     @type elf_file: string
     @return: list (set) of strings in NEEDED metadatum
     @rtype: set
+    @raise FileNotFound: if the ELF file cannot be read
     """
-    proc = None
-    args = ("/usr/bin/scanelf", "-qF", "%n", elf_file)
-
-    out = None
-    try:
-        proc = subprocess.Popen(args, stdout = subprocess.PIPE)
-        exit_st = proc.wait()
-        if exit_st != 0:
-            raise FileNotFound("scanelf failure")
-        out = proc.stdout.read()
-
-    except (OSError, IOError) as err:
-        if err.errno != errno.ENOENT:
-            raise
-        raise FileNotFound("/usr/bin/scanelf not found")
-
-    finally:
-        if proc is not None:
-            try:
-                proc.stdout.close()
-            except (OSError, IOError):
-                pass
-
-    outcome = set()
-    if out is not None:
-        if const_is_python3():
-            out = const_convert_to_unicode(out)
-        for line in out.split("\n"):
-            if line:
-                libs = line.strip().split(" ", -1)[0].split(",")
-                outcome.update(libs)
-    return outcome
+    meta = _read_elf_metadata(elf_file)
+    if meta is None:
+        return set()
+    return set(meta['needed'])
 
 def read_elf_metadata(elf_file):
     """
@@ -2753,110 +2860,110 @@ def read_elf_metadata(elf_file):
     @return: dict with "soname", "class", "runpath" and "needed" keys. None if
         no metadata is found.
     @rtype: dict or None
+    @raise FileNotFound: if the ELF file cannot be read
     """
-    proc = None
-    args = ("/usr/bin/scanelf", "-qF", "%M;%S;%r;%n", elf_file)
-
-    out = None
-    try:
-        proc = subprocess.Popen(args, stdout = subprocess.PIPE)
-        exit_st = proc.wait()
-        if exit_st != 0:
-            raise FileNotFound("scanelf failure")
-        out = proc.stdout.read()
-
-    except (OSError, IOError) as err:
-        if err.errno != errno.ENOENT:
-            raise
-        raise FileNotFound("/usr/bin/scanelf not found")
-
-    finally:
-        if proc is not None:
-            try:
-                proc.stdout.close()
-            except (OSError, IOError):
-                pass
+    meta = _read_elf_metadata(elf_file)
+    if meta is None:
+        return None
+    return _elf_metadata_to_legacy(meta)
 
-    if out is not None:
-        if const_is_python3():
-            out = const_convert_to_unicode(out)
-        if not out:
-            # no metadata.
-            return None
+def read_elf_metadata_many(elf_files):
+    """
+    Batch version of read_elf_metadata(). All the files are parsed
+    in-process, unreadable files and non-ELF objects are mapped to None.
 
-        for line in out.split("\n"):
-            if line:
-                data = line.strip().split(" ", -1)[0]
-                elfclass_str, soname, runpath, libs = data.split(";")
-                libs = set(libs.split(","))
-                return {
-                    'soname': soname,
-                    'class': elf_class_strtoint(elfclass_str),
-                    'runpath': runpath,
-                    'needed': libs,
-                }
+    @param elf_files: list of paths to ELF files
+    @type elf_files: iterable
+    @return: dict mapping ELF file path to read_elf_metadata() output
+    @rtype: dict
+    """
+    outcome = {}
+    for elf_file, meta in entropy.elf.read_metadata_many(elf_files).items():
+        if meta is not None:
+            meta = _elf_metadata_to_legacy(meta)
+        outcome[elf_file] = meta
+    return outcome
 
-    raise FileNotFound("scanelf failure")
+def _find_elf_library(library, ld_paths, elf_class):
+    """
+    Look for a library with the given ELF class into ld_paths.
+    """
+    for ld_dir in ld_paths:
+        lib_path = os.path.join(ld_dir, library)
+        if os.path.isdir(lib_path):
+            continue
+        if not const_file_readable(lib_path):
+            continue
+        try:
+            if not is_elf_file(lib_path):
+                continue
+            if read_elf_class(lib_path) != elf_class:
+                continue
+        except (OSError, IOError, struct.error):
+            continue
+        return lib_path
+    return None
 
 def read_elf_real_dynamic_libraries(elf_file):
     """
-    This function is similar to read_elf_dynamic_libraries but uses ldd to
-    retrieve a list of "real" .so library dependencies used by the ELF file.
+    This function is similar to read_elf_dynamic_libraries but it walks
+    the whole NEEDED graph, like ldd does, to retrieve a list of "real"
+    .so library dependencies used by the ELF file.
     This is useful to ensure that there are no .so libraries missing in the
-    dependencies, because ldd expands and resolves the .so dependency graph.
-    This is anyway dangerous because the output returned by ldd is somehow
+    dependencies, because the .so dependency graph is expanded and resolved.
+    This is anyway dangerous because the outcome is somehow
     environment-dependent, so make sure this function is only used for
     informative purposes, and not for adding real dependencies to a package.
+    Libraries that cannot be resolved are returned as well.
 
     @param elf_file: path to ELF file
     @type elf_file: string
     @return: list (set) of strings in NEEDED metadatum
     @rtype: set
-    @raise FileNotFound: if ldd is not found
+    @raise FileNotFound: if the ELF file cannot be read
     """
     # use the real path, so that it can be dropped from the resulting set
     elf_file = os.path.realpath(elf_file)
-
-    proc = None
-    output = None
-    args = ("/usr/bin/lddtree", "-l", elf_file)
-
-    try:
-        proc = subprocess.Popen(args, stdout = subprocess.PIPE)
-
-        output = const_convert_to_unicode("")
-
-        while True:
-
-            out = proc.stdout.read()
-            if not out:
-                break
-
-            if const_is_python3():
-                out = const_convert_to_unicode(out)
-            output += out
-
-        exit_st = proc.wait()
-        if exit_st != 0:
-            raise FileNotFound("lddtree returned error %d on %s" % (
-                exit_st, elf_file))
-
-    except (OSError, IOError) as err:
-        if err.errno != errno.ENOENT:
-            raise
-        raise FileNotFound("/usr/bin/lddtree not found")
-
-    finally:
-        if proc is not None:
-            proc.stdout.close()
-
+    meta = _read_elf_metadata(elf_file)
     outcome = set()
-    if output is not None:
-        for line in output.split("\n"):
-            if line == elf_file:
+    if meta is None:
+        return outcome
+
+    linker_paths = collect_linker_paths()
+    seen = set([elf_file])
+    queue = collections.deque()
+    queue.append((meta, []))
+
+    while queue:
+        meta, inherited_rpath = queue.popleft()
+        if meta['interpreter']:
+            outcome.add(os.path.basename(meta['interpreter']))
+
+        # DT_RPATH is used only if DT_RUNPATH is not set and it is
+        # inherited by the dependencies, DT_RUNPATH is not.
+        rpath = list(inherited_rpath)
+        if not meta['runpath']:
+            rpath += [x for x in parse_rpath(meta['rpath']) if x]
+        runpath = [x for x in parse_rpath(meta['runpath']) if x]
+        ld_paths = rpath + runpath + list(linker_paths)
+        if meta['class'] == entropy.elf.ELFCLASS64:
+            ld_paths += ["/lib64", "/usr/lib64"]
+
+        for library in meta['needed']:
+            outcome.add(library)
+            lib_path = _find_elf_library(library, ld_paths, meta['class'])
+            if lib_path is None:
                 continue
-            if line:
-                outcome.add(os.path.basename(line))
+            lib_path = os.path.realpath(lib_path)
+            if lib_path in seen:
+                continue
+            seen.add(lib_path)
+            try:
+                lib_meta = entropy.elf.read_metadata(lib_path)
+            except (OSError, IOError, entropy.elf.ElfError):
+                continue
+            if lib_meta is not None:
+                queue.append((lib_meta, rpath))
 
     return outcome
 
@@ -2921,40 +3028,21 @@ def read_elf_linker_paths(elf_file):
     @type elf_file: string
     @return: list of extracted built-in linker paths.
     @rtype: list
+    @raise FileNotFound: if the ELF file cannot be read
     """
-    proc = None
-    args = ("/usr/bin/scanelf", "-qF", "%r", elf_file)
-    out = None
-
-    try:
-        proc = subprocess.Popen(args, stdout = subprocess.PIPE)
-        exit_st = proc.wait()
-        if exit_st != 0:
-            raise FileNotFound("scanelf error")
-
-        out = proc.stdout.read()
-
-    except (OSError, IOError) as err:
-        if err.errno != errno.ENOENT:
-            raise
-        raise FileNotFound("/usr/bin/scanelf not found")
-
-    finally:
-        if proc is not None:
-            proc.stdout.close()
+    meta = _read_elf_metadata(elf_file)
 
     outcome = []
-    if out is not None:
+    if meta is not None:
 
         elf_dir = os.path.dirname(elf_file)
-        if const_is_python3():
-            out = const_convert_to_unicode(out)
-        for line in out.split("\n"):
-            if line:
-                paths = line.strip().split(" ", -1)[0].split(",")
-                for path in paths:
-                    path = path.replace("$ORIGIN", elf_dir)
-                    path = path.replace("${ORIGIN}", elf_dir)
+        for rpath in (meta['rpath'], meta['runpath']):
+            for path in parse_rpath(rpath):
+                if not path:
+                    continue
+                path = path.replace("$ORIGIN", elf_dir)
+                path = path.replace("${ORIGIN}", elf_dir)
+                if path not in outcome:
                     outcome.append(path)
 
     return outcome
@@ -273,6 +273,23 @@ class EntropyFileUriHandler(EntropyUriHandler):
 
         return data
 
+    def list_directory_stamps(self, remote_path):
+        remote_str = self._setup_remote_path(remote_path)
+        if not os.path.isdir(remote_str):
+            return None
+
+        data = {}
+        for currentdir, subdirs, files in os.walk(remote_str):
+            path = os.path.relpath(currentdir, remote_str)
+            if path == os.curdir:
+                path = ""
+            try:
+                data[path] = repr(os.stat(currentdir).st_mtime)
+            except OSError as err:
+                if err.errno != errno.ENOENT:
+                    raise
+        return data
+
     def is_dir(self, remote_path):
         remote_str = self._setup_remote_path(remote_path)
         return os.path.isdir(remote_str)
@@ -15,6 +15,11 @@ import errno
 import time
 import shutil
 import codecs
+import threading
+try:
+    from shlex import quote as _shell_quote
+except ImportError:
+    from pipes import quote as _shell_quote
 
 from entropy.const import const_isnumber, const_debug_write, \
     const_mkdtemp, const_mkstemp, etpConst
@@ -27,6 +32,9 @@ class EntropySshUriHandler(EntropyUriHandler):
 
     """
     EntropyUriHandler based SSH (with pubkey) transceiver plugin.
+    All the ssh and scp commands of a handler instance share a single
+    SSH connection (OpenSSH ControlMaster), opened on first use and
+    closed by close().
     """
 
     PLUGIN_API_VERSION = 4
@@ -36,6 +44,15 @@ class EntropySshUriHandler(EntropyUriHandler):
     _TXC_CMD = "/usr/bin/scp"
     _SSH_CMD = "/usr/bin/ssh"
 
+    # set ETP_SSH_DISABLE_MULTIPLEXING to open a new SSH connection
+    # for every command
+    _MULTIPLEXING = os.getenv("ETP_SSH_DISABLE_MULTIPLEXING") is None
+    # seconds the master connection is kept alive once idle, if close()
+    # is never called
+    _CONTROL_PERSIST = 300
+    # maximum number of files per get_md5_many() remote command
+    _MD5_BATCH_SIZE = 256
+
     @staticmethod
     def approve_uri(uri):
         if uri.startswith("ssh://"):
@@ -62,6 +79,10 @@ class EntropySshUriHandler(EntropyUriHandler):
         self.__host = EntropySshUriHandler.get_uri_name(self._uri)
         self.__user, self.__port, self.__dir = self.__extract_scp_data(
             self._uri)
+        self.__master_lock = threading.Lock()
+        # None: not started yet, False: not available
+        self.__control_path = None
+        self.__control_dir = None
 
     def __enter__(self):
         pass
@@ -184,19 +205,97 @@ class EntropySshUriHandler(EntropyUriHandler):
 
         return exec_rc, output, error
 
-    def _setup_common_args(self, remote_path):
+    def _get_remote_str(self):
+        remote_str = ""
+        if self.__user:
+            remote_str += self.__user + "@"
+        remote_str += self.__host
+        return remote_str
+
+    def _setup_timeout_args(self):
         args = []
         if const_isnumber(self._timeout):
             args += ["-o", "ConnectTimeout=%s" % (self._timeout,),
                 "-o", "ServerAliveCountMax=4", # hardcoded
                 "-o", "ServerAliveInterval=15"] # hardcoded
+        return args
+
+    def _setup_master_args(self):
+        """
+        Return the ssh/scp arguments needed to share the master connection,
+        starting it if needed. If the master connection cannot be started,
+        commands fall back to their own connection.
+        """
+        if not EntropySshUriHandler._MULTIPLEXING:
+            return []
+
+        with self.__master_lock:
+            if self.__control_path is None:
+                self.__control_path = self.__start_master()
+            control_path = self.__control_path
+
+        if not control_path:
+            return []
+        # if the master connection died, ssh connects directly
+        return ["-o", "ControlMaster=no",
+                "-o", "ControlPath=%s" % (control_path,)]
+
+    def __start_master(self):
+        """
+        Start the master connection in background, return its control
+        socket path or False.
+        """
+        control_dir = const_mkdtemp(prefix="entropy.transceivers.ssh")
+        control_path = os.path.join(control_dir, "master")
+
+        args = [EntropySshUriHandler._SSH_CMD, "-p", str(self.__port)]
+        args += self._setup_timeout_args()
+        args += ["-o", "ControlMaster=yes",
+                 "-o", "ControlPath=%s" % (control_path,),
+                 "-o", "ControlPersist=%d" % (
+                     EntropySshUriHandler._CONTROL_PERSIST,),
+                 "-f", "-N", self._get_remote_str()]
+
+        with open(os.devnull, "r+b") as null_f:
+            proc = self._subprocess.Popen(args, stdin = null_f,
+                stdout = null_f, stderr = null_f)
+            exec_rc = proc.wait()
+
+        const_debug_write(__name__,
+            "__start_master(): %s, rc: %s" % (control_path, exec_rc,))
+        if exec_rc != os.EX_OK:
+            shutil.rmtree(control_dir, True)
+            return False
+
+        self.__control_dir = control_dir
+        return control_path
+
+    def __stop_master(self):
+        """
+        Terminate the master connection, if any.
+        """
+        with self.__master_lock:
+            control_path, self.__control_path = self.__control_path, None
+            control_dir, self.__control_dir = self.__control_dir, None
+
+        if control_path:
+            args = [EntropySshUriHandler._SSH_CMD, "-p", str(self.__port),
+                    "-o", "ControlPath=%s" % (control_path,),
+                    "-O", "exit", self._get_remote_str()]
+            with open(os.devnull, "r+b") as null_f:
+                proc = self._subprocess.Popen(args, stdin = null_f,
+                    stdout = null_f, stderr = null_f)
+                proc.wait()
+        if control_dir:
+            shutil.rmtree(control_dir, True)
+
+    def _setup_common_args(self, remote_path):
+        args = self._setup_master_args()
+        args += self._setup_timeout_args()
         if self._speed_limit:
             args += ["-l", str(self._speed_limit*8)] # scp wants kbits/sec
         remote_ptr = os.path.join(self.__dir, remote_path)
-        remote_str = ""
-        if self.__user:
-            remote_str += self.__user + "@"
-        remote_str += self.__host + ":" + remote_ptr
+        remote_str = self._get_remote_str() + ":" + remote_ptr
 
         return args, remote_str
 
@@ -361,11 +460,8 @@ class EntropySshUriHandler(EntropyUriHandler):
 
     def _setup_fs_args(self):
         args = [EntropySshUriHandler._SSH_CMD, "-p", str(self.__port)]
-        remote_str = ""
-        if self.__user:
-            remote_str += self.__user + "@"
-        remote_str += self.__host
-        return args, remote_str
+        args += self._setup_master_args()
+        return args, self._get_remote_str()
 
     def rename(self, remote_path_old, remote_path_new):
         args, remote_str = self._setup_fs_args()
@@ -414,6 +510,29 @@ class EntropySshUriHandler(EntropyUriHandler):
             return None
         return output.strip().split()[0]
 
+    def get_md5_many(self, remote_paths):
+        md5s = dict((x, None) for x in remote_paths)
+        remote_paths = list(md5s.keys())
+        batch_size = EntropySshUriHandler._MD5_BATCH_SIZE
+
+        for idx in range(0, len(remote_paths), batch_size):
+            batch = remote_paths[idx:idx + batch_size]
+            args, remote_str = self._setup_fs_args()
+            # md5sum prints the paths as given, run it from the base
+            # directory, so that they match remote_paths
+            args += [remote_str, "cd", self.__dir, "&&", "md5sum", "--"]
+            args += [_shell_quote(x) for x in batch]
+            # non-zero exit status if any file is missing, the output
+            # still contains the available ones
+            exec_rc, output, error = self._exec_cmd(args)
+            for line in output.split("\n"):
+                digest, _sep, path = line.partition(" ")
+                # "<digest>  <path>" or "<digest> *<path>" (binary mode)
+                path = path[1:]
+                if path in md5s:
+                    md5s[path] = digest
+        return md5s
+
     def list_content(self, remote_path):
         args, remote_str = self._setup_fs_args()
         remote_ptr = os.path.join(self.__dir, remote_path)
@@ -441,6 +560,43 @@ class EntropySshUriHandler(EntropyUriHandler):
             data.append((name, size, owner, group, perms,))
         return data
 
+    def list_content_recursive(self, remote_path):
+        args, remote_str = self._setup_fs_args()
+        remote_ptr = os.path.join(self.__dir, remote_path)
+        args += [remote_str, "find", remote_ptr, "-mindepth", "1",
+                 "!", "-type", "d", "-printf", _shell_quote("%s %P\\n")]
+        exec_rc, output, error = self._exec_cmd(args)
+        if exec_rc:
+            return []
+
+        data = []
+        for item in output.split("\n"):
+            size, _sep, path = item.partition(" ")
+            if not path:
+                continue
+            try:
+                data.append((path, int(size)))
+            except ValueError:
+                continue
+        return data
+
+    def list_directory_stamps(self, remote_path):
+        args, remote_str = self._setup_fs_args()
+        remote_ptr = os.path.join(self.__dir, remote_path)
+        args += [remote_str, "find", remote_ptr, "-type", "d",
+                 "-printf", _shell_quote("%T@ %P\\n")]
+        exec_rc, output, error = self._exec_cmd(args)
+        if exec_rc:
+            # missing directory or no GNU find
+            return None
+
+        data = {}
+        for item in output.split("\n"):
+            stamp, _sep, path = item.partition(" ")
+            if stamp:
+                data[path] = stamp
+        return data
+
     def is_dir(self, remote_path):
         args, remote_str = self._setup_fs_args()
         remote_ptr = os.path.join(self.__dir, remote_path)
@@ -473,4 +629,4 @@ class EntropySshUriHandler(EntropyUriHandler):
         return
 
     def close(self):
-        return
+        self.__stop_master()
@@ -9,6 +9,8 @@
     B{Entropy Transceivers class prototypes module}.
 
 """
+import os
+
 from entropy.const import const_isnumber
 from entropy.output import TextInterface
 
@@ -301,6 +303,20 @@ class EntropyUriHandler(TextInterface):
         """
         raise NotImplementedError()
 
+    def get_md5_many(self, remote_paths):
+        """
+        Return MD5 checksums of many files at URI. Handlers should
+        reimplement this using a single remote operation, the default
+        implementation calls get_md5() for each file.
+
+        @param remote_paths: list of remote paths to handle
+        @type remote_paths: list
+        @return: dict mapping remote paths to MD5 checksums in hexdigest
+            form, or None (if not supported or file not available)
+        @rtype: dict
+        """
+        return dict((x, self.get_md5(x)) for x in remote_paths)
+
     def list_content(self, remote_path):
         """
         List content of directory referenced at URI.
@@ -327,6 +343,49 @@ class EntropyUriHandler(TextInterface):
         """
         raise NotImplementedError()
 
+    def list_content_recursive(self, remote_path):
+        """
+        List the files in the directory tree referenced at URI, in this form:
+        [(path relative to remote_path, size), ...]
+        Handlers should reimplement this using a single remote operation,
+        the default implementation calls list_content_metadata() for each
+        directory.
+
+        @param remote_path: remote path to handle
+        @type remote_path: string
+        @return: content
+        @rtype: list
+        """
+        content = []
+        directories = [""]
+        while directories:
+            directory = directories.pop(0)
+            info = self.list_content_metadata(
+                os.path.join(remote_path, directory))
+            for name, size, _owner, _group, perms in info:
+                path = os.path.join(directory, name)
+                if perms.startswith("d"):
+                    directories.append(path)
+                else:
+                    content.append((path, int(size)))
+        return content
+
+    def list_directory_stamps(self, remote_path):
+        """
+        Return the modification stamps of the directory referenced at URI
+        and of all the directories below it, in this form:
+        {path relative to remote_path ("" for remote_path): stamp, ...}
+        A directory stamp changes whenever entries are added, removed or
+        renamed inside it, stamps are opaque and can only be compared.
+
+        @param remote_path: remote path to handle
+        @type remote_path: string
+        @return: stamps, or None (if not supported or remote_path is not
+            available)
+        @rtype: dict
+        """
+        return None
+
     def is_path_available(self, remote_path):
         """
         Given a remote path (which can point to dir or file), determine whether
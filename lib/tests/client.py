@@ -5,20 +5,38 @@ sys.path.insert(0, '../../client')
 sys.path.insert(0, '.')
 sys.path.insert(0, '../')
 import unittest
+import errno
 import os
 import shutil
 import signal
+import threading
 import time
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
 
 from entropy.client.interfaces import Client
 from entropy.client.interfaces.db import InstalledPackagesRepository
+from entropy.client.interfaces.repository import Repository
+from entropy.client.interfaces.package import PackageInstallScheduler
+from entropy.client.interfaces.package.actions._merge import \
+    ConfigProtectMatcher, LiveFilesystem, PathPrefixTrie, is_dir, is_file, \
+    is_link
+from entropy.client.interfaces.package.actions._stream import \
+    PackageStreamUnpacker
 from entropy.client.interfaces.package.actions._triggers import Trigger
-from entropy.cache import EntropyCacher
+from entropy.client.interfaces.package.store import PackageStore
+from entropy.cache import EntropyCacher, PackedCacheStore
 from entropy.const import etpConst, const_mkdtemp
 from entropy.output import set_mute
 from entropy.core.settings.base import SystemSettings
 from entropy.db import EntropyRepository
+from entropy.db.skel import EntropyRepositoryBase
 from entropy.exceptions import RepositoryError, EntropyPackageException
+from entropy.misc import ParallelTask
 import entropy.tools
 import tests._misc as _misc
 
@@ -142,6 +160,609 @@ class EntropyClientTest(unittest.TestCase):
         finally:
             shutil.rmtree(tmp_dir, True)
 
+    def test_cacher_packed_store(self):
+        cacher = self.Client._cacher
+        tmp_dir = const_mkdtemp()
+        backend = EntropyCacher.BACKEND
+        cacher.close_stores()
+        EntropyCacher.BACKEND = "packed"
+        cacher.start()
+        try:
+            for idx in range(10):
+                cacher.push("foo/bar_%d" % (idx,), [idx],
+                            cache_dir = tmp_dir)
+            cacher.push("foo/bar_0", "new", cache_dir = tmp_dir)
+            cacher.push("baz", {"a": 1}, cache_dir = tmp_dir)
+            cacher.sync()
+            self.assertEqual(os.listdir(tmp_dir),
+                             [PackedCacheStore.FILE_NAME])
+
+            cacher.discard()
+            self.assertEqual(cacher.pop("foo/bar_0", cache_dir = tmp_dir),
+                             "new")
+            self.assertEqual(cacher.pop("foo/bar_5", cache_dir = tmp_dir),
+                             [5])
+            self.assertEqual(cacher.pop("baz", cache_dir = tmp_dir),
+                             {"a": 1})
+            self.assertEqual(cacher.pop("baz", cache_dir = tmp_dir,
+                                        aging_days = -1), None)
+
+            cacher.remove("foo/bar_5", cache_dir = tmp_dir)
+            self.assertEqual(cacher.pop("foo/bar_5", cache_dir = tmp_dir),
+                             None)
+            EntropyCacher.clear_cache_item("foo/bar", cache_dir = tmp_dir)
+            self.assertEqual(cacher.pop("foo/bar_1", cache_dir = tmp_dir),
+                             None)
+            self.assertEqual(cacher.pop("baz", cache_dir = tmp_dir),
+                             {"a": 1})
+
+            cacher.compact(cache_dir = tmp_dir, aging_days = -1)
+            self.assertEqual(cacher.pop("baz", cache_dir = tmp_dir), None)
+        finally:
+            cacher.stop()
+            cacher.close_stores()
+            EntropyCacher.BACKEND = backend
+            shutil.rmtree(tmp_dir, True)
+
+    def test_benchmark_mirrors(self):
+        requests = []
+
+        class MirrorHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                requests.append(self.path)
+                if not self.path.endswith("/MIRROR_TEST"):
+                    self.send_error(404)
+                    return
+                if self.path.startswith("/slow/"):
+                    time.sleep(0.5)
+                data = b"x" * 65536
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                return
+
+        class MirrorServer(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        server = MirrorServer(("127.0.0.1", 0), MirrorHandler)
+        port = server.server_address[1]
+        task = ParallelTask(server.serve_forever)
+        task.daemon = True
+        task.start()
+
+        fast = "http://127.0.0.1:%d/fast" % (port,)
+        slow = "http://localhost:%d/slow" % (port,)
+        broken = "http://127.0.0.1:%d/fast/dup" % (port,)
+        cache_key = self.Client._MIRROR_BENCHMARK_CACHE_KEY
+        results = self.Client._cacher.pop(cache_key)
+        try:
+            set_mute(True)
+            mirrors = self.Client.benchmark_mirrors([fast, slow, broken])
+            # same host, probed once, best mirror is the last one
+            self.assertEqual(mirrors, [slow, fast])
+            self.assertEqual(len(requests), 2)
+
+            bench = self.Client.mirror_benchmark_results()
+            self.assertTrue(bench[slow]['ttfb'] >= 0.5)
+            self.assertTrue(bench[fast]['ttfb'] < bench[slow]['ttfb'])
+            self.assertTrue(bench[fast]['throughput'] > 0)
+
+            # recent results are reused
+            mirrors = self.Client.benchmark_mirrors(
+                [fast, slow], max_age = 3600)
+            self.assertEqual(mirrors, [slow, fast])
+            self.assertEqual(len(requests), 2)
+        finally:
+            set_mute(False)
+            server.shutdown()
+            server.server_close()
+            if results is None:
+                self.Client._cacher.remove(cache_key)
+            else:
+                self.Client._cacher.save(cache_key, results)
+
+    def test_repository_sync_workers(self):
+        sts = EntropyRepositoryBase
+        running = []
+        concurrency = []
+        lock = threading.Lock()
+
+        class FakeRepository(object):
+
+            @staticmethod
+            def update(entropy_client, repository_id, force, gpg):
+                with lock:
+                    running.append(repository_id)
+                    concurrency.append(len(running))
+                try:
+                    entropy_client.output("updating %s" % (repository_id,))
+                    entropy_client.output("progress", back = True)
+                    time.sleep(0.2)
+                    if repository_id == "broken":
+                        raise IOError("broken repository")
+                    entropy_client.output("updated %s" % (repository_id,))
+                    return sts.REPOSITORY_UPDATED_OK
+                finally:
+                    with lock:
+                        running.remove(repository_id)
+
+        repository_ids = ["repo_a", "broken", "repo_b", "repo_c"]
+        repo_intf = Repository(self.Client, list(repository_ids),
+                               workers = 2)
+        self.assertEqual(repo_intf.repo_ids, repository_ids)
+
+        output = []
+        progress = []
+        def _output(text, **kwargs):
+            if kwargs.get("back"):
+                progress.append(text)
+            else:
+                output.append(text)
+
+        self.Client.get_repository = lambda repository_id: FakeRepository
+        self.Client.output = _output
+        try:
+            events, statuses, outputs = repo_intf._start_update_workers(
+                repo_intf.repo_ids)
+            for repository_id in repository_ids:
+                self.assertTrue(events[repository_id].wait(10))
+            # progress is written right away, one prefixed line per
+            # repository, messages are buffered until flushed, in
+            # repository order
+            self.assertEqual(output, [])
+            self.assertEqual(len(progress), len(repository_ids))
+            for repository_id in repository_ids:
+                self.assertEqual(
+                    len([x for x in progress if repository_id in x]), 1)
+            for repository_id in repository_ids:
+                outputs[repository_id].flush()
+        finally:
+            del self.Client.get_repository
+            del self.Client.output
+
+        self.assertEqual(statuses, {
+            "repo_a": sts.REPOSITORY_UPDATED_OK,
+            "broken": sts.REPOSITORY_GENERIC_ERROR,
+            "repo_b": sts.REPOSITORY_UPDATED_OK,
+            "repo_c": sts.REPOSITORY_UPDATED_OK,
+        })
+        self.assertEqual(max(concurrency), 2)
+        self.assertEqual(output[:2], ["updating repo_a", "updated repo_a"])
+        self.assertEqual(output[2], "updating broken")
+        self.assertEqual(len(output), 8)
+        self.assertEqual(output[-2:], ["updating repo_c", "updated repo_c"])
+
+    def test_package_install_scheduler(self):
+        started = []
+        max_reserved = []
+        lock = threading.Lock()
+        tmp_dir = const_mkdtemp()
+
+        class FakeAction(object):
+
+            def __init__(self, idx):
+                self._idx = idx
+                self._meta = None
+                self.unpacking = False
+                self.unpacked = False
+
+            def package_id(self):
+                return self._idx
+
+            def repository_id(self):
+                return "test_repo"
+
+            def setup(self):
+                if self._meta is None:
+                    unpack_dir = os.path.join(tmp_dir, str(self._idx))
+                    os.makedirs(unpack_dir)
+                    self._meta = {'unpackdir': unpack_dir}
+
+            def metadata(self):
+                return self._meta
+
+            def preunpack(self):
+                self.unpacking = True
+                with lock:
+                    max_reserved.append(scheduler._reserved_size)
+                time.sleep(0.01)
+                self.unpacked = True
+                self.unpacking = False
+                return 0
+
+            def start(self):
+                self.setup()
+                started.append((self._idx, self.unpacking))
+                time.sleep(0.05)
+                shutil.rmtree(self._meta['unpackdir'])
+                return 0
+
+        class FakeScheduler(PackageInstallScheduler):
+
+            def _unpack_ahead_size_limit(self):
+                return 250
+
+            def _unpacked_size(self, action):
+                return 100
+
+        try:
+            actions = [FakeAction(x) for x in range(8)]
+            scheduler = FakeScheduler(self.Client, actions, workers = 2)
+            scheduler.start()
+            try:
+                for action in actions:
+                    self.assertEqual(scheduler.run(action), 0)
+            finally:
+                scheduler.shutdown()
+
+            # strictly ordered, never overlapping the unpack
+            self.assertEqual(started, [(x, False) for x in range(8)])
+            self.assertTrue(max_reserved)
+            self.assertTrue(max(max_reserved) <= 200)
+            self.assertTrue(all(x.unpacked for x in actions[1:]))
+            self.assertEqual(os.listdir(tmp_dir), [])
+
+            # unpacked packages that are not run get cleaned up
+            actions = [FakeAction(x) for x in range(8, 12)]
+            scheduler = FakeScheduler(self.Client, actions, workers = 2)
+            scheduler.start()
+            try:
+                self.assertEqual(scheduler.run(actions[0]), 0)
+            finally:
+                scheduler.shutdown()
+            self.assertEqual(os.listdir(tmp_dir), [])
+        finally:
+            shutil.rmtree(tmp_dir, True)
+
+    def test_package_stream_unpacker(self):
+        pkg_path = _misc.get_test_entropy_package()
+        with open(pkg_path, "rb") as pkg_f:
+            data = pkg_f.read()
+        checksum = entropy.tools.md5sum(pkg_path)
+        tmp_dir = const_mkdtemp()
+
+        def _feed(unpacker, data, chunk_size):
+            for idx in range(0, len(data), chunk_size):
+                unpacker.feed(data[idx:idx + chunk_size])
+
+        def _list_dir(directory):
+            paths = set()
+            for root, dirs, files in os.walk(directory):
+                for name in dirs + files:
+                    paths.add(os.path.relpath(
+                        os.path.join(root, name), directory))
+            return paths
+
+        try:
+            download_path = os.path.join(tmp_dir, os.path.basename(pkg_path))
+            staging_dir = PackageStreamUnpacker.staging_directory(
+                download_path)
+
+            ref_image_dir = os.path.join(tmp_dir, "ref", "image")
+            ref_edb_path = os.path.join(tmp_dir, "ref", "pkg.db")
+            os.makedirs(ref_image_dir)
+            self.assertEqual(
+                entropy.tools.uncompress_tarball(
+                    pkg_path, extract_path = ref_image_dir,
+                    catch_empty = True), 0)
+            self.assertTrue(entropy.tools.dump_entropy_metadata(
+                    pkg_path, ref_edb_path))
+
+            # odd chunk size, so that the edb tag is split across chunks
+            for chunk_size in (1021, 8192):
+                unpacker = PackageStreamUnpacker(
+                    download_path, hashes = ("md5", "sha256"))
+                unpacker.start()
+                _feed(unpacker, data, chunk_size)
+                self.assertTrue(unpacker.finish())
+                self.assertEqual(unpacker.hexdigest("md5"), checksum)
+                self.assertEqual(unpacker.hexdigest("sha256"),
+                                 entropy.tools.sha256(pkg_path))
+                self.assertTrue(unpacker.commit(checksum))
+
+                image_dir = os.path.join(tmp_dir, str(chunk_size), "image")
+                edb_path = os.path.join(
+                    tmp_dir, str(chunk_size), "edb", "pkg.db")
+                self.assertTrue(PackageStreamUnpacker.adopt(
+                        download_path, checksum, image_dir, edb_path))
+                self.assertFalse(os.path.lexists(staging_dir))
+                self.assertEqual(_list_dir(image_dir),
+                                 _list_dir(ref_image_dir))
+                self.assertEqual(entropy.tools.md5sum(edb_path),
+                                 entropy.tools.md5sum(ref_edb_path))
+
+            # checksum mismatch
+            unpacker = PackageStreamUnpacker(download_path)
+            unpacker.start()
+            _feed(unpacker, data, 8192)
+            self.assertTrue(unpacker.finish())
+            self.assertTrue(unpacker.commit(checksum))
+            image_dir = os.path.join(tmp_dir, "mismatch", "image")
+            self.assertFalse(PackageStreamUnpacker.adopt(
+                    download_path, "0" * 32, image_dir,
+                    os.path.join(tmp_dir, "mismatch", "pkg.db")))
+            self.assertFalse(os.path.lexists(image_dir))
+            self.assertFalse(os.path.lexists(staging_dir))
+
+            # truncated download, edb trailer missing
+            unpacker.start()
+            _feed(unpacker, data[:len(data) // 2], 8192)
+            self.assertFalse(unpacker.finish())
+            self.assertFalse(unpacker.commit(checksum))
+            self.assertFalse(os.path.lexists(staging_dir))
+        finally:
+            shutil.rmtree(tmp_dir, True)
+
+    def test_merge_helpers(self):
+        trie = PathPrefixTrie(["/etc", "/usr/share/config/", "/opt/x"])
+        self.assertTrue(trie.match("/etc"))
+        self.assertTrue(trie.match("/etc/conf.d/net"))
+        self.assertTrue(trie.match("/usr/share/config/kdeglobals"))
+        self.assertFalse(trie.match("/etcetera/file"))
+        self.assertFalse(trie.match("/usr/share"))
+        self.assertFalse(trie.match("/opt/xy"))
+        self.assertFalse(PathPrefixTrie())
+        self.assertTrue(PathPrefixTrie(["/"]).match("/any/path"))
+
+        matcher = ConfigProtectMatcher(
+            ["/etc", "/usr/share/config"],
+            ["/etc/env.d", "/etc/fonts/fonts.conf"],
+            ["/etc/skipped.conf"])
+        self.assertTrue(matcher.protected("/etc/make.conf"))
+        self.assertTrue(matcher.protected("/etc/fonts/local.conf"))
+        self.assertFalse(matcher.protected("/etc/fonts/fonts.conf"))
+        self.assertFalse(matcher.protected("/etc/env.d/00basic"))
+        self.assertFalse(matcher.protected("/usr/bin/equo"))
+        self.assertTrue(matcher.masked("/etc/env.d/00basic"))
+        self.assertTrue(matcher.skipped("/etc/skipped.conf"))
+        self.assertFalse(matcher.skipped("/etc/make.conf"))
+
+        tmp_dir = const_mkdtemp()
+        try:
+            file_path = os.path.join(tmp_dir, "file")
+            with open(file_path, "w") as f:
+                f.write("data")
+            os.symlink("file", os.path.join(tmp_dir, "link"))
+
+            live = LiveFilesystem()
+            self.assertTrue(live.lstat(file_path) is not None)
+            self.assertTrue(
+                live.lstat(os.path.join(tmp_dir, "missing")) is None)
+            self.assertEqual(live.realpath(os.path.join(tmp_dir, ".")),
+                             os.path.realpath(tmp_dir))
+
+            new_path = os.path.join(tmp_dir, "new")
+            live.rename(file_path, new_path)
+            live.discard(file_path)
+            live.add(new_path)
+            self.assertTrue(live.lstat(file_path) is None)
+            self.assertTrue(live.lstat(new_path) is not None)
+
+            sub_dir = os.path.join(tmp_dir, "sub")
+            self.assertTrue(live.lstat(os.path.join(sub_dir, "x")) is None)
+            os.mkdir(sub_dir)
+            live.add(sub_dir)
+            with open(os.path.join(sub_dir, "x"), "w") as f:
+                f.write("x")
+            self.assertTrue(
+                live.lstat(os.path.join(sub_dir, "x")) is not None)
+
+            self.assertTrue(is_file(live.file_type(new_path)))
+            self.assertTrue(is_link(live.file_type(
+                os.path.join(tmp_dir, "link"))))
+            self.assertTrue(is_dir(live.file_type(sub_dir)))
+            self.assertTrue(
+                live.file_type(os.path.join(tmp_dir, "missing")) is None)
+
+            # fill the directory descriptors cache, then rename across
+            # two directories not in it
+            for count in range(LiveFilesystem._MAX_DIR_FDS + 1):
+                fill_dir = os.path.join(tmp_dir, "fill%d" % (count,))
+                os.mkdir(fill_dir)
+                with open(os.path.join(fill_dir, "f"), "w") as f:
+                    f.write("f")
+                live.rename(os.path.join(fill_dir, "f"),
+                            os.path.join(fill_dir, "g"))
+            src_dir = os.path.join(tmp_dir, "src")
+            dest_dir = os.path.join(tmp_dir, "dest")
+            os.mkdir(src_dir)
+            os.mkdir(dest_dir)
+            with open(os.path.join(src_dir, "y"), "w") as f:
+                f.write("y")
+            live.rename(os.path.join(src_dir, "y"),
+                        os.path.join(dest_dir, "y"))
+            self.assertFalse(os.path.lexists(os.path.join(src_dir, "y")))
+            self.assertTrue(os.path.isfile(os.path.join(dest_dir, "y")))
+            live.close()
+        finally:
+            shutil.rmtree(tmp_dir, True)
+
+    def test_package_store(self):
+        test_pkg = _misc.get_test_entropy_package()
+        hashes = entropy.tools.multi_hash(test_pkg, ("md5", "sha256"))
+        signatures = {'sha1': None, 'sha256': hashes['sha256'],
+                      'sha512': None, 'gpg': None}
+
+        self.assertEqual(PackageStore.key(hashes['md5'], signatures),
+                         ("sha256", hashes['sha256']))
+        self.assertEqual(PackageStore.key(hashes['md5'], None),
+                         ("md5", hashes['md5']))
+        self.assertEqual(PackageStore.key("../../etc/passwd", None), None)
+
+        tmp_dir = const_mkdtemp()
+        try:
+            store = PackageStore(os.path.join(tmp_dir, "store"))
+            key = store.key(hashes['md5'], signatures)
+            repo_a = os.path.join(tmp_dir, "a", "pkg.tbz2")
+            repo_b = os.path.join(tmp_dir, "b", "pkg.tbz2")
+
+            self.assertFalse(store.link(key, repo_a))
+            os.makedirs(os.path.dirname(repo_a))
+            shutil.copyfile(test_pkg, repo_a)
+            self.assertTrue(store.insert(key, repo_a))
+            self.assertEqual(os.stat(repo_a).st_nlink, 2)
+
+            # a second repository shares the stored file
+            self.assertTrue(store.link(key, repo_b))
+            self.assertTrue(os.path.samefile(repo_a, repo_b))
+            self.assertEqual(
+                entropy.tools.md5sum(repo_b), hashes['md5'])
+
+            # an identical copy is replaced by a link
+            os.remove(repo_b)
+            shutil.copyfile(test_pkg, repo_b)
+            self.assertTrue(store.insert(key, repo_b))
+            self.assertTrue(os.path.samefile(repo_a, repo_b))
+            self.assertEqual(store.size(), (1, os.path.getsize(test_pkg)))
+
+            # a corrupted stored file of the same size is not linked, the
+            # verified package file replaces it
+            blob_path = store.blob_path(key)
+            os.remove(blob_path)
+            with open(blob_path, "wb") as f:
+                f.write(b"x" * os.path.getsize(test_pkg))
+            os.remove(repo_b)
+            shutil.copyfile(test_pkg, repo_b)
+            self.assertTrue(store.insert(key, repo_b))
+            self.assertTrue(os.path.samefile(repo_b, blob_path))
+            self.assertEqual(
+                entropy.tools.md5sum(repo_b), hashes['md5'])
+            self.assertTrue(store.link(key, repo_a))
+
+            # a store on another filesystem gets plain copies
+            def _cross_device_link(src, dest):
+                raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+            os_link = os.link
+            os.link = _cross_device_link
+            try:
+                os.remove(blob_path)
+                self.assertTrue(store.insert(key, repo_b))
+                self.assertFalse(os.path.samefile(repo_b, blob_path))
+                self.assertEqual(
+                    entropy.tools.md5sum(blob_path), hashes['md5'])
+                os.remove(repo_b)
+                self.assertTrue(store.link(key, repo_b))
+                self.assertEqual(
+                    entropy.tools.md5sum(repo_b), hashes['md5'])
+            finally:
+                os.link = os_link
+            self.assertTrue(store.insert(key, repo_a))
+            self.assertTrue(os.path.samefile(repo_a, blob_path))
+
+            # stored files still linked are removed last
+            other_key = ("md5", "0" * 32)
+            other_path = os.path.join(tmp_dir, "other.tbz2")
+            with open(other_path, "wb") as f:
+                f.write(b"x" * 10)
+            self.assertTrue(store.insert(other_key, other_path))
+            os.remove(other_path)
+            self.assertEqual(store.collect(10**9), [])
+            self.assertEqual(store.collect(os.path.getsize(test_pkg)),
+                             [store.blob_path(other_key)])
+            self.assertEqual(store.collect(0, dry_run = True),
+                             [store.blob_path(key)])
+            self.assertEqual(store.collect(0), [store.blob_path(key)])
+            self.assertEqual(store.size(), (0, 0))
+            self.assertTrue(os.path.isfile(repo_a))
+        finally:
+            shutil.rmtree(tmp_dir, True)
+
+    def test_calculate_updates_engines(self):
+        test_pkg = _misc.get_test_package()
+        data = self.Spm.extract_package_metadata(test_pkg)
+
+        def _add(repo, key, version, tag = "", revision = 0, slot = "0",
+                 digest = "0123456789abcdef0123456789abcdef"):
+            category, name = key.split("/")
+            pkg_data = data.copy()
+            pkg_data.update({
+                'category': category,
+                'name': name,
+                'version': version,
+                'versiontag': tag,
+                'revision': revision,
+                'slot': slot,
+                'digest': digest,
+                'atom': "%s-%s%s" % (key, version, tag and "#" + tag),
+            })
+            return repo.addPackage(pkg_data)
+
+        # restored below, UPDATES_ENGINE is a class attribute
+        updates_engine = vars(self.Client).get("UPDATES_ENGINE")
+        installed_repository = self.Client._real_installed_repository
+        tmp_dir = const_mkdtemp()
+        try:
+            self.Client._real_installed_repository = \
+                self.Client.open_temp_repository(
+                    name = InstalledPackagesRepository.NAME,
+                    temp_file = os.path.join(tmp_dir, "installed.db"))
+            self.Client._installed_repository.override_handlePackage = True
+            inst_repo = self.Client.installed_repository()
+            repo_a = self.Client._init_generic_temp_repository(
+                "repo_a", self.mem_repo_desc,
+                temp_file = os.path.join(tmp_dir, "repo_a.db"))
+            repo_b = self.Client._init_generic_temp_repository(
+                "repo_b", self.mem_repo_desc,
+                temp_file = os.path.join(tmp_dir, "repo_b.db"))
+
+            for key, version, tag, rev, slot, digest in (
+                    ("app-misc/same", "1.0", "", 1, "0", "a" * 32),
+                    ("app-misc/newer", "1.0", "", 0, "0", "a" * 32),
+                    ("app-misc/revision", "1.0", "", 1, "0", "a" * 32),
+                    ("app-misc/spm", "1.0", "", 9999, "0", "a" * 32),
+                    ("app-misc/digest", "1.0", "", 0, "0", "a" * 32),
+                    ("app-misc/tagged", "1.0", "foo", 0, "0", "a" * 32),
+                    ("app-misc/slotted", "1.0", "", 0, "1", "a" * 32),
+                    ("app-misc/gone", "1.0", "", 0, "0", "a" * 32)):
+                _add(inst_repo, key, version, tag, rev, slot, digest)
+
+            _add(repo_a, "app-misc/same", "1.0", "", 1, "0", "a" * 32)
+            _add(repo_a, "app-misc/newer", "1.0", "", 0, "0", "a" * 32)
+            newer_id = _add(repo_b, "app-misc/newer", "1.1", "", 0)
+            _add(repo_a, "app-misc/revision", "1.0", "", 1)
+            revision_id = _add(repo_b, "app-misc/revision", "1.0", "", 2)
+            spm_id = _add(repo_a, "app-misc/spm", "1.0", "", 1)
+            digest_id = _add(repo_a, "app-misc/digest", "1.0", "", 0,
+                             digest = "b" * 32)
+            _add(repo_a, "app-misc/tagged", "1.0", "foo", 0, "0", "a" * 32)
+            _add(repo_a, "app-misc/tagged", "2.0", "", 0)
+            _add(repo_b, "app-misc/slotted", "2.0", "", 0, "2")
+
+            outcomes = {}
+            for engine in ("legacy", "joined"):
+                self.Client.UPDATES_ENGINE = engine
+                outcomes[engine] = self.Client.calculate_updates(
+                    use_cache = False, critical_updates = False,
+                    quiet = True)
+            self.assertEqual(outcomes["legacy"], outcomes["joined"])
+
+            outcome = outcomes["joined"]
+            self.assertEqual(sorted(outcome['update']), sorted([
+                (newer_id, "repo_b"), (revision_id, "repo_b"),
+                (spm_id, "repo_a"), (digest_id, "repo_a")]))
+            self.assertEqual(outcome['fine'], [
+                "app-misc/same-1.0", "app-misc/tagged-1.0#foo"])
+            self.assertEqual(
+                [inst_repo.retrieveAtom(x) for x in outcome['remove']],
+                ["app-misc/gone-1.0", "app-misc/slotted-1.0"])
+        finally:
+            for repository_id in ("repo_a", "repo_b"):
+                self.Client.remove_repository(repository_id)
+            test_repository = self.Client._real_installed_repository
+            if test_repository is not installed_repository:
+                test_repository.close(
+                    _token = InstalledPackagesRepository.NAME)
+            self.Client._real_installed_repository = installed_repository
+            if updates_engine is None:
+                vars(self.Client).pop("UPDATES_ENGINE", None)
+            else:
+                self.Client.UPDATES_ENGINE = updates_engine
+            shutil.rmtree(tmp_dir, True)
+
     def test_clear_cache(self):
         current_dir = self.Client._cacher.current_directory()
         test_file = os.path.join(current_dir, "asdasd")
@@ -370,9 +370,79 @@ class EntropyRepositoryTest(unittest.TestCase):
         cached = self.test_db._EntropyRepositoryBase__atomMatchFetchCache(
             key, True, False, False, None, None, False, False, True)
         self.assertEqual(cached, (123, 0))
+
+        # multiMatch results must not be shared with the callers
+        match_cacher = self.test_db._match_cacher
+        hits = match_cacher.stats()['hits']
+        self.test_db._EntropyRepositoryBase__atomMatchStoreCache(
+            key, True, True, False, None, None, False, False, True,
+            result = (set([123]), 0)
+        )
+        cached = self.test_db._EntropyRepositoryBase__atomMatchFetchCache(
+            key, True, True, False, None, None, False, False, True)
+        self.assertEqual(cached, (set([123]), 0))
+        cached[0].add(456)
+        cached = self.test_db._EntropyRepositoryBase__atomMatchFetchCache(
+            key, True, True, False, None, None, False, False, True)
+        self.assertEqual(cached, (set([123]), 0))
+        self.assertEqual(match_cacher.stats()['hits'], hits + 2)
         if not started:
             cacher.stop()
 
+    def test_db_live_cache(self):
+        from entropy.db.cache import EntropyRepositoryCacher
+        cacher = EntropyRepositoryCacher()
+        prefix = self.test_db._getLiveCacheKey()
+        other_prefix = "other_" + prefix
+        value = list(range(100))
+        size = cacher._sizeof(value)
+        cacher.discard(prefix)
+        cacher.discard(other_prefix)
+
+        try:
+            # room for two items per repository
+            cacher.configure(max_bytes = size * 2 + size // 2)
+            stats = cacher.stats(prefix = prefix)
+
+            cacher.set(prefix + "a", value, prefix = prefix)
+            cacher.set(prefix + "b", value, prefix = prefix)
+            cacher.set(other_prefix + "a", value, prefix = other_prefix)
+            self.assertEqual(cacher.get(prefix + "a", prefix = prefix), value)
+
+            # "b" is the least recently used one
+            cacher.set(prefix + "c", value, prefix = prefix)
+            self.assertEqual(cacher.get(prefix + "b", prefix = prefix), None)
+            self.assertEqual(cacher.get(prefix + "a", prefix = prefix), value)
+            self.assertEqual(
+                cacher.get(other_prefix + "a", prefix = other_prefix), value)
+
+            new_stats = cacher.stats(prefix = prefix)
+            self.assertEqual(new_stats['hits'], stats['hits'] + 2)
+            self.assertEqual(new_stats['misses'], stats['misses'] + 1)
+            self.assertEqual(new_stats['evictions'], stats['evictions'] + 1)
+            self.assertEqual(new_stats['items'], 2)
+            self.assertEqual(new_stats['bytes'], size * 2)
+
+            # too big to be cached
+            cacher.set(prefix + "d", value * 3, prefix = prefix)
+            self.assertEqual(cacher.get(prefix + "d", prefix = prefix), None)
+
+            # expired items are evicted
+            cacher.configure(ttl = 1)
+            cacher.set(prefix + "e", value, prefix = prefix)
+            time.sleep(1.5)
+            self.assertEqual(cacher.get(prefix + "e", prefix = prefix), None)
+
+            cacher.discard(prefix)
+            self.assertEqual(cacher.stats(prefix = prefix)['items'], 0)
+            self.assertEqual(cacher.stats(prefix = other_prefix)['items'], 1)
+        finally:
+            cacher.discard(prefix)
+            cacher.discard(other_prefix)
+            cacher.configure(
+                max_bytes = EntropyRepositoryCacher.MAX_BYTES,
+                ttl = EntropyRepositoryCacher.TTL)
+
     def test_db_insert_compare_match(self):
 
         # insert/compare
@@ -581,6 +651,67 @@ class EntropyRepositoryTest(unittest.TestCase):
             self.assertEqual(f_match, self.test_db.atomMatch(atom))
             self.assertEqual(f_match, self.test_db.atomMatch("~"+atom))
 
+    def test_db_atom_match_many(self):
+        test_pkg = _misc.get_test_package()
+        data = self.Spm.extract_package_metadata(test_pkg)
+        idpackage = self.test_db.addPackage(data)
+        self.test_db.addPackage(self.test_db.getPackageData(idpackage))
+        key, slot = self.test_db.retrieveKeySlot(idpackage)
+        atom = self.test_db.retrieveAtom(idpackage)
+
+        atoms = [
+            key, atom, "~" + atom, ">=" + atom, "<" + atom,
+            "%s:%s" % (key, slot), "%s:%s" % (key, slot + "foo"),
+            "%s[%s(+)]" % (key, "doesntexistforsure"),
+            "%s[-%s(+)]" % (key, "kernel_linux"),
+            data['name'], key + "foo", "app-foo/bar;%s?" % (key,),
+            "slib", "", "=" + key,
+        ]
+        for multi in (False, True):
+            results = self.test_db.atomMatchMany(atoms, multiMatch = multi)
+            self.assertEqual(set(atoms), set(results.keys()))
+            for dep in atoms:
+                self.assertEqual(
+                    self.test_db.atomMatch(dep, multiMatch = multi),
+                    results[dep])
+
+    def test_db_incremental_checksum(self):
+        test_pkg = _misc.get_test_package()
+        data = self.Spm.extract_package_metadata(test_pkg)
+        checksum = self.test_db.checksum()
+        self.assertTrue(self.test_db.verifyChecksum())
+
+        package_id = self.test_db.addPackage(data)
+        package_id2 = self.test_db.addPackage(data)
+        self.assertNotEqual(checksum, self.test_db.checksum())
+        self.assertTrue(self.test_db.verifyChecksum())
+
+        # order independent
+        ck_sum = self.test_db.checksum()
+        self.test_db.removePackage(package_id)
+        self.test_db.addPackage(data, package_id = package_id)
+        self.assertEqual(ck_sum, self.test_db.checksum())
+
+        self.test_db.setSlot(package_id, "foo")
+        self.test_db.setRevision(package_id2, 123)
+        self.test_db.setDigest(package_id2, "abc")
+        self.assertNotEqual(ck_sum, self.test_db.checksum())
+        self.assertTrue(self.test_db.verifyChecksum())
+
+        self.test_db.removePackage(package_id)
+        self.test_db.removePackage(package_id2)
+        self.assertEqual(checksum, self.test_db.checksum())
+        self.assertTrue(self.test_db.verifyChecksum())
+
+        # writes not going through the tracked methods are detected
+        self.test_db.addPackage(data)
+        self.test_db._cursor().execute("""
+        UPDATE baseinfo SET slot = 'bar'
+        """)
+        self.assertFalse(self.test_db.verifyChecksum())
+        self.assertFalse(self.test_db.verifyChecksum(repair = True))
+        self.assertTrue(self.test_db.verifyChecksum())
+
     def test_db_multithread(self):
 
         # insert/compare
@@ -752,6 +883,174 @@ class EntropyRepositoryTest(unittest.TestCase):
         pkg_data = self.test_db.retrieveUnusedPackageIds()
         self.assertEqual(pkg_data, tuple())
 
+    def test_db_reverse_deps_table(self):
+        test_pkg = _misc.get_test_package()
+        data = self.Spm.extract_package_metadata(test_pkg)
+        test_pkg2 = _misc.get_test_package2()
+        data2 = self.Spm.extract_package_metadata(test_pkg2)
+        data['pkg_dependencies'] += ((
+                _misc.get_test_package_atom2(),
+                etpConst['dependency_type_ids']['rdepend_id']),)
+        data2['pkg_dependencies'] += ((
+                _misc.get_test_package_atom(),
+                etpConst['dependency_type_ids']['rdepend_id']),)
+
+        # generic repositories are maskable, use a plain one
+        test_db = EntropyRepository(
+            readOnly = False,
+            dbFile = ":memory:",
+            name = self.test_db_name,
+            xcache = False,
+            indexing = False,
+            skipChecks = True,
+            temporary = True)
+        test_db.initializeRepository()
+
+        def table_rows():
+            cur = test_db._cursor().execute("""
+            SELECT idpackage, iddependency FROM reversedependencies
+            """)
+            return sorted(cur)
+
+        self.assertFalse(self.test_db._isReverseDependenciesTableEnabled())
+        idpackage = test_db.addPackage(data)
+        test_db._generateReverseDependenciesTable()
+        self.assertTrue(test_db._isReverseDependenciesTableValid())
+        rev_deps_t = test_db.retrieveReverseDependencies(idpackage,
+            key_slot = True)
+        self.assertEqual(rev_deps_t, tuple())
+
+        # the index is kept up-to-date on write
+        idpackage2 = test_db.addPackage(data2)
+        self.assertTrue(test_db._isReverseDependenciesTableValid())
+        rows = table_rows()
+        test_db._generateReverseDependenciesTable()
+        self.assertEqual(rows, table_rows())
+
+        rev_deps = test_db.retrieveReverseDependencies(idpackage)
+        rev_deps2 = test_db.retrieveReverseDependencies(idpackage2)
+        self.assertTrue(idpackage in rev_deps2)
+        self.assertTrue(idpackage2 in rev_deps)
+        rev_deps_t = test_db.retrieveReverseDependencies(idpackage,
+            key_slot = True)
+        self.assertEqual(rev_deps_t, (('app-dicts/aspell-es', '0'),))
+        self.assertEqual(test_db.retrieveUnusedPackageIds(), tuple())
+
+        test_db.removePackage(idpackage2)
+        self.assertTrue(test_db._isReverseDependenciesTableValid())
+        rows = table_rows()
+        test_db._generateReverseDependenciesTable()
+        self.assertEqual(rows, table_rows())
+        self.assertEqual(
+            test_db.retrieveReverseDependencies(idpackage), frozenset())
+
+        # and on other metadata changes
+        idpackage2 = test_db.addPackage(data2)
+        test_db.setDigest(idpackage, "0" * 32)
+        self.assertTrue(test_db._isReverseDependenciesTableValid())
+        test_db.setSlot(idpackage, "foo")
+        self.assertTrue(test_db._isReverseDependenciesTableValid())
+        rev_deps = test_db.retrieveReverseDependencies(idpackage)
+        self.assertEqual(rev_deps, frozenset([idpackage2]))
+        test_db.setName(idpackage2, "aspell-foo")
+        self.assertTrue(test_db._isReverseDependenciesTableValid())
+        self.assertEqual(
+            test_db.retrieveReverseDependencies(idpackage2), frozenset())
+        rows = table_rows()
+        test_db._generateReverseDependenciesTable()
+        self.assertEqual(rows, table_rows())
+
+        # it is rebuilt by createAllIndexes() when not valid
+        test_db._setSetting(test_db._REVERSE_DEPENDENCIES_SETTING, "")
+        self.assertFalse(test_db._isReverseDependenciesTableValid())
+        test_db._indexing = True
+        test_db.createAllIndexes()
+        self.assertTrue(test_db._isReverseDependenciesTableValid())
+        self.assertEqual(
+            test_db.retrieveReverseDependencies(idpackage), rev_deps)
+        test_db.close()
+
+    def test_db_mask_table(self):
+        test_pkg = _misc.get_test_package()
+        data = self.Spm.extract_package_metadata(test_pkg)
+        test_pkg2 = _misc.get_test_package2()
+        data2 = self.Spm.extract_package_metadata(test_pkg2)
+        idpackage = self.test_db.addPackage(data)
+        idpackage2 = self.test_db.addPackage(data2)
+        mask_ref = self._settings['pkg_masking_reference']
+
+        table = self.test_db.compute_mask_table()
+        self.assertEqual(len(table), 2)
+        for package_id in (idpackage, idpackage2):
+            self.assertEqual(table.get(package_id),
+                (package_id, mask_ref['system_keyword']))
+            self.assertEqual(table.get(package_id),
+                self.test_db.maskFilter(package_id))
+        self.assertEqual(table.get(idpackage2 + 1), None)
+        self.assertEqual(table.get(-1), None)
+        # the table is kept in memory
+        self.assertTrue(self.test_db.compute_mask_table() is table)
+
+        # and it can be serialized
+        from entropy.client.interfaces.db import MaskTable
+        restored = MaskTable(table.dump())
+        for package_id in (idpackage, idpackage2):
+            self.assertEqual(restored.get(package_id), table.get(package_id))
+
+        # a new revision of the repository gets a new table
+        self.test_db.removePackage(idpackage2)
+        table = self.test_db.compute_mask_table()
+        self.assertEqual(len(table), 1)
+        self.assertEqual(table.get(idpackage2), None)
+
+        # table results match the rule by rule evaluation
+        etpConst['keywords'] = set()
+        client_settings = self.Client.ClientSettings()
+        client_settings['masking_validation']['cache'].clear()
+        client_settings['masking_validation']['tables'].clear()
+        table = self.test_db.compute_mask_table()
+        self.assertEqual(table.get(idpackage),
+            (-1, mask_ref['completely_masked']))
+        self.assertEqual(
+            self.test_db._maskFilter_keyword_mask(idpackage, False), None)
+        self.assertEqual(self.test_db.maskFilter(idpackage),
+            (-1, mask_ref['completely_masked']))
+
+    def test_db_mask_table_license(self):
+        test_pkg = _misc.get_test_package()
+        data = self.Spm.extract_package_metadata(test_pkg)
+        test_pkg2 = _misc.get_test_package2()
+        data2 = self.Spm.extract_package_metadata(test_pkg2)
+        idpackage = self.test_db.addPackage(data)
+        idpackage2 = self.test_db.addPackage(data2)
+        mask_ref = self._settings['pkg_masking_reference']
+
+        licenses = self.test_db.retrieveLicense(idpackage).split()
+        licenses2 = self.test_db.retrieveLicense(idpackage2).split()
+        masked_license = [x for x in licenses if x not in licenses2][0]
+
+        # SystemSettings stores license.mask entries into a list
+        lic_mask = self._settings['license_mask']
+        lic_mask.append(masked_license)
+        try:
+            client_settings = self.Client.ClientSettings()
+            client_settings['masking_validation']['cache'].clear()
+            client_settings['masking_validation']['tables'].clear()
+
+            table = self.test_db.compute_mask_table()
+            self.assertEqual(table.get(idpackage),
+                (-1, mask_ref['user_license_mask']))
+            self.assertEqual(table.get(idpackage2),
+                (idpackage2, mask_ref['system_keyword']))
+            self.assertEqual(self.test_db.maskFilter(idpackage),
+                (-1, mask_ref['user_license_mask']))
+            self.assertEqual(
+                self.test_db._maskFilter_package_license_mask(
+                    idpackage, False),
+                (-1, mask_ref['user_license_mask']))
+        finally:
+            lic_mask.remove(masked_license)
+
     def test_similar(self):
         test_pkg = _misc.get_test_package()
         data = self.Spm.extract_package_metadata(test_pkg)
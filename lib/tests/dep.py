@@ -114,15 +114,26 @@ class DepTest(unittest.TestCase):
 
     def test_compare_versions(self):
         ver_a = ("1.0.0", "1.0.0", 0,)
-        ver_b = ("1.0.1", "1.0.0", 0.10000000000000001,)
-        ver_c = ("1.0.0", "1.0.1", -0.10000000000000001,)
-        ver_d = ("4.9.44", "4.11.12", -2,)
+        ver_b = ("1.0.1", "1.0.0", 1,)
+        ver_c = ("1.0.0", "1.0.1", -1,)
+        ver_d = ("4.9.44", "4.11.12", -1,)
 
         self.assertEqual(et.compare_versions(ver_a[0], ver_a[1]), ver_a[2])
         self.assertEqual(et.compare_versions(ver_b[0], ver_b[1]), ver_b[2])
         self.assertEqual(et.compare_versions(ver_c[0], ver_c[1]), ver_c[2])
         self.assertEqual(et.compare_versions(ver_d[0], ver_d[1]), ver_d[2])
 
+    def test_version_key(self):
+        vers = ["1.0_alpha", "1.0_beta2", "1.0_rc1", "1.0", "1.0-r1",
+            "1.0_p1", "1.0a", "1.0.0", "1.01", "1.02", "1.1", "1.1_p1_alpha",
+            "1.1_p1", "1.1_p1_p2"]
+        self.assertEqual(sorted(reversed(vers), key = et.version_key), vers)
+        for ver_a, ver_b in zip(vers, vers[1:]):
+            self.assertTrue(et.compare_versions(ver_a, ver_b) < 0)
+            self.assertTrue(et.compare_versions(ver_b, ver_a) > 0)
+        self.assertEqual(et.version_key("1.0"), et.version_key("1.0-r0"))
+        self.assertTrue(et.version_key("invalid") < et.version_key("0"))
+
     def test_get_newer_version(self):
         vers = ["1.0", "3.4", "0.5", "999", "9999", "10.0", "10.11.12", "10.1.32", "10.9.44"]
         out_vers = ['9999', '999', '10.11.12', '10.9.44', '10.1.32', '10.0', '3.4', '1.0', '0.5']
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import sys
+sys.path.insert(0, 'client')
+sys.path.insert(0, '../../client')
+sys.path.insert(0, '.')
+sys.path.insert(0, '../')
+import unittest
+from entropy.const import const_mkdtemp, const_convert_to_unicode
+import entropy.dump
+
+class DumpTest(unittest.TestCase):
+
+    def setUp(self):
+        self._obj = {
+            'match': ((123, "sabayonlinux.org"), 0),
+            'set': set([1, 2, 3]),
+            'unicode': const_convert_to_unicode("entropy"),
+            'list': [None] * 100,
+        }
+
+    def test_codecs(self):
+        codecs = entropy.dump.available_codecs()
+        self.assertTrue("zlib" in codecs)
+        self.assertTrue("none" in codecs)
+        self.assertTrue(entropy.dump.get_default_codec() in codecs)
+
+        for codec in codecs:
+            data = entropy.dump.serialize_string(self._obj, codec = codec)
+            self.assertTrue(data.startswith(entropy.dump.D_MAGIC))
+            self.assertEqual(entropy.dump.unserialize_string(data),
+                             self._obj)
+
+        self.assertRaises(ValueError, entropy.dump.serialize_string,
+                          self._obj, codec = "foo")
+        self.assertRaises(ValueError, entropy.dump.set_default_codec, "foo")
+
+    def test_legacy_format(self):
+        tmp_dir = const_mkdtemp()
+        try:
+            legacy = entropy.dump.pickle.dumps(self._obj, 0)
+            self.assertEqual(entropy.dump.unserialize_string(legacy),
+                             self._obj)
+            with open(os.path.join(tmp_dir, "legacy" + entropy.dump.D_EXT),
+                      "wb") as dmp_f:
+                dmp_f.write(legacy)
+            self.assertEqual(
+                entropy.dump.loadobj("legacy", dump_dir = tmp_dir),
+                self._obj)
+
+            entropy.dump.dumpobj("framed/obj", self._obj, dump_dir = tmp_dir)
+            self.assertEqual(
+                entropy.dump.loadobj("framed/obj", dump_dir = tmp_dir),
+                self._obj)
+
+            # unknown codecs are treated as cache misses
+            data = entropy.dump.serialize_string(self._obj)
+            data = data[:5] + b"\xff" + data[6:]
+            with open(os.path.join(tmp_dir, "unknown" + entropy.dump.D_EXT),
+                      "wb") as dmp_f:
+                dmp_f.write(data)
+            self.assertEqual(
+                entropy.dump.loadobj("unknown", dump_dir = tmp_dir), None)
+        finally:
+            shutil.rmtree(tmp_dir, True)
+
+if __name__ == '__main__':
+    unittest.main()
+    raise SystemExit(0)
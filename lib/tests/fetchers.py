@@ -3,9 +3,26 @@ import sys
 import os
 sys.path.insert(0, '.')
 sys.path.insert(0, '../')
+import hashlib
+import shutil
+import threading
+import time
 import unittest
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib2 import HTTPError, URLError
+    from httplib import BadStatusLine
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.error import HTTPError, URLError
+    from http.client import BadStatusLine
 import tests._misc as _misc
+from entropy.const import const_mkdtemp
 from entropy.fetchers import UrlFetcher, MultipleUrlFetcher
+from entropy.httppool import HTTPConnectionPool
+from entropy.misc import ParallelTask
 from entropy.output import set_mute
 import entropy.tools
 
@@ -47,6 +64,246 @@ class FetchersTest(unittest.TestCase):
         self.assertEqual(rc.pop(1), ck_sum)
         os.remove(path_to_save)
 
+    def _start_range_server(self, data, served, keep_alive = False):
+        """
+        Start a local HTTP server publishing data at /<mirror>/file.
+        Range requests are not supported by the "norange" mirror, the
+        "once" mirror closes the connections after each request.
+        /<mirror>/missing is a keep-alive 404 error response.
+        /<mirror>/drop closes the connection without any response, the
+        dropped requests are counted in served["drop"].
+        The client addresses of the served requests are collected in
+        served["clients"].
+        Return the server object and its base URL.
+        """
+        lock = threading.Lock()
+
+        class RangeHandler(BaseHTTPRequestHandler):
+
+            if keep_alive:
+                protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                with lock:
+                    served.setdefault("clients", set()).add(
+                        self.client_address)
+                mirror, _sep, name = self.path.strip("/").partition("/")
+                if name == "drop":
+                    with lock:
+                        served["drop"] = served.get("drop", 0) + 1
+                    self.close_connection = True
+                    return
+                if name == "missing":
+                    body = b"not found"
+                    self.send_response(404)
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                if name != "file":
+                    self.send_error(404)
+                    return
+                start, end = 0, len(data) - 1
+                range_hdr = self.headers.get("Range")
+                if range_hdr and mirror != "norange":
+                    start, end = range_hdr.split("=")[1].split("-")
+                    start, end = int(start), int(end)
+                    self.send_response(206)
+                    self.send_header("Content-Range", "bytes %d-%d/%d" % (
+                        start, end, len(data)))
+                else:
+                    self.send_response(200)
+                self.send_header("Content-Length", str(end - start + 1))
+                self.end_headers()
+
+                offset = start
+                while offset <= end:
+                    chunk = data[offset:min(offset + 16384, end + 1)]
+                    try:
+                        self.wfile.write(chunk)
+                    except (IOError, OSError):
+                        return
+                    offset += len(chunk)
+                    with lock:
+                        served.setdefault(mirror, 0)
+                        served[mirror] += len(chunk)
+                    if mirror == "slow":
+                        time.sleep(0.02)
+                if mirror == "once":
+                    # drop the connection, without telling the client
+                    self.close_connection = True
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                self.do_GET()
+
+            def log_message(self, *args):
+                return
+
+        class RangeServer(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+            def handle_error(self, request, client_address):
+                # interrupted downloads close the connections
+                return
+
+        server = RangeServer(("127.0.0.1", 0), RangeHandler)
+        task = ParallelTask(server.serve_forever)
+        task.daemon = True
+        task.start()
+        return server, "http://127.0.0.1:%d" % (server.server_address[1],)
+
+    def test_urlfetcher_segmented_fetch(self):
+        data = os.urandom(1024 * 1024)
+        checksum = hashlib.md5(data).hexdigest()
+        served = {}
+        server, base_url = self._start_range_server(data, served)
+        tmp_dir = const_mkdtemp()
+        path_to_save = os.path.join(tmp_dir, "file")
+        state_path = path_to_save + UrlFetcher.SEGMENTS_STATE_EXT
+        min_size = UrlFetcher.SEGMENT_MIN_SIZE
+        UrlFetcher.SEGMENT_MIN_SIZE = 128 * 1024
+        try:
+            # segments spread across two mirrors
+            fetcher = UrlFetcher(
+                base_url + "/a/file", path_to_save, show_speed = False,
+                resume = False, segments = 4,
+                mirror_urls = [base_url + "/b/file"])
+            self.assertEqual(fetcher.download(), checksum)
+            self.assertEqual(served["a"] + served["b"], len(data) + 1)
+            self.assertTrue(served["b"] > 0)
+            self.assertFalse(os.path.exists(state_path))
+            os.remove(path_to_save)
+
+            # servers not supporting Range requests
+            served.clear()
+            fetcher = UrlFetcher(
+                base_url + "/norange/file", path_to_save,
+                show_speed = False, resume = False, segments = 4)
+            self.assertEqual(fetcher.download(), checksum)
+            os.remove(path_to_save)
+
+            # interrupted downloads are resumed
+            class Interrupted(Exception):
+                pass
+
+            def abort_check():
+                if served.get("slow"):
+                    raise Interrupted()
+
+            served.clear()
+            fetcher = UrlFetcher(
+                base_url + "/slow/file", path_to_save, show_speed = False,
+                resume = True, segments = 4,
+                abort_check_func = abort_check)
+            self.assertRaises(Interrupted, fetcher.download)
+            self.assertTrue(os.path.isfile(state_path))
+            self.assertEqual(os.path.getsize(path_to_save), len(data))
+
+            served.clear()
+            fetcher = UrlFetcher(
+                base_url + "/a/file", path_to_save, show_speed = False,
+                resume = True, segments = 4)
+            self.assertEqual(fetcher.download(), checksum)
+            self.assertTrue(fetcher.is_resumed())
+            self.assertTrue(served["a"] < len(data))
+            self.assertFalse(os.path.exists(state_path))
+        finally:
+            UrlFetcher.SEGMENT_MIN_SIZE = min_size
+            server.shutdown()
+            server.server_close()
+            shutil.rmtree(tmp_dir, True)
+
+    def test_urlfetcher_connection_reuse(self):
+        data = os.urandom(64 * 1024)
+        checksum = hashlib.md5(data).hexdigest()
+        served = {}
+        server, base_url = self._start_range_server(
+            data, served, keep_alive = True)
+        pool = HTTPConnectionPool()
+        pool.clear()
+        tmp_dir = const_mkdtemp()
+        try:
+            stats = pool.stats()
+            for idx in range(3):
+                path_to_save = os.path.join(tmp_dir, "file%d" % (idx,))
+                fetcher = UrlFetcher(
+                    base_url + "/a/file", path_to_save,
+                    show_speed = False, resume = False)
+                self.assertEqual(fetcher.download(), checksum)
+            self.assertEqual(len(served["clients"]), 1)
+            self.assertEqual(pool.stats()["reused"] - stats["reused"], 2)
+            self.assertEqual(pool.stats()["idle"], 1)
+
+            # partially read responses do not go back to the pool
+            url = base_url + "/a/file"
+            remote = UrlFetcher._get_pooled_opener(True).open(url)
+            remote.read(1024)
+            remote.close()
+            self.assertEqual(pool.stats()["idle"], 0)
+
+            # error responses give the connection back to the pool, even
+            # if the HTTPError is never read nor closed
+            opener = UrlFetcher._get_pooled_opener(True)
+            for idx in range(2):
+                try:
+                    opener.open(base_url + "/a/missing")
+                except HTTPError as err:
+                    self.assertEqual(err.code, 404)
+                    if idx == 0:
+                        self.assertEqual(err.read(), b"not found")
+                else:
+                    self.fail("HTTPError not raised")
+                self.assertEqual(pool.stats()["idle"], 1)
+
+            # idle connections closed by the server are not reused
+            remote = UrlFetcher._get_pooled_opener(True).open(
+                base_url + "/once/file")
+            self.assertEqual(remote.read(), data)
+            self.assertEqual(pool.stats()["idle"], 1)
+            time.sleep(0.2)
+            stats = pool.stats()
+            fetcher = UrlFetcher(
+                base_url + "/a/file", os.path.join(tmp_dir, "file"),
+                show_speed = False, resume = False)
+            self.assertEqual(fetcher.download(), checksum)
+            self.assertEqual(pool.stats()["reused"], stats["reused"])
+            self.assertEqual(pool.stats()["dropped"], stats["dropped"] + 1)
+
+            # requests dropped on a reused connection are sent again on a
+            # new one, only if they can be safely sent twice (GET, HEAD)
+            for post_data, attempts in ((None, 2), (b"data", 1)):
+                remote = opener.open(base_url + "/a/file")
+                self.assertEqual(remote.read(), data)
+                self.assertEqual(pool.stats()["idle"], 1)
+                served["drop"] = 0
+                self.assertRaises((URLError, BadStatusLine), opener.open,
+                                  base_url + "/a/drop", post_data)
+                self.assertEqual(served["drop"], attempts)
+
+            served.clear()
+            url_path_list = [(base_url + "/a/file",
+                              os.path.join(tmp_dir, "multi%d" % (x,)))
+                             for x in range(8)]
+            set_mute(True)
+            try:
+                fetcher = MultipleUrlFetcher(
+                    url_path_list, show_speed = False, resume = False)
+                statuses = fetcher.download()
+            finally:
+                set_mute(False)
+            self.assertEqual(set(statuses.values()), set([checksum]))
+            self.assertTrue(len(served["clients"]) <= \
+                fetcher._parallel_downloads())
+            self.assertEqual(fetcher._parallel_downloads(),
+                min(len(url_path_list),
+                    MultipleUrlFetcher.MAX_PARALLEL_DOWNLOADS or 8))
+        finally:
+            server.shutdown()
+            server.server_close()
+            pool.clear()
+            shutil.rmtree(tmp_dir, True)
+
 if __name__ == '__main__':
     unittest.main()
     raise SystemExit(0)
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import sys
+sys.path.insert(0, '.')
+sys.path.insert(0, '../')
+import unittest
+from entropy.graph import Graph, TopologicalSorter
+
+
+class GraphTest(unittest.TestCase):
+
+    def _check_order(self, adj_map, sorted_map):
+        position = {}
+        for level, component in sorted_map.items():
+            for node in component:
+                position[node] = level
+        self.assertEqual(sorted(position), sorted(adj_map))
+        for node, successors in adj_map.items():
+            for successor in successors:
+                self.assertTrue(position[successor] >= position[node])
+
+    def test_sort(self):
+        adj_map = {
+            1: set([2, 3]),
+            2: set([4]),
+            3: set([4]),
+            4: set(),
+            5: set([6]),
+            6: set([5, 4]),
+        }
+        sorted_map = TopologicalSorter(adj_map).sort()
+        self.assertEqual(sorted(sorted_map), [1, 2, 3, 4, 5])
+        components = sorted(sorted(x) for x in sorted_map.values())
+        self.assertEqual(components, [[1], [2], [3], [4], [5, 6]])
+        self._check_order(adj_map, sorted_map)
+
+    def test_sort_deep_chain(self):
+        length = sys.getrecursionlimit() * 3
+        adj_map = dict((x, set([x + 1])) for x in range(length))
+        adj_map[length] = set()
+        sorted_map = TopologicalSorter(adj_map).sort()
+        self.assertEqual(len(sorted_map), length + 1)
+        self._check_order(adj_map, sorted_map)
+
+        # one big cycle
+        adj_map[length] = set([0])
+        sorted_map = TopologicalSorter(adj_map).sort()
+        self.assertEqual(list(sorted_map.keys()), [1])
+        self.assertEqual(sorted(sorted_map[1]), list(range(length + 1)))
+
+    def test_sort_levels(self):
+        adj_map = {
+            1: set([2, 3]),
+            2: set([4]),
+            3: set([4, 7]),
+            4: set(),
+            5: set([6]),
+            6: set([5, 4]),
+            7: set([4]),
+        }
+        levels = TopologicalSorter(adj_map).sort_levels()
+        levels = dict((x, sorted(sorted(k) for k in y)) \
+            for x, y in levels.items())
+        self.assertEqual(levels, {
+            1: [[1], [5, 6]],
+            2: [[2], [3]],
+            3: [[7]],
+            4: [[4]],
+        })
+
+    def test_graph_solve_levels(self):
+        graph = Graph()
+        graph.add("app", ["lib-a", "lib-b"])
+        graph.add("lib-a", ["libc"])
+        graph.add("lib-b", ["libc"])
+        graph.add("libc", [])
+        try:
+            levels = graph.solve_levels()
+            self.assertEqual(levels[1], (("app",),))
+            self.assertEqual(sorted(levels[2]), [("lib-a",), ("lib-b",)])
+            self.assertEqual(levels[3], (("libc",),))
+
+            serial = graph.solve()
+            self.assertEqual(sorted(serial), [1, 2, 3, 4])
+            self.assertEqual(serial[1], ("app",))
+            self.assertEqual(serial[4], ("libc",))
+        finally:
+            graph.destroy()
+
+
+if __name__ == '__main__':
+    unittest.main()
+    raise SystemExit(0)
@@ -8,7 +8,7 @@ import tempfile
 import json
 from entropy.const import const_convert_to_unicode, const_mkstemp
 from entropy.misc import Lifo, TimeScheduled, ParallelTask, EmailSender, \
-    FastRSS, FlockFile
+    FastRSS, FlockFile, LRUCache
 
 class MiscTest(unittest.TestCase):
 
@@ -64,6 +64,23 @@ class MiscTest(unittest.TestCase):
         # test if it raises ValueError exception
         self.assertRaises(ValueError, self.__lifo.pop)
 
+    def test_lru_cache(self):
+        cache = LRUCache(2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("c", 3)
+        # "b" is the least recently used item
+        self.assertTrue("b" not in cache)
+        self.assertEqual(cache.get("b", -1), -1)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(len(cache), 2)
+        cache.discard("a")
+        self.assertTrue("a" not in cache)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
     """
     XXX: causes random lock ups
     def test_timesched(self):
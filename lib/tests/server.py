@@ -6,12 +6,21 @@ import unittest
 import os
 import shutil
 from entropy.server.interfaces import Server
-from entropy.const import etpConst, initconfig_entropy_constants, etpSys
+from entropy.server.interfaces.inventory import RemoteInventory
+from entropy.server.transceivers import TransceiverServerHandler
+from entropy.const import etpConst, initconfig_entropy_constants, etpSys, \
+    const_mkdtemp, const_convert_to_rawstring
+from entropy.cache import EntropyCacher
+from entropy.output import TextInterface
 from entropy.core.settings.base import SystemSettings
+from entropy.core.settings.plugins.skel import SystemSettingsPlugin
 from entropy.db import EntropyRepository
 from entropy.db.cache import EntropyRepositoryCacher, \
     EntropyRepositoryCachePolicies
 from entropy.exceptions import RepositoryError
+from entropy.transceivers import EntropyTransceiver
+from entropy.transceivers.uri_handlers.plugins.interfaces.file_plugin import \
+    EntropyFileUriHandler
 import entropy.tools
 import tests._misc as _misc
 
@@ -169,6 +178,243 @@ class EntropyRepositoryTest(unittest.TestCase):
         self.assertEqual(False, const_key in etpConst)
         self.assertEqual(None, etpConst.get(const_key))
 
+
+class FakeServer(TextInterface):
+
+    """
+    The bits of Entropy Server used by RemoteInventory and
+    TransceiverServerHandler.
+    """
+
+    def __init__(self, cache_dir):
+        self.CACHE_DIR = cache_dir
+        self._cacher = EntropyCacher()
+        self.messages = []
+
+    def output(self, text, **kwargs):
+        self.messages.append((text, kwargs.get("back", False)))
+
+    def Transceiver(self, uri):
+        txc = EntropyTransceiver(uri)
+        txc.set_silent(True)
+        return txc
+
+
+class RemoteInventoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp_dir = const_mkdtemp(prefix = "test_inventory")
+        self._mirror_dir = os.path.join(self._tmp_dir, "mirror")
+        self._uri = "file://" + self._mirror_dir
+        self._server = FakeServer(
+            os.path.join(self._tmp_dir, "cache"))
+
+        # keep track of the remote directories being listed
+        self._listed = []
+        self._list_content_metadata = vars(
+            EntropyFileUriHandler)["list_content_metadata"]
+        listed = self._listed
+        list_content_metadata = self._list_content_metadata
+
+        def _list_content_metadata(handler, remote_path):
+            listed.append(remote_path)
+            return list_content_metadata(handler, remote_path)
+        EntropyFileUriHandler.list_content_metadata = _list_content_metadata
+
+    def tearDown(self):
+        EntropyFileUriHandler.list_content_metadata = \
+            self._list_content_metadata
+        shutil.rmtree(self._tmp_dir, True)
+
+    def _write(self, path, size):
+        path = os.path.join(self._mirror_dir, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "wb") as path_f:
+            path_f.write(b"x" * size)
+
+    def _list_files(self, remote_dirs):
+        inventory = RemoteInventory(self._server, "foo", self._uri)
+        txc = self._server.Transceiver(self._uri)
+        with txc as handler:
+            content = inventory.list_files(remote_dirs, handler)
+        return dict((x, sorted(y)) for x, y in content.items())
+
+    def test_remote_inventory(self):
+        remote_dir = "packages/amd64/5"
+        self._write(os.path.join(remote_dir, "x", "a.tbz2"), 1)
+        self._write(os.path.join(remote_dir, "x", "b.tbz2"), 2)
+        self._write(os.path.join(remote_dir, "y", "c.tbz2"), 3)
+        # make sure that later changes update the directory stamps
+        for currentdir, _subdirs, _files in os.walk(self._mirror_dir):
+            os.utime(currentdir, (1000000000, 1000000000))
+
+        # first run, the whole tree is listed
+        expected = {
+            remote_dir: [("x/a.tbz2", 1), ("x/b.tbz2", 2), ("y/c.tbz2", 3)],
+        }
+        self.assertEqual(self._list_files([remote_dir]), expected)
+        self.assertEqual(len(self._listed), 3)
+
+        # nothing changed, the cached manifest is used
+        del self._listed[:]
+        self.assertEqual(self._list_files([remote_dir]), expected)
+        self.assertEqual(self._listed, [])
+
+        # only the changed directory is listed again
+        self._write(os.path.join(remote_dir, "x", "d.tbz2"), 4)
+        os.remove(os.path.join(self._mirror_dir, remote_dir, "x", "a.tbz2"))
+        expected = {
+            remote_dir: [("x/b.tbz2", 2), ("x/d.tbz2", 4), ("y/c.tbz2", 3)],
+        }
+        self.assertEqual(self._list_files([remote_dir]), expected)
+        self.assertEqual(self._listed, [os.path.join(remote_dir, "x")])
+
+        # missing trees are created
+        missing_dir = "packages/amd64/4"
+        del self._listed[:]
+        expected[missing_dir] = []
+        self.assertEqual(
+            self._list_files([remote_dir, missing_dir]), expected)
+        self.assertTrue(
+            os.path.isdir(os.path.join(self._mirror_dir, missing_dir)))
+        self.assertEqual(self._listed, [os.path.join(missing_dir, "")])
+
+
+class FakeServerSettingsPlugin(SystemSettingsPlugin):
+
+    def server_parser(self, sys_set):
+        return {'sync_speed_limit': None}
+
+
+class FailingTransceiverServerHandler(TransceiverServerHandler):
+
+    """
+    Uploads to broken_uris, or of failing_files, never pass verification.
+    """
+
+    broken_uris = ()
+    failing_files = ()
+
+    def handler_verify_upload(self, local_filepath, uri, *args, **kwargs):
+        if uri in self.broken_uris or local_filepath in self.failing_files:
+            return False
+        return TransceiverServerHandler.handler_verify_upload(
+            self, local_filepath, uri, *args, **kwargs)
+
+
+class TransceiverServerHandlerTest(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp_dir = const_mkdtemp(prefix = "test_transceivers")
+        self._server = FakeServer(os.path.join(self._tmp_dir, "cache"))
+        self._mirror_dirs = []
+        self._uris = []
+        for mirror in ("mirror_a", "mirror_b"):
+            mirror_dir = os.path.join(self._tmp_dir, mirror)
+            self._mirror_dirs.append(mirror_dir)
+            self._uris.append("file://" + mirror_dir)
+
+        self._files = []
+        for name in ("a.tbz2", "b.tbz2", "c.tbz2"):
+            path = os.path.join(self._tmp_dir, name)
+            with open(path, "wb") as path_f:
+                path_f.write(const_convert_to_rawstring(name))
+            self._files.append(path)
+        # two remote directories
+        self._queue = [
+            ("x", self._files[0]),
+            ("x", self._files[1]),
+            ("y", self._files[2]),
+        ]
+
+        self._settings = SystemSettings()
+        self._plugin_id = etpConst['system_settings_plugins_ids'][
+            'server_plugin']
+        self._plugin = None
+        if not self._settings.has_plugin(self._plugin_id):
+            self._plugin = FakeServerSettingsPlugin(self._plugin_id, None)
+            self._settings.add_plugin(self._plugin)
+
+    def tearDown(self):
+        if self._plugin is not None:
+            self._settings.remove_plugin(self._plugin_id)
+        shutil.rmtree(self._tmp_dir, True)
+
+    def _handler(self, critical_files = None):
+        handler = FailingTransceiverServerHandler(self._server,
+            self._uris, self._queue, critical_files = critical_files,
+            txc_basedir = "x", local_basedir = self._tmp_dir, repo = "foo")
+        return handler
+
+    def _remote_files(self, mirror_dir):
+        content = []
+        for currentdir, _subdirs, files in os.walk(mirror_dir):
+            for name in files:
+                content.append(os.path.relpath(
+                    os.path.join(currentdir, name), mirror_dir))
+        return sorted(content)
+
+    def test_transceiver_upload(self):
+        handler = self._handler()
+        errors, fine_uris, broken_uris = handler.go()
+        self.assertFalse(errors)
+        self.assertEqual(fine_uris, set(self._uris))
+        self.assertEqual(broken_uris, set())
+        for mirror_dir in self._mirror_dirs:
+            self.assertEqual(self._remote_files(mirror_dir),
+                ["x/a.tbz2", "x/b.tbz2", "y/c.tbz2"])
+            self.assertEqual(
+                entropy.tools.md5sum(os.path.join(mirror_dir, "y/c.tbz2")),
+                entropy.tools.md5sum(self._files[2]))
+
+    def test_transceiver_broken_mirror(self):
+        handler = self._handler(critical_files = self._files)
+        handler.broken_uris = (self._uris[1],)
+        errors, fine_uris, broken_uris = handler.go()
+        self.assertTrue(errors)
+        self.assertEqual(fine_uris, set([self._uris[0]]))
+        self.assertEqual(broken_uris, set([(self._uris[1], False)]))
+        self.assertEqual(self._remote_files(self._mirror_dirs[0]),
+            ["x/a.tbz2", "x/b.tbz2", "y/c.tbz2"])
+
+    def test_transceiver_critical_file(self):
+        handler = self._handler(critical_files = self._files)
+        handler.failing_files = (self._files[0],)
+        # transfer the files in order
+        handler.MIRROR_WORKERS = 1
+        errors, fine_uris, broken_uris = handler.go()
+        self.assertTrue(errors)
+        self.assertEqual(broken_uris, set((x, False) for x in self._uris))
+        for mirror_dir in self._mirror_dirs:
+            # the failed file stops the transfers to its directory only
+            self.assertEqual(self._remote_files(mirror_dir),
+                ["x/a.tbz2", "y/c.tbz2"])
+
+    def test_transceiver_output(self):
+        handler = self._handler()
+        uri_a, uri_b = self._uris
+        del self._server.messages[:]
+        handler._buffer_output(uri_a)
+        handler._output(uri_a, "a1")
+        handler._output(uri_b, "b1")
+        # transfer progress is not kept back
+        handler._output(uri_a, "a2", back = True)
+        handler._output(uri_a, "a3")
+        self.assertEqual(self._server.messages,
+            [("b1", False), ("a2", True)])
+        handler._flush_output(uri_a)
+        self.assertEqual(self._server.messages,
+            [("b1", False), ("a2", True), ("a1", False), ("a3", False)])
+
+    def test_transceiver_speed_limit(self):
+        handler = self._handler()
+        self.assertEqual(handler._transfer_speed_limit(1), 0)
+        handler.speed_limit = 800
+        self.assertEqual(handler._transfer_speed_limit(1), 800)
+        self.assertEqual(handler._transfer_speed_limit(3), 266)
+        self.assertEqual(handler._transfer_speed_limit(1000), 1)
+
 if __name__ == '__main__':
     unittest.main()
     raise SystemExit(0)
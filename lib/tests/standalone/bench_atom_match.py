@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+# Compare per-atom atomMatch() calls against a single atomMatchMany() call.
+# Usage: python bench_atom_match.py [<number of packages>]
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, '../')
+sys.path.insert(0, '../../')
+
+from entropy.client.interfaces import Client
+import tests._misc as _misc
+import entropy.tools
+
+
+def _populate(client, count):
+    fd, tmp_path = tempfile.mkstemp()
+    os.close(fd)
+    entropy.tools.dump_entropy_metadata(
+        _misc.get_test_entropy_package(), tmp_path)
+    source = client.open_generic_repository(tmp_path)
+    data = source.getPackageData(sorted(source.listAllPackageIds())[0])
+    source.close()
+    os.remove(tmp_path)
+
+    fd, repo_path = tempfile.mkstemp()
+    os.close(fd)
+    repo = client.open_temp_repository(name = "bench",
+        temp_file = repo_path)
+    atoms = []
+    for idx in range(count):
+        data['name'] = "pkg%d" % (idx,)
+        data['atom'] = "%s/%s-%s" % (data['category'], data['name'],
+            data['version'])
+        repo.addPackage(data)
+        atoms.append("%s/%s" % (data['category'], data['name']))
+        atoms.append(">=" + data['atom'])
+    repo.commit()
+    return repo, repo_path, atoms
+
+
+def _bench(name, func):
+    t1 = time.time()
+    func()
+    print("%-14s %8.3fs" % (name, time.time() - t1))
+
+
+if __name__ == "__main__":
+    count = 2000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    client = Client(installed_repo = -1, indexing = False,
+        xcache = False, repo_validation = False)
+    repo, repo_path, atoms = _populate(client, count)
+    print("%d atoms" % (len(atoms),))
+
+    _bench("atomMatch", lambda: [repo.atomMatch(x, maskFilter = False,
+        useCache = False) for x in atoms])
+    _bench("atomMatchMany", lambda: repo.atomMatchMany(atoms,
+        maskFilter = False, useCache = False))
+
+    repo.close()
+    if os.path.isfile(repo_path):
+        os.remove(repo_path)
+    client.shutdown()
+    raise SystemExit(0)
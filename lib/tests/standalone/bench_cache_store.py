@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# Compare the EntropyCacher "dump" and "packed" storage backends.
+# Usage: python bench_cache_store.py [<number of keys>]
+import os
+import shutil
+import sys
+import time
+
+sys.path.insert(0, '../')
+sys.path.insert(0, '../../')
+
+from entropy.cache import EntropyCacher, DumpCacheStore, PackedCacheStore
+from entropy.const import const_mkdtemp
+
+
+def _count_inodes(directory):
+    count = 0
+    for root, dirs, files in os.walk(directory):
+        count += len(dirs) + len(files)
+    return count
+
+
+def _bench(store_class, keys):
+    tmp_dir = const_mkdtemp(prefix = "bench_cache_store")
+    try:
+        store = store_class(tmp_dir)
+        data = dict((x, str(x) * 4) for x in range(32))
+        items = [(key, data) for key in keys]
+        batch = EntropyCacher._OBJS_WRITTEN_AT_ONCE
+
+        t1 = time.time()
+        for idx in range(0, len(items), batch):
+            store.store_many(items[idx:idx + batch])
+        t2 = time.time()
+        for key in keys:
+            store.load(key)
+        t3 = time.time()
+        inodes = _count_inodes(tmp_dir)
+        store.remove_tree(keys[0])
+        store.close()
+        t4 = time.time()
+
+        print("%-8s write %7.3fs  read %7.3fs  clear %7.3fs  inodes %d" % (
+            store_class.__name__[:-len("CacheStore")].lower(),
+            t2 - t1, t3 - t2, t4 - t3, inodes))
+    finally:
+        shutil.rmtree(tmp_dir, True)
+
+
+if __name__ == "__main__":
+    count = 20000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    keys = ["bench/ns_%d/item_%d" % (x % 16, x) for x in range(count)]
+    for store_class in (DumpCacheStore, PackedCacheStore):
+        _bench(store_class, keys)
+    raise SystemExit(0)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# Compare the former per-file CONFIG_PROTECT/CONFIG_PROTECT_MASK lookup
+# (walking up the parent directories of each path) with the compiled
+# ConfigProtectMatcher over a synthetic content list.
+# Usage: python bench_config_protect.py [<number of paths>]
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, '../')
+sys.path.insert(0, '../../')
+
+from entropy.client.interfaces.package.actions._merge import \
+    ConfigProtectMatcher
+
+_PROTECT = ["/etc", "/usr/share/config", "/usr/share/gnupg/qualified.txt",
+            "/var/lib/hsqldb", "/usr/share/X11/xkb", "/usr/kde/3.5/env",
+            "/usr/kde/3.5/shutdown", "/usr/share/maven-bin-3.0/conf"]
+_PROTECT += ["/opt/app%d/etc" % (x,) for x in range(200)]
+_MASK = ["/etc/ca-certificates.conf", "/etc/env.d", "/etc/fonts/fonts.conf",
+         "/etc/gconf", "/etc/gentoo-release", "/etc/revdep-rebuild",
+         "/etc/sandbox.d", "/etc/terminfo", "/etc/texmf/language.dat.d",
+         "/etc/texmf/language.def.d", "/etc/texmf/updmap.d",
+         "/etc/texmf/web2c"]
+_PREFIXES = ["/etc", "/etc/env.d", "/etc/conf.d", "/usr/bin", "/usr/lib64",
+             "/usr/share/doc", "/usr/share/config/kdm", "/usr/include/qt4",
+             "/usr/src/linux/drivers/net/wireless", "/opt/app42/etc/x"]
+_ROUNDS = 3
+
+
+def _legacy_protected(protect, mask, path):
+    """
+    The former _handle_config_protect() lookup.
+    """
+    def _in(paths):
+        if path in paths:
+            return True
+        testdir = os.path.dirname(path)
+        old_testdir = None
+        while testdir != old_testdir:
+            if testdir in paths:
+                return True
+            old_testdir = testdir
+            testdir = os.path.dirname(testdir)
+        return False
+
+    return _in(protect) and not _in(mask)
+
+
+def _paths(count):
+    rnd = random.Random(42)
+    return ["%s/%s/file-%d" % (
+            rnd.choice(_PREFIXES), "sub" * rnd.randint(0, 3), x)
+            for x in range(count)]
+
+
+def _bench(name, func, paths):
+    t1 = time.time()
+    for _idx in range(_ROUNDS):
+        protected = [x for x in paths if func(x)]
+    t2 = time.time()
+    print("%-8s %7d paths  %5d protected  %8.3fms" % (
+        name, len(paths), len(protected), (t2 - t1) * 1000 / _ROUNDS))
+    return protected
+
+
+if __name__ == "__main__":
+    count = 100000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    paths = _paths(count)
+    protect, mask = set(_PROTECT), set(_MASK)
+
+    t1 = time.time()
+    matcher = ConfigProtectMatcher(protect, mask, ())
+    print("matcher built in %.3fms" % ((time.time() - t1) * 1000,))
+
+    legacy = _bench(
+        "legacy", lambda x: _legacy_protected(protect, mask, x), paths)
+    compiled = _bench("matcher", matcher.protected, paths)
+    if legacy != compiled:
+        print("ERROR: results differ")
+        raise SystemExit(1)
+    raise SystemExit(0)
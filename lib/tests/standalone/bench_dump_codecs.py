@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+# Compare entropy.dump codecs over cached objects: atomMatch results,
+# calculate_updates() output and web service responses. Objects are read
+# from the on-disk Entropy caches, if any, synthetic ones are used
+# otherwise.
+# Usage: python bench_dump_codecs.py [<cache directory> ...]
+import os
+import sys
+import time
+
+sys.path.insert(0, '../')
+sys.path.insert(0, '../../')
+
+from entropy.const import etpConst
+import entropy.dump
+
+_ROUNDS = 5
+
+
+def _cached_objects(directories):
+    groups = {}
+    for directory in directories:
+        for root, dirs, files in os.walk(directory):
+            for name in files:
+                if not name.endswith(entropy.dump.D_EXT):
+                    continue
+                obj = entropy.dump.loadobj(
+                    os.path.join(root, name), complete_path = True)
+                if obj is None:
+                    continue
+                group = os.path.relpath(root, directory).split(os.sep)[0]
+                if group == ".":
+                    group = os.path.basename(directory)
+                groups.setdefault(group, []).append(obj)
+    return groups
+
+
+def _synthetic_objects():
+    repository_id = "sabayonlinux.org"
+    matches = [((x, repository_id), 0) for x in range(5000)]
+    multi_matches = [(set((x + y, repository_id) for y in range(4)), 0)
+                     for x in range(1000)]
+    updates = [(
+        [(x, repository_id) for x in range(3000)],
+        list(range(200)),
+        [(x, repository_id) for x in range(3000, 20000)],
+        [],
+    )]
+    webserv = [dict(
+        ("app-misc/package-%d" % (x,), {
+            'vote': 3.5 + (x % 3) / 2.0,
+            'downloads': x * 17,
+            'comments': ["comment %d about package" % (y,)
+                         for y in range(x % 5)],
+        }) for x in range(5000))]
+    return {
+        'match': matches + multi_matches,
+        'updates': updates,
+        'webserv': webserv,
+    }
+
+
+def _legacy_dumps(obj):
+    return entropy.dump.pickle.dumps(obj, entropy.dump.COMPAT_PICKLE_PROTOCOL)
+
+
+def _bench(group, objs):
+    codecs = [("legacy", _legacy_dumps),
+              ("default", entropy.dump.serialize_string)]
+    for codec in entropy.dump.available_codecs():
+        codecs.append(
+            (codec,
+             lambda obj, codec=codec: entropy.dump.serialize_string(
+                    obj, codec = codec)))
+
+    for name, dumps in codecs:
+        t1 = time.time()
+        for _idx in range(_ROUNDS):
+            data = [dumps(obj) for obj in objs]
+        t2 = time.time()
+        for _idx in range(_ROUNDS):
+            for item in data:
+                entropy.dump.unserialize_string(item)
+        t3 = time.time()
+        size = sum(len(x) for x in data)
+        print("%-10s %-8s %10d bytes  dump %8.3fms  load %8.3fms" % (
+            group, name, size,
+            (t2 - t1) * 1000 / _ROUNDS, (t3 - t2) * 1000 / _ROUNDS))
+
+
+if __name__ == "__main__":
+    directories = sys.argv[1:] or [
+        entropy.dump.D_DIR,
+        os.path.join(etpConst['entropyworkdir'], "websrv_cache")]
+    groups = _cached_objects(directories)
+    if not groups:
+        print("no cached objects found, using synthetic ones")
+        groups = _synthetic_objects()
+    for group in sorted(groups.keys()):
+        _bench(group, groups[group])
+    raise SystemExit(0)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# Compare the in-process ELF reader against the scanelf based one.
+# Usage: python bench_elf.py [<directory> ...]
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, '../')
+sys.path.insert(0, '../../')
+
+import entropy.tools
+import entropy.elf
+
+
+def _collect_elf_files(directories):
+    elf_files = []
+    for directory in directories:
+        for root, dirs, files in os.walk(directory):
+            for name in files:
+                path = os.path.join(root, name)
+                if os.path.islink(path) or not os.path.isfile(path):
+                    continue
+                try:
+                    if entropy.tools.is_elf_file(path):
+                        elf_files.append(path)
+                except (OSError, IOError):
+                    continue
+    return elf_files
+
+
+def _scanelf(elf_files):
+    for elf_file in elf_files:
+        proc = subprocess.Popen(
+            ("/usr/bin/scanelf", "-qF", "%M;%S;%r;%n", elf_file),
+            stdout = subprocess.PIPE)
+        proc.stdout.read()
+        proc.stdout.close()
+        proc.wait()
+
+
+def _native(elf_files):
+    for elf_file in elf_files:
+        try:
+            entropy.elf.read_metadata(elf_file)
+        except entropy.elf.ElfError:
+            continue
+
+
+def _native_batch(elf_files):
+    entropy.elf.read_metadata_many(elf_files)
+
+
+def _bench(name, func, elf_files):
+    t1 = time.time()
+    func(elf_files)
+    elapsed = time.time() - t1
+    print("%-14s %8.3fs  %10.1f files/s" % (
+        name, elapsed, len(elf_files) / max(elapsed, 1e-9)))
+
+
+if __name__ == "__main__":
+    directories = sys.argv[1:] or ["/usr/lib", "/usr/bin"]
+    elf_files = _collect_elf_files(directories)
+    print("%d ELF files found" % (len(elf_files),))
+
+    if os.path.isfile("/usr/bin/scanelf"):
+        _bench("scanelf", _scanelf, elf_files)
+    else:
+        print("scanelf        not available, skipping")
+    _bench("native", _native, elf_files)
+    _bench("native batch", _native_batch, elf_files)
+    raise SystemExit(0)
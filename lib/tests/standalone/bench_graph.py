@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# Benchmark TopologicalSorter.sort() and sort_levels() over synthetic
+# graphs (long chains, wide random DAGs, big cycles) and real dependency
+# graphs, reporting how many independent groups sort_levels() finds.
+# Real graphs are pickled Graph.get_adjacency_map() dumps, with items as
+# nodes, for example:
+#   adj = dict((x.item(), [k.item() for k in y])
+#              for x, y in graph.get_adjacency_map().items())
+#   pickle.dump(adj, open("deptree.pickle", "wb"))
+# Usage: python bench_graph.py [<number of nodes>] [<dump file> ...]
+import pickle
+import random
+import sys
+import time
+
+sys.path.insert(0, '../')
+sys.path.insert(0, '../../')
+
+from entropy.graph import TopologicalSorter
+
+_ROUNDS = 3
+
+
+def _chain(count):
+    adj_map = dict((x, [x + 1]) for x in range(count - 1))
+    adj_map[count - 1] = []
+    return adj_map
+
+
+def _random_dag(count):
+    rnd = random.Random(42)
+    adj_map = {}
+    for node in range(count):
+        deps = set()
+        for _idx in range(rnd.randint(0, 8)):
+            dep = node + rnd.randint(1, 500)
+            if dep < count:
+                deps.add(dep)
+        adj_map[node] = list(deps)
+    return adj_map
+
+
+def _cycles(count):
+    # a big strongly connected component plus small cycles around it
+    rnd = random.Random(42)
+    half = count // 2
+    adj_map = dict((x, [(x + 1) % half]) for x in range(half))
+    for node in range(half, count):
+        deps = [rnd.randint(0, half - 1)]
+        if node % 3 == 0 and node + 1 < count:
+            deps.append(node + 1)
+        if node % 3 == 1:
+            deps.append(node - 1)
+        adj_map[node] = deps
+    return adj_map
+
+
+def _bench(name, adj_map):
+    sorter = TopologicalSorter(adj_map)
+    t1 = time.time()
+    for _idx in range(_ROUNDS):
+        serial = sorter.sort()
+    t2 = time.time()
+    for _idx in range(_ROUNDS):
+        levels = sorter.sort_levels()
+    t3 = time.time()
+
+    groups = sum(len(x) for x in levels.values())
+    width = max(len(x) for x in levels.values())
+    print("%-24s %6d nodes  sort %7.3fs  sort_levels %7.3fs  "
+          "%6d steps -> %6d levels (max width %d)" % (
+            name, len(adj_map), (t2 - t1) / _ROUNDS, (t3 - t2) / _ROUNDS,
+            len(serial), len(levels), width))
+    assert groups == len(serial)
+
+
+if __name__ == "__main__":
+    count = 10000
+    dumps = sys.argv[1:]
+    if dumps and dumps[0].isdigit():
+        count = int(dumps.pop(0))
+
+    _bench("chain", _chain(count))
+    _bench("random dag", _random_dag(count))
+    _bench("cycles", _cycles(count))
+    for dump in dumps:
+        with open(dump, "rb") as dump_f:
+            _bench(dump, pickle.load(dump_f))
+    raise SystemExit(0)
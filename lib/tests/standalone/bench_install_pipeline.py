@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+# Compare serial and pipelined (PackageInstallScheduler) package installs.
+# Synthetic package tarballs are unpacked with entropy.tools and then
+# "merged" by copying the image directory into a fake root.
+# Usage: python bench_install_pipeline.py [<number of packages>]
+import os
+import shutil
+import sys
+import tarfile
+import time
+
+sys.path.insert(0, '../')
+sys.path.insert(0, '../../')
+
+from entropy.const import const_mkdtemp
+from entropy.client.interfaces.package import PackageInstallScheduler
+import entropy.tools
+
+_FILES = 200
+_FILE_SIZE = 16 * 1024
+_MERGE_WAIT = 0.2
+
+
+class _BenchAction(object):
+
+    def __init__(self, idx, package_path, work_dir, root):
+        self._idx = idx
+        self._package_path = package_path
+        self._work_dir = work_dir
+        self._root = root
+        self._meta = None
+
+    def package_id(self):
+        return self._idx
+
+    def repository_id(self):
+        return "bench"
+
+    def metadata(self):
+        return self._meta
+
+    def setup(self):
+        if self._meta is None:
+            unpack_dir = const_mkdtemp(dir = self._work_dir)
+            self._meta = {
+                'unpackdir': unpack_dir,
+                'imagedir': os.path.join(unpack_dir, "image"),
+            }
+
+    def preunpack(self):
+        self.setup()
+        exit_st = entropy.tools.uncompress_tarball(
+            self._package_path, extract_path = self._meta['imagedir'])
+        self._meta['preunpack_status'] = exit_st
+        return exit_st
+
+    def start(self):
+        self.setup()
+        if self._meta.get('preunpack_status') != 0:
+            self.preunpack()
+        target = os.path.join(self._root, str(self._idx))
+        os.rename(self._meta['imagedir'], target)
+        shutil.rmtree(self._meta['unpackdir'])
+        # triggers and installed packages repository commit
+        time.sleep(_MERGE_WAIT)
+        return 0
+
+
+def _make_packages(directory, count):
+    payload = os.urandom(_FILE_SIZE // 2) * 2
+    src_dir = os.path.join(directory, "src")
+    os.makedirs(src_dir)
+    for idx in range(_FILES):
+        with open(os.path.join(src_dir, "file-%d" % (idx,)), "wb") as f:
+            f.write(payload)
+    packages = []
+    for idx in range(count):
+        path = os.path.join(directory, "package-%d.tbz2" % (idx,))
+        with tarfile.open(path, "w:bz2") as tar:
+            tar.add(src_dir, arcname = "usr/share/package-%d" % (idx,))
+        packages.append(path)
+    return packages
+
+
+def _bench(packages, work_dir, workers):
+    root = const_mkdtemp(dir = work_dir)
+    actions = [_BenchAction(idx, path, work_dir, root)
+               for idx, path in enumerate(packages)]
+    scheduler = PackageInstallScheduler(None, actions, workers = workers)
+    scheduler._unpacked_size = lambda action: _FILES * _FILE_SIZE
+
+    t1 = time.time()
+    scheduler.start()
+    try:
+        for action in actions:
+            scheduler.run(action)
+    finally:
+        scheduler.shutdown()
+    t2 = time.time()
+    shutil.rmtree(root)
+
+    print("workers %d  packages %d  %7.3fs" % (
+        workers, len(packages), t2 - t1))
+
+
+if __name__ == "__main__":
+    count = 50
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    tmp_dir = const_mkdtemp(prefix = "bench_install_pipeline")
+    try:
+        packages = _make_packages(tmp_dir, count)
+        for workers in (0, 1, 2):
+            _bench(packages, tmp_dir, workers)
+    finally:
+        shutil.rmtree(tmp_dir, True)
+    raise SystemExit(0)
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# Sort every package version found in the available repositories,
+# comparing the key based sorting against the cmp based one.
+import functools
+import sys
+import time
+
+sys.path.insert(0, '../')
+sys.path.insert(0, '../../')
+
+import entropy.dep
+from entropy.client.interfaces import Client
+
+
+def _bench(name, func, versions):
+    t1 = time.time()
+    func(versions)
+    print("%-24s %8.3fs" % (name, time.time() - t1))
+
+
+if __name__ == "__main__":
+    client = Client()
+    versions = []
+    entropy_versions = []
+    try:
+        for repository_id in client.repositories():
+            repo = client.open_repository(repository_id)
+            for package_id in repo.listAllPackageIds():
+                ver, tag, rev = repo.getVersioningData(package_id)
+                versions.append(ver)
+                entropy_versions.append((ver, tag, rev))
+    finally:
+        client.shutdown()
+
+    print("%d versions found" % (len(versions),))
+    _bench("cmp_to_key", lambda x: sorted(
+        x, key = functools.cmp_to_key(entropy.dep.compare_versions)),
+        versions)
+    entropy.dep._VERSION_KEY_CACHE.clear()
+    _bench("version_key (cold)", lambda x: sorted(
+        x, key = entropy.dep.version_key), versions)
+    _bench("version_key (warm)", lambda x: sorted(
+        x, key = entropy.dep.version_key), versions)
+    _bench("get_newer_version", entropy.dep.get_newer_version, versions)
+    _bench("get_entropy_newer_version",
+        entropy.dep.get_entropy_newer_version, entropy_versions)
+    raise SystemExit(0)
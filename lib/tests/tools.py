@@ -210,6 +210,30 @@ class ToolsTest(unittest.TestCase):
         os.close(fd)
         os.remove(tmp_path)
 
+    def test_multi_hash(self):
+        hash_types = ("md5", "sha1", "sha256", "sha512")
+        for pkg in self.test_pkgs:
+            hashes = et.multi_hash(pkg, hash_types)
+            self.assertEqual(hashes["md5"], et.md5sum(pkg))
+            self.assertEqual(hashes["sha1"], et.sha1(pkg))
+            self.assertEqual(hashes["sha256"], et.sha256(pkg))
+            self.assertEqual(hashes["sha512"], et.sha512(pkg))
+
+        fd, tmp_path = const_mkstemp()
+        os.close(fd)
+        r_md5 = "d41d8cd98f00b204e9800998ecf8427e"
+        self.assertEqual(et.multi_hash(tmp_path, ("md5",)), {"md5": r_md5})
+
+        paths = self.test_pkgs + [tmp_path + ".missing"]
+        for workers in (1, 3):
+            results = et.multi_hash_files(
+                paths, hash_types, workers = workers)
+            self.assertEqual(results.pop(tmp_path + ".missing"), None)
+            for pkg in self.test_pkgs:
+                self.assertEqual(
+                    results[pkg], et.multi_hash(pkg, hash_types))
+        os.remove(tmp_path)
+
     def test_md5sum_directory(self):
         tmp_dir = const_mkdtemp()
         f = open(os.path.join(tmp_dir, "foo"), "w")
@@ -462,6 +486,28 @@ class ToolsTest(unittest.TestCase):
         metadata = et.read_elf_dynamic_libraries(elf_obj)
         self.assertEqual(metadata, known_meta)
 
+    def test_read_elf_metadata(self):
+        elf_obj = _misc.get_dl_so_amd_2()
+        known_meta = {
+            'soname': 'libkdb5.so.4',
+            'class': 2,
+            'runpath': '/usr/lib64',
+            'needed': set(['libcom_err.so.2', 'libkrb5.so.3',
+                'libkrb5support.so.0', 'libgssrpc.so.4', 'libk5crypto.so.3',
+                'libc.so.6']),
+        }
+        metadata = et.read_elf_metadata(elf_obj)
+        self.assertEqual(metadata, known_meta)
+
+    def test_read_elf_metadata_many(self):
+        elf_obj = _misc.get_dl_so_amd_2()
+        not_elf = _misc.get_random_file()
+        metadata = et.read_elf_metadata_many(
+            [elf_obj, not_elf, "/non/existent/lib.so"])
+        self.assertEqual(metadata[elf_obj], et.read_elf_metadata(elf_obj))
+        self.assertEqual(metadata[not_elf], None)
+        self.assertEqual(metadata["/non/existent/lib.so"], None)
+
     def test_read_elf_real_dynamic_libraries(self):
         elf_obj = _misc.get_dl_so_amd_2()
         known_meta = set(
@@ -638,6 +684,38 @@ class ToolsTest(unittest.TestCase):
 
         self.assertEqual(path_perms, new_path_perms)
 
+    def test_apply_tarball_ownership(self):
+        import tarfile
+
+        tmp_dir = const_mkdtemp()
+        try:
+            src_dir = os.path.join(tmp_dir, "src")
+            extract_dir = os.path.join(tmp_dir, "image")
+            os.makedirs(os.path.join(src_dir, "etc"))
+            file_path = os.path.join(src_dir, "etc", "foo.conf")
+            with open(file_path, "w") as foo_f:
+                foo_f.write("foo=bar\n")
+            os.chmod(file_path, 0o640)
+
+            tar_path = os.path.join(tmp_dir, "foo.tar.bz2")
+            tar = tarfile.open(tar_path, "w:bz2")
+            try:
+                tar.add(os.path.join(src_dir, "etc"), arcname = "etc")
+            finally:
+                tar.close()
+
+            rc = et.uncompress_tarball(tar_path, extract_path = extract_dir)
+            self.assertTrue(not rc)
+            extracted = os.path.join(extract_dir, "etc", "foo.conf")
+            os.chmod(extracted, 0o600)
+
+            et.apply_tarball_ownership(tar_path, extract_dir)
+            fstat = os.lstat(extracted)
+            self.assertEqual(stat.S_IMODE(fstat.st_mode), 0o640)
+            self.assertEqual(fstat.st_uid, os.lstat(file_path).st_uid)
+        finally:
+            shutil.rmtree(tmp_dir, True)
+
 if __name__ == '__main__':
     unittest.main()
     raise SystemExit(0)
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+import sys
+import os
+sys.path.insert(0, '.')
+sys.path.insert(0, '../')
+import shutil
+import unittest
+from entropy.const import const_mkdtemp, const_convert_to_rawstring
+from entropy.transceivers import EntropyTransceiver
+from entropy.transceivers.uri_handlers.skel import EntropyUriHandler
+from entropy.transceivers.uri_handlers.plugins.interfaces.ssh_plugin import \
+    EntropySshUriHandler
+import entropy.tools
+
+
+class FakeUriHandler(EntropyUriHandler):
+
+    """
+    URI handler serving an in-memory directory tree:
+    {directory: [(name, size, is_dir), ...]}.
+    """
+
+    def __init__(self, uri, tree):
+        EntropyUriHandler.__init__(self, uri)
+        self._tree = tree
+        self.listed = []
+
+    def list_content_metadata(self, remote_path):
+        self.listed.append(remote_path)
+        data = []
+        for name, size, is_dir in self._tree.get(remote_path, []):
+            perms = "-rw-r--r--"
+            if is_dir:
+                perms = "drwxr-xr-x"
+            data.append((name, str(size), "root", "root", perms))
+        return data
+
+
+class UriHandlersTest(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp_dir = const_mkdtemp(prefix = "test_transceivers")
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir, True)
+
+    def _write(self, path, data):
+        path = os.path.join(self._tmp_dir, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "wb") as path_f:
+            path_f.write(const_convert_to_rawstring(data))
+        return path
+
+    def test_list_content_recursive(self):
+        tree = {
+            "pkgs/": [("a.tbz2", 1, False), ("x", 4096, True)],
+            "pkgs/x": [("b.tbz2", 2, False), ("y", 4096, True)],
+            "pkgs/x/y": [("c.tbz2", 3, False)],
+        }
+        handler = FakeUriHandler("fake://", tree)
+        self.assertEqual(sorted(handler.list_content_recursive("pkgs")),
+            [("a.tbz2", 1), ("x/b.tbz2", 2), ("x/y/c.tbz2", 3)])
+        self.assertEqual(handler.listed, ["pkgs/", "pkgs/x", "pkgs/x/y"])
+        # not supported by default
+        self.assertEqual(handler.list_directory_stamps("pkgs"), None)
+
+    def test_file_uri_handler(self):
+        a_path = self._write("mirror/pkgs/a.tbz2", "a")
+        self._write("mirror/pkgs/x/b.tbz2", "bb")
+        os.makedirs(os.path.join(self._tmp_dir, "mirror", "pkgs", "empty"))
+
+        txc = EntropyTransceiver("file://" + os.path.join(
+            self._tmp_dir, "mirror"))
+        txc.set_silent(True)
+        with txc as handler:
+            self.assertEqual(
+                sorted(handler.list_content_recursive("pkgs")),
+                [("a.tbz2", 1), ("x/b.tbz2", 2)])
+            self.assertEqual(handler.list_content_recursive("missing"), [])
+
+            self.assertEqual(
+                sorted(handler.list_directory_stamps("pkgs").keys()),
+                ["", "empty", "x"])
+            self.assertEqual(handler.list_directory_stamps("missing"), None)
+
+            self.assertEqual(
+                handler.get_md5_many(["pkgs/a.tbz2", "pkgs/missing.tbz2"]),
+                {"pkgs/a.tbz2": entropy.tools.md5sum(a_path),
+                 "pkgs/missing.tbz2": None})
+
+    def test_ssh_get_md5_many(self):
+        commands = []
+        digest_a = "0123456789abcdef0123456789abcdef"
+        digest_b = "fedcba9876543210fedcba9876543210"
+
+        def _exec_cmd(args):
+            commands.append(args)
+            # text and binary mode lines, the missing file is not printed
+            output = "%s  pkgs/a.tbz2\n%s *pkgs/b c.tbz2\n" % (
+                digest_a, digest_b)
+            return 1, output, "md5sum: pkgs/missing.tbz2: No such file"
+
+        # without multiplexing, no SSH master connection is spawned
+        multiplexing = EntropySshUriHandler._MULTIPLEXING
+        EntropySshUriHandler._MULTIPLEXING = False
+        try:
+            handler = EntropySshUriHandler("ssh://user@mirror:/srv/entropy")
+            handler._exec_cmd = _exec_cmd
+            md5s = handler.get_md5_many(
+                ["pkgs/a.tbz2", "pkgs/b c.tbz2", "pkgs/missing.tbz2"])
+        finally:
+            EntropySshUriHandler._MULTIPLEXING = multiplexing
+
+        self.assertEqual(md5s, {
+            "pkgs/a.tbz2": digest_a,
+            "pkgs/b c.tbz2": digest_b,
+            "pkgs/missing.tbz2": None,
+        })
+        # a single remote command, run from the base directory
+        self.assertEqual(len(commands), 1)
+        args = commands[0]
+        self.assertEqual(args[args.index("user@mirror") + 1:][:4],
+            ["cd", "/srv/entropy", "&&", "md5sum"])
+
+if __name__ == '__main__':
+    unittest.main()
+    raise SystemExit(0)
@@ -64,7 +64,8 @@ EntropyCacher.WRITEBACK_TIMEOUT = 120
 
 # Change the default in-RAM cache policy for repositories in order to
 # save a huge amount of RAM.
-from entropy.db.cache import EntropyRepositoryCachePolicies
+from entropy.db.cache import EntropyRepositoryCachePolicies, \
+    EntropyRepositoryCacher, EntropyRepositoryMatchCacher
 _NONE_POL = EntropyRepositoryCachePolicies.NONE
 EntropyRepositoryCachePolicies.DEFAULT_CACHE_POLICY = _NONE_POL
 
@@ -515,7 +516,7 @@ class RigoDaemonService(dbus.service.Object):
         Gio.FileMonitorEvent.ATTRIBUTE_CHANGED,
         Gio.FileMonitorEvent.CHANGED)
 
-    API_VERSION = 8
+    API_VERSION = 9
 
     class ActionQueueItem(object):
 
@@ -3646,6 +3647,21 @@ class RigoDaemonService(dbus.service.Object):
         write_output("api called", debug=True)
         return RigoDaemonService.API_VERSION
 
+    @dbus.service.method(BUS_NAME, in_signature='',
+        out_signature='a{sx}')
+    def cache_stats(self):
+        """
+        Return the in-memory Entropy Repository cache statistics.
+        Repository cache counters are exposed as is (hits, misses,
+        evictions, bytes, ...), atomMatch() cache counters are
+        prefixed with "match_".
+        """
+        write_output("cache_stats called", debug=True)
+        stats = EntropyRepositoryCacher().stats()
+        for key, value in EntropyRepositoryMatchCacher().stats().items():
+            stats["match_" + key] = value
+        return stats
+
     @dbus.service.method(BUS_NAME, in_signature='',
         out_signature='')
     def reload(self):
@@ -191,7 +191,7 @@ class RigoServiceController(GObject.Object):
     _REPOS_SETTINGS_CHANGED_SIGNAL = "repositories_settings_changed"
     _MIRRORS_OPTIMIZED_SIGNAL = "mirrors_optimized"
     _PRESERVED_LIBS_AVAILABLE_SIGNAL = "preserved_libraries_available"
-    _SUPPORTED_APIS = [6, 7, 8]
+    _SUPPORTED_APIS = [6, 7, 8, 9]
 
     def __init__(self, rigo_app, activity_rwsem,
                  entropy_client, entropy_ws):
@@ -1850,6 +1850,21 @@ class RigoServiceController(GObject.Object):
                 dbus_interface=self.DBUS_INTERFACE).api()
         return self._execute_mainloop(_api)
 
+    def cache_stats(self):
+        """
+        Return RigoDaemon in-memory Repository cache statistics.
+        """
+        if self.api() < 9:
+            # RigoDaemon is too old
+            return {}
+
+        def _cache_stats():
+            return dbus.Interface(
+                self._entropy_bus,
+                dbus_interface=self.DBUS_INTERFACE).cache_stats()
+        stats = self._execute_mainloop(_cache_stats)
+        return dict((str(x), int(y)) for x, y in stats.items())
+
     def hello(self):
         """
         Say hello to RigoDaemon. This causes the sending of